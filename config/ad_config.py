@@ -103,7 +103,53 @@ ARCHER_DOCKER = (
     "seglh/archer_api_upload_py:6ff3ff0"
 )
 
+# Host resources and the per-container budget used by the demultiplex scheduler. Each
+# demultiplexing container is given BASES2FASTQ_CPU cores and DEMULTIPLEX_MEM_GB memory (each
+# capped at the host's resources), and as many containers are run concurrently as the host allows
+BASES2FASTQ_CPU = 10
+DEMULTIPLEX_MEM_GB = 32  # Memory requested by each bclconvert / bases2fastq container
+HOST_CPU = os.cpu_count() or 1
+HOST_MEM_GB = int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3)
+DEMULTIPLEX_CONTAINER_CPU = min(BASES2FASTQ_CPU, HOST_CPU)
+DEMULTIPLEX_CONTAINER_MEM_GB = max(1, min(DEMULTIPLEX_MEM_GB, HOST_MEM_GB))
+DEMULTIPLEX_SLOTS = max(
+    1,
+    min(
+        HOST_CPU // DEMULTIPLEX_CONTAINER_CPU,
+        HOST_MEM_GB // DEMULTIPLEX_CONTAINER_MEM_GB,
+    ),
+)
+# Progress lines printed by the demultiplexing tools, capturing the percent complete
+# ("percent"). bclconvert does not print its progress, so its progress is not tracked
+PROGRESS_PATTERNS = {
+    "bases2fastq": r"(?P<percent>\d{1,3}(?:\.\d+)?)\s*%",
+}
+DEMULTIPLEX_DOCKER_LIMITS = (
+    f"--cpus {DEMULTIPLEX_CONTAINER_CPU} --memory {DEMULTIPLEX_CONTAINER_MEM_GB}g"
+)
+# Lane-sharded bclconvert runs BCLCONVERT_LANE_SHARDS single-lane containers at a time, which
+# share the per-container budget of the runfolder
+BCLCONVERT_LANE_SHARDS = max(1, min(4, DEMULTIPLEX_CONTAINER_CPU // 4))
+BCLCONVERT_LANE_DOCKER_LIMITS = (
+    f"--cpus {DEMULTIPLEX_CONTAINER_CPU / BCLCONVERT_LANE_SHARDS:g} "
+    f"--memory {max(1, DEMULTIPLEX_CONTAINER_MEM_GB // BCLCONVERT_LANE_SHARDS)}g"
+)
+
+FLAG_FILES = {
+    "upload_started": "DNANexus_upload_started.txt",  # Holds upload agent output
+    "bclconvertlog": "bclconvert_output.log",  # Holds bclconvert logs
+    "bases2fastqlog": "bases2fastq_output.log", # Holds bases2fastq logs
+    "md5checksum": "md5checksum.txt",  # File holding checksum results
+    "initial_sscheck_flag": "initial_sscheck_flagfile.txt",  # Denotes initial SampleSheet has been checked
+    "sscheck_flag": "sscheck_flagfile.txt",  # Denotes SampleSheet has been checked
+    "illumina_seq_complete": "RTAComplete.txt",  # Illumina Sequencing complete file
+    "aviti_seq_complete": "RunUploaded.json", # AVITI Sequencing complete file
+    "quality_hold": "run_quality_hold.txt",  # Run held by the run quality gate (holds failed metrics)
+    "quality_release": "run_quality_release.txt",  # Created manually to release a held run
+    "cd_failed": "cluster_density_failed.txt",  # Cluster density failed after demultiplexing (holds error)
+}
 LANE_METRICS_SUFFIX = ".illumina_lane_metrics"
+PHASING_METRICS_SUFFIX = ".illumina_phasing_metrics"
 DEMUX_NOT_REQUIRED_MSG = "%s run. Does not need demultiplexing locally"
 ILLUMINA_DEMULTIPLEX_SUCCESS = "thread 1 Conversion Complete."
 AVITI_DEMULTIPLEX_SUCCESS = "Output stored in /output"
@@ -399,10 +445,42 @@ class DemultiplexConfig(PanelConfig):
     RUNFOLDER_PATTERN = RUNFOLDER_PATTERN
     RUNFOLDERS = RUNFOLDERS
     AVITI_RUNFOLDER = AVITI_RUNFOLDER
-    BASES2FASTQ_CPU = 10
+    BASES2FASTQ_CPU = BASES2FASTQ_CPU
+    DEMULTIPLEX_MEM_GB = DEMULTIPLEX_MEM_GB
+    DEMULTIPLEX_CONTAINER_CPU = DEMULTIPLEX_CONTAINER_CPU
+    DEMULTIPLEX_CONTAINER_MEM_GB = DEMULTIPLEX_CONTAINER_MEM_GB
+    DEMULTIPLEX_SLOTS = DEMULTIPLEX_SLOTS
+    PROGRESS_PATTERNS = PROGRESS_PATTERNS
+    # Number of processes used to check pending SampleSheets in parallel (SamplesheetCheckStage)
+    SSCHECK_PROCESSES = max(1, min(4, HOST_CPU))
+    FLAG_FILES = FLAG_FILES
+    SAMPLESHEETS_DIR = os.path.join(RUNFOLDERS, "samplesheets")
+    AVITI_SAMPLESHEET = AVITI_SAMPLESHEET
+    # Watch mode settings. Files that, when created / written, may mean a runfolder is ready
+    # for demultiplexing, and flag files that, when removed, denote a runfolder should be re-assessed
+    WATCH_READY_FILES = [
+        FLAG_FILES["illumina_seq_complete"],
+        FLAG_FILES["aviti_seq_complete"],
+        FLAG_FILES["md5checksum"],
+        FLAG_FILES["quality_release"],
+    ]
+    WATCH_RESET_FILES = [
+        FLAG_FILES["bclconvertlog"],
+        FLAG_FILES["bases2fastqlog"],
+        FLAG_FILES["initial_sscheck_flag"],
+        FLAG_FILES["sscheck_flag"],
+    ]
+    WATCH_SETTLE_SECONDS = 5  # Time to wait for further events before processing runfolders
+    WATCH_POLL_INTERVAL = 30  # Polling interval (seconds) when inotify cannot be used
+    WATCH_RESCAN_INTERVAL = 3600  # Interval (seconds) between full reconciliation passes
+    # Filesystems that do not deliver inotify events for changes made by other hosts
+    NETWORK_FS_TYPES = ["nfs", "nfs4", "cifs", "smb3", "fuse.sshfs"]
+    # Runfolder states (from the state index) that never require demultiplexing
+    STATE_INDEX_SKIP = ["demultiplexing", "demultiplexed", "uploaded"]
     STRINGS = {
         "demultiplex_not_required_msg": DEMUX_NOT_REQUIRED_MSG,
         "lane_metrics_suffix": LANE_METRICS_SUFFIX,
+        "phasing_metrics_suffix": PHASING_METRICS_SUFFIX,
         "cd_success": "picard.illumina.CollectIlluminaLaneMetrics done",
         "checksums_assessed": "Checksums assessed by AS: %s",  # Written to file by AS
         "checksums_match": "Checksums match",  # Success message written to md5checksum file by integrity check scripts
@@ -410,10 +488,15 @@ class DemultiplexConfig(PanelConfig):
         "samplesheet_success": "Samplesheet check successful with no errors identified: %s",
         "samplesheet_fail": "Processing halted. SampleSheet contains SampleSheet errors: %s ",
         "upload_flag_umis": "Runfolder contains UMIs. Runfolder will not be uploaded and requires manual upload: %s",
+        "cd_failed_flag": (
+            "Cluster density calculation failed after demultiplexing: %s. The calculation is "
+            "re-run on the next script run, and the run is not uploaded until it succeeds"
+        ),
     }
     TESTING = TESTING
     BCLCONVERT_CMD = (
-        f"docker run --ulimit nofile=65535:65535 --rm --user %s:%s -v %s:/data/input -v %s:/data/output "
+        f"docker run --ulimit nofile=65535:65535 --rm {DEMULTIPLEX_DOCKER_LIMITS} "
+        f"--user %s:%s -v %s:/data/input -v %s:/data/output "
         f"-v %s:/var/log/bcl-convert "
         f"-v %s:/samplesheet_input {BCLCONVERT_DOCKER} "
         f"--force --bcl-input-directory /data/input "
@@ -421,14 +504,125 @@ class DemultiplexConfig(PanelConfig):
         f"--sample-sheet /samplesheet_input/%s "
         f"--no-lane-splitting true --fastq-gzip-compression-level 4"
     )
+    # Lane-sharded bclconvert (demultiplex/bclconvert_lanes.py). For runs from the sequencers in
+    # BCLCONVERT_LANE_SHARDING, one bclconvert is run per lane (--bcl-only-lane), into a per-lane
+    # directory within BCLCONVERT_LANE_DIR, and the per-lane fastqs and Reports are merged into the
+    # same outputs as BCLCONVERT_CMD. A failed lane is re-run without re-running completed lanes
+    BCLCONVERT_LANE_SHARDING = []  # Sequencer IDs, e.g. [NOVASEQ_ID]
+    BCLCONVERT_LANE_SHARDS = BCLCONVERT_LANE_SHARDS
+    BCLCONVERT_LANE_DIR = "Bcl_convert_lanes"
+    BCLCONVERT_LANE_CMD = (
+        f"docker run --ulimit nofile=65535:65535 --rm {BCLCONVERT_LANE_DOCKER_LIMITS} "
+        f"--user %s:%s -v %s:/data/input -v %s:/data/output "
+        f"-v %s:/var/log/bcl-convert "
+        f"-v %s:/samplesheet_input {BCLCONVERT_DOCKER} "
+        f"--force --bcl-input-directory /data/input "
+        f"--output-directory /data/output "
+        f"--sample-sheet /samplesheet_input/%s "
+        f"--bcl-only-lane %s --fastq-gzip-compression-level 4"
+    )
+    # Pre-flight disk capacity check (demultiplex/disk_capacity.py). Demultiplexing is deferred if
+    # the estimated fastq output (bases sequenced x DISK_BYTES_PER_BASE) plus DISK_SAFETY_MARGIN_GB
+    # exceeds the free space of the output filesystem
+    DISK_BYTES_PER_BASE = 0.6  # Bytes of gzip fastq per base (incl. quality scores and headers)
+    DISK_SAFETY_MARGIN_GB = 50
+    # Estimated AVITI polonies per run, by RunParameters.json ThroughputSelection (the maximum is
+    # used if the throughput selection is not listed)
+    DISK_AVITI_POLONIES = {"High": 1_000_000_000, "Medium": 500_000_000, "Low": 250_000_000}
+    # Run quality gate (demultiplex/run_quality.py). Illumina runs with any lane below the minimum
+    # %PF or %Q30, or outside the cluster density range (K/mm2) of the sequencer, are held for
+    # manual release (by creating FLAG_FILES["quality_release"] in the runfolder) rather than
+    # demultiplexed. Set a threshold to None to not check it. Disabled by default, until the
+    # thresholds have been agreed for each sequencer by the laboratory
+    RUN_QUALITY_GATE = False
+    RUN_QUALITY_MIN_PERCENT_PF = 50
+    RUN_QUALITY_MIN_PERCENT_Q30 = 70
+    # (Minimum, maximum) cluster density by sequencer ID. Not checked for sequencers not listed
+    # (the cluster density of NovaSeq patterned flowcells is fixed by the well layout)
+    RUN_QUALITY_DENSITY_RANGE = {
+        "NB551068": (100, 350),
+        "NB552085": (100, 350),
+        "M02353": (400, 1800),
+        "M02631": (400, 1800),
+    }
+    # Demultiplexing thread layouts (demultiplex/thread_tuning.py). Each layout gives the threads
+    # per container CPU for each thread option. --benchmark_threads runs each layout on a subset of
+    # the tiles of a runfolder (THREAD_BENCHMARK_SUBSET) and stores the fastest per host, tool and
+    # sequencer type. Stored layouts are scaled to the per-container CPU budget and added to the
+    # demultiplexing commands. Without a stored layout, bclconvert chooses its own thread counts
+    # and bases2fastq is run with BASES2FASTQ_CPU threads
+    THREAD_BENCHMARK_LAYOUTS = {
+        "bclconvert": [
+            {
+                "--bcl-num-conversion-threads": 1.0,
+                "--bcl-num-compression-threads": 1.0,
+                "--bcl-num-decompression-threads": 0.5,
+            },
+            {
+                "--bcl-num-conversion-threads": 1.0,
+                "--bcl-num-compression-threads": 0.5,
+                "--bcl-num-decompression-threads": 0.25,
+            },
+            {
+                "--bcl-num-conversion-threads": 0.5,
+                "--bcl-num-compression-threads": 1.0,
+                "--bcl-num-decompression-threads": 0.25,
+            },
+            {
+                "--bcl-num-conversion-threads": 1.5,
+                "--bcl-num-compression-threads": 1.5,
+                "--bcl-num-decompression-threads": 0.5,
+            },
+        ],
+        "bases2fastq": [{"-p": 1.0}, {"-p": 1.5}, {"-p": 2.0}],
+    }
+    THREAD_BENCHMARK_SUBSET = {
+        "bclconvert": "--first-tile-only true",
+        "bases2fastq": "--include-tile L1R01C01S1",
+    }
+    THREAD_BENCHMARK_DIR = "Thread_benchmark"  # Created within the runfolder, removed afterwards
+    # Local scratch staging (demultiplex/scratch_staging.py). If STAGING_DIR is set (e.g. a
+    # directory on local NVMe), the bclconvert inputs (STAGING_INPUTS, relative to the runfolder)
+    # are synced there using STAGING_COPY_THREADS threads, bclconvert is run there, and the outputs
+    # are moved back into the runfolder. Runfolders are only staged if STAGING_DIR has
+    # STAGING_SPACE_FACTOR times the input size free. Does not apply to lane-sharded or AVITI runs
+    STAGING_DIR = None
+    STAGING_INPUTS = ["RunInfo.xml", "RunParameters.xml", "InterOp", "Data/Intensities"]
+    STAGING_EXCLUDE_DIRS = ["Reports", "Logs"]  # Outputs of previous demultiplexing
+    STAGING_COPY_THREADS = max(1, min(8, HOST_CPU))
+    STAGING_SPACE_FACTOR = 2
+    # Sample-subset re-demultiplexing (demultiplex/sample_redemultiplex.py). If bclconvert fastqs
+    # are invalid, only the samples with invalid fastqs are re-demultiplexed (BCLCONVERT_CMD with a
+    # SampleSheet containing only those samples, into BCLCONVERT_SAMPLE_DIR), and their fastqs
+    # replaced. If this is not possible, the whole run is re-demultiplexed on the next script run
+    SAMPLE_REDEMULTIPLEX = True
+    BCLCONVERT_SAMPLE_DIR = "Bcl_convert_samples"
     BASES2FASTQ_CMD = (
-        f"docker run --rm --user %s:%s -v %s:/input -v %s:/output {BASES2FASTQ_DOCKER} "
+        f"docker run --rm {DEMULTIPLEX_DOCKER_LIMITS} --user %s:%s -v %s:/input -v %s:/output "
+        f"{BASES2FASTQ_DOCKER} "
         "bases2fastq /input /output -p %s --group-fastq --no-projects -r /input/%s"
     )
     CD_CMD = (
         f"docker run --rm --user %s:%s -v %s:/input_run {GATK_DOCKER} ./gatk CollectIlluminaLaneMetrics "
         "--RUN_DIRECTORY /input_run --OUTPUT_DIRECTORY /input_run --OUTPUT_PREFIX %s"
     )
+    # Cluster density / phasing metrics calculation. "gatk" runs GATK CollectIlluminaLaneMetrics
+    # in docker (CD_CMD), "native" reads the InterOp files directly (demultiplex/interop_metrics.py)
+    CLUSTER_DENSITY_ENGINE = "gatk"
+    CLUSTER_DENSITY_ENGINES = ["gatk", "native"]
+    # Runfolder integrity check. "external" relies on the integrity check scripts writing the
+    # checksums match / do not match message to md5checksum.txt, "builtin" verifies the runfolder
+    # files against the md5 checksums written by the sequencer (demultiplex/checksum_verifier.py)
+    # and writes the same messages
+    INTEGRITY_CHECK_ENGINE = "external"
+    INTEGRITY_CHECK_ENGINES = ["external", "builtin"]
+    # md5sum format file of expected checksums (paths relative to the runfolder), written to the
+    # runfolder by the sequencer once complete
+    CHECKSUM_EXPECTED_FILE = "sequencer_md5sums.txt"
+    CHECKSUM_THREADS = max(1, min(8, HOST_CPU))  # Files hashed in parallel (hashlib releases the GIL)
+    CHECKSUM_READ_BYTES = 8 * 1024**2  # Bytes read from a file at a time
+    # During sequencing, only files unmodified for this many seconds are hashed
+    CHECKSUM_SETTLE_SECONDS = 60
     ADX_LOG = f"{AD_LOGDIR}/archer_api_upload_logfiles/"
     ADX_CMD = (
         f"docker run "
@@ -486,6 +680,17 @@ class SWConfig(PanelConfig):
     RUNFOLDERS = RUNFOLDERS
     AVITI_RUNFOLDER = AVITI_RUNFOLDER
     AVITI_ID = AVITI_ID
+    # Runfolder states (from the state index) that never require processing
+    STATE_INDEX_SKIP = ["sequencing", "sequencing_complete", "cluster_density_failed", "uploaded"]
+    # Per-sample QC gate (setoff_workflows/sample_qc.py). Samples (other than negative controls)
+    # with fewer reads than SAMPLE_QC_MIN_READS or a %Q30 below SAMPLE_QC_MIN_PERCENT_Q30 (None to
+    # not check) in the demultiplexing reports are flagged ("flag"), or are also excluded from the
+    # dx run commands and pre-pipeline fastq upload ("skip", must be explicitly enabled). Their
+    # fastqs are still backed up with the rest of the runfolder
+    SAMPLE_QC_ACTION = "flag"
+    SAMPLE_QC_ACTIONS = [None, "flag", "skip"]
+    SAMPLE_QC_MIN_READS = 10000
+    SAMPLE_QC_MIN_PERCENT_Q30 = None
     PROD_ORGANISATION = "org-viapath_prod"  # Prod org for billing
     if BRANCH == "main":  # Prod branch
 
@@ -673,19 +878,54 @@ class ToolboxConfig(PanelConfig):
     ]
     NTCON_IDS = ["00000", "NTCcon", "NTC000", "NC000"]
     STRINGS = {
-        "phasing_metrics_suffix": ".illumina_phasing_metrics",
+        "phasing_metrics_suffix": PHASING_METRICS_SUFFIX,
         "lane_metrics_suffix": LANE_METRICS_SUFFIX,
     }
-    FLAG_FILES = {
-        "upload_started": "DNANexus_upload_started.txt",  # Holds upload agent output
-        "bclconvertlog": "bclconvert_output.log",  # Holds bclconvert logs
-        "bases2fastqlog": "bases2fastq_output.log", # Holds bases2fastq logs
-        "md5checksum": "md5checksum.txt",  # File holding checksum results
-        "initial_sscheck_flag": "initial_sscheck_flagfile.txt",  # Denotes initial SampleSheet has been checked
-        "sscheck_flag": "sscheck_flagfile.txt",  # Denotes SampleSheet has been checked
-        "illumina_seq_complete": "RTAComplete.txt",  # Illumina Sequencing complete file
-        "aviti_seq_complete": "RunUploaded.json", # AVITI Sequencing complete file
-    }
+    FLAG_FILES = FLAG_FILES
+    # Seconds to wait for a SQLite database (SqliteStore) locked by a concurrent script run
+    SQLITE_TIMEOUT = 30
+    STATE_INDEX_NAME = "runfolder_state_index.sqlite3"  # Created in AD_LOGDIR
+    # Runfolder lifecycle states recorded in the state index, in lifecycle order
+    RUNFOLDER_STATES = [
+        "sequencing",
+        "sequencing_complete",
+        "demultiplexing",  # Demultiplex log file present but empty
+        "cluster_density_failed",  # Demultiplexed, cluster density calculation to be re-run
+        "demultiplexed",
+        "uploaded",
+    ]
+    FASTQ_CACHE_NAME = "fastq_validation_cache.sqlite3"  # Created in AD_LOGDIR
+    SAMPLESHEET_CACHE_NAME = "samplesheet_validation_cache.sqlite3"  # Created in AD_LOGDIR
+    CHECKSUM_CACHE_NAME = "checksum_cache.sqlite3"  # Created in AD_LOGDIR
+    THREAD_LAYOUT_STORE_NAME = "thread_layouts.sqlite3"  # Created in AD_LOGDIR
+    # Number of processes used to validate fastqs in parallel (bounded as fastqs are read over NFS)
+    FASTQ_VALIDATION_PROCESSES = max(1, min(8, HOST_CPU))
+    # Fastq validation mode used by validate_fastqs. "quick" checks the gzip header / trailer and
+    # first record. "sampled" additionally decompresses short windows at several offsets across the
+    # fastq and its tail. "deep" decompresses the whole fastq, checking every record and that R1 and
+    # R2 contain the same number of reads (opt-in as it is slower)
+    FASTQ_VALIDATION_MODE = "quick"
+    FASTQ_VALIDATION_MODES = ["quick", "sampled", "deep"]  # In order of increasing coverage
+    FASTQ_DEEP_BUFFER = 16 * 1024**2  # Bytes of compressed data read at a time in deep mode
+    FASTQ_SAMPLED_WINDOWS = 8  # Number of windows checked across the fastq in sampled mode
+    FASTQ_SAMPLED_WINDOW_BYTES = 1024**2  # Bytes of compressed data decompressed per window
+    # Bytes searched from each window offset for a gzip member / deflate block boundary
+    FASTQ_SAMPLED_SEARCH_BYTES = 256 * 1024
+    # Fastqs smaller than this are fully decompressed (deep mode) in sampled mode
+    FASTQ_SAMPLED_MIN_BYTES = 256 * 1024**2
+    # Streamed subprocess output (stream_subprocess_command). Only the last SUBPROCESS_TAIL_LINES
+    # lines of each output stream are retained for error reporting
+    SUBPROCESS_TAIL_LINES = 200
+    SUBPROCESS_MAX_LINE_BYTES = 64 * 1024  # Longer lines are split
+    # Commands run without a shell by execute_commands(). At most COMMAND_CONCURRENCY commands of
+    # a call run at once, and commands are killed after COMMAND_TIMEOUT seconds (None for no limit)
+    COMMAND_CONCURRENCY = 4
+    COMMAND_TIMEOUT = None
+    PROGRESS_PATTERNS = PROGRESS_PATTERNS
+    PROGRESS_LOG_INTERVAL = 300  # Seconds between progress log messages
+    # Software tested by test_software(). Passing tests are cached (SOFTWARE_TEST_CACHE_NAME) for
+    # SOFTWARE_TEST_TTL seconds, keyed by the docker image ID ("docker_image") or the executable
+    # path and modification time
     TEST_PROGRAMS_DICT = {
         "dx_toolkit": {
             "executable": "dx",
@@ -697,17 +937,22 @@ class ToolboxConfig(PanelConfig):
         },
         "gatk_collect_lane_metrics": {
             "executable": "docker",
+            "docker_image": GATK_DOCKER,
             "test_cmd": f"docker run --rm {GATK_DOCKER} ./gatk CollectIlluminaLaneMetrics --version",
         },
         "bclconvert": {
             "executable": "docker",
+            "docker_image": BCLCONVERT_DOCKER,
             "test_cmd": f"docker run --rm {BCLCONVERT_DOCKER} --version",
         },
         "bases2fastq" : {
             "executable": "docker",
+            "docker_image": BASES2FASTQ_DOCKER,
             "test_cmd": f"docker run --rm {BASES2FASTQ_DOCKER} bases2fastq --version",
         },
     }
+    SOFTWARE_TEST_CACHE_NAME = "software_test_cache.sqlite3"  # Created in AD_LOGDIR
+    SOFTWARE_TEST_TTL = 6 * 3600  # Seconds for which a passing software test is reused
 
 
 class URConfig:
@@ -722,6 +967,7 @@ class URConfig:
     STRINGS = {
         "upload_started": "Upload started",  # Statement to write to DNAnexus upload started file
     }
+    UPLOAD_ATTEMPTS = 5  # Attempts made for each upload agent command
 
 
 class RunfolderCleanupConfig(PanelConfig):
@@ -733,3 +979,11 @@ class RunfolderCleanupConfig(PanelConfig):
     RUNFOLDER_PATTERN = RUNFOLDER_PATTERN
     RUNFOLDERS = RUNFOLDERS
     CREDENTIALS = CREDENTIALS
+    # Runfolder states (from the state index) that can never be deleted (not yet uploaded)
+    STATE_INDEX_SKIP = [
+        "sequencing",
+        "sequencing_complete",
+        "demultiplexing",
+        "cluster_density_failed",
+        "demultiplexed",
+    ]
@@ -14,10 +14,18 @@ LOG_MSGS = {
         "script_start": "Automate demultiplex release: %s. Start of %s script",
         "script_end": "Automate demultiplex release %s: %s complete",
         "runfolders_processed": "%s runfolders processed: %s",
+        "state_index_skipped": "Runfolder state index shows the following runfolders do not require processing: %s",
+        "sqlite_store_unavailable": "SQLite database %s could not be used, continuing without it: %s",
         "executing_command": "Executing the following command: %s",
         "cmd_success": "Command executed successfully with returncode %s",
         "cmd_fail": "Command returned non-zero exit code %s. Stdout: %s. Stderr: %s",
+        "cmd_timeout": "Command timed out after %s seconds and was killed: %s",
+        "cmd_not_started": "Command could not be started: %s. Error: %s",
+        "executing_commands": "Executing %s commands, at most %s at a time",
+        "cmd_progress": "%s progress: %.1f%% complete after %.0f seconds (%s)",
         "testing_software": "Testing %s software",
+        "software_test_cached": "%s test passed recently for the same image / executable (%s), not re-tested",
+        "software_tests_skipped": "No runfolders require processing, software tests skipped",
         "test_fail": "%s test failed: Stdout: %s. Stderr: %s. Script exited",
         "test_pass": "%s test passed",
         "software_fail": "Software tests did not all pass. Script exited",
@@ -43,9 +51,13 @@ LOG_MSGS = {
             "pipelines for the same run. Supported pipelines: %s"
         ),
         "ss_missing": "SampleSheet is missing and is required for sample name parsing",
-        "fastq_valid": "Gzip testing determined that the fastq is valid: %s",
+        "fastq_valid": "Gzip testing (%s mode) determined that the fastq is valid: %s",
         "fastq_invalid": "Gzip testing determined that the fastq is not valid: %s. Error: %s",
         "demux_success": "Demultiplexing was successful for the run with all fastqs valid",
+        "fastq_cached": "%s fastqs previously validated and unchanged (validation result cache): %s",
+        "fastq_read_count": "Fastq contains %s reads: %s",
+        "fastq_pair_mismatch": "R1 and R2 fastqs contain different numbers of reads (%s and %s): %s, %s",
+        "fastq_validation_aborted": "Fastq validation aborted after the first invalid fastq. %s fastqs not validated",
         "wes_batch_nos_identified": "WES batch numbers %s identified",
         "wes_batch_nos_missing": "WES batch numbers missing. Check for errors in the sample names. Script exited",
     },
@@ -62,7 +74,27 @@ LOG_MSGS = {
             "Remove the flag files (at least sscheck_flagfile.txt) to re-process: %s"),
         "ss_check_required": "Samplesheet check not yet conducted",
         "ss_validator_version": "Calling samplesheet_validator v%s",
+        "ss_check_cached": (
+            "SampleSheet unchanged since it was last validated (validation result cache): %s"
+        ),
         "sschecks_passed": "SampleSheet passed in %s all checks %s",
+        "checksum_expected_absent": (
+            "Sequencer md5 checksums file not yet present, built-in integrity check not started: %s"
+        ),
+        "checksum_expected_empty": (
+            "Sequencer md5 checksums file contains no checksums, built-in integrity check not "
+            "started: %s"
+        ),
+        "checksum_files_hashed": "Built-in integrity check hashed %s file(s), %s unchanged file(s) cached",
+        "checksum_progress": (
+            "Built-in integrity check: %s of %s file(s) verified, %s mismatched (%.1fs)"
+        ),
+        "checksum_result_written": "Built-in integrity check result written to md5checksum file: %s",
+        "sscheck_stage_start": "Checking %s SampleSheet(s) pending an initial SampleSheet check: %s",
+        "sscheck_stage_error": (
+            "Initial SampleSheet check for %s raised an exception, it will be checked when the "
+            "runfolder is processed: %s"
+        ),
         "sschecks_failed": (
             "SampleSheet check for %s failed with the following errors: %s. You may wait for the 2nd attempt check "
             "if it is initial check or please correct these, remove the "
@@ -77,9 +109,83 @@ LOG_MSGS = {
         "programmatic_runfolders": "Runfolders were gathered programmatically",
         "runfolder_names": "Runfolders identified for processing: %s",
         "script_success": "Runfolder has been successfully processed by the demultiplex script: %s",
+        "scheduler_budget": (
+            "Demultiplex scheduler running %s concurrent slot(s). Per-container budget: %s CPUs, %sGB memory"
+        ),
+        "slot_start": "Slot %s started processing runfolder: %s",
+        "slot_end": "Slot %s finished processing runfolder %s in %.1f seconds",
+        "watched_runfolders": "Runfolders identified by watch mode for processing: %s",
+        "watch_batch_failed": "Watch mode failed to prepare runfolders %s for processing: %s",
+        "runfolder_failed": "Processing of runfolder %s failed, continuing watch mode: %s",
+        "runfolder_already_scheduled": "Runfolder %s is already queued or being processed. Skipping",
+        "watch_start": "Watch mode started using %s on the following directories: %s",
+        "watch_inotify_unavailable": "inotify could not be used (%s). Falling back to polling",
+        "watch_network_fs": "%s is on a network filesystem (%s). Falling back to polling",
+        "watch_add_fail": "Could not watch directory %s: %s",
+        "watch_event": "Watch event for runfolder %s: %s",
+        "watch_overflow": "inotify event queue overflowed. Performing full rescan",
+        "watch_rescan": "Performing full rescan of runfolder directories",
+        "slot_utilisation": "Slot %s utilisation: %s runfolder(s), %.1f seconds busy (%.1f%% of %.1f seconds)",
         "demultiplexing_required": "Demultiplexing is required for this runfolder",
         "demultiplexing_start": "Demultiplexing started using the following command: %s",
         "demultiplexing_complete": "Demultiplexing completed successfully for %s",
+        "lane_demultiplexing_start": "Demultiplexing lane %s started using the following command: %s",
+        "lane_previously_complete": "Lane %s was demultiplexed by a previous run of the script, not re-running",
+        "lane_demultiplexing_failed": "Demultiplexing lane %s failed. Completed lanes will not be re-run",
+        "disk_space_sufficient": (
+            "Estimated fastq output of %.1f GiB fits in the %.1f GiB free (%.1f GiB reserved by "
+            "runfolders being demultiplexed) on the filesystem of %s"
+        ),
+        "disk_space_insufficient": (
+            "Demultiplexing deferred until the next script run: estimated fastq output of %.1f GiB "
+            "plus a %s GiB safety margin exceeds the %.1f GiB free (%.1f GiB reserved by "
+            "runfolders being demultiplexed) on the filesystem of %s"
+        ),
+        "run_quality_lane": "Lane %s run quality: %%PF %.1f, %%Q30 %.1f, cluster density %.1f K/mm2",
+        "run_quality_passed": "Run passed the run quality gate",
+        "run_quality_held": (
+            "Run held by the run quality gate and will not be demultiplexed: %s. Create %s to "
+            "release the run for demultiplexing"
+        ),
+        "run_quality_still_held": (
+            "Run is held by the run quality gate. Create %s to release the run for demultiplexing"
+        ),
+        "run_quality_released": "Run released from the run quality gate (%s present)",
+        "run_quality_unavailable": "Run quality metrics could not be calculated (%s). Run quality gate not applied",
+        "disk_estimate_unavailable": "Fastq output size could not be estimated (%s). Disk capacity not checked",
+        "thread_benchmark_start": "Benchmarking %s %s thread layouts on runfolder %s, with %s CPUs per container",
+        "thread_benchmark_layout": "Thread layout %s took %.1f seconds",
+        "thread_benchmark_failed": "Thread layout %s failed. STDOUT: %s. STDERR: %s",
+        "thread_benchmark_stored": "Stored fastest thread layout %s (%.1f seconds) for %s %s runs on this host",
+        "thread_counts": "Using benchmarked thread counts for this host: %s",
+        "staging_phase_time": "Scratch staging: %s took %.1f seconds",
+        "staging_files_copied": "Scratch staging: %s files copied (%.2f GiB, %.0f MiB/s)",
+        "staging_insufficient_space": (
+            "Scratch staging directory %s has %.1f GiB free, which is insufficient for %.1f GiB of "
+            "inputs. Demultiplexing within the runfolder"
+        ),
+        "staging_failed": "Scratch staging failed (%s). Demultiplexing within the runfolder",
+        "sample_redemultiplex_start": (
+            "Re-demultiplexing the samples with invalid fastqs (%s) using the following "
+            "command: %s"
+        ),
+        "sample_redemultiplex_not_possible": (
+            "Invalid fastqs (%s) cannot all be attributed to samples in the SampleSheet, so the "
+            "samples cannot be re-demultiplexed"
+        ),
+        "sample_redemultiplex_failed": (
+            "Re-demultiplexing of the samples with invalid fastqs failed. STDOUT: %s. STDERR: %s"
+        ),
+        "sample_redemultiplex_fastqs_differ": (
+            "Re-demultiplexed fastqs (%s) do not correspond to the fastqs of the samples (%s). "
+            "Fastqs not replaced"
+        ),
+        "sample_fastqs_replaced": "Replaced %s fastqs of samples %s with re-demultiplexed fastqs",
+        "lane_fastqs_merged": "Merged the per-lane fastqs into %s fastqs from %s lanes",
+        "lane_index_metrics_not_merged": (
+            "IndexMetricsOut.bin version not recognised, per-lane records not merged. "
+            "Copied the first lane to %s"
+        ),
         "demultiplexing_failed": "Demultiplexing failed - demultiplexing subprocess failed. Script exited. Stdout: %s. Stderr: %s",
         "demux_already_complete": "Demultiplexing already completed. Demultiplexing log found @ %s",
         "skipping_runfolder": "Upload flagfile present denoting runfolder has been uploaded - skipping runfolder: %s",
@@ -106,7 +212,22 @@ LOG_MSGS = {
         "bclconvertlog_empty": "BCLCONVERT logfile is empty for run %s. Please see logfile %s",
         "running_cd": "Running the following command for cluster density calculation: %s",
         "cd_success": "Cluster density calculation saved to %s",
-        "cd_fail": "Cluster density calculation failed. Error: %s. Script exited",
+        "running_cd_native": "Calculating cluster density from the InterOp files of runfolder: %s",
+        "cd_started": "Cluster density calculation started in the background",
+        "cd_fail": "Cluster density calculation failed. Error: %s",
+        "cd_success_absent": (
+            "Cluster density calculation exited with returncode 0, but the success statement was "
+            "not found in its output. Error: %s"
+        ),
+        "cd_incomplete": (
+            "Cluster density calculation did not complete successfully. Script exited"
+        ),
+        "cd_failed_flagfile": (
+            "Cluster density calculation did not complete successfully. Demultiplexing is not "
+            "repeated, the calculation is re-run on the next script run. Flag file written: %s"
+        ),
+        "cd_rerun": "Re-running cluster density calculation that previously failed (flag file: %s)",
+        "cd_rerun_success": "Cluster density calculation re-run successfully. Flag file removed: %s",
         "file_copy_success": "File successfully copied from %s to %s",
         "file_copy_fail": "Could not copy file - file does not exist: %s",
         "re_demultiplex": "Invalid fastqs were identified. Demultiplex log has been removed to trigger re-demultiplex",
@@ -124,6 +245,7 @@ LOG_MSGS = {
         "demux_complete": "Run has been previously successfully processed by the demultiplexing script",
         "success_string_absent": "Run has previously been demultiplexed but no success string is present",
         "not_yet_demultiplexed": "Demultiplexing has not been performed",
+        "cd_failed": "Cluster density calculation failed and has not yet been re-run. See: %s",
         "demultiplexlog_empty": "Demultiplex log file exists but is empty",
         "nonexistent_files": "Not all files exist: %s",
         "view_users": "Users identifed that require VIEW project permissions: %s",
@@ -140,6 +262,15 @@ LOG_MSGS = {
         "decision_support_upload_required": "Sample %s requires upload to decision support tool",
         "decision_support_upload_notrequired": "Sample %s is a control so does not require decision support upload",
         "cmds_built": "Finished building dx run commands",
+        "sample_qc": "Sample %s QC: %s reads, %%Q30 %.1f, %.2f%% of lane",
+        "sample_qc_failed": "Samples failed QC: %s. Most frequent unknown barcode: %s",
+        "sample_qc_missing": "Sample %s not found in the demultiplexing reports. Sample QC not applied to this sample",
+        "sample_qc_unavailable": "Per-sample QC metrics could not be read (%s). Sample QC gate not applied",
+        "sample_qc_skipped": "Samples failing QC excluded from dx run commands and pre-pipeline fastq upload: %s",
+        "sample_qc_flagged": (
+            "Samples failing QC will still be processed (SAMPLE_QC_ACTION is %s, or all samples "
+            "failed): %s"
+        ),
         "building_cmd": "Building %s cmd for %s",
         "insufficient_samples_for_cnv": (
             "Less than 3 samples detected for %s - CNV calling cannot be conducted"
@@ -5,6 +5,7 @@ that is run before and after every test. This is the top-level testing configura
 
 import os
 import re
+import types
 import shutil
 import pytest
 import tarfile
@@ -156,3 +157,62 @@ def run_before_and_after_tests(monkeypatch):
         # Remove dir and all flag files created
         shutil.rmtree(test_data_temp)
     ad_logger.remove_all_loggers()
+
+
+@pytest.fixture(scope="function")
+def logfile_section():
+    """
+    Logfile section (LOG_MSGS key) of the temp_logger fixture. Override this fixture in a test
+    module or class to use another section
+    """
+    return "demux"
+
+
+@pytest.fixture(scope="function")
+def temp_logger(logfile_section, tmp_path):
+    """
+    Return a logger for the logfile section writing to a temporary file, shut down after the
+    test
+    """
+    logger = ad_logger.AdLogger(
+        f"test_{logfile_section}", logfile_section, str(tmp_path / f"{logfile_section}.log")
+    ).get_logger()
+    yield logger
+    ad_logger.shutdown_logs(logger)
+
+
+@pytest.fixture(scope="function")
+def make_rf_obj(tmp_path):
+    """
+    Return a function that creates a runfolder in a temporary directory and returns a stand-in
+    RunfolderObject for it (a NovaSeq runfolder unless the sequencer type is given). Further
+    RunfolderObject attributes are passed as keyword arguments
+    """
+
+    def make_rf_obj(runfolder_name="999999_A01229_0000_000000TEST", **attributes):
+        runfolderpath = tmp_path / runfolder_name
+        runfolderpath.mkdir(parents=True, exist_ok=True)
+        return types.SimpleNamespace(
+            **{
+                "runfolder_name": runfolder_name,
+                "runfolderpath": str(runfolderpath),
+                "samplesheet_name": f"{runfolder_name}_SampleSheet.csv",
+                "sequencer_type": ad_config.NOVASEQ_ID,
+                **attributes,
+            }
+        )
+
+    return make_rf_obj
+
+
+@pytest.fixture(scope="function")
+def temp_state_index(tmp_path, monkeypatch):
+    """
+    Use a temporary runfolder state index database
+    """
+    state_index_class = toolbox.RunfolderStateIndex
+    monkeypatch.setattr(
+        toolbox,
+        "RunfolderStateIndex",
+        lambda: state_index_class(str(tmp_path / "state_index.sqlite3")),
+    )
@@ -4,8 +4,15 @@ Main entry point for demultiplex module.
 Demultiplexes NGS Run Folders. See README and docstrings for further details
 """
 
+import sys
 import argparse
-from demultiplex.demultiplex import GetRunfolders
+from demultiplex.demultiplex import (
+    GetRunfolders,
+    DemultiplexScheduler,
+    RunfolderWatcher,
+    benchmark_threads,
+    script_logger,
+)
 from ad_logger.ad_logger import set_root_logger
 
 set_root_logger()
@@ -38,15 +45,53 @@ def get_arguments():
             "errors and run demultiplexing anyway"
         ),
     )
+    parser.add_argument(
+        "-w",
+        "--watch",
+        action="store_true",
+        default=False,
+        help=(
+            "Run continuously, demultiplexing runfolders as soon as their sequencing complete, "
+            "md5checksum or SampleSheet files are written (uses inotify, falling back to "
+            "polling for network filesystems)"
+        ),
+    )
+    parser.add_argument(
+        "--poll",
+        action="store_true",
+        default=False,
+        help="Use polling rather than inotify in watch mode",
+    )
+    parser.add_argument(
+        "--benchmark_threads",
+        type=str,
+        required=False,
+        metavar="RUNFOLDER_NAME",
+        help=(
+            "Benchmark the demultiplexing thread layouts on a subset of the tiles of the given "
+            "(completed) runfolder, and store the fastest for this host and sequencer type. "
+            "Does not demultiplex any runfolders"
+        ),
+    )
     return parser.parse_args()
 
 
 parsed_args = get_arguments()
 
-if parsed_args.runfolder_name:  # If run with runfolder name provided as input
-    gr_obj = GetRunfolders(parsed_args.runfolder_name)
+if parsed_args.benchmark_threads:
+    benchmark_threads(parsed_args.benchmark_threads)
+    sys.exit(0)
 
+if parsed_args.watch:
+    # Start watching before the initial pass so that no events are missed. Runfolders are
+    # processed by the scheduler in the background so that the watcher is never blocked
+    watcher = RunfolderWatcher(parsed_args.poll)
+    scheduler_obj = DemultiplexScheduler(script_logger.timestamp)
+    scheduler_obj.submit_batch(parsed_args.runfolder_name or False)
+    for runfolder_names in watcher.watch():
+        # False denotes a full rescan of the runfolder directories
+        scheduler_obj.submit_batch(runfolder_names)
+elif parsed_args.runfolder_name:  # If run with runfolder name provided as input
+    GetRunfolders(parsed_args.runfolder_name).setoff_processing()
 else:
-    gr_obj = GetRunfolders()
-
-gr_obj.setoff_processing()
+    GetRunfolders().setoff_processing()
@@ -0,0 +1,349 @@
+"""bclconvert_lanes.py
+
+Lane-sharded bclconvert. Runs one bclconvert per flowcell lane concurrently, rather than a single
+bclconvert over the whole flowcell, so that a failed lane can be re-run without re-running the
+completed lanes. The per-lane fastqs and Reports are merged into the same outputs (fastq names and
+Reports files within Data/Intensities/BaseCalls) that a single bclconvert run with
+--no-lane-splitting writes. Contains the following classes:
+
+- BclconvertLaneShards
+    Run bclconvert for each lane of a runfolder within the per-container CPU / memory budget,
+    and merge the per-lane outputs
+"""
+
+import os
+import csv
+import shutil
+import logging
+import xml.etree.ElementTree as ET
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from config.ad_config import DemultiplexConfig
+from toolbox.toolbox import FASTQ_NAME_PATTERN, stream_subprocess_command
+from demultiplex.thread_tuning import get_thread_counts, format_thread_options
+
+LANE_COMPLETE_FILE = "lane_complete.txt"  # Written to a lane directory once bclconvert succeeds
+COPY_BUFFER = 16 * 1024**2  # Bytes copied at a time when concatenating fastqs
+# Header bytes of the InterOp IndexMetricsOut.bin versions that have a header followed by records
+INDEX_METRICS_HEADER_BYTES = {1: 1, 2: 1}
+
+
+def get_lane_count(runinfo_path: str) -> int:
+    """
+    Return the number of flowcell lanes from the runfolder RunInfo.xml
+        :param runinfo_path (str):  Path to RunInfo.xml
+        :return (int):              Number of lanes
+    """
+    return int(ET.parse(runinfo_path).getroot().find("Run/FlowcellLayout").get("LaneCount"))
+
+
+def merged_fastq_name(fastq_name: str) -> str:
+    """
+    Return the fastq name (or path) without the lane, as written by bclconvert with
+    --no-lane-splitting, e.g. Sample_S1_R1_001.fastq.gz for Sample_S1_L001_R1_001.fastq.gz. Names
+    that are not lane-split fastq names are returned unchanged
+        :param fastq_name (str):    Lane-split fastq name or path
+        :return (str):              Fastq name or path without the lane
+    """
+    dir_path, file_name = os.path.split(fastq_name)
+    match = FASTQ_NAME_PATTERN.match(file_name)
+    if not match or not match.group("lane"):
+        return fastq_name
+    lane_start, lane_end = match.span("lane")
+    return os.path.join(dir_path, file_name[:lane_start] + file_name[lane_end:])
+
+
+class BclconvertLaneShards(DemultiplexConfig):
+    """
+    Run one bclconvert per flowcell lane (--bcl-only-lane), BCLCONVERT_LANE_SHARDS lanes at a
+    time, each into its own directory within BCLCONVERT_LANE_DIR. The per-lane gzip fastqs are
+    concatenated (gzip members) into the usual per-sample fastq names in the fastq directory, and
+    the Reports CSVs are merged, so that downstream code sees the same output as a single
+    bclconvert run. Lanes that have completed are not re-run if the runfolder is re-processed
+
+    Attributes
+        rf_obj (obj):                       RunfolderObject object
+        user (int):                         User ID the containers are run as
+        logger (logging.Logger):            Demultiplex runfolder logger
+        output_logger (logging.Logger):     Logger to which bclconvert output is written
+        lanes_dir (str):                    Directory containing the per-lane directories
+        reports_dir (str):                  Merged Reports directory (within the fastq directory)
+        lanes (list):                       Lane numbers
+        thread_options (str):               Benchmarked thread options added to each command
+
+    Methods
+        get_lane_dir(lane)
+            Return the output directory for the lane
+        get_lane_cmd(lane)
+            Return the bclconvert command for the lane
+        run_lane(lane)
+            Run bclconvert for the lane, unless it has previously completed
+        run()
+            Run bclconvert for all lanes concurrently
+        merge_fastqs()
+            Concatenate the per-lane fastqs into per-sample fastqs in the fastq directory
+        concatenate(fastq_name, lane_fastqs)
+            Concatenate the per-lane fastqs of a sample
+        merge_reports()
+            Merge the per-lane Reports files into the Reports directory
+        merge_csv(report_name, lane_reports)
+            Merge the rows of per-lane Reports CSVs
+        merge_index_metrics(lane_reports)
+            Concatenate the records of the per-lane IndexMetricsOut.bin files
+        write_demultiplexlog()
+            Write the bclconvert log of each lane to the demultiplex log file
+        remove_lanes()
+            Remove the per-lane directories
+    """
+
+    def __init__(
+        self,
+        rf_obj: object,
+        user: int,
+        logger: logging.Logger,
+        output_logger: Optional[logging.Logger] = None,
+    ):
+        """
+        Constructor for the BclconvertLaneShards class
+            :param rf_obj (obj):                        RunfolderObject object
+            :param user (int):                          User ID the containers are run as
+            :param logger (logging.Logger):             Demultiplex runfolder logger
+            :param output_logger (logging.Logger):      Logger to which bclconvert output is written
+        """
+        self.rf_obj = rf_obj
+        self.user = user
+        self.logger = logger
+        self.output_logger = output_logger
+        self.lanes_dir = os.path.join(
+            self.rf_obj.runfolderpath, DemultiplexConfig.BCLCONVERT_LANE_DIR
+        )
+        self.reports_dir = os.path.join(self.rf_obj.fastq_dir_path, "Reports")
+        self.lanes = list(
+            range(1, get_lane_count(os.path.join(self.rf_obj.runfolderpath, "RunInfo.xml")) + 1)
+        )
+        # Benchmarked thread counts, scaled to each lane's share of the container CPU budget
+        self.thread_options = format_thread_options(
+            get_thread_counts(
+                self.rf_obj.sequencer_type,
+                DemultiplexConfig.DEMULTIPLEX_CONTAINER_CPU
+                / DemultiplexConfig.BCLCONVERT_LANE_SHARDS,
+            )
+        )
+
+    def get_lane_dir(self, lane: int) -> str:
+        """
+        Return the output directory for the lane
+            :param lane (int):  Lane number
+            :return (str):      Lane output directory
+        """
+        return os.path.join(self.lanes_dir, f"L{lane:03d}")
+
+    def get_lane_cmd(self, lane: int) -> str:
+        """
+        Return the bclconvert command for the lane. The fastqs and bclconvert logs are written
+        to output and Logs directories within the lane directory. These are created before the
+        command is run, as docker would otherwise create the mounted directories owned by root
+            :param lane (int):  Lane number
+            :return (str):      bclconvert command
+        """
+        output_dir = os.path.join(self.get_lane_dir(lane), "output")
+        log_dir = os.path.join(self.get_lane_dir(lane), "Logs")
+        for mount_dir in [output_dir, log_dir]:
+            os.makedirs(mount_dir, exist_ok=True)
+        return DemultiplexConfig.BCLCONVERT_LANE_CMD % (
+            self.user,
+            self.user,
+            self.rf_obj.runfolderpath,
+            output_dir,
+            log_dir,
+            os.path.join(DemultiplexConfig.RUNFOLDERS, "samplesheets"),
+            self.rf_obj.samplesheet_name,
+            lane,
+        ) + self.thread_options
+
+    def run_lane(self, lane: int) -> Tuple[str, str, int]:
+        """
+        Run bclconvert for the lane, unless it has previously completed. On success, the lane
+        complete file is written to the lane directory
+            :param lane (int):  Lane number
+            :return (tuple):    Tail of stdout, tail of stderr, returncode
+        """
+        lane_complete_file = os.path.join(self.get_lane_dir(lane), LANE_COMPLETE_FILE)
+        if os.path.isfile(lane_complete_file):
+            self.logger.info(self.logger.log_msgs["lane_previously_complete"], lane)
+            return "", "", 0
+        lane_cmd = self.get_lane_cmd(lane)
+        self.logger.info(self.logger.log_msgs["lane_demultiplexing_start"], lane, lane_cmd)
+        out, err, returncode = stream_subprocess_command(
+            lane_cmd, self.logger, self.output_logger
+        )
+        if returncode == 0:
+            with open(lane_complete_file, "w") as lane_complete:
+                lane_complete.write(f"{self.rf_obj.runfolder_name} lane {lane}\n")
+        else:
+            self.logger.error(self.logger.log_msgs["lane_demultiplexing_failed"], lane)
+        return out, err, returncode
+
+    def run(self) -> Tuple[str, str, int]:
+        """
+        Run bclconvert for all lanes, BCLCONVERT_LANE_SHARDS lanes at a time. If all lanes
+        succeed, the per-lane outputs are merged
+            :return (tuple):    Tail of stdout and stderr (of the failed lanes if any failed), and
+                                returncode (that of the first failed lane, or 0 on success)
+        """
+        with ThreadPoolExecutor(
+            max_workers=min(DemultiplexConfig.BCLCONVERT_LANE_SHARDS, len(self.lanes))
+        ) as executor:
+            results = dict(zip(self.lanes, executor.map(self.run_lane, self.lanes)))
+        failed = [lane for lane, (_, _, returncode) in results.items() if returncode != 0]
+        if failed:
+            return (
+                "\n".join(f"Lane {lane}: {results[lane][0]}" for lane in failed),
+                "\n".join(f"Lane {lane}: {results[lane][1]}" for lane in failed),
+                results[failed[0]][2],
+            )
+        self.merge_fastqs()
+        self.merge_reports()
+        return "", "", 0
+
+    def merge_fastqs(self) -> None:
+        """
+        Concatenate the per-lane fastqs (in lane order) into per-sample fastqs in the fastq
+        directory, with the names written by bclconvert with --no-lane-splitting. Fastqs are
+        concatenated in parallel
+            :return None:
+        """
+        lane_fastqs = {}
+        for lane in self.lanes:
+            output_dir = os.path.join(self.get_lane_dir(lane), "output")
+            for fastq_name in sorted(os.listdir(output_dir)):
+                match = FASTQ_NAME_PATTERN.match(fastq_name)
+                if match and match.group("lane"):
+                    lane_fastqs.setdefault(merged_fastq_name(fastq_name), []).append(
+                        os.path.join(output_dir, fastq_name)
+                    )
+        os.makedirs(self.rf_obj.fastq_dir_path, exist_ok=True)
+        with ThreadPoolExecutor(
+            max_workers=DemultiplexConfig.BCLCONVERT_LANE_SHARDS
+        ) as executor:
+            list(executor.map(self.concatenate, lane_fastqs.keys(), lane_fastqs.values()))
+        self.logger.info(
+            self.logger.log_msgs["lane_fastqs_merged"], len(lane_fastqs), len(self.lanes)
+        )
+
+    def concatenate(self, fastq_name: str, lane_fastqs: list) -> None:
+        """
+        Concatenate the per-lane fastqs of a sample (a gzip file may contain multiple members,
+        so the concatenated file is a valid gzip fastq)
+            :param fastq_name (str):    Merged fastq name
+            :param lane_fastqs (list):  Paths of the per-lane fastqs, in lane order
+            :return None:
+        """
+        with open(os.path.join(self.rf_obj.fastq_dir_path, fastq_name), "wb") as merged_fastq:
+            for lane_fastq in lane_fastqs:
+                with open(lane_fastq, "rb") as lane_file:
+                    shutil.copyfileobj(lane_file, merged_fastq, COPY_BUFFER)
+
+    def merge_reports(self) -> None:
+        """
+        Merge the per-lane Reports files into the Reports directory. CSV rows are concatenated
+        in lane order, IndexMetricsOut.bin records are concatenated, and other files (e.g.
+        RunInfo.xml, SampleSheet.csv), which are the same for every lane, are copied from the
+        first lane
+            :return None:
+        """
+        os.makedirs(self.reports_dir, exist_ok=True)
+        lane_reports_dirs = [
+            os.path.join(self.get_lane_dir(lane), "output", "Reports") for lane in self.lanes
+        ]
+        for report_name in sorted(os.listdir(lane_reports_dirs[0])):
+            lane_reports = [
+                os.path.join(reports_dir, report_name)
+                for reports_dir in lane_reports_dirs
+                if os.path.isfile(os.path.join(reports_dir, report_name))
+            ]
+            if not lane_reports:
+                continue
+            if report_name.endswith(".csv") and report_name != "SampleSheet.csv":
+                self.merge_csv(report_name, lane_reports)
+            elif report_name == "IndexMetricsOut.bin":
+                self.merge_index_metrics(lane_reports)
+            else:
+                shutil.copyfile(lane_reports[0], os.path.join(self.reports_dir, report_name))
+
+    def merge_csv(self, report_name: str, lane_reports: list) -> None:
+        """
+        Merge the rows of the per-lane Reports CSVs, in lane order, below the header of the first.
+        Fastq paths in fastq_list.csv are renamed to the merged fastq names, with one row per
+        merged fastq
+            :param report_name (str):   Reports file name
+            :param lane_reports (list): Paths of the per-lane Reports files, in lane order
+            :return None:
+        """
+        header, rows, seen = None, [], set()
+        for lane_report in lane_reports:
+            with open(lane_report, newline="") as report_file:
+                reader = csv.reader(report_file)
+                lane_header = next(reader, None)
+                header = header or lane_header
+                for row in reader:
+                    if report_name == "fastq_list.csv":
+                        row = [merged_fastq_name(value) for value in row]
+                        fastq_files = tuple(
+                            value for value in row if value.endswith(".fastq.gz")
+                        )
+                        if fastq_files in seen:
+                            continue
+                        seen.add(fastq_files)
+                    rows.append(row)
+        with open(os.path.join(self.reports_dir, report_name), "w", newline="") as merged:
+            writer = csv.writer(merged, lineterminator="\n")
+            if header:
+                writer.writerow(header)
+            writer.writerows(rows)
+
+    def merge_index_metrics(self, lane_reports: list) -> None:
+        """
+        Concatenate the records of the per-lane IndexMetricsOut.bin files below the header of the
+        first. If the file version is not known (so the header length is unknown), the file of
+        the first lane is copied
+            :param lane_reports (list): Paths of the per-lane IndexMetricsOut.bin files
+            :return None:
+        """
+        merged_path = os.path.join(self.reports_dir, "IndexMetricsOut.bin")
+        with open(lane_reports[0], "rb") as first_report:
+            version = first_report.read(1)
+        header_bytes = INDEX_METRICS_HEADER_BYTES.get(version[0] if version else None)
+        shutil.copyfile(lane_reports[0], merged_path)
+        if header_bytes is None:
+            self.logger.warning(
+                self.logger.log_msgs["lane_index_metrics_not_merged"], merged_path
+            )
+            return
+        with open(merged_path, "ab") as merged:
+            for lane_report in lane_reports[1:]:
+                with open(lane_report, "rb") as report_file:
+                    if report_file.read(header_bytes)[:1] != version:
+                        continue  # Records of a different version cannot be concatenated
+                    shutil.copyfileobj(report_file, merged, COPY_BUFFER)
+
+    def write_demultiplexlog(self) -> None:
+        """
+        Write the bclconvert log of each lane (in lane order) to the demultiplex log file, in
+        place of the single bclconvert log written when the lanes are not sharded
+            :return None:
+        """
+        with open(self.rf_obj.demultiplexlog_file, "w") as demultiplexlog:
+            for lane in self.lanes:
+                log_dir = os.path.join(self.get_lane_dir(lane), "Logs")
+                lane_log = os.path.join(log_dir, os.listdir(log_dir)[0])
+                with open(lane_log, "r") as lane_log_file:
+                    shutil.copyfileobj(lane_log_file, demultiplexlog)
+
+    def remove_lanes(self) -> None:
+        """
+        Remove the per-lane directories (once merged, or so that all lanes are re-run if the
+        merged fastqs are invalid)
+            :return None:
+        """
+        shutil.rmtree(self.lanes_dir, ignore_errors=True)
@@ -0,0 +1,266 @@
+"""checksum_verifier.py
+
+Built-in runfolder integrity check, as an alternative to waiting for the external integrity check
+scripts. Verifies the runfolder files against the md5 checksums written by the sequencer, and
+writes the same checksums match / do not match messages to md5checksum.txt that the integrity
+check scripts write, so that the existing integrity check assessment is unchanged. Contains the
+following classes:
+
+- ChecksumVerifier
+    Hash the runfolder files in parallel, incrementally as they arrive during sequencing, and
+    write the integrity check result to the md5checksum file once sequencing is complete
+"""
+
+import os
+import re
+import time
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+from config.ad_config import DemultiplexConfig
+from toolbox.toolbox import ChecksumCache, get_file_key, write_lines_atomic
+
+MD5_PATTERN = re.compile(r"^[0-9a-fA-F]{32}$")
+
+
+def md5_file(file_path: str, read_bytes: int = DemultiplexConfig.CHECKSUM_READ_BYTES) -> str:
+    """
+    Return the md5 checksum of a file. The file is read unbuffered into a reused buffer, with the
+    kernel advised that it will be read sequentially (increases readahead)
+        :param file_path (str):     Path to the file
+        :param read_bytes (int):    Bytes read at a time
+        :return (str):              md5 checksum (hex)
+    """
+    md5 = hashlib.md5()
+    buffer = bytearray(read_bytes)
+    view = memoryview(buffer)
+    with open(file_path, "rb", buffering=0) as open_file:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(open_file.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            size = open_file.readinto(buffer)
+            if not size:
+                break
+            md5.update(view[:size])
+    return md5.hexdigest()
+
+
+class ChecksumVerifier(DemultiplexConfig):
+    """
+    Verify the runfolder files against the md5 checksums written by the sequencer
+    (CHECKSUM_EXPECTED_FILE, md5sum format). Files are hashed using a thread pool, and calculated
+    checksums are cached by file path, size and modification time, so that verification can be
+    run incrementally on each run of the script during sequencing (only files that have arrived,
+    and have not been modified for CHECKSUM_SETTLE_SECONDS, are hashed). Once sequencing is
+    complete the result is written to the md5checksum file
+
+    Attributes
+        runfolderpath (str):        Path to the runfolder
+        checksumfile_path (str):    Path to the md5checksum file the result is written to
+        expected_file_path (str):   Path to the sequencer md5 checksums file
+        logger (logging.Logger):    Logger
+        threads (int):              Number of files hashed in parallel
+        cache (ChecksumCache):      Calculated checksums cache
+
+    Methods
+        read_expected()
+            Read the expected md5 checksums, keyed by path relative to the runfolder
+        hash_file(relative_path)
+            Return the md5 checksum of a runfolder file, and its size and modification time if
+            unchanged while it was hashed
+        hash_files(relative_paths)
+            Hash the runfolder files in parallel, using cached checksums where possible
+        verify(sequencing_complete)
+            Hash the files that have arrived, and once sequencing is complete write the result
+            to the md5checksum file
+        write_checksumfile(expected, calculated, mismatched, missing)
+            Write the checksums match / do not match message and any differences to the
+            md5checksum file
+    """
+
+    def __init__(
+        self,
+        runfolderpath: str,
+        logger: logging.Logger,
+        threads: int = DemultiplexConfig.CHECKSUM_THREADS,
+    ):
+        """
+        Constructor for the ChecksumVerifier class
+            :param runfolderpath (str):         Path to the runfolder
+            :param logger (logging.Logger):     Logger
+            :param threads (int):               Number of files hashed in parallel
+        """
+        self.runfolderpath = runfolderpath
+        self.checksumfile_path = os.path.join(
+            runfolderpath, DemultiplexConfig.FLAG_FILES["md5checksum"]
+        )
+        self.expected_file_path = os.path.join(
+            runfolderpath, DemultiplexConfig.CHECKSUM_EXPECTED_FILE
+        )
+        self.logger = logger
+        self.threads = max(1, threads)
+        self.cache = ChecksumCache()
+
+    def read_expected(self) -> Optional[dict]:
+        """
+        Read the expected md5 checksums from the sequencer md5 checksums file (md5sum format,
+        Windows or POSIX paths relative to the runfolder). Lines that are not checksums, and
+        paths outside the runfolder, are ignored
+            :return (Optional[dict]):   Expected md5 checksum of each file, keyed by path
+                                        relative to the runfolder. None if the file is absent
+        """
+        if not os.path.isfile(self.expected_file_path):
+            return None
+        expected = {}
+        with open(self.expected_file_path, "r", errors="replace") as expected_file:
+            for line in expected_file:
+                fields = line.strip().split(None, 1)
+                if len(fields) != 2 or not MD5_PATTERN.match(fields[0]):
+                    continue
+                relative_path = os.path.normpath(
+                    fields[1].lstrip("*").replace("\\", "/")
+                )
+                if os.path.isabs(relative_path) or relative_path.startswith(".."):
+                    continue
+                expected[relative_path] = fields[0].lower()
+        return expected
+
+    def hash_file(self, relative_path: str) -> Tuple[str, Optional[tuple], Optional[str]]:
+        """
+        Return the md5 checksum of a runfolder file, and its size and modification time if the
+        file did not change while it was being hashed (so that the checksum can be cached)
+            :param relative_path (str):     Path relative to the runfolder
+            :return (tuple):                Tuple of the relative path, size and modification
+                                            time (None if changed) and md5 checksum (None if the
+                                            file could not be read)
+        """
+        file_path = os.path.join(self.runfolderpath, relative_path)
+        key = get_file_key(file_path)
+        try:
+            md5 = md5_file(file_path)
+        except OSError:
+            return relative_path, None, None
+        if get_file_key(file_path) != key:
+            key = None
+        return relative_path, key, md5
+
+    def hash_files(self, relative_paths: list) -> dict:
+        """
+        Hash the runfolder files in parallel (hashlib releases the GIL while hashing), using the
+        cached checksums of files that have not changed since they were last hashed
+            :param relative_paths (list):   Paths relative to the runfolder
+            :return (dict):                 md5 checksum of each file that could be read, keyed
+                                            by relative path
+        """
+        cached = self.cache.get_md5s(
+            [os.path.join(self.runfolderpath, relative_path) for relative_path in relative_paths]
+        )
+        md5s = {
+            relative_path: cached[os.path.join(self.runfolderpath, relative_path)]
+            for relative_path in relative_paths
+            if os.path.join(self.runfolderpath, relative_path) in cached
+        }
+        to_hash = [relative_path for relative_path in relative_paths if relative_path not in md5s]
+        records = []
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            for relative_path, key, md5 in executor.map(self.hash_file, to_hash):
+                if md5:
+                    md5s[relative_path] = md5
+                    if key:
+                        records.append(
+                            (os.path.join(self.runfolderpath, relative_path), key, md5)
+                        )
+        self.cache.record_md5s(records)
+        self.logger.info(
+            self.logger.log_msgs["checksum_files_hashed"],
+            len(to_hash),
+            len(relative_paths) - len(to_hash),
+        )
+        return md5s
+
+    def verify(self, sequencing_complete: bool) -> Optional[bool]:
+        """
+        Hash the files listed in the sequencer md5 checksums file that have arrived in the
+        runfolder. During sequencing only files that have not been modified for
+        CHECKSUM_SETTLE_SECONDS are hashed, and no result is written. Once sequencing is
+        complete all files are hashed and the result is written to the md5checksum file. If the
+        sequencer md5 checksums file is absent or contains no checksums (e.g. it is still being
+        written), nothing is hashed and no result is written
+            :param sequencing_complete (bool):  True if sequencing is complete
+            :return (Optional[bool]):           True if all checksums match, False if not, None
+                                                if verification is not yet complete
+        """
+        expected = self.read_expected()
+        if expected is None:
+            self.logger.info(
+                self.logger.log_msgs["checksum_expected_absent"], self.expected_file_path
+            )
+            return None
+        if not expected:
+            self.logger.warning(
+                self.logger.log_msgs["checksum_expected_empty"], self.expected_file_path
+            )
+            return None
+        settled = time.time() - DemultiplexConfig.CHECKSUM_SETTLE_SECONDS
+        to_hash = []
+        for relative_path in expected.keys():
+            try:
+                mtime = os.stat(os.path.join(self.runfolderpath, relative_path)).st_mtime
+            except FileNotFoundError:
+                continue
+            if sequencing_complete or mtime < settled:
+                to_hash.append(relative_path)
+        start = time.monotonic()
+        calculated = self.hash_files(to_hash)
+        mismatched = [
+            relative_path
+            for relative_path, md5 in calculated.items()
+            if md5 != expected[relative_path]
+        ]
+        missing = [
+            relative_path for relative_path in expected.keys() if relative_path not in calculated
+        ]
+        self.logger.info(
+            self.logger.log_msgs["checksum_progress"],
+            len(calculated) - len(mismatched),
+            len(expected),
+            len(mismatched),
+            time.monotonic() - start,
+        )
+        if sequencing_complete:
+            self.write_checksumfile(expected, calculated, mismatched, missing)
+            return not mismatched and not missing
+
+    def write_checksumfile(
+        self, expected: dict, calculated: dict, mismatched: list, missing: list
+    ) -> None:
+        """
+        Write the checksums match / do not match message (first line, as written by the integrity
+        check scripts) and any mismatched or missing files to the md5checksum file
+            :param expected (dict):     Expected md5 checksum of each file
+            :param calculated (dict):   Calculated md5 checksum of each file
+            :param mismatched (list):   Files whose checksums do not match
+            :param missing (list):      Files that are missing or could not be read
+            :return None:
+        """
+        if mismatched or missing:
+            lines = [
+                f"{DemultiplexConfig.STRINGS['checksums_do_not_match']} "
+                f"(built-in integrity check of {len(expected)} files)"
+            ]
+            lines.extend(
+                f"{relative_path}: expected {expected[relative_path]}, "
+                f"calculated {calculated[relative_path]}"
+                for relative_path in sorted(mismatched)
+            )
+            lines.extend(f"{relative_path}: missing" for relative_path in sorted(missing))
+        else:
+            lines = [
+                f"{DemultiplexConfig.STRINGS['checksums_match']} "
+                f"(built-in integrity check of {len(expected)} files)"
+            ]
+        write_lines_atomic(self.checksumfile_path, lines)
+        self.logger.info(
+            self.logger.log_msgs["checksum_result_written"], self.checksumfile_path
+        )
@@ -4,6 +4,15 @@ Contains the following classes:
 
 - GetRunfolders
     Loop through and process NGS runfolders in a given directory (both Illumina and Aviti Outputs)
+- DemultiplexScheduler
+    Run the demultiplex workflow for multiple runfolders concurrently, within the per-container
+    CPU / memory budget defined in ad_config
+- SamplesheetCheckStage
+    Check the SampleSheets of all runfolders pending an initial SampleSheet check concurrently,
+    before the runfolders are processed by the DemultiplexScheduler
+- RunfolderWatcher
+    Watch the runfolder and SampleSheet directories, yielding runfolders that may be ready
+    for demultiplexing as their flag files are written (used by the --watch mode)
 - DemultiplexRunfolder
     Call bclconvert or bases2fastq on runfolders after asserting that runfolder has not been
     demultiplexed and a valid SampleSheet is present
@@ -15,23 +24,51 @@ import os
 import re
 import datetime
 import json
+import time
+import queue
+import threading
+import select
+import struct
+import ctypes
+import ctypes.util
+import xml.etree.ElementTree as ET
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from importlib.metadata import version
 from shutil import copyfile
 from typing import Optional, Tuple
 import samplesheet_validator.samplesheet_validator as samplesheet_validator
 from config.ad_config import DemultiplexConfig
 from ad_logger.ad_logger import AdLogger, shutdown_logs
+from demultiplex.interop_metrics import InterOpMetrics
+from demultiplex.checksum_verifier import ChecksumVerifier
+from demultiplex.bclconvert_lanes import BclconvertLaneShards
+from demultiplex.sample_redemultiplex import SampleRedemultiplex
+from demultiplex.scratch_staging import ScratchStaging
+from demultiplex.disk_capacity import DiskCapacityCheck, DiskReservations
+from demultiplex.run_quality import RunQualityGate
+from demultiplex.thread_tuning import (
+    ThreadBenchmark,
+    get_thread_counts,
+    format_thread_options,
+)
 from toolbox.toolbox import (
     return_scriptlog_config,
     get_runfolder_path,
     test_processing_software,
     RunfolderObject,
     RunfolderSamples,
+    RunfolderStateIndex,
+    SamplesheetValidationCache,
     get_num_processed_runfolders,
     git_tag,
     read_lines,
+    read_samplesheet,
     write_lines,
+    write_lines_atomic,
     execute_subprocess_command,
+    stream_subprocess_command,
+    CommandProgress,
     validate_fastqs,
     get_sequencer_type,
 )
@@ -45,6 +82,79 @@ ad_logger_obj = AdLogger(
 )
 script_logger = ad_logger_obj.get_logger()
 
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+INOTIFY_EVENT = struct.Struct("iIII")  # wd, mask, cookie, len
+
+
+def get_samplesheet_check_config(sequenced_on_illumina: bool, runfolder_name: str) -> list:
+    """
+    Return the configuration the SampleSheet is validated against (used with the validator
+    version to key the SampleSheet validation cache)
+        :param sequenced_on_illumina (bool):    True if sequenced on an Illumina sequencer
+        :param runfolder_name (str):            Runfolder name
+        :return (list):                         SampleSheet check configuration
+    """
+    return [
+        list(DemultiplexConfig.SEQUENCER_IDS.keys()),
+        DemultiplexConfig.PANELS,
+        DemultiplexConfig.TSO_PANELS,
+        DemultiplexConfig.DEV_PANEL,
+        sequenced_on_illumina,
+        runfolder_name,
+    ]
+
+
+def check_samplesheet(
+    samplesheet_path: str, logdir: str, sequenced_on_illumina: bool, runfolder_name: str
+) -> Tuple[bool, bool, str]:
+    """
+    Check SampleSheet naming and contents using the samplesheet_validator module. Module-level
+    so that it can be run in a process pool
+        :param samplesheet_path (str):          Path to SampleSheet
+        :param logdir (str):                    SampleSheet validator logfile directory
+        :param sequenced_on_illumina (bool):    True if sequenced on an Illumina sequencer
+        :param runfolder_name (str):            Runfolder name
+        :return (tuple):                        Tuple of whether the SampleSheet is valid,
+                                                whether it is a TSO run, and the errors string
+    """
+    sscheck_obj = samplesheet_validator.SamplesheetCheck(
+        samplesheet_path,
+        DemultiplexConfig.SEQUENCER_IDS.keys(),
+        DemultiplexConfig.PANELS,
+        DemultiplexConfig.TSO_PANELS,
+        DemultiplexConfig.DEV_PANEL,
+        logdir,
+        sequenced_on_illumina,
+        runfolder_name,
+    )
+    sscheck_obj.ss_checks()
+    shutdown_logs(sscheck_obj.logger)
+    err_str = ". ".join(", ".join(v) for v in sscheck_obj.errors_dict.values())
+    return not sscheck_obj.errors, sscheck_obj.tso, err_str
+
+
+def benchmark_threads(runfolder_name: str) -> Optional[dict]:
+    """
+    Benchmark the demultiplexing thread layouts on a runfolder, storing the fastest for this
+    host (--benchmark_threads). Called by main module
+        :param runfolder_name (str):    Name of a runfolder that has finished sequencing
+        :return (Optional[dict]):       Fastest thread layout, or None if every layout failed
+    """
+    script_start_logmsg(script_logger, __file__)
+    rf_obj = RunfolderObject(runfolder_name, script_logger.timestamp)
+    fastest = ThreadBenchmark(rf_obj, os.getuid(), script_logger).run()
+    script_end_logmsg(script_logger, __file__)
+    return fastest
+
 
 class GetRunfolders(DemultiplexConfig):
     """
@@ -57,8 +167,12 @@ class GetRunfolders(DemultiplexConfig):
     Methods
         get_runfolder_names(runfolder_names)
             Get test-mode-dependent runfolder names
-        setoff_processing()
-            Call methods to set off runfolder processing. Called by main module
+        setoff_processing(scheduler_obj)
+            Call methods to set off runfolder processing, running the SamplesheetCheckStage and
+            then using the DemultiplexScheduler to process runfolders concurrently. Called by
+            main module, and by the DemultiplexScheduler in watch mode
+        record_result(dr_obj)
+            Log whether the runfolder was processed, and record the decision in the state index
         check_run_processed(dr_obj, runfolder_name)
             If runfolder has been processed during this script run, append
             to processed_runfolders list
@@ -67,7 +181,8 @@ class GetRunfolders(DemultiplexConfig):
     def __init__(self, runfolder_names=False):
         """
         Constructor for the GetRunfolders class
-            :param runfolder_name (str | False):    Optional command line argument
+            :param runfolder_names (str | list | False):    Optional command line argument, or
+                                                            runfolders identified by watch mode
         """
         self.runfolder_names = self.get_runfolder_names(runfolder_names)
         self.timestamp = script_logger.timestamp
@@ -76,15 +191,22 @@ class GetRunfolders(DemultiplexConfig):
     def get_runfolder_names(self, runfolder_names) -> list:
         """
         Get test-mode-dependent runfolder names
-            :param runfolder_names (str | False):   Command line runfolder name string
-                                                    (default is False if none provided)
+            :param runfolder_names (str | list | False):    Command line runfolder name string,
+                                                            list of runfolder names identified
+                                                            by watch mode, or False if none
+                                                            provided
             :return runfolder_names (list):         List of runfolder names
         """
-        if runfolder_names:
+        if isinstance(runfolder_names, list):
+            script_logger.info(
+                script_logger.log_msgs["watched_runfolders"],
+                ", ".join(runfolder_names),
+            )
+        elif runfolder_names:
             script_logger.info(
                 script_logger.log_msgs["cmd_line_runfolder"], runfolder_names
             )
-            runfolder_names = [self.runfolder_names]
+            runfolder_names = [runfolder_names]
         else:
             script_logger.info(script_logger.log_msgs["programmatic_runfolders"])
             runfolder_names = []
@@ -95,34 +217,76 @@ class GetRunfolders(DemultiplexConfig):
                 aviti_runfolders = os.listdir(DemultiplexConfig.AVITI_RUNFOLDER)
                 folders = illumina_runfolders + aviti_runfolders
 
+            runfolder_paths = {}
             for folder_name in folders:
                 sequencer_type = get_sequencer_type(folder_name)
-                if get_runfolder_path(sequencer_type, folder_name) and re.compile(
+                runfolder_path = get_runfolder_path(sequencer_type, folder_name)
+                if runfolder_path and re.compile(
                     DemultiplexConfig.RUNFOLDER_PATTERN
                 ).match(folder_name):
+                    runfolder_paths[folder_name] = runfolder_path
+            # Skip runfolders that the state index shows have been demultiplexed / uploaded
+            states = RunfolderStateIndex().get_states(list(runfolder_paths.values()))
+            skipped = []
+            for folder_name in runfolder_paths.keys():
+                if states.get(folder_name) in DemultiplexConfig.STATE_INDEX_SKIP:
+                    skipped.append(folder_name)
+                else:
                     runfolder_names.append(folder_name)
+            script_logger.info(
+                script_logger.log_msgs["state_index_skipped"], ", ".join(skipped)
+            )
             script_logger.info(
                 script_logger.log_msgs["runfolder_names"],
                 ", ".join(runfolder_names),
             )
         return runfolder_names
 
-    def setoff_processing(self) -> None:
+    def setoff_processing(self, scheduler_obj: Optional[object] = None) -> None:
         """
-        Call methods to set off runfolder processing. Called by main module
+        Call methods to set off runfolder processing. Called by main module. In watch mode a
+        long-lived DemultiplexScheduler is provided, and the runfolders are submitted to it
+        without waiting for them to be processed
+            :param scheduler_obj (Optional[object]):    Watch mode DemultiplexScheduler, None to
+                                                        process the runfolders and wait
             :return None:
         """
         processed_runfolders = []
-        if test_processing_software(script_logger):
-            for runfolder in self.runfolder_names:
-                dr_obj = DemultiplexRunfolder(runfolder, self.timestamp)
-                dr_obj.setoff_workflow()
-                if self.check_run_processed(dr_obj, runfolder):
-                    processed_runfolders.append(runfolder)
+        if not self.runfolder_names:
+            script_logger.info(script_logger.log_msgs["software_tests_skipped"])
+        elif test_processing_software(script_logger):
+            # Runfolders failing the initial SampleSheet check are not processed until the
+            # next script run, when the 2nd attempt SampleSheet check is carried out
+            sscheck_failed = SamplesheetCheckStage(self.timestamp).run(self.runfolder_names)
+            runfolder_names = [
+                name for name in self.runfolder_names if name not in sscheck_failed
+            ]
+            if scheduler_obj:
+                for runfolder_name in runfolder_names:
+                    scheduler_obj.submit(runfolder_name, self.record_result)
+                return
+            for dr_obj in DemultiplexScheduler(self.timestamp).run(runfolder_names):
+                if self.record_result(dr_obj):
+                    processed_runfolders.append(dr_obj.rf_obj.runfolder_name)
 
         get_num_processed_runfolders(script_logger, processed_runfolders)
         script_end_logmsg(script_logger, __file__)
 
+    def record_result(self, dr_obj: object) -> Optional[bool]:
+        """
+        Log whether the runfolder was processed, and record the decision in the state index
+            :param dr_obj (object):     DemultiplexRunfolder object for the run
+            :return (Optional[bool]):   True if the runfolder was processed during this script run
+        """
+        if self.check_run_processed(dr_obj, dr_obj.rf_obj.runfolder_name):
+            RunfolderStateIndex().record_decision(
+                dr_obj.rf_obj.runfolderpath, "demultiplex: processed"
+            )
+            return True
+        RunfolderStateIndex().record_decision(
+            dr_obj.rf_obj.runfolderpath, "demultiplex: not processed"
+        )
+
     def check_run_processed(self, dr_obj: object, runfolder_name: str) -> None:
         """
         If runfolder has been processed during this script run, append
@@ -141,6 +305,713 @@ class GetRunfolders(DemultiplexConfig):
             return True
 
 
+class DemultiplexScheduler(DemultiplexConfig):
+    """
+    Run the demultiplex workflow for multiple runfolders concurrently. The number of slots
+    (runfolders processed at once) is derived in ad_config from the host CPU / memory and the
+    per-container budget (BASES2FASTQ_CPU, DEMULTIPLEX_CONTAINER_MEM_GB), which is also passed to
+    the demultiplexing containers so that concurrent containers cannot oversubscribe the host.
+    Small runs therefore do not have to wait behind a long NovaSeq demultiplex. In watch mode a
+    single scheduler is kept for the lifetime of the script, and batches of runfolders from the
+    RunfolderWatcher are submitted to it without blocking the watcher
+
+    Attributes
+        timestamp (str):                Timestamp in the format %Y%m%d_%H%M%S
+        slots (int):                    Number of runfolders that can be processed concurrently
+        free_slots (queue.Queue):       Queue of slot IDs not currently in use
+        slot_stats (dict):              Per-slot runfolder count and busy time (seconds)
+        executor (ThreadPoolExecutor):  Watch mode executor processing the submitted runfolders
+        batch_executor (ThreadPoolExecutor):    Watch mode executor preparing the watcher batches
+                                                (one batch at a time)
+        scheduled (set):                Names of runfolders submitted in watch mode that are
+                                        queued or being processed
+        lock (threading.Lock):          Lock serialising access to scheduled
+        disk_reservations (DiskReservations):   Estimated fastq output of the runfolders being
+                                                processed, deducted from the free space by the
+                                                disk capacity check of each runfolder
+
+    Methods
+        run(runfolder_names)
+            Process the runfolders concurrently and return the DemultiplexRunfolder objects
+        submit_batch(runfolder_names)
+            Prepare a batch of runfolders from the RunfolderWatcher in the background, and submit
+            them for processing, without blocking the caller
+        process_batch(runfolder_names)
+            Run the pre-demultiplexing stages for a watcher batch and submit its runfolders
+        submit(runfolder_name, callback)
+            Submit a runfolder for processing in watch mode, unless it is already queued or
+            being processed
+        runfolder_done(runfolder_name, future, callback)
+            Release a runfolder submitted in watch mode once processed, logging any failure
+        process_runfolder(runfolder_name)
+            Claim a free slot and run the demultiplex workflow for a single runfolder
+        log_slot_utilisation(wall_time)
+            Log the number of runfolders processed and busy time of each slot
+    """
+
+    def __init__(self, timestamp: str, slots: int = DemultiplexConfig.DEMULTIPLEX_SLOTS):
+        """
+        Constructor for the DemultiplexScheduler class
+            :param timestamp (str):     Timestamp in the format %Y%m%d_%H%M%S
+            :param slots (int):         Number of runfolders that can be processed concurrently
+        """
+        self.timestamp = timestamp
+        self.slots = max(1, slots)
+        self.free_slots = queue.Queue()
+        self.slot_stats = {}
+        for slot in range(1, self.slots + 1):
+            self.free_slots.put(slot)
+            self.slot_stats[slot] = {"runfolders": 0, "busy": 0.0}
+        self.executor = None
+        self.batch_executor = None
+        self.scheduled = set()
+        self.lock = threading.Lock()
+        self.disk_reservations = DiskReservations()
+
+    def run(self, runfolder_names: list) -> list:
+        """
+        Process the runfolders concurrently. Runfolders are submitted in order so that runs
+        listed first are started first. If a runfolder exits the script (sys.exit), runfolders
+        already being processed are allowed to finish before the exit is raised, and runfolders
+        not yet started are cancelled
+            :param runfolder_names (list):  List of runfolder names
+            :return dr_objs (list):         DemultiplexRunfolder objects, in the order of runfolder_names
+        """
+        script_logger.info(
+            script_logger.log_msgs["scheduler_budget"],
+            self.slots,
+            DemultiplexConfig.DEMULTIPLEX_CONTAINER_CPU,
+            DemultiplexConfig.DEMULTIPLEX_CONTAINER_MEM_GB,
+        )
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.slots) as executor:
+            futures = [
+                executor.submit(self.process_runfolder, runfolder_name)
+                for runfolder_name in runfolder_names
+            ]
+            try:
+                dr_objs = [future.result() for future in futures]
+            finally:
+                executor.shutdown(wait=True, cancel_futures=True)
+                self.log_slot_utilisation(time.monotonic() - start)
+        return dr_objs
+
+    def submit_batch(self, runfolder_names) -> None:
+        """
+        Prepare a batch of runfolders from the RunfolderWatcher in the background (runfolder
+        identification, software tests and SampleSheet check stage), submitting the runfolders
+        for processing, so that the watcher is not blocked while runfolders are processed
+            :param runfolder_names (str | list | False):    Runfolder names identified by watch mode,
+                                                            or False for a full rescan
+            :return None:
+        """
+        if self.batch_executor is None:
+            self.batch_executor = ThreadPoolExecutor(max_workers=1)
+            self.executor = ThreadPoolExecutor(max_workers=self.slots)
+            script_logger.info(
+                script_logger.log_msgs["scheduler_budget"],
+                self.slots,
+                DemultiplexConfig.DEMULTIPLEX_CONTAINER_CPU,
+                DemultiplexConfig.DEMULTIPLEX_CONTAINER_MEM_GB,
+            )
+        self.batch_executor.submit(self.process_batch, runfolder_names)
+
+    def process_batch(self, runfolder_names) -> None:
+        """
+        Run the pre-demultiplexing stages for a watcher batch and submit its runfolders for
+        processing. Failures (including sys.exit) are logged so that the watcher keeps running
+            :param runfolder_names (str | list | False):    Runfolder names identified by watch mode,
+                                                            or False for a full rescan
+            :return None:
+        """
+        try:
+            GetRunfolders(runfolder_names).setoff_processing(self)
+        except (SystemExit, Exception) as exception:
+            script_logger.error(
+                script_logger.log_msgs["watch_batch_failed"], runfolder_names, repr(exception)
+            )
+
+    def submit(self, runfolder_name: str, callback) -> None:
+        """
+        Submit a runfolder for processing in watch mode, unless it is already queued or being
+        processed (e.g. watch events caused by the script's own flag files). Runfolders skipped
+        here are picked up by the next watch event or full rescan
+            :param runfolder_name (str):    Runfolder name
+            :param callback (function):     Called with the DemultiplexRunfolder object once the
+                                            runfolder has been processed
+            :return None:
+        """
+        with self.lock:
+            if runfolder_name in self.scheduled:
+                script_logger.info(
+                    script_logger.log_msgs["runfolder_already_scheduled"], runfolder_name
+                )
+                return
+            self.scheduled.add(runfolder_name)
+        future = self.executor.submit(self.process_runfolder, runfolder_name)
+        future.add_done_callback(
+            lambda future: self.runfolder_done(runfolder_name, future, callback)
+        )
+
+    def runfolder_done(self, runfolder_name: str, future: object, callback) -> None:
+        """
+        Release a runfolder submitted in watch mode once processed. If processing raised an
+        exception or exited the script (sys.exit), this is logged rather than stopping the
+        watcher, and the runfolder is re-assessed on the next watch event or full rescan
+            :param runfolder_name (str):    Runfolder name
+            :param future (Future):         Completed future for the runfolder
+            :param callback (function):     Called with the DemultiplexRunfolder object if the
+                                            runfolder was processed without failing
+            :return None:
+        """
+        with self.lock:
+            self.scheduled.discard(runfolder_name)
+        exception = future.exception()
+        try:
+            if exception is None:
+                callback(future.result())
+        except Exception as callback_exception:
+            exception = callback_exception
+        if exception is not None:
+            script_logger.error(
+                script_logger.log_msgs["runfolder_failed"], runfolder_name, repr(exception)
+            )
+
+    def process_runfolder(self, runfolder_name: str) -> object:
+        """
+        Claim a free slot and run the demultiplex workflow for a single runfolder, recording
+        the time the slot was busy. Disk space reserved for the runfolder by its disk capacity
+        check is released once the runfolder has been processed
+            :param runfolder_name (str):    Runfolder name
+            :return dr_obj (object):        DemultiplexRunfolder object for the run
+        """
+        slot = self.free_slots.get()
+        start = time.monotonic()
+        script_logger.info(script_logger.log_msgs["slot_start"], slot, runfolder_name)
+        try:
+            dr_obj = DemultiplexRunfolder(
+                runfolder_name, self.timestamp, disk_reservations=self.disk_reservations
+            )
+            dr_obj.setoff_workflow()
+        finally:
+            self.disk_reservations.release(runfolder_name)
+            elapsed = time.monotonic() - start
+            self.slot_stats[slot]["runfolders"] += 1
+            self.slot_stats[slot]["busy"] += elapsed
+            script_logger.info(
+                script_logger.log_msgs["slot_end"], slot, runfolder_name, elapsed
+            )
+            self.free_slots.put(slot)
+        return dr_obj
+
+    def log_slot_utilisation(self, wall_time: float) -> None:
+        """
+        Log the number of runfolders processed and busy time of each slot, as a percentage
+        of the scheduler wall time
+            :param wall_time (float):   Total time (seconds) taken to process all runfolders
+            :return None:
+        """
+        for slot, stats in self.slot_stats.items():
+            script_logger.info(
+                script_logger.log_msgs["slot_utilisation"],
+                slot,
+                stats["runfolders"],
+                stats["busy"],
+                (stats["busy"] / wall_time * 100) if wall_time else 0.0,
+                wall_time,
+            )
+
+
+class SamplesheetCheckStage(DemultiplexConfig):
+    """
+    Early warning SampleSheet check stage, run before demultiplexing. Checks the SampleSheets of
+    all runfolders that have a SampleSheet but no initial SampleSheet check flag file (and have
+    not already been demultiplexed / uploaded) concurrently in a process pool, rather than one at
+    a time as each runfolder is reached by the scheduler. SampleSheet problems are therefore
+    flagged as soon as the SampleSheet is present, while sequencing is still in progress. The
+    initial SampleSheet check flag files are written atomically so that a concurrent script run
+    cannot read a partially written flag file
+
+    Attributes
+        timestamp (str):    Timestamp in the format %Y%m%d_%H%M%S
+        processes (int):    Maximum number of SampleSheets checked in parallel
+
+    Methods
+        run(runfolder_names)
+            Check the SampleSheets of all runfolders pending an initial SampleSheet check
+        get_pending(runfolder_names)
+            Return RunfolderObjects for runfolders pending an initial SampleSheet check
+        record_result(rf_obj, valid, err_str)
+            Write the initial SampleSheet check flag file and log the result
+    """
+
+    def __init__(
+        self, timestamp: str, processes: int = DemultiplexConfig.SSCHECK_PROCESSES
+    ):
+        """
+        Constructor for the SamplesheetCheckStage class
+            :param timestamp (str):     Timestamp in the format %Y%m%d_%H%M%S
+            :param processes (int):     Maximum number of SampleSheets checked in parallel
+        """
+        self.timestamp = timestamp
+        self.processes = max(1, processes)
+
+    def run(self, runfolder_names: list) -> list:
+        """
+        Check the SampleSheets of all runfolders pending an initial SampleSheet check. Cached
+        results (unchanged SampleSheets) are used where present, and the remaining SampleSheets
+        are checked in parallel. If a check raises an exception, no flag file is written so that
+        the SampleSheet is checked again when the runfolder is processed
+            :param runfolder_names (list):  List of runfolder names
+            :return failed (list):          Names of runfolders that failed the initial
+                                            SampleSheet check
+        """
+        pending = self.get_pending(runfolder_names)
+        if not pending:
+            return []
+        script_logger.info(
+            script_logger.log_msgs["sscheck_stage_start"],
+            len(pending),
+            ", ".join(rf_obj.runfolder_name for rf_obj in pending),
+        )
+        validator_version = version("samplesheet_validator")
+        ss_cache = SamplesheetValidationCache()
+        failed, to_check = [], {}
+        for rf_obj in pending:
+            sequenced_on_illumina = rf_obj.sequencer_type != DemultiplexConfig.AVITI_ID
+            cache_key = ss_cache.get_key(
+                rf_obj.samplesheet_path,
+                validator_version,
+                get_samplesheet_check_config(sequenced_on_illumina, rf_obj.runfolder_name),
+            )
+            cached_result = ss_cache.get_result(cache_key)
+            if cached_result:
+                script_logger.info(
+                    script_logger.log_msgs["ss_check_cached"], rf_obj.samplesheet_path
+                )
+                valid, _, err_str = cached_result
+                if not self.record_result(rf_obj, valid, err_str):
+                    failed.append(rf_obj.runfolder_name)
+            else:
+                to_check[rf_obj.runfolder_name] = (rf_obj, sequenced_on_illumina, cache_key)
+
+        if to_check:
+            script_logger.info(
+                script_logger.log_msgs["ss_validator_version"], validator_version
+            )
+            # forkserver avoids forking a process that may be running other threads
+            with ProcessPoolExecutor(
+                max_workers=min(self.processes, len(to_check)),
+                mp_context=multiprocessing.get_context("forkserver"),
+            ) as executor:
+                futures = {
+                    executor.submit(
+                        check_samplesheet,
+                        rf_obj.samplesheet_path,
+                        os.path.dirname(rf_obj.samplesheet_validator_logfile),
+                        sequenced_on_illumina,
+                        runfolder_name,
+                    ): runfolder_name
+                    for runfolder_name, (rf_obj, sequenced_on_illumina, _) in to_check.items()
+                }
+                for future in as_completed(futures):
+                    runfolder_name = futures[future]
+                    rf_obj, _, cache_key = to_check[runfolder_name]
+                    try:
+                        valid, tso, err_str = future.result()
+                    except Exception as exception:
+                        script_logger.error(
+                            script_logger.log_msgs["sscheck_stage_error"],
+                            runfolder_name,
+                            exception,
+                        )
+                        continue
+                    ss_cache.record_result(cache_key, valid, tso, err_str)
+                    if not self.record_result(rf_obj, valid, err_str):
+                        failed.append(runfolder_name)
+        return failed
+
+    def get_pending(self, runfolder_names: list) -> list:
+        """
+        Return RunfolderObjects for runfolders that have a SampleSheet, but no initial
+        SampleSheet check flag file, and have not been demultiplexed or uploaded. Runfolders
+        whose RunfolderObject cannot be created (e.g. AVITI runfolders without a
+        RunParameters.json) are left for the scheduler
+            :param runfolder_names (list):  List of runfolder names
+            :return pending (list):         List of RunfolderObjects
+        """
+        pending = []
+        for runfolder_name in runfolder_names:
+            try:
+                rf_obj = RunfolderObject(runfolder_name, self.timestamp)
+            except (OSError, ValueError, AttributeError):
+                continue
+            if (
+                os.path.isfile(rf_obj.samplesheet_path)
+                and not os.path.isfile(rf_obj.initial_sscheck_flagfile_path)
+                and not os.path.isfile(rf_obj.demultiplexlog_file)
+                and not os.path.exists(rf_obj.upload_flagfile)
+            ):
+                pending.append(rf_obj)
+        return pending
+
+    def record_result(self, rf_obj: object, valid: bool, err_str: str) -> Optional[bool]:
+        """
+        Write the initial SampleSheet check flag file (atomically) and log the result to the
+        script logfile. The result is not logged to the runfolder demultiplex log, as this is
+        overwritten when the runfolder is processed. The flag file records the result
+            :param rf_obj (object):     RunfolderObject for the runfolder
+            :param valid (bool):        Whether the SampleSheet is valid
+            :param err_str (str):       SampleSheet errors string
+            :return (Optional[bool]):   Return True if the SampleSheet is valid
+        """
+        if valid:
+            script_logger.info(
+                script_logger.log_msgs["sschecks_passed"],
+                "initial attempt",
+                rf_obj.samplesheet_path,
+            )
+            write_lines_atomic(
+                rf_obj.initial_sscheck_flagfile_path,
+                DemultiplexConfig.STRINGS["samplesheet_success"] % datetime.datetime.now(),
+            )
+        else:
+            script_logger.error(
+                script_logger.log_msgs["sschecks_failed"],
+                f"{rf_obj.runfolder_name} (initial attempt)",
+                err_str,
+            )
+            write_lines_atomic(
+                rf_obj.initial_sscheck_flagfile_path,
+                DemultiplexConfig.STRINGS["samplesheet_fail"] % err_str,
+            )
+        return valid or None
+
+
+class RunfolderWatcher(DemultiplexConfig):
+    """
+    Watch the runfolder directories and SampleSheet directories for the files that denote a
+    runfolder may be ready for demultiplexing (sequencing complete file, md5checksum file,
+    SampleSheet), or should be re-assessed (removal of the demultiplex log / SampleSheet check
+    flag files), and yield these runfolders as the files are written. inotify is used where
+    possible. Polling of the flag files is used for network filesystems (which do not deliver
+    inotify events for changes made by other hosts), or if inotify cannot be initialised. A full
+    rescan is requested periodically, and if the inotify event queue overflows
+
+    Attributes
+        runfolder_dirs (list):      Directories containing runfolders
+        samplesheet_dirs (list):    Directories containing SampleSheets
+        runfolders (dict):          Runfolder paths, keyed by runfolder name
+        snapshot (dict | None):     Flag file / SampleSheet modification times from the last poll
+        watch_descriptors (dict):   Watched directory paths, keyed by inotify watch descriptor
+        inotify_fd (int | None):    inotify file descriptor, None if polling
+
+    Methods
+        watch()
+            Generator yielding lists of runfolder names that may be ready for demultiplexing, or
+            False when a full rescan is required
+        get_fs_type(path)
+            Return the type of the filesystem the path is on
+        init_inotify()
+            Initialise inotify and add watches on the runfolder and SampleSheet directories
+        add_watch(path)
+            Add an inotify watch on a directory
+        get_runfolders()
+            Return the paths of the runfolders that have not been uploaded, keyed by runfolder name
+        read_events(timeout)
+            Wait for inotify events, returning runfolders with flag file changes
+        handle_event(dirpath, mask, name)
+            Return the runfolders affected by a single inotify event
+        poll_flag_files()
+            Compare flag file modification times to the previous poll, returning runfolders
+            with flag file changes
+        samplesheet_runfolders(samplesheet_name)
+            Return the runfolders a SampleSheet may belong to
+    """
+
+    def __init__(self, poll: bool = False):
+        """
+        Constructor for the RunfolderWatcher class
+            :param poll (bool):     Use polling rather than inotify
+        """
+        self.runfolder_dirs = list(
+            dict.fromkeys([DemultiplexConfig.RUNFOLDERS, DemultiplexConfig.AVITI_RUNFOLDER])
+        )
+        self.samplesheet_dirs = list(
+            dict.fromkeys(
+                [DemultiplexConfig.SAMPLESHEETS_DIR, DemultiplexConfig.AVITI_SAMPLESHEET]
+            )
+        )
+        self.runfolders = self.get_runfolders()
+        self.snapshot = None
+        self.watch_descriptors = {}
+        self.inotify_fd = None
+        if not poll:
+            for path in self.runfolder_dirs + self.samplesheet_dirs:
+                fs_type = self.get_fs_type(path)
+                if fs_type in DemultiplexConfig.NETWORK_FS_TYPES:
+                    script_logger.info(
+                        script_logger.log_msgs["watch_network_fs"], path, fs_type
+                    )
+                    break
+            else:
+                self.init_inotify()
+        script_logger.info(
+            script_logger.log_msgs["watch_start"],
+            "inotify" if self.inotify_fd is not None else "polling",
+            ", ".join(self.runfolder_dirs + self.samplesheet_dirs),
+        )
+
+    def watch(self):
+        """
+        Generator yielding lists of runfolder names that may be ready for demultiplexing. Events
+        arriving within WATCH_SETTLE_SECONDS of each other are yielded together. False is yielded
+        when a full rescan is required (every WATCH_RESCAN_INTERVAL, or on inotify overflow)
+            :return (Generator[list | False]):  Runfolder names, or False for a full rescan
+        """
+        last_rescan = time.monotonic()
+        while True:
+            rescan_in = max(
+                0, DemultiplexConfig.WATCH_RESCAN_INTERVAL - (time.monotonic() - last_rescan)
+            )
+            if self.inotify_fd is not None:
+                runfolder_names = self.read_events(rescan_in)
+            else:
+                time.sleep(min(DemultiplexConfig.WATCH_POLL_INTERVAL, rescan_in))
+                runfolder_names = self.poll_flag_files()
+            if (
+                runfolder_names is False
+                or time.monotonic() - last_rescan >= DemultiplexConfig.WATCH_RESCAN_INTERVAL
+            ):
+                script_logger.info(script_logger.log_msgs["watch_rescan"])
+                self.runfolders = self.get_runfolders()
+                last_rescan = time.monotonic()
+                yield False
+            elif runfolder_names:
+                yield sorted(runfolder_names)
+
+    def get_fs_type(self, path: str) -> Optional[str]:
+        """
+        Return the type of the filesystem the path is on, using the longest matching
+        mount point in /proc/mounts
+            :param path (str):              Directory path
+            :return fs_type (str | None):   Filesystem type, None if it cannot be determined
+        """
+        fs_type, mount_len = None, -1
+        try:
+            with open("/proc/mounts", "r", encoding="utf-8") as mounts:
+                for line in mounts:
+                    fields = line.split()
+                    mount_point = fields[1]
+                    if (
+                        os.path.realpath(path) + os.sep
+                    ).startswith(mount_point.rstrip(os.sep) + os.sep) and len(mount_point) > mount_len:
+                        fs_type, mount_len = fields[2], len(mount_point)
+        except OSError:
+            pass
+        return fs_type
+
+    def init_inotify(self) -> Optional[bool]:
+        """
+        Initialise inotify and add watches on the runfolder directories (for new runfolders),
+        SampleSheet directories, and each runfolder that has not been uploaded (for flag files)
+            :return (Optional[bool]):   True if inotify was successfully initialised
+        """
+        try:
+            self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            inotify_fd = self.libc.inotify_init1(IN_NONBLOCK)
+            if inotify_fd < 0:
+                raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        except (OSError, AttributeError) as exception:
+            script_logger.warning(
+                script_logger.log_msgs["watch_inotify_unavailable"], exception
+            )
+            return
+        self.inotify_fd = inotify_fd
+        for path in self.runfolder_dirs + self.samplesheet_dirs + list(self.runfolders.values()):
+            self.add_watch(path)
+        return True
+
+    def add_watch(self, path: str) -> Optional[bool]:
+        """
+        Add an inotify watch on a directory
+            :param path (str):          Directory path
+            :return (Optional[bool]):   True if the watch was added
+        """
+        wd = self.libc.inotify_add_watch(
+            self.inotify_fd,
+            os.fsencode(path),
+            IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_CREATE | IN_DELETE,
+        )
+        if wd < 0:
+            script_logger.warning(
+                script_logger.log_msgs["watch_add_fail"],
+                path,
+                os.strerror(ctypes.get_errno()),
+            )
+        else:
+            self.watch_descriptors[wd] = path
+            return True
+
+    def get_runfolders(self) -> dict:
+        """
+        Return the paths of the runfolders in the runfolder directories that have not been
+        uploaded (uploaded runfolders never require demultiplexing)
+            :return runfolders (dict):  Runfolder paths, keyed by runfolder name
+        """
+        runfolders = {}
+        pattern = re.compile(DemultiplexConfig.RUNFOLDER_PATTERN)
+        for runfolder_dir in self.runfolder_dirs:
+            if not os.path.isdir(runfolder_dir):
+                continue
+            for entry in os.scandir(runfolder_dir):
+                if (
+                    pattern.match(entry.name)
+                    and entry.is_dir()
+                    and not os.path.exists(
+                        os.path.join(entry.path, self.FLAG_FILES["upload_started"])
+                    )
+                ):
+                    runfolders[entry.name] = entry.path
+        return runfolders
+
+    def read_events(self, timeout: float):
+        """
+        Wait up to timeout seconds for inotify events. Once an event is received, continue
+        reading events until none arrive for WATCH_SETTLE_SECONDS
+            :param timeout (float):             Maximum time (seconds) to wait for the first event
+            :return runfolder_names (set | False):  Runfolders with flag file changes, False if
+                                                    the event queue overflowed
+        """
+        runfolder_names = set()
+        while select.select([self.inotify_fd], [], [], timeout)[0]:
+            try:
+                buffer = os.read(self.inotify_fd, 65536)
+            except BlockingIOError:
+                continue
+            offset = 0
+            while offset < len(buffer):
+                wd, mask, _cookie, name_len = INOTIFY_EVENT.unpack_from(buffer, offset)
+                name = os.fsdecode(
+                    buffer[offset + INOTIFY_EVENT.size:offset + INOTIFY_EVENT.size + name_len].rstrip(b"\0")
+                )
+                offset += INOTIFY_EVENT.size + name_len
+                if mask & IN_Q_OVERFLOW:
+                    script_logger.warning(script_logger.log_msgs["watch_overflow"])
+                    return False
+                if mask & IN_IGNORED:  # Directory removed
+                    self.watch_descriptors.pop(wd, None)
+                elif wd in self.watch_descriptors:
+                    runfolder_names.update(
+                        self.handle_event(self.watch_descriptors[wd], mask, name)
+                    )
+            timeout = DemultiplexConfig.WATCH_SETTLE_SECONDS
+        return runfolder_names
+
+    def handle_event(self, dirpath: str, mask: int, name: str) -> list:
+        """
+        Return the runfolders affected by a single inotify event. New runfolders are watched
+        but not returned (sequencing will not yet be complete)
+            :param dirpath (str):           Path of the watched directory
+            :param mask (int):              inotify event mask
+            :param name (str):              Name of the file / directory the event relates to
+            :return runfolder_names (list): Runfolders that may require processing
+        """
+        runfolder_names = []
+        if dirpath in self.runfolder_dirs:
+            if (
+                mask & IN_ISDIR
+                and mask & (IN_CREATE | IN_MOVED_TO)
+                and re.match(DemultiplexConfig.RUNFOLDER_PATTERN, name)
+            ):
+                self.runfolders[name] = os.path.join(dirpath, name)
+                self.add_watch(self.runfolders[name])
+        elif dirpath in self.samplesheet_dirs:
+            if mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                runfolder_names = self.samplesheet_runfolders(name)
+        else:
+            runfolder_name = os.path.basename(dirpath)
+            if (
+                name in DemultiplexConfig.WATCH_READY_FILES
+                and mask & (IN_CLOSE_WRITE | IN_MOVED_TO)
+            ) or (
+                name in DemultiplexConfig.WATCH_RESET_FILES
+                and mask & (IN_DELETE | IN_MOVED_FROM)
+            ):
+                runfolder_names = [runfolder_name]
+        for runfolder_name in runfolder_names:
+            script_logger.info(
+                script_logger.log_msgs["watch_event"], runfolder_name, name
+            )
+        return runfolder_names
+
+    def poll_flag_files(self) -> set:
+        """
+        Compare the modification times of the flag files of each runfolder that has not been
+        uploaded, and of the SampleSheets, to the previous poll. Ready files / SampleSheets that
+        have been created or modified, and reset files that have been removed, denote that the
+        runfolder should be assessed. The first poll records the current state only
+            :return runfolder_names (set):  Runfolders with flag file changes
+        """
+        self.runfolders = self.get_runfolders()
+        snapshot = {}
+        for runfolder_name, runfolder_path in self.runfolders.items():
+            for flag_file in (
+                DemultiplexConfig.WATCH_READY_FILES + DemultiplexConfig.WATCH_RESET_FILES
+            ):
+                try:
+                    snapshot[(runfolder_name, flag_file)] = os.stat(
+                        os.path.join(runfolder_path, flag_file)
+                    ).st_mtime
+                except FileNotFoundError:
+                    continue
+        for samplesheet_dir in self.samplesheet_dirs:
+            if os.path.isdir(samplesheet_dir):
+                for entry in os.scandir(samplesheet_dir):
+                    if entry.is_file():
+                        snapshot[(None, entry.name)] = entry.stat().st_mtime
+
+        runfolder_names = set()
+        if self.snapshot is not None:
+            for key, mtime in snapshot.items():
+                runfolder_name, name = key
+                if self.snapshot.get(key) != mtime:
+                    if runfolder_name is None:
+                        runfolder_names.update(self.samplesheet_runfolders(name))
+                    elif name in DemultiplexConfig.WATCH_READY_FILES:
+                        runfolder_names.add(runfolder_name)
+            for runfolder_name, name in self.snapshot.keys() - snapshot.keys():
+                if name in DemultiplexConfig.WATCH_RESET_FILES and runfolder_name in self.runfolders:
+                    runfolder_names.add(runfolder_name)
+        self.snapshot = snapshot
+        for runfolder_name in runfolder_names:
+            script_logger.info(
+                script_logger.log_msgs["watch_event"], runfolder_name, "flag file changed"
+            )
+        return runfolder_names
+
+    def samplesheet_runfolders(self, samplesheet_name: str) -> list:
+        """
+        Return the runfolders a SampleSheet may belong to. Illumina SampleSheets are named after
+        the runfolder. AVITI SampleSheet names are constructed from RunParameters.json, so all
+        AVITI runfolders that have not yet been demultiplexed are returned
+            :param samplesheet_name (str):  SampleSheet file name
+            :return (list):                 Runfolder names
+        """
+        suffix = "_SampleSheet.csv"
+        if not samplesheet_name.endswith(suffix):
+            return []
+        runfolder_name = samplesheet_name[: -len(suffix)]
+        if runfolder_name in self.runfolders:
+            return [runfolder_name]
+        return [
+            name
+            for name, path in self.runfolders.items()
+            if DemultiplexConfig.AVITI_ID in name
+            and not os.path.exists(os.path.join(path, self.FLAG_FILES["bases2fastqlog"]))
+        ]
+
+
 class DemultiplexRunfolder(DemultiplexConfig):
     """
     Call bclconvert or bases2fastq on runfolders after asserting that runfolder has not been
@@ -158,9 +1029,13 @@ class DemultiplexRunfolder(DemultiplexConfig):
                                             RunfolderObject containing runfolder-level loggers
         demultiplex_cmd (str):              Shell command to run demultiplexing (bclconvert/bases2fastq)
         cluster_density_cmd (str):          Shell command to run cluster density calculation
+        cluster_density_job (Future):       Cluster density calculation running in the background,
+                                            or None if not started
         tso (bool):                         Denotes whether the run is a tso500 run
         run_processed (bool):               Denotes whether the run has been successfully
                                             processed
+        disk_reservations (Optional[DiskReservations]):     Disk space reserved by the runfolders
+                                                            being processed concurrently
 
     Methods
         setoff_workflow()
@@ -190,6 +1065,9 @@ class DemultiplexRunfolder(DemultiplexConfig):
         seq_requires_no_ic()
             Determines whether the run requires integrity checking (not possible on all
             sequencers)
+        verify_checksums()
+            If the built-in integrity check engine is selected, verify the runfolder files
+            against the md5 checksums written by the sequencer, writing the md5checksum file
         checksumfile_exists()
             Check if md5checksum file exists (i.e. integrity check has been performed
             by integrity check scripts)
@@ -216,6 +1094,27 @@ class DemultiplexRunfolder(DemultiplexConfig):
             Run dockerised GATK to run Picard CollectIlluminaLaneMetrics - this calculates
             cluster density and saves files (runfolder.illumina_phasing_metrics and
             runfolder.illumina_lane_metrics) to the runfolder
+        calculate_cluster_density_native()
+            Calculate the same metrics directly from the runfolder InterOp files
+        start_cluster_density()
+            Start calculate_cluster_density() in the background, so that it runs concurrently
+            with demultiplexing
+        cluster_density_complete()
+            Wait for the background cluster density calculation to finish. If it failed, write
+            the cluster density failed flag file so that only the calculation is re-run
+        cluster_density_failed()
+            Check for the flag file denoting the cluster density calculation failed after
+            demultiplexing
+        rerun_cluster_density()
+            Re-run the cluster density calculation for a demultiplexed run, removing the flag
+            file if successful
+        run_cluster_density()
+            Run the cluster density calculation for a run that is not demultiplexed, exiting
+            script if it fails
+        run_quality_passed()
+            Check that an Illumina run passes the run quality gate, or has been released
+        sufficient_disk_space()
+            Check that the output filesystem has space for the estimated fastq output
         runtype_requires_demultiplexing()
             Determine whether the run does, or does not (TSO500, dev runs with UMIs)
             require demultiplexing
@@ -225,18 +1124,29 @@ class DemultiplexRunfolder(DemultiplexConfig):
             If runfolder is from tso run or development run with UMIs, add specific message to
             demultiplex log file (these runs do not require demultiplexing)
         run_demultiplexing()
-            Run demultiplexing command. If unsuccessful, exit script
+            Run demultiplexing command (or lane-sharded bclconvert). If unsuccessful, exit script
+        stage_inputs()
+            Sync the bclconvert inputs to the scratch staging directory, if configured
+        redemultiplex_samples(invalid_fastqs)
+            Re-demultiplex only the samples with invalid fastqs, replacing their fastqs
+        get_lane_shards()
+            Return a BclconvertLaneShards object if the run's lanes are demultiplexed separately
         copy_file()
             Copy file from source path to dest path
     """
 
-    def __init__(self, folder_name: str, timestamp: str):
+    def __init__(
+        self, folder_name: str, timestamp: str, disk_reservations: Optional[object] = None
+    ):
         """
         Constructor for the DemultiplexRunfolder class
             :param folder_name(str):                    Runfolder name
             :param timestamp (str):                     Timestamp in the format %Y%m%d_%H%M%S
+            :param disk_reservations (Optional[object]):    DiskReservations shared by the
+                                                            runfolders processed concurrently
         """
         self.timestamp = timestamp
+        self.disk_reservations = disk_reservations
         self.rf_obj = RunfolderObject(folder_name, self.timestamp)
         self.loggers = self.rf_obj.get_runfolder_loggers(
             __package__
@@ -246,6 +1156,14 @@ class DemultiplexRunfolder(DemultiplexConfig):
         #get current user to run docker images with this user instead of root
         #controls the ownership of the files to enable deleting later
         self.user = os.getuid()
+        # Thread counts of the thread layout benchmarked on this host, if any
+        self.thread_counts = get_thread_counts(
+            self.rf_obj.sequencer_type, DemultiplexConfig.DEMULTIPLEX_CONTAINER_CPU
+        )
+        if self.thread_counts:
+            self.demux_rf_logger.info(
+                self.demux_rf_logger.log_msgs["thread_counts"], self.thread_counts
+            )
         # N.B. --no-lane-splitting creates a single fastq for a sample,
         # not into one fastq per lane)
         self.demultiplex_cmd = self.get_demultiplex_cmd()
@@ -256,6 +1174,7 @@ class DemultiplexRunfolder(DemultiplexConfig):
             self.rf_obj.runfolderpath,
             self.rf_obj.runfolder_name,
         )
+        self.cluster_density_job = None
         self.tso = False
         self.run_processed = False
 
@@ -265,15 +1184,23 @@ class DemultiplexRunfolder(DemultiplexConfig):
         runs don't require demultiplexing). First calls self.create_demultiplex_log() to
         create the log file which prevents a simultaneous demultiplex attempt on the
         next run of the script (bclconvert & bases2fastq are slow to create the logfile).
-        Then calls calculate_cluster_density() if an Illumina run. If a tso run, stops here.
-        Else calls run_demultiplexing() to demultiplex the run.
+        The cluster density calculation is then started in the background if an Illumina run,
+        and run_demultiplexing() called to demultiplex the run. If the cluster density
+        calculation previously failed after demultiplexing, only the calculation is re-run
             :return (Optional[bool]):  Return true if run successfully processed
         """
-        if self.demultiplexing_required():
+        if self.cluster_density_failed():
+            if self.rerun_cluster_density():
+                self.run_processed = True
+                return True
+        elif self.demultiplexing_required():
             self.demux_rf_logger.info(
                 self.demux_rf_logger.log_msgs["demultiplexing_required"]
             )
+            self.rf_obj.prepare()  # Create the output directories
             if self.create_demultiplex_log():
+                if self.sequenced_on_illumina():
+                    self.start_cluster_density()
                 if self.run_demultiplexing():
                     self.run_processed = True
                     rf_samples_obj = RunfolderSamples(
@@ -296,7 +1223,8 @@ class DemultiplexRunfolder(DemultiplexConfig):
         If sequencing is complete, (RTAComplete.txt/RunUploaded.json present) the run does not contain UMIs, and the
         SampleSheet contains no disallowed errors, and either 1) the sequencer does not require an
         integrity check or 2) there has not previously been an integrity check and the checksums match,
-        returns True as demultiplexing is required
+        and the run passes the run quality gate, and the output filesystem has space for the
+        estimated fastq output, returns True as demultiplexing is required
             :return None:
         """
         if self.upload_flagfile_absent() and self.demultiplex_docker_log_absent():
@@ -310,6 +1238,8 @@ class DemultiplexRunfolder(DemultiplexConfig):
                     self.sscheck_success_msg_present(self.rf_obj.sscheck_flagfile_path) or self.valid_samplesheet()
                 ):  # Early warning ss checks
                     requires_no_ic = self.seq_requires_no_ic()
+                    if not requires_no_ic:
+                        self.verify_checksums()
                     if requires_no_ic or self.checksumfile_exists():
                         if self.sequencing_complete():
                             if requires_no_ic or self.pass_integrity_check():
@@ -317,11 +1247,46 @@ class DemultiplexRunfolder(DemultiplexConfig):
                                     self.rf_obj.samplesheet_path,
                                     self.rf_obj.runfolder_samplesheet_path,
                                 )
-                                if self.sequenced_on_illumina():
-                                    self.calculate_cluster_density()
-                                if self.runtype_requires_demultiplexing():
+                                if (
+                                    self.runtype_requires_demultiplexing()
+                                    and self.run_quality_passed()
+                                    and self.sufficient_disk_space()
+                                ):
                                     return True
 
+    def run_quality_passed(self) -> Optional[bool]:
+        """
+        Check that an Illumina run passes the run quality gate (per-lane %PF, %Q30 and cluster
+        density from the InterOp files). Failing runs are held (the demultiplex log file has not
+        yet been created) until manually released
+            :return (Optional[bool]):   True if the run passes, has been released, or is not
+                                        checked
+        """
+        if not DemultiplexConfig.RUN_QUALITY_GATE or not self.sequenced_on_illumina():
+            return True
+        return RunQualityGate(self.rf_obj, self.demux_rf_logger).check()
+
+    def sufficient_disk_space(self) -> Optional[bool]:
+        """
+        Check that the output filesystem has space for the estimated fastq output of the run,
+        after the space reserved by runfolders being processed concurrently. If not,
+        demultiplexing is deferred until the next script run (the demultiplex log file has not
+        yet been created). Checked last, so that space is only reserved for runs that will be
+        demultiplexed
+            :return (Optional[bool]):   True if there is sufficient space to demultiplex the run
+        """
+        if self.rf_obj.sequencer_type == DemultiplexConfig.AVITI_ID:
+            output_path = self.rf_obj.bases2fastq_outputpath
+        else:
+            output_path = self.rf_obj.fastq_dir_path
+        return DiskCapacityCheck(
+            self.rf_obj,
+            self.demux_rf_logger,
+            output_path,
+            copies=2 if self.get_lane_shards() else 1,
+            reservations=self.disk_reservations,
+        ).check()
+
     def upload_flagfile_absent(self) -> None:
         """
         Check if runfolder has already been uploaded
@@ -414,7 +1379,8 @@ class DemultiplexRunfolder(DemultiplexConfig):
         Check SampleSheet is present and naming and contents are valid, using the
         samplesheet_validator module. If it is an initial check, the check output is
         written in initial_sscheck_flagfile_path, and for the 2nd attempt, the
-        output is written in sscheck_flagfile_path.
+        output is written in sscheck_flagfile_path. Validation results are cached by
+        SampleSheet content, so an unchanged SampleSheet is not re-validated.
             :return (tuple):    Returns tuple of boolean (denotes whether SampleSheet
                                 is valid), and SampleSheetCheck object containing any
                                 errors identified
@@ -426,42 +1392,48 @@ class DemultiplexRunfolder(DemultiplexConfig):
             attempt = "2nd attempt"
             initial_try = False
 
-        script_logger.info(script_logger.log_msgs["ss_check_required"])
-        script_logger.info(
-            script_logger.log_msgs["ss_validator_version"],
-            version("samplesheet_validator"),
-        )
-        sscheck_obj = samplesheet_validator.SamplesheetCheck(
+        validator_version = version("samplesheet_validator")
+        sequenced_on_illumina = self.sequenced_on_illumina()
+        ss_cache = SamplesheetValidationCache()
+        cache_key = ss_cache.get_key(
             self.rf_obj.samplesheet_path,
-            DemultiplexConfig.SEQUENCER_IDS.keys(),
-            DemultiplexConfig.PANELS,
-            DemultiplexConfig.TSO_PANELS,
-            DemultiplexConfig.DEV_PANEL,
-            os.path.dirname(self.rf_obj.samplesheet_validator_logfile),
-            self.sequenced_on_illumina(),
-            self.rf_obj.runfolder_name,
+            validator_version,
+            get_samplesheet_check_config(sequenced_on_illumina, self.rf_obj.runfolder_name),
         )
-        sscheck_obj.ss_checks()
-        shutdown_logs(sscheck_obj.logger)
-        self.tso = sscheck_obj.tso
-        err_str = ". ".join(", ".join(v) for v in sscheck_obj.errors_dict.values())
+        cached_result = ss_cache.get_result(cache_key)
+        if cached_result:
+            script_logger.info(
+                script_logger.log_msgs["ss_check_cached"], self.rf_obj.samplesheet_path
+            )
+            valid, self.tso, err_str = cached_result
+        else:
+            script_logger.info(script_logger.log_msgs["ss_check_required"])
+            script_logger.info(
+                script_logger.log_msgs["ss_validator_version"],
+                validator_version,
+            )
+            valid, self.tso, err_str = check_samplesheet(
+                self.rf_obj.samplesheet_path,
+                os.path.dirname(self.rf_obj.samplesheet_validator_logfile),
+                sequenced_on_illumina,
+                self.rf_obj.runfolder_name,
+            )
+            ss_cache.record_result(cache_key, valid, self.tso, err_str)
 
-        if sscheck_obj.errors:
+        if not valid:
             self.demux_rf_logger.error(
                 self.demux_rf_logger.log_msgs["sschecks_failed"],
                 attempt,
                 err_str,
             )
             if initial_try:
-                write_lines(
+                write_lines_atomic(
                     self.rf_obj.initial_sscheck_flagfile_path,
-                    "w",
                     DemultiplexConfig.STRINGS["samplesheet_fail"] % err_str,
                 )
             else:
-                write_lines(
+                write_lines_atomic(
                     self.rf_obj.sscheck_flagfile_path,
-                    "w",
                     DemultiplexConfig.STRINGS["samplesheet_fail"] % err_str,
                 )
             return False
@@ -472,16 +1444,14 @@ class DemultiplexRunfolder(DemultiplexConfig):
                 self.rf_obj.samplesheet_path,
             )
             if initial_try:
-                write_lines(
+                write_lines_atomic(
                     self.rf_obj.initial_sscheck_flagfile_path,
-                    "w",
                     DemultiplexConfig.STRINGS["samplesheet_success"]
                     % datetime.datetime.now(),
                 )
             else:
-                write_lines(
+                write_lines_atomic(
                     self.rf_obj.sscheck_flagfile_path,
-                    "w",
                     DemultiplexConfig.STRINGS["samplesheet_success"]
                     % datetime.datetime.now(),
                 )
@@ -504,6 +1474,22 @@ class DemultiplexRunfolder(DemultiplexConfig):
             self.demux_rf_logger.info(self.demux_rf_logger.log_msgs["seq_without_ic"])
             return True
 
+    def verify_checksums(self) -> Optional[bool]:
+        """
+        If the built-in integrity check engine is selected and the md5checksum file has not yet
+        been written, verify the runfolder files against the md5 checksums written by the
+        sequencer. During sequencing this hashes the files that have arrived. Once sequencing
+        is complete the result is written to the md5checksum file
+            :return (Optional[bool]):   True if all checksums match, False if not, None if the
+                                        verification is not complete (or not required)
+        """
+        if DemultiplexConfig.INTEGRITY_CHECK_ENGINE == "builtin" and not os.path.isfile(
+            self.rf_obj.checksumfile_path
+        ):
+            return ChecksumVerifier(self.rf_obj.runfolderpath, self.demux_rf_logger).verify(
+                os.path.isfile(self.rf_obj.runcompletefile_path)
+            )
+
     def checksumfile_exists(self) -> Optional[bool]:
         """
         Check if md5checksum file exists (i.e. integrity check has been performed
@@ -703,10 +1689,15 @@ class DemultiplexRunfolder(DemultiplexConfig):
         Run dockerised GATK to run Picard CollectIlluminaLaneMetrics - this calculates
         cluster density and saves files (runfolder.illumina_phasing_metrics and
         runfolder.illumina_lane_metrics) to the runfolder. If the success statement is
-        seen in the stderr, record in the log file else raise a slack alert and exit
-        script. If run was sequenced on novaseq, an extra argument is provided
-            :return (Optional[bool]):  True if success statement seen
+        seen in the stderr, record in the log file else raise a slack alert. If run was
+        sequenced on novaseq, an extra argument is provided. If CLUSTER_DENSITY_ENGINE is
+        "native", the metrics are instead calculated from the InterOp files by
+        calculate_cluster_density_native(). Runs in a background thread (see
+        start_cluster_density), so failures are returned rather than exiting the script
+            :return (Optional[bool]):  True if success statement seen, else False
         """
+        if DemultiplexConfig.CLUSTER_DENSITY_ENGINE == "native":
+            return self.calculate_cluster_density_native()
         if DemultiplexConfig.NOVASEQ_ID in self.rf_obj.runfolder_name:
             novaseq_flag = " --IS_NOVASEQ"
         else:
@@ -722,34 +1713,164 @@ class DemultiplexRunfolder(DemultiplexConfig):
             self.cluster_density_cmd, self.demux_rf_logger
         )
         if returncode == 0:
-            # Assess stderr, looking for expected success statement
-            if DemultiplexConfig.STRINGS["cd_success"] in out or err:
+            # Assess stdout and stderr, looking for expected success statement
+            if DemultiplexConfig.STRINGS["cd_success"] in f"{out}{err}":
                 self.demux_rf_logger.info(
                     self.demux_rf_logger.log_msgs["cd_success"],
                     f"{self.rf_obj.runfolder_name}{DemultiplexConfig.STRINGS['lane_metrics_suffix']}",
                 )
                 return True
+            self.demux_rf_logger.error(
+                self.demux_rf_logger.log_msgs["cd_success_absent"],
+                err,
+            )
+            return False
         else:
             self.demux_rf_logger.error(
                 self.demux_rf_logger.log_msgs["cd_fail"],
                 err,
             )
-            sys.exit(1)
+            return False
+
+    def calculate_cluster_density_native(self) -> Optional[bool]:
+        """
+        Calculate the cluster density and phasing metrics directly from the runfolder InterOp
+        files, writing the same metric rows as GATK CollectIlluminaLaneMetrics without starting
+        a container
+            :return (Optional[bool]):  True if the metrics files were written, False if not
+        """
+        self.demux_rf_logger.info(
+            self.demux_rf_logger.log_msgs["running_cd_native"],
+            self.rf_obj.runfolderpath,
+        )
+        try:
+            InterOpMetrics(
+                self.rf_obj.runfolderpath,
+                self.rf_obj.runfolder_name,
+                DemultiplexConfig.NOVASEQ_ID in self.rf_obj.runfolder_name,
+            ).write_metrics()
+        except (OSError, ValueError, struct.error, ET.ParseError) as exception:
+            self.demux_rf_logger.error(
+                self.demux_rf_logger.log_msgs["cd_fail"],
+                exception,
+            )
+            return False
+        self.demux_rf_logger.info(
+            self.demux_rf_logger.log_msgs["cd_success"],
+            f"{self.rf_obj.runfolder_name}{DemultiplexConfig.STRINGS['lane_metrics_suffix']}",
+        )
+        return True
+
+    def start_cluster_density(self) -> None:
+        """
+        Start the cluster density calculation in the background. Only called once the run has
+        passed all pre-demultiplexing checks and the demultiplex log file has been created. The
+        calculation only reads the runfolder, so runs concurrently with demultiplexing rather than
+        delaying it. It is waited for by cluster_density_complete() before the demultiplex log file
+        is completed (which marks the run as ready for upload)
+            :return None:
+        """
+        executor = ThreadPoolExecutor(max_workers=1)
+        self.cluster_density_job = executor.submit(self.calculate_cluster_density)
+        executor.shutdown(wait=False)  # Worker thread exits once the calculation has finished
+        self.demux_rf_logger.info(self.demux_rf_logger.log_msgs["cd_started"])
+
+    def wait_cluster_density(self) -> Optional[bool]:
+        """
+        Wait for the background cluster density calculation (if started) to finish. Called on
+        every exit from demultiplexing, so that the calculation is not still writing the lane
+        metrics to the runfolder when the script exits or the run is demultiplexed again
+            :return (Optional[bool]):   True if the calculation was not required or succeeded
+        """
+        if self.cluster_density_job is None:
+            return True
+        try:
+            return self.cluster_density_job.result() is True
+        except Exception as exception:
+            self.demux_rf_logger.error(
+                self.demux_rf_logger.log_msgs["cd_fail"],
+                exception,
+            )
+            return False
+
+    def cluster_density_complete(self) -> Optional[bool]:
+        """
+        Wait for the background cluster density calculation (if started) to finish. If the
+        calculation did not succeed, write the cluster density failed flag file. The demultiplex
+        log file is kept so that the run is not demultiplexed again; only the calculation is
+        re-run on the next run of the script, and the run is not uploaded until it succeeds (the
+        lane metrics are required for upload)
+            :return (Optional[bool]):   True if the calculation was not required or succeeded
+        """
+        if self.wait_cluster_density():
+            return True
+        write_lines_atomic(
+            self.rf_obj.cd_failed_flagfile,
+            DemultiplexConfig.STRINGS["cd_failed_flag"] % "see runfolder demultiplex log",
+        )
+        self.demux_rf_logger.error(
+            self.demux_rf_logger.log_msgs["cd_failed_flagfile"],
+            self.rf_obj.cd_failed_flagfile,
+        )
+
+    def cluster_density_failed(self) -> Optional[bool]:
+        """
+        Check for the flag file denoting that the cluster density calculation failed after the
+        run was demultiplexed (and that the run has not since been uploaded)
+            :return (Optional[bool]):   True if the cluster density calculation requires re-running
+        """
+        if os.path.isfile(self.rf_obj.cd_failed_flagfile) and not os.path.exists(
+            self.rf_obj.upload_flagfile
+        ):
+            return True
+
+    def rerun_cluster_density(self) -> Optional[bool]:
+        """
+        Re-run the cluster density calculation for a run that has already been demultiplexed.
+        If successful, remove the cluster density failed flag file so that the run is uploaded.
+        If not, the flag file is kept and the calculation is re-run on the next run of the script
+            :return (Optional[bool]):   True if the calculation was successful
+        """
+        self.demux_rf_logger.info(
+            self.demux_rf_logger.log_msgs["cd_rerun"], self.rf_obj.cd_failed_flagfile
+        )
+        if self.calculate_cluster_density():
+            os.remove(self.rf_obj.cd_failed_flagfile)
+            RunfolderStateIndex().record_flag_file(self.rf_obj.cd_failed_flagfile)
+            self.demux_rf_logger.info(
+                self.demux_rf_logger.log_msgs["cd_rerun_success"],
+                self.rf_obj.cd_failed_flagfile,
+            )
+            return True
+
+    def run_cluster_density(self) -> Optional[bool]:
+        """
+        Run the cluster density calculation for an Illumina run that is not demultiplexed (TSO,
+        development runs with UMIs), before the demultiplex log file is created. If it fails,
+        exit script so that the run is reprocessed on the next run of the script (the lane
+        metrics are required for upload)
+            :return (Optional[bool]):   True if the calculation was not required or successful
+        """
+        if not self.sequenced_on_illumina() or self.calculate_cluster_density():
+            return True
+        self.demux_rf_logger.error(self.demux_rf_logger.log_msgs["cd_incomplete"])
+        sys.exit(1)
 
     def runtype_requires_demultiplexing(self) -> Optional[bool]:
         """
         Determine whether the run does, or does not (TSO500, dev runs with UMIs) require demultiplexing.
-        If it does not require demultiplexing, creates the demultiplex log file. If it does require
+        If it does not require demultiplexing, calculates the cluster density (Illumina runs) and
+        creates the demultiplex log file. If it does require
         demultiplexing, returns True. Alert sent for dev runs with UMIs, as these require manual
         processing by the bioinformatics team
             :return (Optional[bool]):   True if requires automated processing, else None
         """
-        samplesheet = read_lines(self.rf_obj.runfolder_samplesheet_path)
-        if any(
-            any(pannum in line for line in samplesheet)
-            for pannum in DemultiplexConfig.UMI_DEV_PANEL
-        ):
+        pannums = set(
+            read_samplesheet(self.rf_obj.runfolder_samplesheet_path).get_pannums().values()
+        )
+        if pannums.intersection(DemultiplexConfig.UMI_DEV_PANEL):
             self.demux_rf_logger.info(self.demux_rf_logger.log_msgs["dev_run_umis"])
+            self.run_cluster_density()
             self.create_demultiplex_log()
             self.add_demultiplexlog_msg("DEV UMIs")
             write_lines(  # Create upload started log file to prevent automated upload
@@ -761,10 +1882,8 @@ class DemultiplexRunfolder(DemultiplexConfig):
                 self.demux_rf_logger.log_msgs["dev_umis_upload_flagfile"],
                 self.rf_obj.runfolder_name,
             )
-        elif any(
-            any(pannum in line for line in samplesheet)
-            for pannum in DemultiplexConfig.TSO_PANELS
-        ):
+        elif pannums.intersection(DemultiplexConfig.TSO_PANELS):
+            self.run_cluster_density()
             self.create_demultiplex_log()  # Create bcl2fastq2/bases2fastq log to prevent scripts processing this run
             self.add_demultiplexlog_msg("TSO500")
             self.demux_rf_logger.info(self.demux_rf_logger.log_msgs["tso_run"])
@@ -780,6 +1899,7 @@ class DemultiplexRunfolder(DemultiplexConfig):
         """
         try:
             open(self.rf_obj.demultiplexlog_file, "w", encoding="utf-8").close()
+            RunfolderStateIndex().record_flag_file(self.rf_obj.demultiplexlog_file)
             self.demux_rf_logger.info(
                 self.demux_rf_logger.log_msgs["create_demultiplexlog_pass"],
                 self.rf_obj.demultiplexlog_file,
@@ -816,35 +1936,72 @@ class DemultiplexRunfolder(DemultiplexConfig):
         """
         Decide which demultiplexing command is needed based on which sequencer is used
         Run demultiplexing command. If unsuccessful, exit script
-            :return (Optional[bool]):   True if command executed succesfully and output is
-                                        successfully written to the logfile
+            :return (Optional[bool]):   True if command executed succesfully, output is
+                                        successfully written to the logfile and the cluster
+                                        density calculation (if started) succeeded
         """
-        self.demux_rf_logger.info(
-            self.demux_rf_logger.log_msgs["demultiplexing_start"],
-            self.demultiplex_cmd,
-        )
         # Runs bcl2fastq2 or bases2fastq and checks if completed successfully
-        # Demultiplexing returncode 0 upon success. Outputs info logs to stderr
-
-        out, err, returncode = execute_subprocess_command(
-            self.demultiplex_cmd,
-            self.demux_rf_logger,
-        )
+        # Demultiplexing returncode 0 upon success. Outputs info logs to stderr, which are
+        # streamed to the demultiplex runfolder logfile as they are produced
+        if self.rf_obj.sequencer_type == DemultiplexConfig.AVITI_ID:
+            tool = "bases2fastq"
+        else:
+            tool = "bclconvert"
+        lane_shards = self.get_lane_shards()
+        if lane_shards:
+            out, err, returncode = lane_shards.run()
+        else:
+            demultiplex_cmd = self.demultiplex_cmd
+            staging = self.stage_inputs()
+            if staging:
+                demultiplex_cmd = staging.get_cmd(
+                    self.user,
+                    self.rf_obj.bclconvert_log_output_dir,
+                    os.path.join(DemultiplexConfig.RUNFOLDERS, "samplesheets"),
+                    self.rf_obj.samplesheet_name,
+                ) + format_thread_options(self.thread_counts)
+            self.demux_rf_logger.info(
+                self.demux_rf_logger.log_msgs["demultiplexing_start"],
+                demultiplex_cmd,
+            )
+            # Progress is only tracked for tools that print it (bases2fastq)
+            progress = None
+            if tool in DemultiplexConfig.PROGRESS_PATTERNS:
+                progress = CommandProgress(tool, self.demux_rf_logger)
+            start = time.monotonic()
+            try:
+                out, err, returncode = stream_subprocess_command(
+                    demultiplex_cmd,
+                    self.demux_rf_logger,
+                    self.demultiplex_rf_logger,
+                    progress,
+                )
+                if staging:
+                    staging.log_phase("Demultiplexing", start)
+                    if returncode == 0:
+                        staging.move_outputs()
+            finally:
+                if staging:
+                    staging.remove()
         if returncode == 0:
-            if validate_fastqs(self.rf_obj.fastq_dir_path, self.demux_rf_logger):
+            invalid_fastqs = []
+            if validate_fastqs(
+                self.rf_obj.fastq_dir_path, self.demux_rf_logger, invalid_fastqs=invalid_fastqs
+            ) or self.redemultiplex_samples(invalid_fastqs):
+                cd_complete = self.cluster_density_complete()
                 self.demux_rf_logger.info(
                     self.demux_rf_logger.log_msgs["demultiplexing_complete"],
                     self.rf_obj.runfolder_name,
                 )
-                self.demultiplex_rf_logger.info(
-                    err  # Write stderr to demultiplex runfolder logfile 
-                )
                 # Use sequencer type to copy over the correct output log to demultiplexlog_file
                 if self.rf_obj.sequencer_type == DemultiplexConfig.AVITI_ID:
                     self.copy_file(
                         self.rf_obj.bases2fastq_log_output, 
                         self.rf_obj.demultiplexlog_file
                         )
+                elif lane_shards:
+                    lane_shards.write_demultiplexlog()
+                    lane_shards.remove_lanes()
                 else: # Add step to read bclconvert log file generated by tool and write this to the output log file
                     demultiplex_output_log =os.listdir(self.rf_obj.bclconvert_log_output_dir)[0]
                     demultiplex_output_log_filepath = f"{self.rf_obj.bclconvert_log_output_dir}/{demultiplex_output_log}"
@@ -852,15 +2009,21 @@ class DemultiplexRunfolder(DemultiplexConfig):
                         with open(self.rf_obj.demultiplexlog_file, 'w') as dest_file:
                             for line in source_file:
                                 dest_file.write(line)
-                return True
+                RunfolderStateIndex().record_flag_file(self.rf_obj.demultiplexlog_file)
+                return cd_complete
             else:
+                self.wait_cluster_density()
+                if lane_shards:  # Re-demultiplex all lanes
+                    lane_shards.remove_lanes()
                 os.remove(
                     self.rf_obj.demultiplexlog_file
                 )  # Demultiplexing log file removed to trigger re-demultiplex
+                RunfolderStateIndex().record_flag_file(self.rf_obj.demultiplexlog_file)
                 self.demux_rf_logger.error(
                     self.demux_rf_logger.log_msgs["re_demultiplex"]
                 )
         else:
+            self.wait_cluster_density()
             self.demux_rf_logger.error(
                 self.demux_rf_logger.log_msgs["demultiplexing_failed"],
                 out,
@@ -868,9 +2031,65 @@ class DemultiplexRunfolder(DemultiplexConfig):
             )
             sys.exit(1)
 
+    def stage_inputs(self) -> Optional[object]:
+        """
+        If a scratch staging directory is configured (STAGING_DIR), sync the bclconvert inputs
+        to it. Falls back to demultiplexing within the runfolder if staging is not possible
+            :return (Optional[object]):     ScratchStaging object with the inputs staged, or None
+                                            if demultiplexing within the runfolder
+        """
+        if (
+            DemultiplexConfig.STAGING_DIR
+            and self.rf_obj.sequencer_type != DemultiplexConfig.AVITI_ID
+        ):
+            staging = ScratchStaging(self.rf_obj, self.demux_rf_logger)
+            try:
+                if staging.stage_inputs():
+                    return staging
+            except OSError as exception:
+                self.demux_rf_logger.warning(
+                    self.demux_rf_logger.log_msgs["staging_failed"], exception
+                )
+            staging.remove()
+
+    def redemultiplex_samples(self, invalid_fastqs: list) -> Optional[bool]:
+        """
+        Re-demultiplex only the samples with invalid bclconvert fastqs (SAMPLE_REDEMULTIPLEX),
+        replacing their fastqs, and re-validate the fastqs (only the replaced fastqs are
+        re-validated, as the others are cached as valid)
+            :param invalid_fastqs (list):   Names of the invalid fastqs
+            :return (Optional[bool]):       True if the samples were re-demultiplexed and the
+                                            fastqs are all valid
+        """
+        if (
+            DemultiplexConfig.SAMPLE_REDEMULTIPLEX
+            and invalid_fastqs
+            and self.rf_obj.sequencer_type != DemultiplexConfig.AVITI_ID
+        ):
+            if SampleRedemultiplex(
+                self.rf_obj, self.user, self.demux_rf_logger, self.demultiplex_rf_logger
+            ).run(invalid_fastqs):
+                return validate_fastqs(self.rf_obj.fastq_dir_path, self.demux_rf_logger)
+
+    def get_lane_shards(self) -> Optional[object]:
+        """
+        Return a BclconvertLaneShards object if the run is from a sequencer whose runs are
+        demultiplexed one lane at a time (BCLCONVERT_LANE_SHARDING)
+            :return (Optional[object]):     BclconvertLaneShards object, or None if the run is
+                                            demultiplexed by a single bclconvert / bases2fastq
+        """
+        if self.rf_obj.sequencer_type != DemultiplexConfig.AVITI_ID and any(
+            sequencer_id in self.rf_obj.runfolder_name
+            for sequencer_id in DemultiplexConfig.BCLCONVERT_LANE_SHARDING
+        ):
+            return BclconvertLaneShards(
+                self.rf_obj, self.user, self.demux_rf_logger, self.demultiplex_rf_logger
+            )
+
     def get_demultiplex_cmd(self) -> str:
         """
-        Return either the bcl2fastq or bases2fastq demultiplex command based on sequencer used
+        Return either the bcl2fastq or bases2fastq demultiplex command based on sequencer used,
+        with the thread counts benchmarked on this host (if any)
             :returns (str):     Command string to be actioned for demultiplexing
         """
         if self.rf_obj.sequencer_type == DemultiplexConfig.AVITI_ID:
@@ -879,7 +2098,7 @@ class DemultiplexRunfolder(DemultiplexConfig):
             self.user,
             self.rf_obj.runfolderpath,
             self.rf_obj.bases2fastq_outputpath,
-            DemultiplexConfig.BASES2FASTQ_CPU,
+            (self.thread_counts or {}).get("-p", DemultiplexConfig.BASES2FASTQ_CPU),
             self.rf_obj.samplesheet_name
             )
         else:
@@ -902,5 +2121,5 @@ class DemultiplexRunfolder(DemultiplexConfig):
                 "samplesheets"
             ),
             self.rf_obj.samplesheet_name
-        )
+        ) + format_thread_options(self.thread_counts)
         return demultiplex_cmd
\ No newline at end of file
@@ -0,0 +1,243 @@
+"""disk_capacity.py
+
+Pre-flight disk capacity check. Estimates the size of the fastqs that demultiplexing will write,
+so that demultiplexing is deferred (rather than failing part way through, leaving partial output)
+if the output filesystem does not have enough free space. Contains the following classes:
+
+- DiskCapacityCheck
+    Estimate the fastq output size of a runfolder from the read structure and cluster / polony
+    count, and compare it with the free space of the output filesystem
+- DiskReservations
+    Estimated fastq output of the runfolders being demultiplexed concurrently, shared by the
+    DemultiplexScheduler so that concurrent runs do not each count the same free space
+"""
+
+import os
+import json
+import shutil
+import logging
+import threading
+import xml.etree.ElementTree as ET
+from typing import Optional, Tuple
+from config.ad_config import DemultiplexConfig
+from demultiplex.interop_metrics import InterOpMetrics
+
+
+class DiskCapacityCheck(DemultiplexConfig):
+    """
+    Estimate the fastq output size of a runfolder, as the bases sequenced multiplied by
+    DISK_BYTES_PER_BASE (bytes of gzip fastq per base, including the quality scores and read
+    headers). For Illumina runs the bases sequenced are the total cluster count (InterOp
+    TileMetricsOut.bin, all lanes) multiplied by the cycles of all reads (RunInfo.xml). For AVITI
+    runs the cycles are read from RunParameters.json, and the polony count is taken from
+    DISK_AVITI_POLONIES for the run's throughput selection. The projected footprint
+    plus DISK_SAFETY_MARGIN_GB must fit in the free space of the output filesystem, less the
+    space reserved by the runfolders already being demultiplexed (if a DiskReservations object
+    is provided)
+
+    Attributes
+        rf_obj (obj):               RunfolderObject object
+        logger (logging.Logger):    Demultiplex runfolder logger
+        output_path (str):          Path the fastqs are written to
+        copies (int):               Number of copies of the fastqs held at once
+        reservations (Optional[DiskReservations]):  Space reserved by concurrent runfolders, None
+                                                    if runfolders are not demultiplexed concurrently
+
+    Methods
+        get_illumina_bases()
+            Return the bases sequenced in an Illumina run
+        get_aviti_bases()
+            Return the estimated bases sequenced in an AVITI run
+        get_existing_path()
+            Return the output path, or its nearest existing parent directory
+        get_free_bytes()
+            Return the free space of the output filesystem
+        check()
+            Return True if the output filesystem has space for the estimated output
+    """
+
+    def __init__(
+        self,
+        rf_obj: object,
+        logger: logging.Logger,
+        output_path: str,
+        copies: int = 1,
+        reservations: Optional[object] = None,
+    ):
+        """
+        Constructor for the DiskCapacityCheck class
+            :param rf_obj (obj):                RunfolderObject object
+            :param logger (logging.Logger):     Demultiplex runfolder logger
+            :param output_path (str):           Path the fastqs are written to
+            :param copies (int):                Number of copies of the fastqs held at once (e.g.
+                                                2 for lane-sharded bclconvert, where the per-lane
+                                                fastqs are merged into new files)
+            :param reservations (Optional[object]):     DiskReservations shared by the runfolders
+                                                        being demultiplexed concurrently
+        """
+        self.rf_obj = rf_obj
+        self.logger = logger
+        self.output_path = output_path
+        self.copies = copies
+        self.reservations = reservations
+
+    def get_illumina_bases(self) -> int:
+        """
+        Return the bases sequenced in an Illumina run, as the total cluster count multiplied by
+        the cycles of all reads (index reads are written to the read headers)
+            :return (int):  Bases sequenced
+        """
+        interop_metrics = InterOpMetrics(
+            self.rf_obj.runfolderpath,
+            self.rf_obj.runfolder_name,
+            DemultiplexConfig.NOVASEQ_ID in self.rf_obj.runfolder_name,
+        )
+        cycles = sum(num_cycles for num_cycles, _ in interop_metrics.reads)
+        return interop_metrics.get_cluster_count() * cycles
+
+    def get_aviti_bases(self) -> int:
+        """
+        Return the estimated bases sequenced in an AVITI run, as the polony count for the run's
+        throughput selection multiplied by the cycles of all reads (RunParameters.json)
+            :return (int):  Bases sequenced
+        """
+        with open(self.rf_obj.aviti_runparameters_file, "r") as runparameters_file:
+            runparameters = json.load(runparameters_file)
+        cycles = sum(int(num_cycles) for num_cycles in runparameters["Cycles"].values())
+        polonies = DemultiplexConfig.DISK_AVITI_POLONIES.get(
+            runparameters.get("ThroughputSelection"),
+            max(DemultiplexConfig.DISK_AVITI_POLONIES.values()),
+        )
+        return polonies * cycles
+
+    def get_existing_path(self) -> str:
+        """
+        Return the output path, or its nearest existing parent directory if the output directory
+        does not yet exist
+            :return (str):  Existing path on the output filesystem
+        """
+        path = os.path.abspath(self.output_path)
+        while not os.path.exists(path):
+            path = os.path.dirname(path)
+        return path
+
+    def get_free_bytes(self) -> int:
+        """
+        Return the free space of the output filesystem
+            :return (int):  Free bytes
+        """
+        return shutil.disk_usage(self.get_existing_path()).free
+
+    def check(self) -> Optional[bool]:
+        """
+        Return True if the output filesystem has space for the estimated output plus the safety
+        margin, after the space reserved by runfolders already being demultiplexed. If so, the
+        estimated output is reserved until the runfolder is released by the scheduler. If the
+        output size cannot be estimated (e.g. InterOp files missing), the check is passed so that
+        demultiplexing is not blocked
+            :return (Optional[bool]):   True if there is sufficient space, None if demultiplexing
+                                        should be deferred
+        """
+        try:
+            if self.rf_obj.sequencer_type == DemultiplexConfig.AVITI_ID:
+                bases = self.get_aviti_bases()
+            else:
+                bases = self.get_illumina_bases()
+        except (OSError, ValueError, KeyError, AttributeError, ET.ParseError) as exception:
+            self.logger.warning(
+                self.logger.log_msgs["disk_estimate_unavailable"], exception
+            )
+            return True
+        estimate = bases * DemultiplexConfig.DISK_BYTES_PER_BASE * self.copies
+        required = estimate + DemultiplexConfig.DISK_SAFETY_MARGIN_GB * 1024**3
+        free = self.get_free_bytes()
+        if self.reservations is None:
+            sufficient, reserved = free >= required, 0
+        else:
+            sufficient, reserved = self.reservations.reserve(
+                self.rf_obj.runfolder_name,
+                os.stat(self.get_existing_path()).st_dev,
+                estimate,
+                free - DemultiplexConfig.DISK_SAFETY_MARGIN_GB * 1024**3,
+            )
+        if not sufficient:
+            self.logger.warning(
+                self.logger.log_msgs["disk_space_insufficient"],
+                estimate / 1024**3,
+                DemultiplexConfig.DISK_SAFETY_MARGIN_GB,
+                free / 1024**3,
+                reserved / 1024**3,
+                self.output_path,
+            )
+            return None
+        self.logger.info(
+            self.logger.log_msgs["disk_space_sufficient"],
+            estimate / 1024**3,
+            free / 1024**3,
+            reserved / 1024**3,
+            self.output_path,
+        )
+        return True
+
+
+class DiskReservations:
+    """
+    Estimated fastq output (bytes) of the runfolders being demultiplexed concurrently, per
+    output filesystem. Shared by the DemultiplexScheduler, so that runfolders started at the
+    same time cannot each pass the disk capacity check against the same free space. Reservations
+    are released once a runfolder has been processed. Output already written by a reserving
+    runfolder is counted twice (as used space and as reserved space), so the check is
+    conservative while runfolders are being demultiplexed
+
+    Attributes
+        reserved (dict):            Reserved bytes, keyed by filesystem device then runfolder name
+        lock (threading.Lock):      Lock making checking and reserving space atomic
+
+    Methods
+        reserve(runfolder_name, device, estimate, available)
+            Reserve space for a runfolder if available after the space reserved by other
+            runfolders
+        release(runfolder_name)
+            Release the space reserved for a runfolder
+    """
+
+    def __init__(self):
+        """
+        Constructor for the DiskReservations class
+        """
+        self.reserved = {}
+        self.lock = threading.Lock()
+
+    def reserve(
+        self, runfolder_name: str, device: int, estimate: float, available: float
+    ) -> Tuple[bool, float]:
+        """
+        Reserve space for the estimated output of a runfolder, if the space available on the
+        filesystem (free space less the safety margin) is sufficient once the space reserved by
+        other runfolders on the same filesystem is deducted
+            :param runfolder_name (str):    Runfolder name
+            :param device (int):            Device ID of the output filesystem
+            :param estimate (float):        Estimated output (bytes)
+            :param available (float):       Free space less the safety margin (bytes)
+            :return (Tuple[bool, float]):   True if the space was reserved, and the space reserved
+                                            by other runfolders (bytes)
+        """
+        with self.lock:
+            device_reserved = self.reserved.setdefault(device, {})
+            reserved = sum(
+                size for name, size in device_reserved.items() if name != runfolder_name
+            )
+            if available - reserved < estimate:
+                return False, reserved
+            device_reserved[runfolder_name] = estimate
+            return True, reserved
+
+    def release(self, runfolder_name: str) -> None:
+        """
+        Release the space reserved for a runfolder (once demultiplexed, or if not demultiplexed)
+            :param runfolder_name (str):    Runfolder name
+            :return None:
+        """
+        with self.lock:
+            for device_reserved in self.reserved.values():
+                device_reserved.pop(runfolder_name, None)
@@ -0,0 +1,495 @@
+"""interop_metrics.py
+
+Calculates the Illumina lane (cluster density) and phasing metrics for a runfolder directly from
+the InterOp binary files, as a native alternative to running GATK CollectIlluminaLaneMetrics in
+docker. The metric rows written match those written by Picard CollectIlluminaLaneMetrics (the
+header lines differ). Also calculates the per-lane run quality metrics (%PF, %Q30, cluster density) used by the run quality
+gate. Contains the following classes:
+
+- InterOpMetrics
+    Read the TileMetricsOut.bin (and for NovaSeq runs, EmpiricalPhasingMetricsOut.bin) InterOp
+    files of a runfolder, and write the illumina_lane_metrics and illumina_phasing_metrics files
+    to the runfolder. Read the QMetricsOut.bin InterOp file to calculate %Q30
+"""
+
+import os
+import mmap
+import math
+import struct
+import datetime
+import xml.etree.ElementTree as ET
+from typing import Optional
+from config.ad_config import DemultiplexConfig
+
+# InterOp record formats (little-endian, unpadded)
+TILE_METRICS_V2 = struct.Struct("<HHHf")  # lane, tile, code, value
+TILE_METRICS_V3 = struct.Struct("<HIBff")  # lane, tile, code, value, value 2
+EMPIRICAL_PHASING_V1 = struct.Struct("<HIHff")  # lane, tile, cycle, phasing, prephasing
+FLOAT32 = struct.Struct("<f")
+Q_METRICS_HEADER = struct.Struct("<BBB")  # version, record size, has quality score bins (v5+)
+Q_METRICS_BINS = 50  # Histogram size of unbinned QMetricsOut.bin records (Q1 to Q50)
+# TileMetricsOut.bin metric codes
+DENSITY_CODE = 100  # Cluster density (v2)
+CLUSTER_CODE = 102  # Cluster count (v2)
+PF_CLUSTER_CODE = 103  # Passing filter cluster count (v2)
+PHASING_BASE_CODE = 200  # Phasing code of read N (0-based) is 200 + 2N, prephasing 201 + 2N (v2)
+CLUSTER_CODE_V3 = ord("t")  # Cluster count (v3)
+PF_CLUSTER_CODE_V3 = ord("p")  # Passing filter cluster count (v3)
+PHASING_CYCLE = 25  # Cycle of each template read from which NovaSeq phasing is reported
+TEMPLATE_READ_NAMES = ["FIRST", "SECOND"]
+
+
+def to_float32(value: float) -> float:
+    """
+    Round a value to single precision, matching the float arithmetic used by Picard
+        :param value (float):   Value
+        :return (float):        Value rounded to single precision
+    """
+    try:
+        return FLOAT32.unpack(FLOAT32.pack(value))[0]
+    except OverflowError:
+        return math.copysign(math.inf, value)
+
+
+def divide_float32(numerator: float, denominator: float) -> float:
+    """
+    Divide two single precision values, as Java float division
+        :param numerator (float):   Numerator
+        :param denominator (float): Denominator
+        :return (float):            Quotient, rounded to single precision
+    """
+    if denominator == 0:
+        return math.nan if numerator == 0 or math.isnan(numerator) else math.copysign(
+            math.inf, numerator
+        )
+    return to_float32(numerator / denominator)
+
+
+def median(values: list) -> float:
+    """
+    Return the median of the values (apache commons math Median, as used by Picard)
+        :param values (list):   Values
+        :return (float):        Median, or NaN if there are no values
+    """
+    values = sorted(values)
+    if not values:
+        return math.nan
+    position = (len(values) + 1) / 2
+    lower = int(position)
+    if lower >= len(values):
+        return float(values[-1])
+    return values[lower - 1] + (position - lower) * (values[lower] - values[lower - 1])
+
+
+def format_metric(value) -> str:
+    """
+    Format a metric value as htsjdk FormatUtil (at most 6 decimal places, trailing zeros removed)
+        :param value (int|float|str):   Metric value
+        :return (str):                  Formatted value
+    """
+    if isinstance(value, float):
+        if math.isnan(value):
+            return "?"
+        if math.isinf(value):
+            return "∞" if value > 0 else "-∞"
+        return f"{value:.6f}".rstrip("0").rstrip(".")
+    return str(value)
+
+
+class InterOpMetrics(DemultiplexConfig):
+    """
+    Read the InterOp files of a runfolder and write the illumina_lane_metrics and
+    illumina_phasing_metrics files to the runfolder, replicating Picard CollectIlluminaLaneMetrics.
+    The binary files are memory-mapped and decoded using struct
+
+    Attributes
+        runfolderpath (str):        Path to the runfolder
+        runfolder_name (str):       Runfolder name (used as the metrics file prefix)
+        is_novaseq (bool):          Run was sequenced on a NovaSeq (TileMetricsOut.bin v3 /
+                                    EmpiricalPhasingMetricsOut.bin)
+        interop_dir (str):          Path to the runfolder InterOp directory
+        reads (list):               (Number of cycles, is template read) of each read in RunInfo.xml
+
+    Methods
+        get_reads()
+            Read the read structure from RunInfo.xml
+        read_records(file_path, record_struct, header_bytes)
+            Memory-map an InterOp file and decode its records
+        get_tiles()
+            Decode the tile metrics, returning the cluster count, cluster density and
+            phasing / prephasing values of each tile
+        get_cluster_count()
+            Return the total cluster count of the run from TileMetricsOut.bin
+        get_lane_clusters()
+            Return the cluster count, passing filter cluster count and tile area of each lane
+        get_lane_q30()
+            Return the base calls at or above Q30, and the total base calls, of each lane from
+            QMetricsOut.bin
+        get_lane_quality()
+            Calculate the %PF, %Q30 and cluster density of each lane
+        get_tile_phasing(codes)
+            Return the phasing / prephasing values of each template read from TileMetricsOut.bin
+            v2 metric codes
+        get_novaseq_phasing()
+            Return the phasing / prephasing values of each template read of each tile from
+            EmpiricalPhasingMetricsOut.bin
+        get_lane_metrics(tiles)
+            Calculate the cluster density of each lane
+        get_phasing_metrics(tiles)
+            Calculate the median phasing / prephasing of each template read of each lane
+        write_metrics_file(file_path, metrics_class, columns, rows)
+            Write a metrics file in the htsjdk MetricsFile format
+        write_metrics()
+            Calculate the lane and phasing metrics and write the metrics files to the runfolder
+    """
+
+    def __init__(self, runfolderpath: str, runfolder_name: str, is_novaseq: bool = False):
+        """
+        Constructor for the InterOpMetrics class
+            :param runfolderpath (str):     Path to the runfolder
+            :param runfolder_name (str):    Runfolder name (used as the metrics file prefix)
+            :param is_novaseq (bool):       Run was sequenced on a NovaSeq
+        """
+        self.runfolderpath = runfolderpath
+        self.runfolder_name = runfolder_name
+        self.is_novaseq = is_novaseq
+        self.interop_dir = os.path.join(self.runfolderpath, "InterOp")
+        self.reads = self.get_reads()
+
+    def get_reads(self) -> list:
+        """
+        Read the read structure from RunInfo.xml
+            :return (list):     (Number of cycles, is template read) of each read, in read order
+        """
+        tree = ET.parse(os.path.join(self.runfolderpath, "RunInfo.xml"))
+        reads = sorted(tree.iter("Read"), key=lambda read: int(read.get("Number")))
+        return [
+            (int(read.get("NumCycles")), read.get("IsIndexedRead") != "Y") for read in reads
+        ]
+
+    def read_records(self, file_path: str, record_struct: struct.Struct, header_bytes: int = 0):
+        """
+        Memory-map an InterOp file and decode its records. InterOp files begin with a version
+        byte and a record size byte, optionally followed by further header bytes
+            :param file_path (str):                 Path to the InterOp file
+            :param record_struct (struct.Struct):   Record format
+            :param header_bytes (int):              Header bytes following the version and record
+                                                    size bytes
+            :return (tuple):                        Header bytes, and list of decoded records
+        """
+        with open(file_path, "rb") as file, mmap.mmap(
+            file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as mapped:
+            record_size = mapped[1]
+            if record_size != record_struct.size:
+                raise ValueError(
+                    f"Unexpected record size {record_size} (version {mapped[0]}): {file_path}"
+                )
+            start = 2 + header_bytes
+            end = start + (len(mapped) - start) // record_size * record_size
+            with memoryview(mapped) as view:
+                header = bytes(view[2:start])
+                records = list(record_struct.iter_unpack(view[start:end]))
+        return header, records
+
+    def get_tiles(self) -> dict:
+        """
+        Decode the tile metrics, keeping the last value of any lane / tile / code combination.
+        For TileMetricsOut.bin v3 (NovaSeq), the tile area is read from the file header and the
+        phasing from EmpiricalPhasingMetricsOut.bin
+            :return (dict):     Dictionary of tiles keyed by (lane, tile), containing the cluster
+                                count, cluster density, and phasing / prephasing of each template read
+        """
+        tile_metrics_path = os.path.join(self.interop_dir, "TileMetricsOut.bin")
+        tile_codes = {}
+        if self.is_novaseq:
+            header, records = self.read_records(tile_metrics_path, TILE_METRICS_V3, FLOAT32.size)
+            tile_area = FLOAT32.unpack(header)[0]
+            phasing = self.get_novaseq_phasing()
+        else:
+            header, records = self.read_records(tile_metrics_path, TILE_METRICS_V2)
+        for lane, tile, code, value, *_ in records:
+            tile_codes.setdefault((lane, tile), {})[code] = value
+        tiles = {}
+        for (lane, tile), codes in tile_codes.items():
+            if self.is_novaseq:
+                if CLUSTER_CODE_V3 not in codes:
+                    raise ValueError(f"Cluster count missing for lane {lane} tile {tile}")
+                clusters = codes[CLUSTER_CODE_V3]
+                density = divide_float32(clusters, tile_area)
+                tile_phasing = phasing.get((lane, tile), {})
+            else:
+                if DENSITY_CODE not in codes or CLUSTER_CODE not in codes:
+                    raise ValueError(f"Cluster density / count missing for lane {lane} tile {tile}")
+                clusters, density = codes[CLUSTER_CODE], codes[DENSITY_CODE]
+                tile_phasing = self.get_tile_phasing(codes)
+            tiles[(lane, tile)] = {
+                "clusters": clusters,
+                "density": density,
+                "phasing": tile_phasing,
+            }
+        return tiles
+
+    def get_cluster_count(self) -> int:
+        """
+        Return the total cluster count of the run from TileMetricsOut.bin (without the phasing
+        files read by get_tiles(), so that it can be used before demultiplexing)
+            :return (int):      Total cluster count of all lanes / tiles
+        """
+        tile_metrics_path = os.path.join(self.interop_dir, "TileMetricsOut.bin")
+        if self.is_novaseq:
+            _, records = self.read_records(tile_metrics_path, TILE_METRICS_V3, FLOAT32.size)
+            cluster_code = CLUSTER_CODE_V3
+        else:
+            _, records = self.read_records(tile_metrics_path, TILE_METRICS_V2)
+            cluster_code = CLUSTER_CODE
+        clusters = {}
+        for lane, tile, code, value, *_ in records:
+            if code == cluster_code:
+                clusters[(lane, tile)] = value
+        return int(sum(clusters.values()))
+
+    def get_lane_clusters(self) -> dict:
+        """
+        Return the cluster count, passing filter cluster count and tile area of each lane from
+        TileMetricsOut.bin, keeping the last value of any lane / tile / code combination. The
+        tile area is read from the file header (v3) or calculated from the tile cluster count
+        and density (v2)
+            :return (dict):     (Clusters, passing filter clusters, area in mm2) keyed by lane
+        """
+        tile_metrics_path = os.path.join(self.interop_dir, "TileMetricsOut.bin")
+        if self.is_novaseq:
+            header, records = self.read_records(tile_metrics_path, TILE_METRICS_V3, FLOAT32.size)
+            tile_area = FLOAT32.unpack(header)[0]
+            cluster_code, pf_cluster_code = CLUSTER_CODE_V3, PF_CLUSTER_CODE_V3
+        else:
+            _, records = self.read_records(tile_metrics_path, TILE_METRICS_V2)
+            cluster_code, pf_cluster_code = CLUSTER_CODE, PF_CLUSTER_CODE
+        tile_codes = {}
+        for lane, tile, code, value, *_ in records:
+            tile_codes.setdefault((lane, tile), {})[code] = value
+        lanes = {}
+        for (lane, tile), codes in tile_codes.items():
+            if cluster_code not in codes or pf_cluster_code not in codes:
+                raise ValueError(f"Cluster / PF cluster count missing for lane {lane} tile {tile}")
+            if not self.is_novaseq:
+                if DENSITY_CODE not in codes:
+                    raise ValueError(f"Cluster density missing for lane {lane} tile {tile}")
+                tile_area = divide_float32(codes[cluster_code], codes[DENSITY_CODE])
+            clusters, pf_clusters, area = lanes.get(lane, (0.0, 0.0, 0.0))
+            lanes[lane] = (
+                clusters + codes[cluster_code],
+                pf_clusters + codes[pf_cluster_code],
+                area + tile_area,
+            )
+        return lanes
+
+    def get_lane_q30(self) -> dict:
+        """
+        Return the base calls at or above Q30, and the total base calls, of each lane from
+        QMetricsOut.bin (versions 4 to 7). Each record holds a quality score histogram for a
+        lane / tile / cycle. Unbinned histograms have a bin per quality score (Q1 to Q50). From
+        version 5 the header may define quality score bins, in which case version 5 records
+        hold the counts at the bin's remapped quality score, and version 6+ records hold a
+        histogram of the bins
+            :return (dict):     (Base calls >= Q30, total base calls) keyed by lane
+        """
+        q_metrics_path = os.path.join(self.interop_dir, "QMetricsOut.bin")
+        with open(q_metrics_path, "rb") as q_metrics_file:
+            header = q_metrics_file.read(Q_METRICS_HEADER.size + 1 + 3 * 255)
+        version, _, has_bins = Q_METRICS_HEADER.unpack_from(header)
+        if version not in (4, 5, 6, 7):
+            raise ValueError(f"Unsupported QMetricsOut.bin version {version}: {q_metrics_path}")
+        header_bytes, qscores = 0, list(range(1, Q_METRICS_BINS + 1))
+        if version > 4:
+            header_bytes = 1
+            if has_bins:
+                bin_count = header[Q_METRICS_HEADER.size]
+                header_bytes = 2 + 3 * bin_count
+                if version > 5:  # Remapped quality score of each bin
+                    remapped = Q_METRICS_HEADER.size + 1 + 2 * bin_count
+                    qscores = list(header[remapped: remapped + bin_count])
+        tile_format = "I" if version == 7 else "H"
+        record_struct = struct.Struct(f"<H{tile_format}H{len(qscores)}I")
+        q30_bins = [index for index, qscore in enumerate(qscores) if qscore >= 30]
+        _, records = self.read_records(q_metrics_path, record_struct, header_bytes)
+        lanes = {}
+        for lane, _, _, *histogram in records:
+            q30, total = lanes.get(lane, (0, 0))
+            lanes[lane] = (
+                q30 + sum(histogram[index] for index in q30_bins),
+                total + sum(histogram),
+            )
+        return lanes
+
+    def get_lane_quality(self) -> dict:
+        """
+        Calculate the %PF, %Q30 and cluster density (K/mm2) of each lane
+            :return (dict):     Dictionary of metrics keyed by lane
+        """
+        lane_q30 = self.get_lane_q30()
+        lane_quality = {}
+        for lane, (clusters, pf_clusters, area) in sorted(self.get_lane_clusters().items()):
+            q30, total = lane_q30.get(lane, (0, 0))
+            lane_quality[lane] = {
+                "percent_pf": pf_clusters / clusters * 100 if clusters else 0.0,
+                "percent_q30": q30 / total * 100 if total else 0.0,
+                "cluster_density": clusters / area / 1000 if area else 0.0,
+            }
+        return lane_quality
+
+    def get_tile_phasing(self, codes: dict) -> dict:
+        """
+        Return the phasing / prephasing values of each template read of a tile from its
+        TileMetricsOut.bin v2 metric codes. Values are 0 where they are missing
+            :param codes (dict):    Metric values of the tile, keyed by metric code
+            :return (dict):         (Phasing, prephasing) keyed by template read name
+        """
+        tile_phasing = {}
+        template_reads = 0
+        for read_index, (_, is_template) in enumerate(self.reads):
+            if is_template:
+                phasing_code = PHASING_BASE_CODE + read_index * 2
+                if phasing_code in codes and phasing_code + 1 in codes:
+                    values = (codes[phasing_code], codes[phasing_code + 1])
+                else:
+                    values = (0.0, 0.0)
+                read_name = TEMPLATE_READ_NAMES[min(template_reads, 1)]
+                tile_phasing[read_name] = values
+                template_reads += 1
+        return tile_phasing
+
+    def get_novaseq_phasing(self) -> dict:
+        """
+        Return the phasing / prephasing values of each template read of each tile from
+        EmpiricalPhasingMetricsOut.bin, taken at the PHASING_CYCLE cycle of each template read.
+        Uses the top-level InterOp file if present, else the file in the cycle directory
+            :return (dict):     Dictionary keyed by (lane, tile), of (phasing, prephasing) keyed
+                                by template read name
+        """
+        phasing = {}
+        read_cycles = {}
+        first_cycle = 1
+        for num_cycles, is_template in self.reads:
+            if is_template:
+                read_name = TEMPLATE_READ_NAMES[min(len(read_cycles), 1)]
+                read_cycles[first_cycle + PHASING_CYCLE - 1] = read_name
+            first_cycle += num_cycles
+        phasing_path = os.path.join(self.interop_dir, "EmpiricalPhasingMetricsOut.bin")
+        for cycle, read_name in read_cycles.items():
+            cycle_path = phasing_path
+            if not os.path.exists(cycle_path):
+                cycle_path = os.path.join(
+                    self.interop_dir, f"C{cycle}.1", "EmpiricalPhasingMetricsOut.bin"
+                )
+            _, records = self.read_records(cycle_path, EMPIRICAL_PHASING_V1)
+            for lane, tile, record_cycle, phasing_value, prephasing_value in records:
+                if record_cycle == cycle:
+                    phasing.setdefault((lane, tile), {})[read_name] = (
+                        phasing_value,
+                        prephasing_value,
+                    )
+        return phasing
+
+    def get_lane_metrics(self, tiles: dict) -> list:
+        """
+        Calculate the cluster density of each lane, as the total number of clusters divided by
+        the total area of the tiles in the lane
+            :param tiles (dict):    Tiles, as returned by get_tiles()
+            :return (list):         List of (cluster density, lane) rows, ordered by lane
+        """
+        lanes = {}
+        for (lane, _), tile in tiles.items():
+            area, clusters = lanes.get(lane, (0.0, 0.0))
+            lanes[lane] = (
+                area + divide_float32(tile["clusters"], tile["density"]),
+                clusters + tile["clusters"],
+            )
+        return [
+            (clusters / area if area else math.nan, lane)
+            for lane, (area, clusters) in sorted(lanes.items())
+        ]
+
+    def get_phasing_metrics(self, tiles: dict) -> list:
+        """
+        Calculate the median phasing / prephasing of each template read of each lane across
+        tiles. Values are reported as percentages, except for NovaSeq runs
+            :param tiles (dict):    Tiles, as returned by get_tiles()
+            :return (list):         List of (lane, template read, phasing, prephasing) rows,
+                                    ordered by lane and template read
+        """
+        lane_values = {}
+        for (lane, _), tile in tiles.items():
+            for read_name, values in tile["phasing"].items():
+                lane_values.setdefault((lane, read_name), []).append(values)
+        scale = 1 if self.is_novaseq else 100
+        rows = []
+        for lane, read_name in sorted(
+            lane_values, key=lambda key: (key[0], TEMPLATE_READ_NAMES.index(key[1]))
+        ):
+            values = lane_values[(lane, read_name)]
+            rows.append(
+                (
+                    lane,
+                    read_name,
+                    to_float32(median([value[0] for value in values]) * scale),
+                    to_float32(median([value[1] for value in values]) * scale),
+                )
+            )
+        return rows
+
+    def write_metrics_file(
+        self, file_path: str, metrics_class: str, columns: list, rows: list
+    ) -> None:
+        """
+        Write a metrics file in the htsjdk MetricsFile format
+            :param file_path (str):     Path of metrics file to write
+            :param metrics_class (str): Picard metrics class name
+            :param columns (list):      Column names
+            :param rows (list):         Metrics rows
+            :return None:
+        """
+        command = (
+            f"InterOpMetrics --RUN_DIRECTORY {self.runfolderpath} "
+            f"--OUTPUT_PREFIX {self.runfolder_name}"
+            f"{' --IS_NOVASEQ' if self.is_novaseq else ''}"
+        )
+        started = datetime.datetime.now().astimezone().strftime("%a %b %d %H:%M:%S %Z %Y")
+        lines = [
+            "## htsjdk.samtools.metrics.StringHeader",
+            f"# {command}",
+            "## htsjdk.samtools.metrics.StringHeader",
+            f"# Started on: {started}",
+            "",
+            f"## METRICS CLASS\t{metrics_class}",
+            "\t".join(columns),
+        ]
+        lines.extend("\t".join(format_metric(value) for value in row) for row in rows)
+        with open(file_path, "w", encoding="utf-8") as metrics_file:
+            metrics_file.write("\n".join(lines) + "\n\n")
+
+    def write_metrics(self) -> Optional[bool]:
+        """
+        Calculate the lane and phasing metrics and write the metrics files to the runfolder
+            :return (Optional[bool]):   True if the metrics files were written
+        """
+        tiles = self.get_tiles()
+        self.write_metrics_file(
+            os.path.join(
+                self.runfolderpath,
+                f"{self.runfolder_name}{DemultiplexConfig.STRINGS['lane_metrics_suffix']}",
+            ),
+            "picard.illumina.IlluminaLaneMetrics",
+            ["CLUSTER_DENSITY", "LANE"],
+            self.get_lane_metrics(tiles),
+        )
+        self.write_metrics_file(
+            os.path.join(
+                self.runfolderpath,
+                f"{self.runfolder_name}{DemultiplexConfig.STRINGS['phasing_metrics_suffix']}",
+            ),
+            "picard.illumina.IlluminaPhasingMetrics",
+            ["LANE", "TYPE_NAME", "PHASING_APPLIED", "PREPHASING_APPLIED"],
+            self.get_phasing_metrics(tiles),
+        )
+        return True
@@ -0,0 +1,135 @@
+"""run_quality.py
+
+Run quality gate. Runs that fail on %PF or %Q30 are otherwise demultiplexed and uploaded before
+the lab reviews the run metrics, wasting demultiplexing time, upload bandwidth and DNAnexus
+compute. The per-lane run quality metrics are calculated from the InterOp files before
+demultiplexing, and runs below the configured thresholds are held for manual release. Contains
+the following classes:
+
+- RunQualityGate
+    Calculate the %PF, %Q30 and cluster density of each lane of an Illumina run, and hold the
+    run if any lane fails the thresholds, until it is manually released
+"""
+
+import os
+import struct
+import logging
+import datetime
+import xml.etree.ElementTree as ET
+from typing import Optional
+from config.ad_config import DemultiplexConfig
+from toolbox.toolbox import write_lines
+from demultiplex.interop_metrics import InterOpMetrics
+
+
+class RunQualityGate(DemultiplexConfig):
+    """
+    Calculate the %PF, %Q30 and cluster density of each lane of an Illumina run from the InterOp
+    files (TileMetricsOut.bin, QMetricsOut.bin), and hold the run if any lane is below
+    RUN_QUALITY_MIN_PERCENT_PF or RUN_QUALITY_MIN_PERCENT_Q30, or outside the
+    RUN_QUALITY_DENSITY_RANGE of the sequencer. A held run has the failed metrics written to the
+    quality hold flag file (the alert is only raised when the run is first held), and is not
+    demultiplexed until the quality release flag file is created in the runfolder. If the metrics
+    cannot be calculated (e.g. InterOp files missing), the run is not held
+
+    Attributes
+        rf_obj (obj):               RunfolderObject object
+        logger (logging.Logger):    Demultiplex runfolder logger
+
+    Methods
+        get_failures(lane_quality)
+            Return the lane metrics that fail the thresholds
+        check()
+            Return True if the run passes the run quality gate, or has been released
+    """
+
+    def __init__(self, rf_obj: object, logger: logging.Logger):
+        """
+        Constructor for the RunQualityGate class
+            :param rf_obj (obj):                RunfolderObject object
+            :param logger (logging.Logger):     Demultiplex runfolder logger
+        """
+        self.rf_obj = rf_obj
+        self.logger = logger
+
+    def get_failures(self, lane_quality: dict) -> list:
+        """
+        Return the lane metrics that fail the thresholds
+            :param lane_quality (dict):     Lane metrics, as returned by
+                                            InterOpMetrics.get_lane_quality()
+            :return (list):                 Failure descriptions, e.g. "Lane 1 percent_q30 65.2 < 70"
+        """
+        minimums = {
+            "percent_pf": DemultiplexConfig.RUN_QUALITY_MIN_PERCENT_PF,
+            "percent_q30": DemultiplexConfig.RUN_QUALITY_MIN_PERCENT_Q30,
+        }
+        density_range = DemultiplexConfig.RUN_QUALITY_DENSITY_RANGE.get(
+            self.rf_obj.sequencer_type
+        )
+        failures = []
+        for lane, metrics in lane_quality.items():
+            for metric, minimum in minimums.items():
+                if minimum is not None and metrics[metric] < minimum:
+                    failures.append(
+                        f"Lane {lane} {metric} {metrics[metric]:.1f} < {minimum}"
+                    )
+            if density_range and not (
+                density_range[0] <= metrics["cluster_density"] <= density_range[1]
+            ):
+                failures.append(
+                    f"Lane {lane} cluster_density {metrics['cluster_density']:.1f} K/mm2 "
+                    f"outside {density_range[0]}-{density_range[1]}"
+                )
+        return failures
+
+    def check(self) -> Optional[bool]:
+        """
+        Return True if the run passes the run quality gate, or has been released. If the run
+        fails, write the failed metrics to the quality hold flag file and raise an alert (only
+        when the run is first held)
+            :return (Optional[bool]):   True if the run can be demultiplexed, None if held
+        """
+        if os.path.exists(self.rf_obj.quality_release_flagfile):
+            self.logger.info(
+                self.logger.log_msgs["run_quality_released"],
+                self.rf_obj.quality_release_flagfile,
+            )
+            return True
+        try:
+            lane_quality = InterOpMetrics(
+                self.rf_obj.runfolderpath,
+                self.rf_obj.runfolder_name,
+                DemultiplexConfig.NOVASEQ_ID in self.rf_obj.runfolder_name,
+            ).get_lane_quality()
+        except (OSError, ValueError, struct.error, ET.ParseError) as exception:
+            self.logger.warning(self.logger.log_msgs["run_quality_unavailable"], exception)
+            return True
+        for lane, metrics in lane_quality.items():
+            self.logger.info(
+                self.logger.log_msgs["run_quality_lane"],
+                lane,
+                metrics["percent_pf"],
+                metrics["percent_q30"],
+                metrics["cluster_density"],
+            )
+        failures = self.get_failures(lane_quality)
+        if not failures:
+            self.logger.info(self.logger.log_msgs["run_quality_passed"])
+            return True
+        if os.path.exists(self.rf_obj.quality_hold_flagfile):
+            self.logger.info(
+                self.logger.log_msgs["run_quality_still_held"],
+                self.rf_obj.quality_release_flagfile,
+            )
+            return None
+        write_lines(
+            self.rf_obj.quality_hold_flagfile,
+            "w",
+            [f"Run held by run quality gate {datetime.datetime.now()}"] + failures,
+        )
+        self.logger.error(
+            self.logger.log_msgs["run_quality_held"],
+            "; ".join(failures),
+            self.rf_obj.quality_release_flagfile,
+        )
+        return None
@@ -0,0 +1,236 @@
+"""sample_redemultiplex.py
+
+Sample-subset re-demultiplexing. If the fastqs of some samples are found to be invalid after
+bclconvert has completed (e.g. a truncated fastq), only those samples are demultiplexed again,
+rather than the whole run on the next script run. Contains the following classes:
+
+- SampleRedemultiplex
+    Re-demultiplex the samples with invalid fastqs into a scratch directory using a SampleSheet
+    containing only those samples, and replace their fastqs in the fastq directory
+"""
+
+import os
+import shutil
+import logging
+from typing import Optional
+from config.ad_config import DemultiplexConfig
+from toolbox.toolbox import (
+    FASTQ_NAME_PATTERN,
+    read_samplesheet,
+    write_lines,
+    stream_subprocess_command,
+)
+from demultiplex.thread_tuning import get_thread_counts, format_thread_options
+
+UNDETERMINED_SAMPLE_ID = "Undetermined"
+
+
+class SampleRedemultiplex(DemultiplexConfig):
+    """
+    Re-demultiplex the samples with invalid fastqs. A SampleSheet containing only those samples
+    is written to BCLCONVERT_SAMPLE_DIR within the runfolder, and bclconvert (BCLCONVERT_CMD) is
+    run into a scratch output directory within it. The fastqs of the samples in the fastq
+    directory are then replaced by renaming the re-demultiplexed fastqs over them (the scratch
+    directory is on the same filesystem, so each replacement is atomic). Re-demultiplexing is
+    not possible if an invalid fastq does not belong to a SampleSheet sample (e.g. Undetermined
+    fastqs, whose reads depend on every sample), or for bases2fastq runs
+
+    Attributes
+        rf_obj (obj):                       RunfolderObject object
+        user (int):                         User ID the container is run as
+        logger (logging.Logger):            Demultiplex runfolder logger
+        output_logger (logging.Logger):     Logger to which bclconvert output is written
+        samples_dir (str):                  Scratch directory
+        samplesheet_name (str):             Name of the subset SampleSheet
+        output_dir (str):                   bclconvert output directory within samples_dir
+        log_dir (str):                      bclconvert log directory within samples_dir
+
+    Methods
+        get_sample_ids(invalid_fastqs)
+            Return the sample IDs of the invalid fastqs
+        write_samplesheet(sample_ids)
+            Write a SampleSheet containing only the samples to the scratch directory
+        get_cmd()
+            Return the bclconvert command for the subset SampleSheet
+        get_fastq_names(fastq_dir_path, sample_ids)
+            Return the fastqs of the samples in a directory, keyed by sample ID and read
+        replace_fastqs(sample_ids)
+            Replace the fastqs of the samples with the re-demultiplexed fastqs
+        run(invalid_fastqs)
+            Re-demultiplex the samples with invalid fastqs and replace their fastqs
+        remove_samples_dir()
+            Remove the scratch directory
+    """
+
+    def __init__(
+        self,
+        rf_obj: object,
+        user: int,
+        logger: logging.Logger,
+        output_logger: Optional[logging.Logger] = None,
+    ):
+        """
+        Constructor for the SampleRedemultiplex class
+            :param rf_obj (obj):                        RunfolderObject object
+            :param user (int):                          User ID the container is run as
+            :param logger (logging.Logger):             Demultiplex runfolder logger
+            :param output_logger (logging.Logger):      Logger to which bclconvert output is written
+        """
+        self.rf_obj = rf_obj
+        self.user = user
+        self.logger = logger
+        self.output_logger = output_logger
+        self.samples_dir = os.path.join(
+            self.rf_obj.runfolderpath, DemultiplexConfig.BCLCONVERT_SAMPLE_DIR
+        )
+        self.samplesheet_name = self.rf_obj.samplesheet_name
+        self.output_dir = os.path.join(self.samples_dir, "output")
+        self.log_dir = os.path.join(self.samples_dir, "Logs")
+
+    def get_sample_ids(self, invalid_fastqs: list) -> Optional[set]:
+        """
+        Return the sample IDs of the invalid fastqs
+            :param invalid_fastqs (list):   Names of the invalid fastqs
+            :return (Optional[set]):        Sample IDs, or None if any invalid fastq does not
+                                            belong to a sample
+        """
+        sample_ids = set()
+        for fastq_name in invalid_fastqs:
+            match = FASTQ_NAME_PATTERN.match(fastq_name)
+            if not match or match.group("sample_name") == UNDETERMINED_SAMPLE_ID:
+                return None
+            sample_ids.add(match.group("sample_name"))
+        return sample_ids or None
+
+    def write_samplesheet(self, sample_ids: set) -> Optional[bool]:
+        """
+        Write a SampleSheet containing only the samples to the scratch directory. All lines
+        other than the data rows of other samples are retained
+            :param sample_ids (set):    Sample IDs to retain
+            :return (Optional[bool]):   True if all samples were found in the SampleSheet
+        """
+        samplesheet = read_samplesheet(self.rf_obj.samplesheet_path)
+        if sample_ids.issubset(samplesheet.get_sample_ids()):
+            write_lines(
+                os.path.join(self.samples_dir, self.samplesheet_name),
+                "w",
+                samplesheet.get_lines(sample_ids),
+            )
+            return True
+
+    def get_cmd(self) -> str:
+        """
+        Return the bclconvert command for the subset SampleSheet, writing to the scratch output
+        and log directories, with the thread counts benchmarked on this host (if any)
+            :return (str):  bclconvert command
+        """
+        return DemultiplexConfig.BCLCONVERT_CMD % (
+            self.user,
+            self.user,
+            self.rf_obj.runfolderpath,
+            self.output_dir,
+            self.log_dir,
+            self.samples_dir,
+            self.samplesheet_name,
+        ) + format_thread_options(
+            get_thread_counts(
+                self.rf_obj.sequencer_type, DemultiplexConfig.DEMULTIPLEX_CONTAINER_CPU
+            )
+        )
+
+    def get_fastq_names(self, fastq_dir_path: str, sample_ids: set) -> dict:
+        """
+        Return the fastqs of the samples in a directory, keyed by sample ID and read (and lane,
+        if the fastqs are lane-split). The sample number (S1) is the position of the sample in the
+        SampleSheet, so differs between the full and subset runs and is not part of the key
+            :param fastq_dir_path (str):    Directory containing the fastqs
+            :param sample_ids (set):        Sample IDs
+            :return (dict):                 Fastq names keyed by (sample ID, lane, read)
+        """
+        fastq_names = {}
+        for fastq_name in os.listdir(fastq_dir_path):
+            match = FASTQ_NAME_PATTERN.match(fastq_name)
+            if match and match.group("sample_name") in sample_ids:
+                fastq_names[match.group("sample_name", "lane", "read")] = fastq_name
+        return fastq_names
+
+    def replace_fastqs(self, sample_ids: set) -> Optional[bool]:
+        """
+        Replace the fastqs of the samples in the fastq directory with the re-demultiplexed
+        fastqs, keeping the original fastq names. Fastqs are only replaced if every fastq of the
+        samples was re-demultiplexed
+            :param sample_ids (set):    Sample IDs
+            :return (Optional[bool]):   True if the fastqs were replaced
+        """
+        original = self.get_fastq_names(self.rf_obj.fastq_dir_path, sample_ids)
+        redemultiplexed = self.get_fastq_names(self.output_dir, sample_ids)
+        if not original or set(original) != set(redemultiplexed):
+            self.logger.error(
+                self.logger.log_msgs["sample_redemultiplex_fastqs_differ"],
+                ", ".join(sorted(redemultiplexed.values())),
+                ", ".join(sorted(original.values())),
+            )
+            return None
+        for key, fastq_name in original.items():
+            os.replace(
+                os.path.join(self.output_dir, redemultiplexed[key]),
+                os.path.join(self.rf_obj.fastq_dir_path, fastq_name),
+            )
+        self.logger.info(
+            self.logger.log_msgs["sample_fastqs_replaced"],
+            len(original),
+            ", ".join(sorted(sample_ids)),
+        )
+        return True
+
+    def run(self, invalid_fastqs: list) -> Optional[bool]:
+        """
+        Re-demultiplex the samples with invalid fastqs and replace their fastqs. The scratch
+        directory is removed afterwards
+            :param invalid_fastqs (list):   Names of the invalid fastqs
+            :return (Optional[bool]):       True if the fastqs of the samples were replaced,
+                                            None if the whole run must be re-demultiplexed
+        """
+        sample_ids = self.get_sample_ids(invalid_fastqs)
+        if not sample_ids:
+            self.logger.warning(
+                self.logger.log_msgs["sample_redemultiplex_not_possible"],
+                ", ".join(invalid_fastqs),
+            )
+            return None
+        self.remove_samples_dir()
+        # Created before bclconvert is run, as docker would otherwise create the mounted
+        # directories owned by root
+        for mount_dir in [self.output_dir, self.log_dir]:
+            os.makedirs(mount_dir)
+        try:
+            if not self.write_samplesheet(sample_ids):
+                self.logger.warning(
+                    self.logger.log_msgs["sample_redemultiplex_not_possible"],
+                    ", ".join(invalid_fastqs),
+                )
+                return None
+            cmd = self.get_cmd()
+            self.logger.info(
+                self.logger.log_msgs["sample_redemultiplex_start"],
+                ", ".join(sorted(sample_ids)),
+                cmd,
+            )
+            out, err, returncode = stream_subprocess_command(
+                cmd, self.logger, self.output_logger
+            )
+            if returncode != 0:
+                self.logger.error(
+                    self.logger.log_msgs["sample_redemultiplex_failed"], out, err
+                )
+                return None
+            return self.replace_fastqs(sample_ids)
+        finally:
+            self.remove_samples_dir()
+
+    def remove_samples_dir(self) -> None:
+        """
+        Remove the scratch directory
+            :return None:
+        """
+        shutil.rmtree(self.samples_dir, ignore_errors=True)
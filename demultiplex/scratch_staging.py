@@ -0,0 +1,248 @@
+"""scratch_staging.py
+
+Local scratch staging for bclconvert. The runfolder volume also receives live sequencer transfers
+and uploads, so bclconvert reading the BCL / CBCL files from, and writing the fastqs to, that
+volume competes with them for I/O. In staging mode the bclconvert inputs are synced to a local
+scratch directory (STAGING_DIR), bclconvert is run there, and the outputs are moved back into the
+runfolder. Contains the following classes:
+
+- ScratchStaging
+    Sync the bclconvert inputs of a runfolder to the scratch directory using a thread pool, and
+    move the bclconvert outputs back into the runfolder, logging the duration of each phase
+"""
+
+import os
+import time
+import shutil
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+from config.ad_config import DemultiplexConfig
+
+
+class ScratchStaging(DemultiplexConfig):
+    """
+    Stage the bclconvert inputs of a runfolder (STAGING_INPUTS, excluding any fastqs and Reports
+    from previous demultiplexing) in a per-runfolder directory within STAGING_DIR. Inputs are
+    synced, so files that are already staged with the same size and modification time are not
+    copied again. bclconvert writes to an output directory within the staging directory, and
+    each output file is copied back into the runfolder fastq directory under a temporary name
+    and renamed, so that a partially copied fastq is never seen. If the scratch directory does
+    not have STAGING_SPACE_FACTOR times the input size free, the runfolder is not staged
+
+    Attributes
+        rf_obj (obj):               RunfolderObject object
+        logger (logging.Logger):    Demultiplex runfolder logger
+        staging_path (str):         Staging directory for the runfolder
+        input_path (str):           Staged copy of the runfolder (bclconvert input)
+        output_path (str):          bclconvert output directory
+        threads (int):              Number of files copied in parallel
+
+    Methods
+        get_input_files()
+            Return the runfolder files required by bclconvert
+        copy_file(source, destination)
+            Copy a file, unless the destination has the same size and modification time
+        copy_files(file_pairs)
+            Copy files in parallel
+        stage_inputs()
+            Sync the bclconvert inputs to the staging directory
+        get_cmd(user, log_dir, samplesheet_dir, samplesheet_name)
+            Return the bclconvert command reading from and writing to the staging directory
+        move_outputs()
+            Move the bclconvert outputs into the runfolder fastq directory
+        remove()
+            Remove the staging directory
+        log_phase(phase, start, files, size)
+            Log the duration of a staging phase, and the files copied if it is a copy phase
+    """
+
+    def __init__(
+        self,
+        rf_obj: object,
+        logger: logging.Logger,
+        threads: int = DemultiplexConfig.STAGING_COPY_THREADS,
+    ):
+        """
+        Constructor for the ScratchStaging class
+            :param rf_obj (obj):                RunfolderObject object
+            :param logger (logging.Logger):     Demultiplex runfolder logger
+            :param threads (int):               Number of files copied in parallel
+        """
+        self.rf_obj = rf_obj
+        self.logger = logger
+        self.staging_path = os.path.join(DemultiplexConfig.STAGING_DIR, rf_obj.runfolder_name)
+        self.input_path = os.path.join(self.staging_path, "input")
+        self.output_path = os.path.join(self.staging_path, "output")
+        self.threads = max(1, threads)
+
+    def get_input_files(self) -> list:
+        """
+        Return the runfolder files required by bclconvert (STAGING_INPUTS), excluding fastqs
+        and Reports / Logs directories from previous demultiplexing
+            :return (list):     Paths relative to the runfolder
+        """
+        input_files = []
+        for staging_input in DemultiplexConfig.STAGING_INPUTS:
+            input_path = os.path.join(self.rf_obj.runfolderpath, staging_input)
+            if os.path.isfile(input_path):
+                input_files.append(staging_input)
+            for dirpath, dirnames, filenames in os.walk(input_path):
+                dirnames[:] = [
+                    dirname
+                    for dirname in dirnames
+                    if dirname not in DemultiplexConfig.STAGING_EXCLUDE_DIRS
+                ]
+                input_files.extend(
+                    os.path.relpath(os.path.join(dirpath, filename), self.rf_obj.runfolderpath)
+                    for filename in filenames
+                    if not filename.endswith(".fastq.gz")
+                )
+        return input_files
+
+    def copy_file(self, source: str, destination: str) -> int:
+        """
+        Copy a file (preserving its modification time), unless the destination has the same
+        size and modification time
+            :param source (str):        Source path
+            :param destination (str):   Destination path
+            :return (int):              Bytes copied
+        """
+        source_stat = os.stat(source)
+        try:
+            destination_stat = os.stat(destination)
+            if (
+                destination_stat.st_size == source_stat.st_size
+                and destination_stat.st_mtime_ns == source_stat.st_mtime_ns
+            ):
+                return 0
+        except FileNotFoundError:
+            pass
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        shutil.copy2(source, destination)
+        return source_stat.st_size
+
+    def copy_files(self, file_pairs: list) -> int:
+        """
+        Copy files in parallel (shutil releases the GIL while copying)
+            :param file_pairs (list):   List of (source, destination) path tuples
+            :return (int):              Bytes copied
+        """
+        with ThreadPoolExecutor(max_workers=self.threads) as executor:
+            return sum(executor.map(lambda pair: self.copy_file(*pair), file_pairs))
+
+    def stage_inputs(self) -> Optional[bool]:
+        """
+        Sync the bclconvert inputs to the staging directory, if the scratch directory has
+        enough free space
+            :return (Optional[bool]):   True if the inputs were staged
+        """
+        start = time.monotonic()
+        input_files = self.get_input_files()
+        input_bytes = sum(
+            os.path.getsize(os.path.join(self.rf_obj.runfolderpath, input_file))
+            for input_file in input_files
+        )
+        os.makedirs(DemultiplexConfig.STAGING_DIR, exist_ok=True)
+        free_bytes = shutil.disk_usage(DemultiplexConfig.STAGING_DIR).free
+        if free_bytes < input_bytes * DemultiplexConfig.STAGING_SPACE_FACTOR:
+            self.logger.warning(
+                self.logger.log_msgs["staging_insufficient_space"],
+                DemultiplexConfig.STAGING_DIR,
+                free_bytes / 1024**3,
+                input_bytes / 1024**3,
+            )
+            return None
+        copied_bytes = self.copy_files(
+            [
+                (
+                    os.path.join(self.rf_obj.runfolderpath, input_file),
+                    os.path.join(self.input_path, input_file),
+                )
+                for input_file in input_files
+            ]
+        )
+        shutil.rmtree(self.output_path, ignore_errors=True)
+        os.makedirs(self.output_path)
+        self.log_phase("Staging inputs", start, len(input_files), copied_bytes)
+        return True
+
+    def get_cmd(
+        self, user: int, log_dir: str, samplesheet_dir: str, samplesheet_name: str
+    ) -> str:
+        """
+        Return the bclconvert command (BCLCONVERT_CMD) reading from and writing to the staging
+        directory. The bclconvert logs are written to the runfolder log directory as usual
+            :param user (int):              User ID the container is run as
+            :param log_dir (str):           bclconvert log directory
+            :param samplesheet_dir (str):   Directory containing the SampleSheet
+            :param samplesheet_name (str):  SampleSheet name
+            :return (str):                  bclconvert command
+        """
+        return DemultiplexConfig.BCLCONVERT_CMD % (
+            user,
+            user,
+            self.input_path,
+            self.output_path,
+            log_dir,
+            samplesheet_dir,
+            samplesheet_name,
+        )
+
+    def move_outputs(self) -> None:
+        """
+        Move the bclconvert outputs into the runfolder fastq directory. Each file is copied to
+        a temporary name in its destination directory and renamed, so that it appears complete
+            :return None:
+        """
+        start = time.monotonic()
+        file_pairs = []
+        for dirpath, _, filenames in os.walk(self.output_path):
+            for filename in filenames:
+                destination_dir = os.path.join(
+                    self.rf_obj.fastq_dir_path, os.path.relpath(dirpath, self.output_path)
+                )
+                file_pairs.append(
+                    (
+                        os.path.join(dirpath, filename),
+                        os.path.join(destination_dir, f".{filename}.staging.tmp"),
+                    )
+                )
+        copied_bytes = self.copy_files(file_pairs)
+        for _, tmp_path in file_pairs:
+            os.replace(
+                tmp_path,
+                os.path.join(
+                    os.path.dirname(tmp_path),
+                    os.path.basename(tmp_path)[1: -len(".staging.tmp")],
+                ),
+            )
+        self.log_phase("Moving outputs", start, len(file_pairs), copied_bytes)
+
+    def remove(self) -> None:
+        """
+        Remove the staging directory
+            :return None:
+        """
+        shutil.rmtree(self.staging_path, ignore_errors=True)
+
+    def log_phase(
+        self, phase: str, start: float, files: Optional[int] = None, size: int = 0
+    ) -> None:
+        """
+        Log the duration of a staging phase, and the files copied if it is a copy phase
+            :param phase (str):     Phase name
+            :param start (float):   time.monotonic() at the start of the phase
+            :param files (int):     Number of files in the copy phase
+            :param size (int):      Bytes copied in the copy phase
+            :return None:
+        """
+        duration = time.monotonic() - start
+        self.logger.info(self.logger.log_msgs["staging_phase_time"], phase, duration)
+        if files is not None:
+            self.logger.info(
+                self.logger.log_msgs["staging_files_copied"],
+                files,
+                size / 1024**3,
+                size / 1024**2 / duration if duration else 0,
+            )
@@ -3,12 +3,32 @@ demultiplex.py pytest unit tests. The test suite is currently incomplete
 """
 
 import os
+import sys
+import types
+import time
 import itertools
+import shutil
+import gzip
+import struct
+import threading
+import subprocess
 import pytest
-from demultiplex import demultiplex
+from concurrent.futures import Future, ThreadPoolExecutor
+from demultiplex import (
+    demultiplex,
+    interop_metrics,
+    checksum_verifier,
+    bclconvert_lanes,
+    sample_redemultiplex,
+    scratch_staging,
+    thread_tuning,
+    disk_capacity,
+    run_quality,
+)
 from config import ad_config
 from .. import conftest
 from ad_logger import ad_logger
+from toolbox import toolbox
 from pytest_cases import fixture_union
 from ..conftest import test_data_temp
 
@@ -248,6 +268,337 @@ class TestGetRunfolders(object):
             assert pytest_wrapped_e.value.code == 1
 
 
+class TestDemultiplexScheduler(object):
+    """
+    Test DemultiplexScheduler class
+    """
+
+    @pytest.fixture(scope="function")
+    def dummy_runfolders(self):
+        """
+        List of dummy runfolder names
+        """
+        return [f"999999_M02631_0000_00000SLOT{i}" for i in range(6)]
+
+    @pytest.fixture(scope="function")
+    def dummy_dr_class(self):
+        """
+        Stand-in for DemultiplexRunfolder that records the maximum number of runfolders
+        processed concurrently
+        """
+        state = {"running": 0, "max_running": 0, "lock": threading.Lock()}
+
+        class DummyRunfolder:
+            def __init__(self, folder_name, timestamp, disk_reservations=None):
+                self.rf_obj = types.SimpleNamespace(runfolder_name=folder_name)
+                self.run_processed = False
+
+            def setoff_workflow(self):
+                with state["lock"]:
+                    state["running"] += 1
+                    state["max_running"] = max(state["max_running"], state["running"])
+                time.sleep(0.05)
+                with state["lock"]:
+                    state["running"] -= 1
+                self.run_processed = True
+
+        DummyRunfolder.state = state
+        return DummyRunfolder
+
+    def test_run_respects_slots(self, dummy_runfolders, dummy_dr_class, monkeypatch):
+        """
+        Test that runfolders are processed concurrently, without exceeding the number of
+        slots, and that results are returned in the order provided
+        """
+        monkeypatch.setattr(demultiplex, "DemultiplexRunfolder", dummy_dr_class)
+        scheduler_obj = demultiplex.DemultiplexScheduler(ad_config.TIMESTAMP, slots=2)
+        dr_objs = scheduler_obj.run(dummy_runfolders)
+        assert [dr_obj.rf_obj.runfolder_name for dr_obj in dr_objs] == dummy_runfolders
+        assert all(dr_obj.run_processed for dr_obj in dr_objs)
+        assert dummy_dr_class.state["max_running"] == 2
+        assert sum(stats["runfolders"] for stats in scheduler_obj.slot_stats.values()) == len(
+            dummy_runfolders
+        )
+
+    def test_run_exit_propagates(self, dummy_runfolders, dummy_dr_class, monkeypatch):
+        """
+        Test that a runfolder exiting the script causes the scheduler to exit
+        """
+        def exit_workflow(self):
+            sys.exit(1)
+
+        monkeypatch.setattr(dummy_dr_class, "setoff_workflow", exit_workflow)
+        monkeypatch.setattr(demultiplex, "DemultiplexRunfolder", dummy_dr_class)
+        scheduler_obj = demultiplex.DemultiplexScheduler(ad_config.TIMESTAMP, slots=2)
+        with pytest.raises(SystemExit) as pytest_wrapped_e:
+            scheduler_obj.run(dummy_runfolders)
+        assert pytest_wrapped_e.value.code == 1
+
+    def test_submit_failure_contained(self, dummy_runfolders, dummy_dr_class, monkeypatch):
+        """
+        Test that in watch mode a runfolder exiting the script or raising an exception does not
+        stop the other runfolders being processed, and that submitted runfolders are released
+        """
+        def failing_workflow(self):
+            if self.rf_obj.runfolder_name == dummy_runfolders[0]:
+                sys.exit(1)
+            if self.rf_obj.runfolder_name == dummy_runfolders[1]:
+                raise ValueError("Unexpected error")
+            self.run_processed = True
+
+        monkeypatch.setattr(dummy_dr_class, "setoff_workflow", failing_workflow)
+        monkeypatch.setattr(demultiplex, "DemultiplexRunfolder", dummy_dr_class)
+        scheduler_obj = demultiplex.DemultiplexScheduler(ad_config.TIMESTAMP, slots=2)
+        scheduler_obj.executor = ThreadPoolExecutor(max_workers=scheduler_obj.slots)
+        processed = []
+        for runfolder_name in dummy_runfolders:
+            scheduler_obj.submit(
+                runfolder_name, lambda dr_obj: processed.append(dr_obj.rf_obj.runfolder_name)
+            )
+        scheduler_obj.executor.shutdown(wait=True)
+        assert sorted(processed) == sorted(dummy_runfolders[2:])
+        assert not scheduler_obj.scheduled
+
+    def test_submit_skips_scheduled(self, dummy_dr_class, monkeypatch):
+        """
+        Test that a runfolder already queued or being processed in watch mode is not
+        submitted again
+        """
+        release = threading.Event()
+
+        def blocking_workflow(self):
+            release.wait(5)
+
+        monkeypatch.setattr(dummy_dr_class, "setoff_workflow", blocking_workflow)
+        monkeypatch.setattr(demultiplex, "DemultiplexRunfolder", dummy_dr_class)
+        scheduler_obj = demultiplex.DemultiplexScheduler(ad_config.TIMESTAMP, slots=2)
+        scheduler_obj.executor = ThreadPoolExecutor(max_workers=scheduler_obj.slots)
+        processed = []
+        for _ in range(3):
+            scheduler_obj.submit("999999_M02631_0000_00000SLOT0", processed.append)
+        release.set()
+        scheduler_obj.executor.shutdown(wait=True)
+        assert len(processed) == 1
+        assert sum(stats["runfolders"] for stats in scheduler_obj.slot_stats.values()) == 1
+
+    def test_submit_batch_does_not_block(self, monkeypatch):
+        """
+        Test that submit_batch() returns without waiting for the batch to be prepared, and that
+        a batch exiting the script does not prevent later batches being prepared
+        """
+        release = threading.Event()
+        prepared = []
+
+        class DummyGetRunfolders:
+            def __init__(self, runfolder_names):
+                self.runfolder_names = runfolder_names
+
+            def setoff_processing(self, scheduler_obj):
+                release.wait(5)
+                if self.runfolder_names == ["exit"]:
+                    sys.exit(1)
+                prepared.append(self.runfolder_names)
+
+        monkeypatch.setattr(demultiplex, "GetRunfolders", DummyGetRunfolders)
+        scheduler_obj = demultiplex.DemultiplexScheduler(ad_config.TIMESTAMP, slots=2)
+        scheduler_obj.submit_batch(["exit"])
+        scheduler_obj.submit_batch(["999999_M02631_0000_00000SLOT0"])
+        assert not prepared  # Caller not blocked while the batches wait
+        release.set()
+        scheduler_obj.batch_executor.shutdown(wait=True)
+        scheduler_obj.executor.shutdown(wait=True)
+        assert prepared == [["999999_M02631_0000_00000SLOT0"]]
+
+
+class TestSamplesheetCheckStage(object):
+    """
+    Test SamplesheetCheckStage class
+    """
+
+    @pytest.fixture(scope="function")
+    def dummy_rf_class(self, tmp_path):
+        """
+        Stand-in for RunfolderObject, with the runfolder and SampleSheet in a temporary
+        directory. It has no runfolder loggers, as the result is only written to the flag file
+        and the script logfile
+        """
+
+        class DummyRunfolderObject:
+            def __init__(self, runfolder_name, timestamp):
+                self.runfolder_name = runfolder_name
+                self.sequencer_type = "miseq"
+                runfolderpath = tmp_path / runfolder_name
+                runfolderpath.mkdir(exist_ok=True)
+                self.samplesheet_path = str(tmp_path / f"{runfolder_name}_SampleSheet.csv")
+                self.samplesheet_validator_logfile = str(tmp_path / "ss_validator.log")
+                self.initial_sscheck_flagfile_path = str(
+                    runfolderpath / ad_config.FLAG_FILES["initial_sscheck_flag"]
+                )
+                self.demultiplexlog_file = str(
+                    runfolderpath / ad_config.FLAG_FILES["bclconvertlog"]
+                )
+                self.upload_flagfile = str(
+                    runfolderpath / ad_config.FLAG_FILES["upload_started"]
+                )
+
+        return DummyRunfolderObject
+
+    @pytest.fixture(scope="function")
+    def sscheck_stage(self, dummy_rf_class, tmp_path, monkeypatch, temp_state_index):
+        """
+        SamplesheetCheckStage using the dummy RunfolderObject, temporary validation cache and
+        state index, and a thread pool (so that the stand-in SampleSheet check is used). The
+        stand-in check records the SampleSheets checked, and fails runfolders named INVALID
+        """
+        checked = []
+
+        def dummy_check_samplesheet(samplesheet_path, logdir, sequenced_on_illumina, runfolder_name):
+            checked.append(runfolder_name)
+            if "INVALID" in runfolder_name:
+                return False, False, "Invalid sample name"
+            return True, False, ""
+
+        def thread_pool(max_workers, mp_context):
+            return demultiplex.ThreadPoolExecutor(max_workers=max_workers)
+
+        ss_cache_class = toolbox.SamplesheetValidationCache
+        monkeypatch.setattr(demultiplex, "RunfolderObject", dummy_rf_class)
+        monkeypatch.setattr(demultiplex, "check_samplesheet", dummy_check_samplesheet)
+        monkeypatch.setattr(demultiplex, "ProcessPoolExecutor", thread_pool)
+        monkeypatch.setattr(demultiplex, "version", lambda package: "1.4.0")
+        monkeypatch.setattr(
+            demultiplex,
+            "SamplesheetValidationCache",
+            lambda: ss_cache_class(str(tmp_path / "ss_cache.sqlite3")),
+        )
+        sscheck_stage = demultiplex.SamplesheetCheckStage(ad_config.TIMESTAMP, processes=2)
+        sscheck_stage.checked = checked
+        return sscheck_stage
+
+    def write_samplesheets(self, tmp_path, runfolder_names):
+        """
+        Write a SampleSheet for each runfolder
+        """
+        for runfolder_name in runfolder_names:
+            (tmp_path / f"{runfolder_name}_SampleSheet.csv").write_text(
+                f"[Data]\nSample_ID,Sample_Name\n{runfolder_name}\n"
+            )
+
+    def test_pending_samplesheets_checked(self, sscheck_stage, tmp_path):
+        """
+        Test that only runfolders with a SampleSheet and no initial SampleSheet check flag
+        file are checked, that the flag files are written and the failed runfolders returned
+        """
+        runfolder_names = [
+            "999999_M02631_0000_0000VALID1",
+            "999999_M02631_0000_000INVALID",
+            "999999_M02631_0000_0000CHECKED",
+            "999999_M02631_0000_000NOSHEET",
+        ]
+        self.write_samplesheets(tmp_path, runfolder_names[:3])
+        (tmp_path / runfolder_names[2]).mkdir()
+        (tmp_path / runfolder_names[2] / ad_config.FLAG_FILES["initial_sscheck_flag"]).write_text(
+            "previous check\n"
+        )
+        assert sscheck_stage.run(runfolder_names) == ["999999_M02631_0000_000INVALID"]
+        assert sorted(sscheck_stage.checked) == sorted(runfolder_names[:2])
+        flag_file = ad_config.FLAG_FILES["initial_sscheck_flag"]
+        assert "Invalid sample name" in (tmp_path / runfolder_names[1] / flag_file).read_text()
+        assert (tmp_path / runfolder_names[0] / flag_file).read_text().startswith(
+            ad_config.DemultiplexConfig.STRINGS["samplesheet_success"].split(":")[0]
+        )
+        assert (tmp_path / runfolder_names[2] / flag_file).read_text() == "previous check\n"
+        assert not (tmp_path / runfolder_names[3] / flag_file).exists()
+
+    def test_unchanged_samplesheet_cached(self, sscheck_stage, tmp_path):
+        """
+        Test that an unchanged SampleSheet is not checked again when its flag file is removed
+        """
+        runfolder_names = ["999999_M02631_0000_000INVALID"]
+        self.write_samplesheets(tmp_path, runfolder_names)
+        assert sscheck_stage.run(runfolder_names) == runfolder_names
+        os.remove(tmp_path / runfolder_names[0] / ad_config.FLAG_FILES["initial_sscheck_flag"])
+        assert sscheck_stage.run(runfolder_names) == runfolder_names
+        assert sscheck_stage.checked == runfolder_names
+
+
+class TestRunfolderWatcher(object):
+    """
+    Test RunfolderWatcher class
+    """
+
+    @pytest.fixture(scope="function")
+    def watch_dirs(self, tmp_path, monkeypatch):
+        """
+        Create temporary runfolder and SampleSheet directories containing a single runfolder,
+        and point the watcher configuration at them
+        """
+        samplesheet_dir = tmp_path / "samplesheets"
+        aviti_dir = tmp_path / ad_config.AVITI_ID
+        runfolder_path = tmp_path / "999999_M02631_0000_00000WATCH"
+        for path in [samplesheet_dir, aviti_dir, runfolder_path]:
+            path.mkdir()
+        for attribute, value in {
+            "RUNFOLDERS": str(tmp_path),
+            "AVITI_RUNFOLDER": str(aviti_dir),
+            "SAMPLESHEETS_DIR": str(samplesheet_dir),
+            "AVITI_SAMPLESHEET": str(samplesheet_dir),
+        }.items():
+            monkeypatch.setattr(demultiplex.DemultiplexConfig, attribute, value)
+        return samplesheet_dir, runfolder_path
+
+    def test_poll_flag_files(self, watch_dirs):
+        """
+        Test that polling returns runfolders whose sequencing complete file or SampleSheet has
+        been written, or whose demultiplex log has been removed, and nothing on the first poll
+        """
+        samplesheet_dir, runfolder_path = watch_dirs
+        demultiplex_log = runfolder_path / ad_config.FLAG_FILES["bclconvertlog"]
+        demultiplex_log.write_text("")
+        watcher = demultiplex.RunfolderWatcher(poll=True)
+        assert watcher.inotify_fd is None
+        assert watcher.poll_flag_files() == set()
+        assert watcher.poll_flag_files() == set()
+        (runfolder_path / ad_config.FLAG_FILES["illumina_seq_complete"]).write_text("")
+        assert watcher.poll_flag_files() == {runfolder_path.name}
+        (samplesheet_dir / f"{runfolder_path.name}_SampleSheet.csv").write_text("")
+        assert watcher.poll_flag_files() == {runfolder_path.name}
+        demultiplex_log.unlink()
+        assert watcher.poll_flag_files() == {runfolder_path.name}
+        assert watcher.poll_flag_files() == set()
+
+    def test_uploaded_runfolders_ignored(self, watch_dirs):
+        """
+        Test that runfolders containing the upload flag file are not watched
+        """
+        _, runfolder_path = watch_dirs
+        (runfolder_path / ad_config.FLAG_FILES["upload_started"]).write_text("")
+        watcher = demultiplex.RunfolderWatcher(poll=True)
+        assert watcher.get_runfolders() == {}
+
+    def test_handle_event(self, watch_dirs):
+        """
+        Test that inotify events on ready / reset files return the runfolder, and that
+        writes to other files, and the creation of reset files, do not
+        """
+        _, runfolder_path = watch_dirs
+        watcher = demultiplex.RunfolderWatcher(poll=True)
+        ready_file = ad_config.FLAG_FILES["illumina_seq_complete"]
+        reset_file = ad_config.FLAG_FILES["sscheck_flag"]
+        assert watcher.handle_event(
+            str(runfolder_path), demultiplex.IN_CLOSE_WRITE, ready_file
+        ) == [runfolder_path.name]
+        assert watcher.handle_event(
+            str(runfolder_path), demultiplex.IN_DELETE, reset_file
+        ) == [runfolder_path.name]
+        assert not watcher.handle_event(
+            str(runfolder_path), demultiplex.IN_CLOSE_WRITE, reset_file
+        )
+        assert not watcher.handle_event(
+            str(runfolder_path), demultiplex.IN_CLOSE_WRITE, "RunInfo.xml"
+        )
+
+
 class TestDemultiplexRunfolder(object):
     """
     Test DemultiplexRunfolder class
@@ -787,13 +1138,1013 @@ class TestDemultiplexRunfolder(object):
 
     def test_calculate_cluster_density_fail(self, demultiplexing_notrequired):
         """
-        Test calculate_cluster_density() returns None for runfolders where RunInfo.xml
+        Test calculate_cluster_density() returns False for runfolders where RunInfo.xml
         file is not present
         """
         for runfolder in demultiplexing_notrequired:
             dr_obj = get_dr_obj(runfolder)
-            with pytest.raises(SystemExit) as pytest_wrapped_e:
-                dr_obj.calculate_cluster_density()
-                ad_logger.shutdown_logs(dr_obj.demux_rf_logger)
-                assert pytest_wrapped_e.type == SystemExit
-                assert pytest_wrapped_e.value.code == 1
+            assert dr_obj.calculate_cluster_density() is False
+            ad_logger.shutdown_logs(dr_obj.demux_rf_logger)
+
+    def test_start_cluster_density(self, demultiplexing_required, monkeypatch):
+        """
+        Test start_cluster_density() runs the cluster density calculation in the background
+        and cluster_density_complete() waits for it to finish
+        """
+        events = {}
+
+        def calculate_cluster_density(self):
+            events["started"].set()
+            events["release"].wait(5)
+            return True
+
+        monkeypatch.setattr(
+            demultiplex.DemultiplexRunfolder, "calculate_cluster_density", calculate_cluster_density
+        )
+        for runfolder in demultiplexing_required:
+            events["started"] = threading.Event()
+            events["release"] = threading.Event()
+            dr_obj = get_dr_obj(runfolder)
+            dr_obj.start_cluster_density()
+            assert events["started"].wait(5)
+            assert not dr_obj.cluster_density_job.done()  # Not blocking the caller
+            events["release"].set()
+            assert dr_obj.cluster_density_complete()
+            ad_logger.shutdown_logs(dr_obj.demux_rf_logger)
+
+    def test_cd_success_statement_absent(self, demultiplexing_required, monkeypatch):
+        """
+        Test calculate_cluster_density() returns False if the command exits successfully but
+        the success statement is not in its output (stderr alone is not success)
+        """
+        monkeypatch.setattr(ad_config.DemultiplexConfig, "CLUSTER_DENSITY_ENGINE", "gatk")
+        monkeypatch.setattr(
+            demultiplex,
+            "execute_subprocess_command",
+            lambda cmd, logger: ("", "Picked up _JAVA_OPTIONS", 0),
+        )
+        for runfolder in demultiplexing_required:
+            dr_obj = get_dr_obj(runfolder)
+            assert dr_obj.calculate_cluster_density() is False
+            ad_logger.shutdown_logs(dr_obj.demux_rf_logger)
+
+    @pytest.mark.parametrize("result", [False, None])
+    def test_cluster_density_complete_fail(self, demultiplexing_required, result):
+        """
+        Test cluster_density_complete() writes the cluster density failed flag file, and keeps
+        the demultiplex log file, if the background cluster density calculation did not succeed
+        """
+        for runfolder in demultiplexing_required:
+            dr_obj = get_dr_obj(runfolder)
+            dr_obj.cluster_density_job = Future()
+            dr_obj.cluster_density_job.set_result(result)
+            open(dr_obj.rf_obj.demultiplexlog_file, "w").close()
+            try:
+                assert not dr_obj.cluster_density_complete()
+                assert os.path.exists(dr_obj.rf_obj.demultiplexlog_file)
+                assert dr_obj.cluster_density_failed()
+            finally:
+                os.remove(dr_obj.rf_obj.demultiplexlog_file)
+                if os.path.exists(dr_obj.rf_obj.cd_failed_flagfile):
+                    os.remove(dr_obj.rf_obj.cd_failed_flagfile)
+            ad_logger.shutdown_logs(dr_obj.demux_rf_logger)
+
+    def test_demultiplexing_failed_waits_for_cd(self, demultiplexing_required, monkeypatch):
+        """
+        Test run_demultiplexing() waits for the background cluster density calculation to finish
+        before exiting the script when demultiplexing fails
+        """
+
+        def calculate_cluster_density(self):
+            time.sleep(0.2)
+            return True
+
+        class FailedLaneShards:
+            def run(self):
+                return "", "bclconvert failed", 1
+
+        monkeypatch.setattr(
+            demultiplex.DemultiplexRunfolder, "calculate_cluster_density", calculate_cluster_density
+        )
+        monkeypatch.setattr(
+            demultiplex.DemultiplexRunfolder, "get_lane_shards", lambda self: FailedLaneShards()
+        )
+        for runfolder in demultiplexing_required:
+            dr_obj = get_dr_obj(runfolder)
+            dr_obj.start_cluster_density()
+            with pytest.raises(SystemExit):
+                dr_obj.run_demultiplexing()
+            assert dr_obj.cluster_density_job.done()
+            ad_logger.shutdown_logs(dr_obj.demux_rf_logger)
+
+    def test_rerun_cluster_density(self, demultiplexing_required, monkeypatch):
+        """
+        Test setoff_workflow() only re-runs the cluster density calculation for a run where it
+        failed after demultiplexing, removing the flag file once it succeeds
+        """
+        results = []
+
+        def calculate_cluster_density(self):
+            return results.pop(0)
+
+        def demultiplex_again(self):
+            raise AssertionError("Run demultiplexed again")
+
+        monkeypatch.setattr(
+            demultiplex.DemultiplexRunfolder, "calculate_cluster_density", calculate_cluster_density
+        )
+        monkeypatch.setattr(
+            demultiplex.DemultiplexRunfolder, "demultiplexing_required", demultiplex_again
+        )
+        for runfolder in demultiplexing_required:
+            results.extend([False, True])
+            dr_obj = get_dr_obj(runfolder)
+            open(dr_obj.rf_obj.cd_failed_flagfile, "w").close()
+            try:
+                assert not dr_obj.setoff_workflow()  # Calculation fails again
+                assert os.path.exists(dr_obj.rf_obj.cd_failed_flagfile)
+                assert dr_obj.setoff_workflow()
+                assert dr_obj.run_processed
+                assert not os.path.exists(dr_obj.rf_obj.cd_failed_flagfile)
+            finally:
+                if os.path.exists(dr_obj.rf_obj.cd_failed_flagfile):
+                    os.remove(dr_obj.rf_obj.cd_failed_flagfile)
+            ad_logger.shutdown_logs(dr_obj.demux_rf_logger)
+
+
+RUNINFO_XML = """<?xml version="1.0"?>
+<RunInfo><Run><Reads>
+<Read Number="1" NumCycles="151" IsIndexedRead="N"/>
+<Read Number="2" NumCycles="8" IsIndexedRead="Y"/>
+<Read Number="3" NumCycles="8" IsIndexedRead="Y"/>
+<Read Number="4" NumCycles="151" IsIndexedRead="N"/>
+</Reads></Run></RunInfo>
+"""
+
+
+def metrics_rows(metrics_file: str) -> list:
+    """
+    Return the lines of a metrics file following the headers (the metrics class, column names
+    and metrics rows)
+    """
+    with open(metrics_file, "r") as file:
+        contents = file.read()
+    return contents.split("\n## METRICS CLASS", 1)[1].strip().split("\n")
+
+
+class TestInterOpMetrics(object):
+    """
+    Tests for the InterOpMetrics class
+    """
+
+    @pytest.fixture(scope="function")
+    def interop_runfolder(self, tmp_path):
+        """
+        Return the path to a runfolder containing RunInfo.xml and a TileMetricsOut.bin (v2) with
+        two lanes of three tiles
+        """
+        (tmp_path / "InterOp").mkdir()
+        (tmp_path / "RunInfo.xml").write_text(RUNINFO_XML)
+        records = b""
+        for lane in (1, 2):
+            for tile, density, clusters, phasing in [
+                (1101, 250000.0, 125000.0, 0.001),
+                (1102, 250000.0, 250000.0, 0.002),
+                (1103, 250000.0, 375000.0, 0.004),
+            ]:
+                for code, value in [
+                    (100, density * lane),
+                    (102, clusters),
+                    (200, phasing),  # Read 1 phasing
+                    (201, phasing / 2),  # Read 1 prephasing
+                    (206, phasing * 2),  # Read 4 phasing
+                    (207, phasing),  # Read 4 prephasing
+                    (102, clusters),  # Repeated records are superseded
+                ]:
+                    records += struct.pack("<HHHf", lane, tile, code, value)
+        (tmp_path / "InterOp" / "TileMetricsOut.bin").write_bytes(bytes([2, 10]) + records)
+        return str(tmp_path)
+
+    def test_cluster_count(self, interop_runfolder):
+        """
+        Test that the total cluster count of all lanes / tiles is returned, using the last
+        value of repeated records
+        """
+        assert interop_metrics.InterOpMetrics(
+            interop_runfolder, "999999_M02631_0000_00000TEST"
+        ).get_cluster_count() == 1500000
+
+    def test_lane_metrics(self, interop_runfolder):
+        """
+        Test the cluster density of each lane is the total clusters over the total tile area
+        """
+        interop_metrics.InterOpMetrics(interop_runfolder, "TEST_RUN").write_metrics()
+        assert metrics_rows(
+            os.path.join(interop_runfolder, "TEST_RUN.illumina_lane_metrics")
+        ) == [
+            "picard.illumina.IlluminaLaneMetrics",
+            "CLUSTER_DENSITY\tLANE",
+            "250000\t1",
+            "500000\t2",
+        ]
+
+    def test_phasing_metrics(self, interop_runfolder):
+        """
+        Test the phasing / prephasing of each template read is the median across tiles, as a
+        percentage
+        """
+        interop_metrics.InterOpMetrics(interop_runfolder, "TEST_RUN").write_metrics()
+        assert metrics_rows(
+            os.path.join(interop_runfolder, "TEST_RUN.illumina_phasing_metrics")
+        )[2:4] == [
+            "1\tFIRST\t0.2\t0.1",
+            "1\tSECOND\t0.4\t0.2",
+        ]
+
+    def test_novaseq_metrics(self, interop_runfolder):
+        """
+        Test NovaSeq runs (TileMetricsOut.bin v3), where the cluster density is calculated from
+        the tile area and the phasing is read from EmpiricalPhasingMetricsOut.bin at cycle 25
+        of each template read
+        """
+        interop_dir = os.path.join(interop_runfolder, "InterOp")
+        with open(os.path.join(interop_dir, "TileMetricsOut.bin"), "wb") as file:
+            file.write(bytes([3, 15]) + struct.pack("<f", 0.5))
+            for tile in (1101, 1102):
+                file.write(struct.pack("<HIBff", 1, tile, ord("t"), 1000000.0, 0.0))
+                file.write(struct.pack("<HIBff", 1, tile, ord("p"), 800000.0, 0.0))
+        with open(os.path.join(interop_dir, "EmpiricalPhasingMetricsOut.bin"), "wb") as file:
+            file.write(bytes([1, 16]))
+            for tile in (1101, 1102):
+                for cycle, phasing in [(24, 0.5), (25, 0.125), (192, 0.25)]:
+                    file.write(struct.pack("<HIHff", 1, tile, cycle, phasing, 0.0625))
+        interop_metrics.InterOpMetrics(interop_runfolder, "TEST_RUN", True).write_metrics()
+        assert metrics_rows(
+            os.path.join(interop_runfolder, "TEST_RUN.illumina_lane_metrics")
+        )[2:] == ["2000000\t1"]
+        assert metrics_rows(
+            os.path.join(interop_runfolder, "TEST_RUN.illumina_phasing_metrics")
+        )[2:] == ["1\tFIRST\t0.125\t0.0625", "1\tSECOND\t0.25\t0.0625"]
+
+    @pytest.mark.skipif(shutil.which("docker") is None, reason="Requires docker")
+    def test_matches_gatk(self):
+        """
+        Test that the metric rows written by the native calculation are identical to those
+        written by GATK CollectIlluminaLaneMetrics on the InterOp test fixtures (NovaSeq
+        runfolders, so the NovaSeq option is passed to both, as in production). The header
+        lines differ so are not compared
+        """
+        for runfolder in [
+            "999999_A01229_0000_00000TEST7",
+            "999999_A01229_0000_00000TEST9",
+            "999999_A01229_0000_0000TEST11",
+        ]:
+            runfolderpath = os.path.join(conftest.temp_runfolderdir, runfolder)
+            subprocess.run(
+                ad_config.DemultiplexConfig.CD_CMD % (
+                    os.getuid(), os.getgid(), runfolderpath, "GATK"
+                ) + " --IS_NOVASEQ",
+                shell=True,
+                check=True,
+            )
+            interop_metrics.InterOpMetrics(
+                runfolderpath, "NATIVE", is_novaseq=True
+            ).write_metrics()
+            for suffix in [".illumina_lane_metrics", ".illumina_phasing_metrics"]:
+                assert metrics_rows(
+                    os.path.join(runfolderpath, f"NATIVE{suffix}")
+                ) == metrics_rows(os.path.join(runfolderpath, f"GATK{suffix}"))
+
+
+class TestChecksumVerifier(object):
+    """
+    Tests for the ChecksumVerifier class
+    """
+
+    @pytest.fixture(scope="function")
+    def ic_runfolder(self, tmp_path, monkeypatch, temp_state_index):
+        """
+        Return the path to a runfolder containing data files and a sequencer md5 checksums file
+        (Windows paths), using a temporary checksum cache and state index
+        """
+        runfolder = tmp_path / "999999_A01229_0000_000000TEST"
+        (runfolder / "Data" / "Intensities").mkdir(parents=True)
+        files = {
+            "RunInfo.xml": b"<RunInfo/>",
+            "Data/Intensities/L001.cbcl": os.urandom(3 * 1024**2),
+        }
+        lines = []
+        for relative_path, contents in files.items():
+            (runfolder / relative_path).write_bytes(contents)
+            windows_path = relative_path.replace("/", "\\")
+            lines.append(f"{checksum_verifier.hashlib.md5(contents).hexdigest()} *{windows_path}")
+        (runfolder / ad_config.DemultiplexConfig.CHECKSUM_EXPECTED_FILE).write_text(
+            "\n".join(lines) + "\n"
+        )
+        cache_class = toolbox.ChecksumCache
+        monkeypatch.setattr(
+            checksum_verifier,
+            "ChecksumCache",
+            lambda: cache_class(str(tmp_path / "checksum_cache.sqlite3")),
+        )
+        return str(runfolder)
+
+    def read_checksumfile(self, runfolder):
+        """
+        Return the lines of the md5checksum file
+        """
+        with open(os.path.join(runfolder, ad_config.FLAG_FILES["md5checksum"])) as checksumfile:
+            return checksumfile.read().splitlines()
+
+    def test_checksums_match(self, ic_runfolder, temp_logger):
+        """
+        Test that no result is written during sequencing, and the checksums match message is
+        written once sequencing is complete
+        """
+        verifier = checksum_verifier.ChecksumVerifier(ic_runfolder, temp_logger, threads=2)
+        assert verifier.verify(sequencing_complete=False) is None
+        assert not os.path.exists(os.path.join(ic_runfolder, ad_config.FLAG_FILES["md5checksum"]))
+        assert verifier.verify(sequencing_complete=True)
+        assert self.read_checksumfile(ic_runfolder)[0].startswith(
+            ad_config.DemultiplexConfig.STRINGS["checksums_match"]
+        )
+
+    @pytest.mark.parametrize("contents", ["", "Checksums for run\nnot-an-md5 *RunInfo.xml\n"])
+    def test_expected_file_empty(self, ic_runfolder, temp_logger, contents):
+        """
+        Test that no result is written if the sequencer md5 checksums file contains no
+        checksums (empty, or partly written), as if the file were absent
+        """
+        with open(
+            os.path.join(ic_runfolder, ad_config.DemultiplexConfig.CHECKSUM_EXPECTED_FILE), "w"
+        ) as expected_file:
+            expected_file.write(contents)
+        verifier = checksum_verifier.ChecksumVerifier(ic_runfolder, temp_logger)
+        assert verifier.verify(sequencing_complete=True) is None
+        assert not os.path.exists(os.path.join(ic_runfolder, ad_config.FLAG_FILES["md5checksum"]))
+
+    def test_incremental_files_cached(self, ic_runfolder, temp_logger, monkeypatch):
+        """
+        Test that settled files hashed during sequencing are not hashed again
+        """
+        monkeypatch.setattr(ad_config.DemultiplexConfig, "CHECKSUM_SETTLE_SECONDS", -60)
+        verifier = checksum_verifier.ChecksumVerifier(ic_runfolder, temp_logger)
+        verifier.verify(sequencing_complete=False)
+        hashed = []
+        md5_file = checksum_verifier.md5_file
+        monkeypatch.setattr(
+            checksum_verifier,
+            "md5_file",
+            lambda file_path: hashed.append(file_path) or md5_file(file_path),
+        )
+        assert verifier.verify(sequencing_complete=True)
+        assert hashed == []
+
+    def test_checksums_do_not_match(self, ic_runfolder, temp_logger):
+        """
+        Test that a corrupted file and a missing file are reported with the checksums do not
+        match message
+        """
+        with open(os.path.join(ic_runfolder, "Data/Intensities/L001.cbcl"), "r+b") as cbcl:
+            cbcl.seek(1024**2)
+            cbcl.write(b"\0")
+        os.remove(os.path.join(ic_runfolder, "RunInfo.xml"))
+        verifier = checksum_verifier.ChecksumVerifier(ic_runfolder, temp_logger)
+        assert verifier.verify(sequencing_complete=True) is False
+        lines = self.read_checksumfile(ic_runfolder)
+        assert lines[0].startswith(ad_config.DemultiplexConfig.STRINGS["checksums_do_not_match"])
+        assert lines[1].startswith("Data/Intensities/L001.cbcl: expected")
+        assert lines[2] == "RunInfo.xml: missing"
+
+
+class TestBclconvertLaneShards(object):
+    """
+    Tests for the BclconvertLaneShards class
+    """
+
+    @pytest.fixture(scope="function")
+    def lane_rf_obj(self, make_rf_obj, tmp_path):
+        """
+        Stand-in RunfolderObject for a two lane runfolder
+        """
+        runfolderpath = tmp_path / "999999_A01229_0000_000000TEST"
+        rf_obj = make_rf_obj(
+            runfolderpath.name,
+            fastq_dir_path=str(runfolderpath / "Data" / "Intensities" / "BaseCalls"),
+            demultiplexlog_file=str(runfolderpath / ad_config.FLAG_FILES["bclconvertlog"]),
+        )
+        (runfolderpath / "RunInfo.xml").write_text(
+            '<RunInfo><Run><FlowcellLayout LaneCount="2"/></Run></RunInfo>'
+        )
+        return rf_obj
+
+    @pytest.fixture(scope="function")
+    def dummy_bclconvert(self, monkeypatch):
+        """
+        Stand-in for running a bclconvert lane, writing lane-split fastqs, Reports and a log to
+        the lane directory. Records the lanes run, and fails the lanes in fail_lanes. The
+        mounted output and log directories must already exist, as docker would otherwise create
+        them owned by root
+        """
+        state = {"lanes_run": [], "fail_lanes": []}
+
+        def run_bclconvert(command, logger, output_logger=None, progress=None):
+            lane = int(command.split("--bcl-only-lane ")[1].split()[0])
+            state["lanes_run"].append(lane)
+            if lane in state["fail_lanes"]:
+                return "", "lane failed", 1
+            output_dir = command.split(" -v ")[2].split(":")[0]
+            log_dir = command.split(" -v ")[3].split(":")[0]
+            assert os.path.isdir(output_dir) and os.path.isdir(log_dir)
+            os.makedirs(os.path.join(output_dir, "Reports"), exist_ok=True)
+            for sample in ("Sample1_S1", "Undetermined_S0"):
+                for read in ("R1", "R2"):
+                    with gzip.open(
+                        os.path.join(output_dir, f"{sample}_L00{lane}_{read}_001.fastq.gz"), "wt"
+                    ) as fastq:
+                        fastq.write(f"@{sample}:{lane}:{read}\nACGT\n+\nFFFF\n")
+            with open(os.path.join(output_dir, "Reports", "Demultiplex_Stats.csv"), "w") as stats:
+                stats.write(f"Lane,SampleID,# Reads\n{lane},Sample1,1\n{lane},Undetermined,1\n")
+            with open(os.path.join(output_dir, "Reports", "fastq_list.csv"), "w") as fastq_list:
+                fastq_list.write(
+                    "RGID,RGSM,Lane,Read1File,Read2File\n"
+                    f"ACGT.{lane},Sample1,{lane},/data/output/Sample1_S1_L00{lane}_R1_001.fastq.gz,"
+                    f"/data/output/Sample1_S1_L00{lane}_R2_001.fastq.gz\n"
+                )
+            with open(os.path.join(output_dir, "Reports", "IndexMetricsOut.bin"), "wb") as index:
+                index.write(bytes([1]) + bytes([lane]) * 4)
+            with open(os.path.join(log_dir, "Info.log"), "w") as log:
+                log.write(f"Lane {lane} {ad_config.ILLUMINA_DEMULTIPLEX_SUCCESS}\n")
+            return "", "", 0
+
+        monkeypatch.setattr(bclconvert_lanes, "stream_subprocess_command", run_bclconvert)
+        return state
+
+    def test_lanes_merged(self, lane_rf_obj, dummy_bclconvert, temp_logger):
+        """
+        Test that each lane is demultiplexed, and the per-lane fastqs and Reports are merged into
+        the names and files written by a single bclconvert run
+        """
+        lane_shards = bclconvert_lanes.BclconvertLaneShards(lane_rf_obj, 1000, temp_logger)
+        assert lane_shards.run() == ("", "", 0)
+        assert sorted(dummy_bclconvert["lanes_run"]) == [1, 2]
+        assert sorted(
+            x for x in os.listdir(lane_rf_obj.fastq_dir_path) if x.endswith("fastq.gz")
+        ) == [
+            "Sample1_S1_R1_001.fastq.gz",
+            "Sample1_S1_R2_001.fastq.gz",
+            "Undetermined_S0_R1_001.fastq.gz",
+            "Undetermined_S0_R2_001.fastq.gz",
+        ]
+        with gzip.open(
+            os.path.join(lane_rf_obj.fastq_dir_path, "Sample1_S1_R1_001.fastq.gz"), "rt"
+        ) as fastq:
+            assert [line for line in fastq if line.startswith("@")] == [
+                "@Sample1_S1:1:R1\n",
+                "@Sample1_S1:2:R1\n",
+            ]
+        reports_dir = os.path.join(lane_rf_obj.fastq_dir_path, "Reports")
+        with open(os.path.join(reports_dir, "Demultiplex_Stats.csv")) as stats:
+            assert [line.split(",")[0] for line in stats] == ["Lane", "1", "1", "2", "2"]
+        with open(os.path.join(reports_dir, "fastq_list.csv")) as fastq_list:
+            rows = fastq_list.read().splitlines()
+        assert rows[1:] == [
+            "ACGT.1,Sample1,1,/data/output/Sample1_S1_R1_001.fastq.gz,"
+            "/data/output/Sample1_S1_R2_001.fastq.gz"
+        ]
+        with open(os.path.join(reports_dir, "IndexMetricsOut.bin"), "rb") as index:
+            assert index.read() == bytes([1]) + bytes([1]) * 4 + bytes([2]) * 4
+        lane_shards.write_demultiplexlog()
+        with open(lane_rf_obj.demultiplexlog_file) as demultiplexlog:
+            assert demultiplexlog.read().count(ad_config.ILLUMINA_DEMULTIPLEX_SUCCESS) == 2
+        lane_shards.remove_lanes()
+        assert not os.path.exists(lane_shards.lanes_dir)
+
+    def test_failed_lane_rerun(self, lane_rf_obj, dummy_bclconvert, temp_logger):
+        """
+        Test that a failed lane returns a non-zero returncode, and that only the failed lane
+        is re-run
+        """
+        dummy_bclconvert["fail_lanes"] = [2]
+        lane_shards = bclconvert_lanes.BclconvertLaneShards(lane_rf_obj, 1000, temp_logger)
+        out, err, returncode = lane_shards.run()
+        assert returncode == 1 and "Lane 2: lane failed" in err
+        assert not os.path.exists(lane_rf_obj.fastq_dir_path)
+        dummy_bclconvert["fail_lanes"] = []
+        dummy_bclconvert["lanes_run"] = []
+        assert lane_shards.run()[2] == 0
+        assert dummy_bclconvert["lanes_run"] == [2]
+
+
+class TestSampleRedemultiplex(object):
+    """
+    Tests for the SampleRedemultiplex class
+    """
+
+    @pytest.fixture(scope="function")
+    def sample_rf_obj(self, make_rf_obj, tmp_path):
+        """
+        Stand-in RunfolderObject for a demultiplexed runfolder with three samples
+        """
+        runfolderpath = tmp_path / "999999_A01229_0000_000000TEST"
+        fastq_dir_path = runfolderpath / "Data" / "Intensities" / "BaseCalls"
+        fastq_dir_path.mkdir(parents=True)
+        samplesheet_path = tmp_path / f"{runfolderpath.name}_SampleSheet.csv"
+        samplesheet_path.write_text(
+            "[Header]\nIEMFileVersion,4\n\n[Data]\nSample_ID,Sample_Name,index\n"
+            "Sample1,Sample1,ACGT\nSample2,Sample2,CGTA\nSample3,Sample3,GTAC\n"
+        )
+        for number, sample in enumerate(("Undetermined", "Sample1", "Sample2", "Sample3")):
+            for read in ("R1", "R2"):
+                (fastq_dir_path / f"{sample}_S{number}_{read}_001.fastq.gz").write_bytes(
+                    b"original"
+                )
+        return make_rf_obj(
+            runfolderpath.name,
+            fastq_dir_path=str(fastq_dir_path),
+            samplesheet_path=str(samplesheet_path),
+        )
+
+    @pytest.fixture(scope="function")
+    def dummy_bclconvert(self, monkeypatch):
+        """
+        Stand-in for running bclconvert, writing the fastqs of the samples in the SampleSheet
+        (numbered by their position in the SampleSheet). Records the SampleSheets used. The
+        mounted output and log directories must already exist, as docker would otherwise create
+        them owned by root
+        """
+        state = {"samplesheets": [], "returncode": 0}
+
+        def run_bclconvert(command, logger, output_logger=None, progress=None):
+            output_dir = command.split(" -v ")[2].split(":")[0]
+            assert os.path.isdir(output_dir)
+            assert os.path.isdir(command.split(" -v ")[3].split(":")[0])
+            samplesheet_dir = command.split(" -v ")[4].split(":")[0]
+            samplesheet_name = command.split("/samplesheet_input/")[1].split()[0]
+            with open(os.path.join(samplesheet_dir, samplesheet_name)) as samplesheet:
+                lines = samplesheet.read().splitlines()
+            state["samplesheets"].append(lines)
+            if state["returncode"]:
+                return "", "bclconvert failed", state["returncode"]
+            samples = lines[lines.index("Sample_ID,Sample_Name,index") + 1:]
+            for number, sample in enumerate(["Undetermined"] + samples):
+                for read in ("R1", "R2"):
+                    with open(
+                        os.path.join(
+                            output_dir, f"{sample.split(',')[0]}_S{number}_{read}_001.fastq.gz"
+                        ),
+                        "wb",
+                    ) as fastq:
+                        fastq.write(b"redemultiplexed")
+            return "", "", 0
+
+        monkeypatch.setattr(sample_redemultiplex, "stream_subprocess_command", run_bclconvert)
+        return state
+
+    def test_sample_fastqs_replaced(self, sample_rf_obj, dummy_bclconvert, temp_logger):
+        """
+        Test that only the samples with invalid fastqs are re-demultiplexed, and that all their
+        fastqs are replaced with their original names
+        """
+        redemultiplex = sample_redemultiplex.SampleRedemultiplex(
+            sample_rf_obj, 1000, temp_logger
+        )
+        assert redemultiplex.run(["Sample3_S3_R2_001.fastq.gz"])
+        assert dummy_bclconvert["samplesheets"][0][-2:] == [
+            "Sample_ID,Sample_Name,index",
+            "Sample3,Sample3,GTAC",
+        ]
+        fastqs = {}
+        for fastq_name in os.listdir(sample_rf_obj.fastq_dir_path):
+            with open(os.path.join(sample_rf_obj.fastq_dir_path, fastq_name), "rb") as fastq:
+                fastqs[fastq_name] = fastq.read()
+        assert len(fastqs) == 8
+        assert fastqs["Sample3_S3_R1_001.fastq.gz"] == b"redemultiplexed"
+        assert fastqs["Sample3_S3_R2_001.fastq.gz"] == b"redemultiplexed"
+        assert fastqs["Sample1_S1_R1_001.fastq.gz"] == b"original"
+        assert not os.path.exists(redemultiplex.samples_dir)
+
+    @pytest.mark.parametrize(
+        "invalid_fastqs",
+        [["Undetermined_S0_R1_001.fastq.gz"], ["Sample4_S4_R1_001.fastq.gz"], ["Sample1.txt"]],
+    )
+    def test_not_possible(self, sample_rf_obj, dummy_bclconvert, temp_logger, invalid_fastqs):
+        """
+        Test that samples are not re-demultiplexed if an invalid fastq does not belong to a
+        SampleSheet sample
+        """
+        assert not sample_redemultiplex.SampleRedemultiplex(
+            sample_rf_obj, 1000, temp_logger
+        ).run(invalid_fastqs)
+        assert not dummy_bclconvert["samplesheets"]
+        assert os.listdir(sample_rf_obj.runfolderpath) == ["Data"]
+
+    def test_failed_bclconvert(self, sample_rf_obj, dummy_bclconvert, temp_logger):
+        """
+        Test that fastqs are not replaced if bclconvert fails
+        """
+        dummy_bclconvert["returncode"] = 1
+        assert not sample_redemultiplex.SampleRedemultiplex(
+            sample_rf_obj, 1000, temp_logger
+        ).run(["Sample1_S1_R1_001.fastq.gz"])
+        with open(
+            os.path.join(sample_rf_obj.fastq_dir_path, "Sample1_S1_R1_001.fastq.gz"), "rb"
+        ) as fastq:
+            assert fastq.read() == b"original"
+
+
+class TestScratchStaging(object):
+    """
+    Tests for the ScratchStaging class
+    """
+
+    @pytest.fixture(scope="function")
+    def staging_rf_obj(self, make_rf_obj, tmp_path, monkeypatch):
+        """
+        Stand-in RunfolderObject for a runfolder with bclconvert inputs and the fastqs and
+        Reports of a previous demultiplex, with STAGING_DIR set to a temporary directory
+        """
+        monkeypatch.setattr(
+            ad_config.DemultiplexConfig, "STAGING_DIR", str(tmp_path / "scratch")
+        )
+        runfolderpath = tmp_path / "999999_A01229_0000_000000TEST"
+        basecalls = runfolderpath / "Data" / "Intensities" / "BaseCalls"
+        (basecalls / "L001").mkdir(parents=True)
+        (basecalls / "Reports").mkdir()
+        (runfolderpath / "InterOp").mkdir()
+        (runfolderpath / "RunInfo.xml").write_text("<RunInfo/>")
+        (runfolderpath / "InterOp" / "TileMetricsOut.bin").write_bytes(b"\x02" * 10)
+        (basecalls / "L001" / "L001_1.cbcl").write_bytes(b"\x01" * 100)
+        (basecalls / "Reports" / "Demultiplex_Stats.csv").write_text("old")
+        (basecalls / "Sample1_S1_R1_001.fastq.gz").write_bytes(b"old")
+        return make_rf_obj(runfolderpath.name, fastq_dir_path=str(basecalls))
+
+    def test_stage_and_move(self, staging_rf_obj, temp_logger, caplog):
+        """
+        Test that only the bclconvert inputs are staged (not previous outputs), that unchanged
+        staged inputs are not copied again, and that outputs are moved into the fastq directory
+        """
+        staging = scratch_staging.ScratchStaging(staging_rf_obj, temp_logger, threads=2)
+        assert staging.stage_inputs()
+        assert sorted(staging.get_input_files()) == [
+            "Data/Intensities/BaseCalls/L001/L001_1.cbcl",
+            "InterOp/TileMetricsOut.bin",
+            "RunInfo.xml",
+        ]
+        assert os.path.isfile(
+            os.path.join(staging.input_path, "Data/Intensities/BaseCalls/L001/L001_1.cbcl")
+        )
+        assert "3 files copied" in caplog.text
+        assert staging.copy_file(
+            os.path.join(staging_rf_obj.runfolderpath, "RunInfo.xml"),
+            os.path.join(staging.input_path, "RunInfo.xml"),
+        ) == 0
+        os.makedirs(os.path.join(staging.output_path, "Reports"))
+        output_fastq = os.path.join(staging.output_path, "Sample1_S1_R1_001.fastq.gz")
+        with open(output_fastq, "wb") as fastq:
+            fastq.write(b"new")
+        output_stats = os.path.join(staging.output_path, "Reports", "Demultiplex_Stats.csv")
+        with open(output_stats, "w") as stats:
+            stats.write("new")
+        staging.move_outputs()
+        fastq_dir_path = staging_rf_obj.fastq_dir_path
+        with open(os.path.join(fastq_dir_path, "Sample1_S1_R1_001.fastq.gz"), "rb") as fastq:
+            assert fastq.read() == b"new"
+        with open(os.path.join(fastq_dir_path, "Reports", "Demultiplex_Stats.csv")) as stats:
+            assert stats.read() == "new"
+        assert not any(name.endswith(".staging.tmp") for name in os.listdir(fastq_dir_path))
+        staging.remove()
+        assert not os.path.exists(staging.staging_path)
+
+    def test_insufficient_space(self, staging_rf_obj, temp_logger, monkeypatch):
+        """
+        Test that the runfolder is not staged if the scratch directory has insufficient space
+        """
+        monkeypatch.setattr(ad_config.DemultiplexConfig, "STAGING_SPACE_FACTOR", 1e15)
+        staging = scratch_staging.ScratchStaging(staging_rf_obj, temp_logger)
+        assert not staging.stage_inputs()
+        assert not os.path.exists(staging.input_path)
+
+
+class TestThreadTuning(object):
+    """
+    Tests for the ThreadBenchmark class and thread layout functions
+    """
+
+    @pytest.fixture(scope="function")
+    def layout_store(self, tmp_path, monkeypatch):
+        """
+        Use a temporary thread layout store
+        """
+        monkeypatch.setattr(ad_config.ToolboxConfig, "AD_LOGDIR", str(tmp_path))
+        return toolbox.ThreadLayoutStore()
+
+    @pytest.fixture(scope="function")
+    def tuning_rf_obj(self, make_rf_obj):
+        """
+        Stand-in RunfolderObject for a NovaSeq runfolder
+        """
+        return make_rf_obj()
+
+    def test_no_layout(self, layout_store):
+        """
+        Test that no thread options are added if no layout has been benchmarked
+        """
+        assert thread_tuning.get_thread_counts(ad_config.NOVASEQ_ID, 8) is None
+        assert thread_tuning.format_thread_options(None) == ""
+
+    def test_layout_scaled(self, layout_store):
+        """
+        Test that the stored layout is scaled to the container CPU budget
+        """
+        layout_store.record_layout(
+            "bclconvert",
+            ad_config.NOVASEQ_ID,
+            {"--bcl-num-conversion-threads": 1.0, "--bcl-num-decompression-threads": 0.25},
+            16,
+            60.0,
+        )
+        thread_counts = thread_tuning.get_thread_counts(ad_config.NOVASEQ_ID, 2)
+        assert thread_counts == {
+            "--bcl-num-conversion-threads": 2,
+            "--bcl-num-decompression-threads": 1,
+        }
+        assert thread_tuning.format_thread_options(thread_counts) == (
+            " --bcl-num-conversion-threads 2 --bcl-num-decompression-threads 1"
+        )
+        assert thread_tuning.get_thread_counts(ad_config.AVITI_ID, 2) is None
+
+    def test_benchmark_stores_fastest(
+        self, layout_store, tuning_rf_obj, temp_logger, monkeypatch
+    ):
+        """
+        Test that each layout is run on the tile subset, the fastest layout is stored, and
+        failed layouts are ignored
+        """
+        commands = []
+
+        def run_command(command, logger):
+            commands.append(command)
+            assert all(  # Output and log directory mounts
+                os.path.isdir(mount.split(":")[0]) for mount in command.split(" -v ")[2:4]
+            )
+            threads = int(command.split("--bcl-num-conversion-threads ")[1].split()[0])
+            if threads == 2:
+                return "", "failed", 1
+            time.sleep(0.02 * (10 - threads))
+            return "", "", 0
+
+        monkeypatch.setattr(thread_tuning, "execute_subprocess_command", run_command)
+        fastest = thread_tuning.ThreadBenchmark(tuning_rf_obj, 1000, temp_logger, cpus=4).run()
+        layouts = ad_config.DemultiplexConfig.THREAD_BENCHMARK_LAYOUTS["bclconvert"]
+        assert len(commands) == len(layouts) + 1  # Including untimed warm-up
+        assert all("--first-tile-only true" in command for command in commands)
+        assert fastest == max(layouts, key=lambda layout: layout["--bcl-num-conversion-threads"])
+        assert layout_store.get_layout("bclconvert", ad_config.NOVASEQ_ID) == fastest
+        assert os.listdir(tuning_rf_obj.runfolderpath) == []
+
+
+    @pytest.mark.parametrize(
+        "sequencer_type, mount_dirs",
+        [(ad_config.NOVASEQ_ID, ["output", "Logs"]), (ad_config.AVITI_ID, [""])],
+    )
+    def test_get_cmd_creates_mount_dirs(
+        self, tuning_rf_obj, temp_logger, tmp_path, sequencer_type, mount_dirs
+    ):
+        """
+        Test that the mounted output (and bclconvert log) directories are created, as docker
+        would otherwise create them owned by root
+        """
+        tuning_rf_obj.sequencer_type = sequencer_type
+        output_dir = tmp_path / "layout"
+        thread_tuning.ThreadBenchmark(tuning_rf_obj, 1000, temp_logger, cpus=4).get_cmd(
+            {"-p": 4}, str(output_dir)
+        )
+        assert all((output_dir / mount_dir).is_dir() for mount_dir in mount_dirs)
+
+
+class TestDiskCapacityCheck(object):
+    """
+    Tests for the DiskCapacityCheck class
+    """
+
+    @pytest.fixture(scope="function")
+    def capacity_rf_obj(self, make_rf_obj, tmp_path):
+        """
+        Stand-in RunfolderObject for a MiSeq runfolder with 1,000,000 clusters (318 cycles)
+        """
+        runfolderpath = tmp_path / "999999_M02631_0000_00000TEST"
+        (runfolderpath / "InterOp").mkdir(parents=True)
+        (runfolderpath / "RunInfo.xml").write_text(RUNINFO_XML)
+        (runfolderpath / "InterOp" / "TileMetricsOut.bin").write_bytes(
+            bytes([2, 10])
+            + struct.pack("<HHHf", 1, 1101, 102, 500000.0)
+            + struct.pack("<HHHf", 1, 1102, 102, 500000.0)
+        )
+        return make_rf_obj(
+            runfolderpath.name,
+            aviti_runparameters_file=str(runfolderpath / "RunParameters.json"),
+        )
+
+    @pytest.fixture(scope="function")
+    def free_bytes(self, monkeypatch):
+        """
+        Set the free space reported for the output filesystem, with no safety margin
+        """
+        monkeypatch.setattr(ad_config.DemultiplexConfig, "DISK_SAFETY_MARGIN_GB", 0)
+        monkeypatch.setattr(ad_config.DemultiplexConfig, "DISK_BYTES_PER_BASE", 1.0)
+        free = {"bytes": 0}
+        monkeypatch.setattr(
+            disk_capacity.shutil,
+            "disk_usage",
+            lambda path: type("usage", (), {"free": free["bytes"]}),
+        )
+        return free
+
+    def test_illumina_estimate(self, capacity_rf_obj, free_bytes, temp_logger, caplog):
+        """
+        Test that demultiplexing is deferred if the estimated output does not fit in the
+        free space of the output filesystem (output directory not yet created)
+        """
+        output_path = os.path.join(capacity_rf_obj.runfolderpath, "Data", "Intensities")
+        capacity_check = disk_capacity.DiskCapacityCheck(
+            capacity_rf_obj, temp_logger, output_path
+        )
+        assert capacity_check.get_illumina_bases() == 318000000
+        free_bytes["bytes"] = 318000000
+        assert capacity_check.check()
+        free_bytes["bytes"] = 317999999
+        assert capacity_check.check() is None
+        assert "Demultiplexing deferred" in caplog.text
+        free_bytes["bytes"] = 318000000
+        assert disk_capacity.DiskCapacityCheck(
+            capacity_rf_obj, temp_logger, output_path, copies=2
+        ).check() is None
+
+    def test_reservations(self, capacity_rf_obj, free_bytes, temp_logger, caplog):
+        """
+        Test that the estimated output of runfolders being demultiplexed concurrently is
+        deducted from the free space, until the runfolder is released
+        """
+        output_path = os.path.join(capacity_rf_obj.runfolderpath, "Data", "Intensities")
+        other_rf_obj = types.SimpleNamespace(
+            **{**vars(capacity_rf_obj), "runfolder_name": "OTHER"}
+        )
+        reservations = disk_capacity.DiskReservations()
+        free_bytes["bytes"] = 500000000  # Space for the output of one runfolder
+        assert disk_capacity.DiskCapacityCheck(
+            capacity_rf_obj, temp_logger, output_path, reservations=reservations
+        ).check()
+        # Re-checking the same runfolder does not count its own reservation
+        assert disk_capacity.DiskCapacityCheck(
+            capacity_rf_obj, temp_logger, output_path, reservations=reservations
+        ).check()
+        assert disk_capacity.DiskCapacityCheck(
+            other_rf_obj, temp_logger, output_path, reservations=reservations
+        ).check() is None
+        assert "0.3 GiB reserved" in caplog.text
+        reservations.release(capacity_rf_obj.runfolder_name)
+        assert disk_capacity.DiskCapacityCheck(
+            other_rf_obj, temp_logger, output_path, reservations=reservations
+        ).check()
+
+    def test_aviti_estimate(self, capacity_rf_obj, temp_logger):
+        """
+        Test that the AVITI estimate uses the cycles and the polonies of the throughput selection
+        """
+        capacity_rf_obj.sequencer_type = ad_config.AVITI_ID
+        with open(capacity_rf_obj.aviti_runparameters_file, "w") as runparameters:
+            runparameters.write(
+                '{"Cycles": {"R1": 151, "R2": 151, "I1": 8, "I2": 8}, '
+                '"ThroughputSelection": "Low"}'
+            )
+        assert disk_capacity.DiskCapacityCheck(
+            capacity_rf_obj, temp_logger, capacity_rf_obj.runfolderpath
+        ).get_aviti_bases() == (
+            ad_config.DemultiplexConfig.DISK_AVITI_POLONIES["Low"] * 318
+        )
+
+    def test_estimate_unavailable(self, capacity_rf_obj, free_bytes, temp_logger, caplog):
+        """
+        Test that demultiplexing is not deferred if the output size cannot be estimated
+        """
+        os.remove(os.path.join(capacity_rf_obj.runfolderpath, "InterOp", "TileMetricsOut.bin"))
+        assert disk_capacity.DiskCapacityCheck(
+            capacity_rf_obj, temp_logger, capacity_rf_obj.runfolderpath
+        ).check()
+        assert "Disk capacity not checked" in caplog.text
+
+
+class TestRunQualityGate(object):
+    """
+    Tests for the RunQualityGate class, and the InterOpMetrics run quality metrics
+    """
+
+    @pytest.fixture(scope="function")
+    def quality_rf_obj(self, make_rf_obj, tmp_path):
+        """
+        Stand-in RunfolderObject for a MiSeq runfolder with one lane of 1,000,000 clusters
+        (900,000 passing filter) at 1000 K/mm2, and a binned QMetricsOut.bin (v6) in which 80%
+        of base calls are at or above Q30
+        """
+        runfolderpath = tmp_path / "999999_M02631_0000_00000TEST"
+        (runfolderpath / "InterOp").mkdir(parents=True)
+        (runfolderpath / "RunInfo.xml").write_text(RUNINFO_XML)
+        (runfolderpath / "InterOp" / "TileMetricsOut.bin").write_bytes(
+            bytes([2, 10])
+            + b"".join(
+                struct.pack("<HHHf", 1, tile, code, value)
+                for tile in (1101, 1102)
+                for code, value in [(100, 1000000.0), (102, 500000.0), (103, 450000.0)]
+            )
+        )
+        (runfolderpath / "InterOp" / "QMetricsOut.bin").write_bytes(
+            bytes([6, 18, 1, 3])
+            + bytes([1, 20, 30])  # Bin lower bounds
+            + bytes([19, 29, 41])  # Bin upper bounds
+            + bytes([14, 21, 38])  # Bin quality scores
+            + b"".join(
+                struct.pack("<HHH3I", 1, tile, cycle, 10, 10, 80)
+                for tile in (1101, 1102)
+                for cycle in (1, 2)
+            )
+        )
+        return make_rf_obj(
+            runfolderpath.name,
+            sequencer_type="M02631",
+            quality_hold_flagfile=str(runfolderpath / "run_quality_hold.txt"),
+            quality_release_flagfile=str(runfolderpath / "run_quality_release.txt"),
+        )
+
+    def test_lane_quality(self, quality_rf_obj):
+        """
+        Test the %PF, %Q30 (using the bin quality scores) and cluster density of each lane
+        """
+        assert interop_metrics.InterOpMetrics(
+            quality_rf_obj.runfolderpath, quality_rf_obj.runfolder_name
+        ).get_lane_quality() == {
+            1: {"percent_pf": 90.0, "percent_q30": 80.0, "cluster_density": 1000.0}
+        }
+
+    def test_unbinned_q30(self, quality_rf_obj):
+        """
+        Test %Q30 of an unbinned QMetricsOut.bin (v4), with a histogram bin per quality score
+        """
+        histogram = [0] * 50
+        histogram[28], histogram[29] = 30, 70  # Q29, Q30
+        with open(
+            os.path.join(quality_rf_obj.runfolderpath, "InterOp", "QMetricsOut.bin"), "wb"
+        ) as q_metrics_file:
+            q_metrics_file.write(bytes([4, 206]) + struct.pack("<HHH50I", 1, 1101, 1, *histogram))
+        assert interop_metrics.InterOpMetrics(
+            quality_rf_obj.runfolderpath, quality_rf_obj.runfolder_name
+        ).get_lane_q30() == {1: (70, 100)}
+
+    def test_hold_and_release(self, quality_rf_obj, temp_logger, monkeypatch, caplog):
+        """
+        Test that a run below the %Q30 threshold is held, with the alert raised only when the
+        run is first held, until the release flag file is created
+        """
+        gate = run_quality.RunQualityGate(quality_rf_obj, temp_logger)
+        assert gate.check()
+        assert not os.path.exists(quality_rf_obj.quality_hold_flagfile)
+        monkeypatch.setattr(ad_config.DemultiplexConfig, "RUN_QUALITY_MIN_PERCENT_Q30", 85)
+        assert gate.check() is None
+        assert "Lane 1 percent_q30 80.0 < 85\n" in toolbox.read_lines(
+            quality_rf_obj.quality_hold_flagfile
+        )
+        caplog.clear()
+        assert gate.check() is None
+        assert "Run is held by the run quality gate" in caplog.text
+        assert not any(record.levelname == "ERROR" for record in caplog.records)
+        toolbox.write_lines(quality_rf_obj.quality_release_flagfile, "w", "Released")
+        assert gate.check()
+
+    def test_density_range(self, quality_rf_obj, temp_logger, monkeypatch):
+        """
+        Test that a run outside the cluster density range of the sequencer is held
+        """
+        monkeypatch.setitem(
+            ad_config.DemultiplexConfig.RUN_QUALITY_DENSITY_RANGE, "M02631", (1200, 1800)
+        )
+        assert run_quality.RunQualityGate(quality_rf_obj, temp_logger).check() is None
+
+    def test_metrics_unavailable(self, quality_rf_obj, temp_logger, caplog):
+        """
+        Test that the run is not held if the run quality metrics cannot be calculated
+        """
+        os.remove(os.path.join(quality_rf_obj.runfolderpath, "InterOp", "QMetricsOut.bin"))
+        assert run_quality.RunQualityGate(quality_rf_obj, temp_logger).check()
+        assert "Run quality gate not applied" in caplog.text
+
+    def test_gate_disabled(self, monkeypatch):
+        """
+        Test that the gate is disabled by default, so runs are not checked until it is enabled
+        """
+        def check(self):
+            raise AssertionError("Run quality gate applied")
+
+        monkeypatch.setattr(demultiplex.RunQualityGate, "check", check)
+        dr_obj = type("dr_obj", (), {"sequenced_on_illumina": lambda self: True})()
+        assert not ad_config.DemultiplexConfig.RUN_QUALITY_GATE
+        assert demultiplex.DemultiplexRunfolder.run_quality_passed(dr_obj)
@@ -0,0 +1,218 @@
+"""thread_tuning.py
+
+Demultiplexing thread layout tuning. bclconvert chooses its own conversion / compression /
+decompression thread counts, and bases2fastq is run with a fixed thread count, whatever the host.
+The thread layouts in THREAD_BENCHMARK_LAYOUTS are benchmarked on a subset of the tiles of a
+runfolder, the fastest is stored per host, tool and sequencer type, and the stored layout is
+scaled to the per-container CPU budget and added to the demultiplexing commands. Contains the
+following classes:
+
+- ThreadBenchmark
+    Run each thread layout on a subset of the tiles of a runfolder and store the fastest
+"""
+
+import os
+import time
+import shutil
+import logging
+from typing import Optional
+from config.ad_config import DemultiplexConfig
+from toolbox.toolbox import ThreadLayoutStore, execute_subprocess_command
+
+
+def get_tool(sequencer_type: str) -> str:
+    """
+    Return the demultiplexing tool used for the sequencer type
+        :param sequencer_type (str):    Sequencer type
+        :return (str):                  bclconvert or bases2fastq
+    """
+    if sequencer_type == DemultiplexConfig.AVITI_ID:
+        return "bases2fastq"
+    return "bclconvert"
+
+
+def scale_layout(layout: dict, cpus: float) -> dict:
+    """
+    Scale a thread layout (threads per CPU) to a number of CPUs
+        :param layout (dict):   Threads per CPU keyed by thread option
+        :param cpus (float):    CPUs available to the container
+        :return (dict):         Thread count (at least 1) keyed by thread option
+    """
+    return {option: max(1, round(ratio * cpus)) for option, ratio in layout.items()}
+
+
+def format_thread_options(thread_counts: Optional[dict]) -> str:
+    """
+    Return the thread options to append to a demultiplexing command
+        :param thread_counts (Optional[dict]):  Thread count keyed by thread option
+        :return (str):                          Thread options (each preceded by a space), or an
+                                                empty string if there are no thread counts
+    """
+    return "".join(
+        f" {option} {threads}" for option, threads in sorted((thread_counts or {}).items())
+    )
+
+
+def get_thread_counts(sequencer_type: str, cpus: float) -> Optional[dict]:
+    """
+    Return the thread counts of the stored thread layout for the sequencer type on this host,
+    scaled to the container CPU budget
+        :param sequencer_type (str):    Sequencer type
+        :param cpus (float):            CPUs available to the container
+        :return (Optional[dict]):       Thread count keyed by thread option, or None if no
+                                        layout has been stored
+    """
+    layout = ThreadLayoutStore().get_layout(get_tool(sequencer_type), sequencer_type)
+    if layout:
+        return scale_layout(layout, cpus)
+
+
+class ThreadBenchmark(DemultiplexConfig):
+    """
+    Run each thread layout in THREAD_BENCHMARK_LAYOUTS on a subset of the tiles of a runfolder
+    (THREAD_BENCHMARK_SUBSET), within the per-container CPU budget, and store the fastest layout
+    for the host, tool and sequencer type. Layouts are run one at a time into THREAD_BENCHMARK_DIR
+    within the runfolder, which is removed afterwards. The first layout is run once untimed, so
+    that every timed layout reads the inputs from the page cache
+
+    Attributes
+        rf_obj (obj):               RunfolderObject object
+        user (int):                 User ID the containers are run as
+        logger (logging.Logger):    Logger
+        cpus (int):                 CPUs available to each demultiplexing container
+        tool (str):                 Demultiplexing tool (bclconvert or bases2fastq)
+        benchmark_dir (str):        Directory the benchmark outputs are written to
+
+    Methods
+        get_cmd(thread_counts, output_dir)
+            Return the demultiplexing command for the tile subset with the thread counts
+        run_layout(layout, output_dir)
+            Run the layout and return the time taken
+        run()
+            Run each layout and store the fastest
+    """
+
+    def __init__(
+        self,
+        rf_obj: object,
+        user: int,
+        logger: logging.Logger,
+        cpus: int = DemultiplexConfig.DEMULTIPLEX_CONTAINER_CPU,
+    ):
+        """
+        Constructor for the ThreadBenchmark class
+            :param rf_obj (obj):                RunfolderObject object
+            :param user (int):                  User ID the containers are run as
+            :param logger (logging.Logger):     Logger
+            :param cpus (int):                  CPUs available to each demultiplexing container
+        """
+        self.rf_obj = rf_obj
+        self.user = user
+        self.logger = logger
+        self.cpus = cpus
+        self.tool = get_tool(rf_obj.sequencer_type)
+        self.benchmark_dir = os.path.join(
+            rf_obj.runfolderpath, DemultiplexConfig.THREAD_BENCHMARK_DIR
+        )
+
+    def get_cmd(self, thread_counts: dict, output_dir: str) -> str:
+        """
+        Return the demultiplexing command for the tile subset with the thread counts. The
+        mounted output (and bclconvert log) directories are created, as docker would otherwise
+        create them owned by root
+            :param thread_counts (dict):    Thread count keyed by thread option
+            :param output_dir (str):        Output directory
+            :return (str):                  Demultiplexing command
+        """
+        if self.tool == "bases2fastq":
+            os.makedirs(output_dir, exist_ok=True)
+            return (
+                DemultiplexConfig.BASES2FASTQ_CMD
+                % (
+                    self.user,
+                    self.user,
+                    self.rf_obj.runfolderpath,
+                    output_dir,
+                    thread_counts["-p"],
+                    self.rf_obj.samplesheet_name,
+                )
+                + f" {DemultiplexConfig.THREAD_BENCHMARK_SUBSET[self.tool]}"
+            )
+        log_dir = os.path.join(output_dir, "Logs")
+        for mount_dir in [os.path.join(output_dir, "output"), log_dir]:
+            os.makedirs(mount_dir, exist_ok=True)
+        return (
+            DemultiplexConfig.BCLCONVERT_CMD
+            % (
+                self.user,
+                self.user,
+                self.rf_obj.runfolderpath,
+                os.path.join(output_dir, "output"),
+                log_dir,
+                os.path.join(DemultiplexConfig.RUNFOLDERS, "samplesheets"),
+                self.rf_obj.samplesheet_name,
+            )
+            + f" {DemultiplexConfig.THREAD_BENCHMARK_SUBSET[self.tool]}"
+            + format_thread_options(thread_counts)
+        )
+
+    def run_layout(self, layout: dict, output_dir: str) -> Optional[float]:
+        """
+        Run the layout, scaled to the container CPU budget, and return the time taken
+            :param layout (dict):       Threads per CPU keyed by thread option
+            :param output_dir (str):    Output directory
+            :return (Optional[float]):  Seconds taken, or None if the command failed
+        """
+        cmd = self.get_cmd(scale_layout(layout, self.cpus), output_dir)
+        start = time.monotonic()
+        out, err, returncode = execute_subprocess_command(cmd, self.logger)
+        seconds = time.monotonic() - start
+        shutil.rmtree(output_dir, ignore_errors=True)
+        if returncode != 0:
+            self.logger.error(self.logger.log_msgs["thread_benchmark_failed"], layout, out, err)
+            return None
+        self.logger.info(self.logger.log_msgs["thread_benchmark_layout"], layout, seconds)
+        return seconds
+
+    def run(self) -> Optional[dict]:
+        """
+        Run each layout and store the fastest for the host, tool and sequencer type
+            :return (Optional[dict]):   Fastest layout, or None if every layout failed
+        """
+        layouts = DemultiplexConfig.THREAD_BENCHMARK_LAYOUTS[self.tool]
+        self.logger.info(
+            self.logger.log_msgs["thread_benchmark_start"],
+            len(layouts),
+            self.tool,
+            self.rf_obj.runfolder_name,
+            self.cpus,
+        )
+        try:
+            self.run_layout(layouts[0], os.path.join(self.benchmark_dir, "warmup"))
+            seconds = {}
+            for number, layout in enumerate(layouts):
+                layout_seconds = self.run_layout(
+                    layout, os.path.join(self.benchmark_dir, f"layout{number}")
+                )
+                if layout_seconds is not None:
+                    seconds[number] = layout_seconds
+        finally:
+            shutil.rmtree(self.benchmark_dir, ignore_errors=True)
+        if not seconds:
+            return None
+        fastest = min(seconds, key=seconds.get)
+        ThreadLayoutStore().record_layout(
+            self.tool,
+            self.rf_obj.sequencer_type,
+            layouts[fastest],
+            self.cpus,
+            seconds[fastest],
+        )
+        self.logger.info(
+            self.logger.log_msgs["thread_benchmark_stored"],
+            layouts[fastest],
+            seconds[fastest],
+            self.tool,
+            self.rf_obj.sequencer_type,
+        )
+        return layouts[fastest]
@@ -0,0 +1,187 @@
+"""sample_qc.py
+
+Per-sample QC gate. The bclconvert Reports (and the bases2fastq RunStats.json for AVITI runs)
+are otherwise only uploaded, so near-empty samples from failed libraries are run through the
+full cloud workflows. The reports are parsed into a per-sample table of read counts, %Q30 and
+% of lane before the dx run commands are built, and samples failing the thresholds are flagged,
+and (if configured) skipped. Contains the following classes:
+
+- SampleQC
+    Parse the demultiplexing reports of a runfolder into a per-sample QC table, and return the
+    samples that fail the QC thresholds
+"""
+
+import os
+import csv
+import json
+import logging
+from typing import Optional
+from config.ad_config import SWConfig
+
+
+class SampleQC(SWConfig):
+    """
+    Parse the demultiplexing reports of a runfolder into a per-sample QC table. For Illumina runs
+    the read counts and % of lane are read from the bclconvert Demultiplex_Stats.csv, and %Q30
+    from Quality_Metrics.csv (summed across lanes). For AVITI runs the polony counts and %Q30 are
+    read from the bases2fastq RunStats.json. Samples with fewer reads than SAMPLE_QC_MIN_READS,
+    or a %Q30 below SAMPLE_QC_MIN_PERCENT_Q30, fail QC. Negative controls are not assessed, as
+    they are expected to be near-empty
+
+    Attributes
+        rf_obj (obj):               RunfolderObject object
+        logger (logging.Logger):    Setoff workflows runfolder logger
+        reports (dict):             Paths of the bclconvert reports, keyed by report name
+
+    Methods
+        read_csv(report_name)
+            Return the rows of a bclconvert report
+        get_illumina_qc()
+            Return the per-sample QC table from the bclconvert reports
+        get_aviti_qc()
+            Return the per-sample QC table from the bases2fastq RunStats.json
+        get_qc_table()
+            Return the per-sample QC table for the run
+        get_top_unknown_barcode()
+            Return the most frequent unknown barcode of the run
+        get_failed_samples(samples_dict)
+            Return the samples that fail the QC thresholds, logging the QC table
+    """
+
+    def __init__(self, rf_obj: object, logger: logging.Logger):
+        """
+        Constructor for the SampleQC class
+            :param rf_obj (obj):                RunfolderObject object
+            :param logger (logging.Logger):     Setoff workflows runfolder logger
+        """
+        self.rf_obj = rf_obj
+        self.logger = logger
+        self.reports = {
+            os.path.basename(report_path): report_path
+            for report_path in self.rf_obj.bclconvertstats_file
+        }
+
+    def read_csv(self, report_name: str) -> list:
+        """
+        Return the rows of a bclconvert report
+            :param report_name (str):   Report name, e.g. Demultiplex_Stats.csv
+            :return (list):             List of rows, as dictionaries keyed by column name
+        """
+        with open(self.reports[report_name], "r", newline="") as report_file:
+            return list(csv.DictReader(report_file))
+
+    def get_illumina_qc(self) -> dict:
+        """
+        Return the per-sample QC table from the bclconvert reports. Read counts are summed
+        across lanes, and the % of lane is the lowest of the sample's lanes
+            :return (dict):     Dictionary of reads, percent_q30 and percent_lane keyed by sample
+        """
+        qc_table = {}
+        for row in self.read_csv("Demultiplex_Stats.csv"):
+            sample_qc = qc_table.setdefault(
+                row["SampleID"], {"reads": 0, "percent_q30": 0.0, "percent_lane": 100.0}
+            )
+            sample_qc["reads"] += int(row["# Reads"])
+            sample_qc["percent_lane"] = min(
+                sample_qc["percent_lane"], float(row["% Reads"]) * 100
+            )
+        yields = {}
+        for row in self.read_csv("Quality_Metrics.csv"):
+            sample_yield, sample_yield_q30 = yields.get(row["SampleID"], (0, 0))
+            yields[row["SampleID"]] = (
+                sample_yield + int(row["Yield"]),
+                sample_yield_q30 + int(row["YieldQ30"]),
+            )
+        for sample_id, (sample_yield, sample_yield_q30) in yields.items():
+            if sample_id in qc_table and sample_yield:
+                qc_table[sample_id]["percent_q30"] = sample_yield_q30 / sample_yield * 100
+        return qc_table
+
+    def get_aviti_qc(self) -> dict:
+        """
+        Return the per-sample QC table from the bases2fastq RunStats.json. Polony counts are
+        reported as reads, and the % of lane is the sample's percentage of all polonies
+            :return (dict):     Dictionary of reads, percent_q30 and percent_lane keyed by sample
+        """
+        with open(
+            os.path.join(self.rf_obj.bases2fastq_outputpath, "RunStats.json"), "r"
+        ) as runstats_file:
+            runstats = json.load(runstats_file)
+        total_polonies = runstats.get("NumPolonies") or sum(
+            sample["NumPolonies"] for sample in runstats["SampleStats"]
+        )
+        return {
+            sample["SampleName"]: {
+                "reads": int(sample["NumPolonies"]),
+                "percent_q30": float(sample["PercentQ30"]),
+                "percent_lane": (
+                    sample["NumPolonies"] / total_polonies * 100 if total_polonies else 0.0
+                ),
+            }
+            for sample in runstats["SampleStats"]
+        }
+
+    def get_qc_table(self) -> dict:
+        """
+        Return the per-sample QC table for the run
+            :return (dict):     Dictionary of reads, percent_q30 and percent_lane keyed by sample
+        """
+        if self.rf_obj.sequencer_type == SWConfig.AVITI_ID:
+            return self.get_aviti_qc()
+        return self.get_illumina_qc()
+
+    def get_top_unknown_barcode(self) -> Optional[str]:
+        """
+        Return the most frequent unknown barcode of the run (an index mix-up shows as a highly
+        represented unknown barcode), from the bclconvert Top_Unknown_Barcodes.csv
+            :return (Optional[str]):    Unknown barcode and its % of lane, or None if not available
+        """
+        try:
+            rows = self.read_csv("Top_Unknown_Barcodes.csv")
+        except (OSError, KeyError):
+            return None
+        if rows:
+            row = max(rows, key=lambda row: int(row["# Reads"]))
+            index = "+".join(row[column] for column in ("index", "index2") if row.get(column))
+            return f"{index} ({float(row['% of Unknown Barcodes']) * 100:.1f}% of unknown)"
+
+    def get_failed_samples(self, samples_dict: dict) -> Optional[list]:
+        """
+        Return the samples that fail the QC thresholds, logging the QC table. Negative controls,
+        and samples missing from the reports, are not assessed
+            :param samples_dict (dict):     RunfolderSamples samples_dict
+            :return (Optional[list]):       Names of the samples that fail QC, or None if the
+                                            reports could not be read
+        """
+        try:
+            qc_table = self.get_qc_table()
+        except (OSError, KeyError, ValueError, TypeError) as exception:
+            self.logger.warning(self.logger.log_msgs["sample_qc_unavailable"], exception)
+            return None
+        failed_samples = []
+        for sample_name, sample_dict in samples_dict.items():
+            if sample_name not in qc_table:
+                self.logger.warning(self.logger.log_msgs["sample_qc_missing"], sample_name)
+                continue
+            sample_qc = qc_table[sample_name]
+            self.logger.info(
+                self.logger.log_msgs["sample_qc"],
+                sample_name,
+                sample_qc["reads"],
+                sample_qc["percent_q30"],
+                sample_qc["percent_lane"],
+            )
+            if sample_dict["neg_control"]:
+                continue
+            if sample_qc["reads"] < SWConfig.SAMPLE_QC_MIN_READS or (
+                SWConfig.SAMPLE_QC_MIN_PERCENT_Q30 is not None
+                and sample_qc["percent_q30"] < SWConfig.SAMPLE_QC_MIN_PERCENT_Q30
+            ):
+                failed_samples.append(sample_name)
+        if failed_samples:
+            self.logger.warning(
+                self.logger.log_msgs["sample_qc_failed"],
+                ", ".join(failed_samples),
+                self.get_top_unknown_barcode(),
+            )
+        return failed_samples
@@ -46,7 +46,9 @@ from toolbox.toolbox import (
     test_upload_software,
     RunfolderObject,
     RunfolderSamples,
+    RunfolderStateIndex,
     read_lines,
+    read_samplesheet,
     get_num_processed_runfolders,
     get_credential,
     git_tag,
@@ -55,6 +57,7 @@ from toolbox.toolbox import (
     get_samplename_dict,
 )
 from setoff_workflows.pipeline_emails import PipelineEmails
+from setoff_workflows.sample_qc import SampleQC
 from setoff_workflows.build_dx_commands import (
     BuildRunfolderDxCommands,
     BuildSampleDxCommands,
@@ -81,6 +84,9 @@ class SequencingRuns(SWConfig):
             has finished successfully and the runfolder has not already been uploaded)
         has_demultiplexed(rf_obj)
             Check if demultiplexing has already been performed and completed sucessfully
+        cluster_density_failed(rf_obj)
+            Check for the flag file denoting the cluster density calculation failed after
+            demultiplexing and has not yet been re-run
         already_uploaded(rf_obj)
             Checks for presence of DNAnexus upload flag file(denotes that the runfolder has
             already been processed)
@@ -102,7 +108,9 @@ class SequencingRuns(SWConfig):
         processed_runfolders = []
         script_start_logmsg(script_logger, __file__)
         runs_to_process = self.set_runfolders()
-        if test_upload_software(script_logger):
+        if not runs_to_process:
+            script_logger.info(script_logger.log_msgs["software_tests_skipped"])
+        elif test_upload_software(script_logger):
             for rf_obj in runs_to_process:
                 if not os.path.exists(rf_obj.upload_flagfile):
                     script_logger.info(
@@ -111,8 +119,12 @@ class SequencingRuns(SWConfig):
                     )
                     if self.process_runfolder(rf_obj):
                         processed_runfolders.append(rf_obj.runfolder_name)
-            get_num_processed_runfolders(script_logger, processed_runfolders)
-            script_end_logmsg(script_logger, __file__)
+                        decision = "setoff_workflows: processed"
+                    else:
+                        decision = "setoff_workflows: not processed"
+                    RunfolderStateIndex().record_decision(rf_obj.runfolderpath, decision)
+        get_num_processed_runfolders(script_logger, processed_runfolders)
+        script_end_logmsg(script_logger, __file__)
 
     def set_runfolders(self) -> list:
         """
@@ -130,8 +142,21 @@ class SequencingRuns(SWConfig):
         # Iterate through list and check directory follows runfolder pattern and also exists in 
         # either the Illumina or AVITI directory. Specific Runfolder path is confirmed when 
         # RunFolderObject is created in Toolbox.py
+        # Skip runfolders that the state index shows have not been demultiplexed, or have
+        # been uploaded, without creating a RunfolderObject
+        states = RunfolderStateIndex().get_states(
+            [os.path.join(SWConfig.RUNFOLDERS, folder) for folder in illumina_runfolders]
+            + [os.path.join(SWConfig.AVITI_RUNFOLDER, folder) for folder in aviti_runfolders]
+        )
+        skipped = [
+            folder for folder in sequenced_folders
+            if states.get(folder) in SWConfig.STATE_INDEX_SKIP
+        ]
+        script_logger.info(
+            script_logger.log_msgs["state_index_skipped"], ", ".join(skipped)
+        )
         for folder in sequenced_folders:
-            if re.compile(SWConfig.RUNFOLDER_PATTERN).match(folder):
+            if re.compile(SWConfig.RUNFOLDER_PATTERN).match(folder) and folder not in skipped:
                 if os.path.isdir(
                     os.path.join(SWConfig.RUNFOLDERS, folder)
                     ) or os.path.isdir(
@@ -147,11 +172,12 @@ class SequencingRuns(SWConfig):
     def requires_processing(self, rf_obj: object) -> Optional[bool]:
         """
         Calls other methods to determine whether the runfolder requires processing (demultiplexing
-        has finished successfully and the runfolder has not already been uploaded)
+        has finished successfully, including the cluster density calculation, and the runfolder
+        has not already been uploaded)
             :param rf_obj (obj):        RunfolderObject object (contains runfolder-specific attributes)
             :return (Optional[bool]):   Returns true if runfolder requires processing, else None
         """
-        if self.has_demultiplexed(rf_obj):
+        if self.has_demultiplexed(rf_obj) and not self.cluster_density_failed(rf_obj):
             if self.already_uploaded(rf_obj):
                 script_logger.info(
                     script_logger.log_msgs["runfolder_prev_proc"],
@@ -195,6 +221,20 @@ class SequencingRuns(SWConfig):
         else:
             script_logger.info(script_logger.log_msgs["not_yet_demultiplexed"])
 
+    def cluster_density_failed(self, rf_obj: object) -> Optional[bool]:
+        """
+        Check for the flag file denoting that the cluster density calculation failed after
+        demultiplexing. The run is not processed until the calculation has been re-run
+        successfully by the demultiplex script (which removes the flag file)
+            :param rf_obj (obj):        RunfolderObject object (contains runfolder-specific attributes)
+            :return (Optional[bool]):   Returns True if the cluster density calculation failed, else None
+        """
+        if os.path.isfile(rf_obj.cd_failed_flagfile):
+            script_logger.info(
+                script_logger.log_msgs["cd_failed"], rf_obj.cd_failed_flagfile
+            )
+            return True
+
     def already_uploaded(self, rf_obj: object) -> Optional[bool]:
         """
         Checks for presence of DNAnexus upload flag file (denotes that the runfolder has already been processed)
@@ -255,6 +295,9 @@ class ProcessRunfolder(SWConfig):
         pipeline_emails (obj):              PipelineEmails object for sending the start of pipeline emails
 
     Methods:
+        apply_sample_qc()
+            Flag samples failing the per-sample QC gate, and if configured exclude them from the
+            dx run commands and pre-pipeline fastq upload
         get_users_dict()
             Create a dictionary of users and admins that require access to the DNAnexus project
         write_project_creation_script()
@@ -280,9 +323,10 @@ class ProcessRunfolder(SWConfig):
         pre_pipeline_upload()
             Uploads the files in the rf_obj.pre_pipeline_upload_dict for the
             runfolder. Calls the tso runfolder upload function if the runfolder is tso
-        upload_to_dnanexus(filetype, file_upload_dict)
-            Passes the command and file list in file_upload_dict to upload_runfolder.upload_files()
-            which writes log messages to the upload agent log within the runfolder
+        upload_to_dnanexus(file_upload_dict)
+            Passes the commands and file lists in file_upload_dict to
+            upload_runfolder.upload_files_concurrently() which writes log messages to the upload
+            agent log within the runfolder
         upload_rest_of_runfolder()
             Backs up the rest of the runfolder, ignoring files dependent upon the type of run
         run_dx_run_commands()
@@ -306,7 +350,9 @@ class ProcessRunfolder(SWConfig):
         open(
             self.rf_obj.upload_flagfile, "w"
         ).close()  # Create upload flag file (prevents processing by other script runs)
+        RunfolderStateIndex().record_flag_file(self.rf_obj.upload_flagfile)
         self.rf_samples_obj = RunfolderSamples(self.rf_obj, self.loggers["sw"])
+        self.apply_sample_qc()
         self.users_dict = self.get_users_dict()
         self.write_project_creation_script()
         self.nexus_identifiers = {
@@ -345,6 +391,42 @@ class ProcessRunfolder(SWConfig):
         self.pipeline_emails.send_samples_email()
         self.post_pipeline_upload()
 
+    def apply_sample_qc(self) -> None:
+        """
+        Flag samples failing the per-sample QC gate (read counts and %Q30 from the
+        demultiplexing reports). If SAMPLE_QC_ACTION is "skip", remove them from the samples
+        dictionary and fastqs list, so that no dx run commands are built for them and their
+        fastqs are not uploaded before the pipeline is set off. Samples are not skipped for
+        tso500 runs (demultiplexed on DNAnexus), or if every sample fails (e.g. a run-wide
+        problem requiring investigation)
+            :return None:
+        """
+        if not SWConfig.SAMPLE_QC_ACTION or self.rf_samples_obj.pipeline == "tso500":
+            return
+        failed_samples = SampleQC(self.rf_obj, self.loggers["sw"]).get_failed_samples(
+            self.rf_samples_obj.samples_dict
+        )
+        if not failed_samples:
+            return
+        if SWConfig.SAMPLE_QC_ACTION != "skip" or len(failed_samples) == len(
+            self.rf_samples_obj.samples_dict
+        ):
+            self.loggers["sw"].error(
+                self.loggers["sw"].log_msgs["sample_qc_flagged"],
+                SWConfig.SAMPLE_QC_ACTION,
+                ", ".join(failed_samples),
+            )
+            return
+        for sample_name in failed_samples:
+            del self.rf_samples_obj.samples_dict[sample_name]
+        self.rf_samples_obj.fastqs_list = self.rf_samples_obj.get_fastqs_list()
+        self.rf_samples_obj.fastqs_str = self.rf_samples_obj.get_fastqs_str(
+            self.rf_samples_obj.fastqs_list
+        )
+        self.loggers["sw"].error(
+            self.loggers["sw"].log_msgs["sample_qc_skipped"], ", ".join(failed_samples)
+        )
+
     def get_users_dict(self) -> dict:
         """
         Create a dictionary of users and admins that require access to the DNAnexus project. This also
@@ -581,32 +663,13 @@ class ProcessRunfolder(SWConfig):
 
     def read_tso_samplesheet(self) -> Union[list, list]:
         """
-        Read required lines from the TSO SampleSheet
+        Read required lines from the TSO SampleSheet (from the parsed SampleSheet)
             :return samples (list):             Samples read from SampleSheet
             :return samplesheet_header (list):  SampleSheet header lines
         """
-        samples, samplesheet_header = [], []
-        no_sample_lines = 0
-        expected_data_headers = ["Sample_ID", "Sample_Name", "index"]
-        header_identified = False
-        # Read all lines from the sample sheet
-        samplesheet = read_lines(self.rf_obj.runfolder_samplesheet_path)
-        for line in samplesheet:
-            line = line.strip("\n")
-            if any(header in line for header in expected_data_headers):
-                samplesheet_header.append(line)  # Extract header and add to list
-                header_identified = True
-            elif (
-                not header_identified
-            ):  # Extract lines above the header and add to list
-                samplesheet_header.append(line)
-            # Skip empty lines (check first element of the line, after splitting on comma)
-            elif header_identified and len(line.split(",")[0]) > 2:
-                samples.append(line)
-                no_sample_lines += 1
-            elif len(line.split(",")[0]) < 2:  # Skip empty lines
-                pass
-        return samples, samplesheet_header
+        samplesheet = read_samplesheet(self.rf_obj.runfolder_samplesheet_path)
+        samples = [samplesheet.lines[line_number] for line_number, _ in samplesheet.data_rows]
+        return samples, samplesheet.header_lines
 
     def create_file_upload_dict(self) -> dict:
         """
@@ -753,43 +816,46 @@ class ProcessRunfolder(SWConfig):
         Calls the upload_rest_of_runfolder function if the runfolder is tso500
             :return None:
         """
-        for filetype in self.pre_pipeline_upload_dict.keys():
-            self.upload_to_dnanexus(filetype, self.pre_pipeline_upload_dict)
+        self.upload_to_dnanexus(self.pre_pipeline_upload_dict)
         if self.rf_samples_obj.pipeline == "tso500":
             self.loggers["sw"].info(
                 self.loggers["sw"].log_msgs["tso_backup"],
             )
             self.upload_rest_of_runfolder()
 
-    def upload_to_dnanexus(self, filetype: str, file_upload_dict: dict) -> None:
+    def upload_to_dnanexus(self, file_upload_dict: dict) -> None:
         """
-        Passes the command and file list in file_upload_dict to upload_runfolder.upload_files()
-        which writes log messages to the backup runfolder log file
-            :param filetype (str):          Name of the file upload type
-            :param file_upload_dict (dict): Dictionary of files for upload
+        Passes the commands and file lists in file_upload_dict to
+        upload_runfolder.upload_files_concurrently(), which uploads the file types concurrently
+        and writes log messages to the backup runfolder log file
+            :param file_upload_dict (dict): Dictionary of files for upload, keyed by file type
             :return None:
         """
-        self.loggers["sw"].info(
-            self.loggers["sw"].log_msgs["uploading_files"], filetype
-        )
-        result = self.upload_runfolder.upload_files(
-            file_upload_dict[filetype]["cmd"],
-            file_upload_dict[filetype]["files_list"],
-        )
-        if result == "success":
+        for filetype in file_upload_dict:
             self.loggers["sw"].info(
-                self.loggers["sw"].log_msgs["upload_success"], filetype
-            )
-        if result == "fail":
-            self.loggers["sw"].info(
-                self.loggers["sw"].log_msgs["upload_fail"],
-                filetype,
-                self.rf_obj.upload_runfolder_logfile,
-            )
-        elif result is list:
-            self.loggers["sw"].error(
-                self.loggers["sw"].log_msgs["nonexistent_files"], result
+                self.loggers["sw"].log_msgs["uploading_files"], filetype
             )
+        results = self.upload_runfolder.upload_files_concurrently(
+            {
+                filetype: (upload["cmd"], upload["files_list"])
+                for filetype, upload in file_upload_dict.items()
+            }
+        )
+        for filetype, result in results.items():
+            if result == "success":
+                self.loggers["sw"].info(
+                    self.loggers["sw"].log_msgs["upload_success"], filetype
+                )
+            elif result == "fail":
+                self.loggers["sw"].info(
+                    self.loggers["sw"].log_msgs["upload_fail"],
+                    filetype,
+                    self.rf_obj.upload_runfolder_logfile,
+                )
+            elif isinstance(result, list):
+                self.loggers["sw"].error(
+                    self.loggers["sw"].log_msgs["nonexistent_files"], result
+                )
 
     def upload_rest_of_runfolder(self) -> None:
         """
@@ -904,8 +970,7 @@ class ProcessRunfolder(SWConfig):
                 "files_list": self.rf_obj.logfiles_to_upload,
             },
         }
-        for filetype in logfiles_upload_dict.keys():  # Upload logfiles for all runtypes
-            self.upload_to_dnanexus(filetype, logfiles_upload_dict)
+        self.upload_to_dnanexus(logfiles_upload_dict)  # Upload logfiles for all runtypes
 
     def run_msk_commands(self):
         """Execute MSK pipeline commands directly without any DNAnexus interaction"""
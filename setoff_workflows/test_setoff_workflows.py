@@ -2,3 +2,133 @@
 """
 
 # TODO finish this test suite as it is currently incomplete
+
+import os
+import json
+import pytest
+from config import ad_config
+from setoff_workflows import sample_qc
+
+DEMULTIPLEX_STATS = (
+    "Lane,SampleID,Sample_Project,Index,# Reads,# Perfect Index Reads,"
+    "# One Mismatch Index Reads,# Two Mismatch Index Reads,% Reads,% Perfect Index Reads,"
+    "% One Mismatch Index Reads,% Two Mismatch Index Reads\n"
+    "1,Sample1,,AAAA-CCCC,600000,590000,10000,0,0.6000,0.98,0.02,0.00\n"
+    "2,Sample1,,AAAA-CCCC,400000,390000,10000,0,0.4000,0.98,0.02,0.00\n"
+    "1,Sample2,,GGGG-TTTT,5000,5000,0,0,0.0050,1.00,0.00,0.00\n"
+    "1,NTC,,CCCC-GGGG,100,100,0,0,0.0001,1.00,0.00,0.00\n"
+)
+QUALITY_METRICS = (
+    "Lane,SampleID,index,index2,ReadNumber,Yield,YieldQ30,QualityScoreSum,"
+    "Mean Quality Score (PF),% Q30\n"
+    "1,Sample1,AAAA,CCCC,1,1000,900,0,36.00,0.90\n"
+    "2,Sample1,AAAA,CCCC,1,1000,700,0,34.00,0.70\n"
+    "1,Sample2,GGGG,TTTT,1,1000,500,0,30.00,0.50\n"
+)
+TOP_UNKNOWN_BARCODES = (
+    "Lane,index,index2,# Reads,% of Unknown Barcodes,% of All Reads\n"
+    "1,ACGT,TGCA,2000,0.2000,0.0020\n"
+    "1,GGGG,AAAA,8000,0.8000,0.0080\n"
+)
+
+
+class TestSampleQC(object):
+    """
+    Tests for the SampleQC class
+    """
+
+    @pytest.fixture(scope="function")
+    def logfile_section(self):
+        """
+        Log the SampleQC messages to a setoff workflows logger (temp_logger)
+        """
+        return "sw"
+
+    @pytest.fixture(scope="function")
+    def qc_rf_obj(self, make_rf_obj, tmp_path):
+        """
+        Stand-in RunfolderObject with bclconvert reports for two samples and a negative control
+        """
+        reports = {
+            "Demultiplex_Stats.csv": DEMULTIPLEX_STATS,
+            "Quality_Metrics.csv": QUALITY_METRICS,
+            "Top_Unknown_Barcodes.csv": TOP_UNKNOWN_BARCODES,
+        }
+        for report_name, report in reports.items():
+            (tmp_path / report_name).write_text(report)
+        return make_rf_obj(
+            sequencer_type="NB552085",
+            bclconvertstats_file=[str(tmp_path / name) for name in reports],
+            bases2fastq_outputpath=str(tmp_path),
+        )
+
+    @pytest.fixture(scope="function")
+    def samples_dict(self):
+        """
+        Return a samples_dict containing the two samples and the negative control
+        """
+        return {
+            "Sample1": {"neg_control": False},
+            "Sample2": {"neg_control": False},
+            "NTC": {"neg_control": True},
+        }
+
+    def test_illumina_qc(self, qc_rf_obj, temp_logger):
+        """
+        Test that read counts and %Q30 are summed across lanes, and the % of lane is the lowest
+        of the sample's lanes
+        """
+        qc_table = sample_qc.SampleQC(qc_rf_obj, temp_logger).get_qc_table()
+        assert qc_table["Sample1"] == {
+            "reads": 1000000,
+            "percent_q30": pytest.approx(80.0),
+            "percent_lane": pytest.approx(40.0),
+        }
+        assert qc_table["Sample2"]["reads"] == 5000
+
+    def test_failed_samples(self, qc_rf_obj, temp_logger, samples_dict, monkeypatch, caplog):
+        """
+        Test that near-empty samples fail QC, negative controls are not assessed, and the most
+        frequent unknown barcode is logged
+        """
+        gate = sample_qc.SampleQC(qc_rf_obj, temp_logger)
+        assert gate.get_failed_samples(samples_dict) == ["Sample2"]
+        assert "GGGG+AAAA (80.0% of unknown)" in caplog.text
+        monkeypatch.setattr(ad_config.SWConfig, "SAMPLE_QC_MIN_PERCENT_Q30", 85)
+        assert gate.get_failed_samples(samples_dict) == ["Sample1", "Sample2"]
+
+    def test_aviti_qc(self, qc_rf_obj, temp_logger):
+        """
+        Test the per-sample QC table is read from the bases2fastq RunStats.json for AVITI runs
+        """
+        qc_rf_obj.sequencer_type = ad_config.SWConfig.AVITI_ID
+        with open(os.path.join(qc_rf_obj.bases2fastq_outputpath, "RunStats.json"), "w") as file:
+            json.dump(
+                {
+                    "NumPolonies": 1000,
+                    "SampleStats": [
+                        {"SampleName": "Sample1", "NumPolonies": 750, "PercentQ30": 92.5},
+                        {"SampleName": "Sample2", "NumPolonies": 250, "PercentQ30": 90.0},
+                    ],
+                },
+                file,
+            )
+        assert sample_qc.SampleQC(qc_rf_obj, temp_logger).get_qc_table()["Sample1"] == {
+            "reads": 750,
+            "percent_q30": 92.5,
+            "percent_lane": 75.0,
+        }
+
+    def test_reports_unavailable(self, qc_rf_obj, temp_logger, samples_dict):
+        """
+        Test that no samples fail QC if the reports cannot be read
+        """
+        os.remove(qc_rf_obj.bclconvertstats_file[0])
+        assert sample_qc.SampleQC(qc_rf_obj, temp_logger).get_failed_samples(samples_dict) is None
+
+    def test_default_action(self):
+        """
+        Test that samples failing QC are flagged by default, skipping them being an explicit opt-in
+        """
+        assert ad_config.SWConfig.SAMPLE_QC_ACTION == "flag"
+        assert ad_config.SWConfig.SAMPLE_QC_ACTION in ad_config.SWConfig.SAMPLE_QC_ACTIONS
@@ -1,4 +1,876 @@
 """ toolbox.py pytest unit tests. Test suite is incomplete
 """
 
+import os
+import builtins
+import sys
+import json
+import gzip
+import pytest
+from toolbox import toolbox
+from ad_logger import ad_logger
+from config.ad_config import ToolboxConfig
+
 # TODO finish this test suite as it is currently incomplete
+
+
+class TestRunfolderStateIndex:
+    """
+    Tests for the RunfolderStateIndex class
+    """
+
+    @pytest.fixture(scope="function")
+    def state_index(self, tmp_path):
+        """
+        Return a RunfolderStateIndex using a temporary database
+        """
+        return toolbox.RunfolderStateIndex(str(tmp_path / "state_index.sqlite3"))
+
+    @pytest.fixture(scope="function")
+    def runfolder_path(self, tmp_path):
+        """
+        Return the path to an empty temporary runfolder
+        """
+        runfolder_path = tmp_path / "999999_M02631_0000_00000INDEX"
+        runfolder_path.mkdir()
+        return str(runfolder_path)
+
+    def test_lifecycle_states(self, state_index, runfolder_path):
+        """
+        Test that the state derived from the flag files follows the runfolder lifecycle
+        """
+        flag_files = ToolboxConfig.FLAG_FILES
+        assert state_index.reconcile(runfolder_path) == "sequencing"
+        open(os.path.join(runfolder_path, flag_files["illumina_seq_complete"]), "w").close()
+        assert state_index.reconcile(runfolder_path) == "sequencing_complete"
+        demultiplexlog = os.path.join(runfolder_path, flag_files["bclconvertlog"])
+        open(demultiplexlog, "w").close()
+        assert state_index.reconcile(runfolder_path) == "demultiplexing"
+        with open(demultiplexlog, "w") as demultiplexlog_file:
+            demultiplexlog_file.write("Conversion Complete.\n")
+        assert state_index.reconcile(runfolder_path) == "demultiplexed"
+        cd_failed_flagfile = os.path.join(runfolder_path, flag_files["cd_failed"])
+        open(cd_failed_flagfile, "w").close()
+        assert state_index.reconcile(runfolder_path) == "cluster_density_failed"
+        os.remove(cd_failed_flagfile)
+        assert state_index.reconcile(runfolder_path) == "demultiplexed"
+        open(os.path.join(runfolder_path, flag_files["upload_started"]), "w").close()
+        assert state_index.reconcile(runfolder_path) == "uploaded"
+
+    def test_get_states_uses_index(self, state_index, runfolder_path, monkeypatch):
+        """
+        Test that runfolders whose directory has not changed are not reconciled, and that
+        creating a flag file causes the runfolder to be reconciled
+        """
+        assert state_index.get_states([runfolder_path]) == {
+            os.path.basename(runfolder_path): "sequencing"
+        }
+        reconciled = []
+        reconcile = state_index.reconcile
+        monkeypatch.setattr(
+            state_index,
+            "reconcile",
+            lambda path: reconciled.append(path) or reconcile(path),
+        )
+        state_index.get_states([runfolder_path])
+        assert not reconciled
+        toolbox.write_lines(
+            os.path.join(runfolder_path, ToolboxConfig.FLAG_FILES["upload_started"]),
+            "w",
+            "Upload started",
+        )
+        # Force a directory modification time change, as the flag file may be created
+        # within the filesystem timestamp resolution
+        os.utime(runfolder_path, ns=(0, 0))
+        assert state_index.get_states([runfolder_path]) == {
+            os.path.basename(runfolder_path): "uploaded"
+        }
+        assert reconciled == [runfolder_path]
+
+    def test_record_decision(self, state_index, runfolder_path):
+        """
+        Test that the last decision is recorded, and runfolders can be queried by state
+        """
+        state_index.record_decision(runfolder_path, "demultiplex: not processed")
+        assert state_index.get_runfolders(["sequencing"]) == {
+            os.path.basename(runfolder_path): runfolder_path
+        }
+        assert state_index.get_runfolders(["uploaded"]) == {}
+
+
+class TestSqliteStore:
+    """
+    Tests for the SqliteStore base class
+    """
+
+    def test_unavailable(self, tmp_path, caplog):
+        """
+        Test that a database that cannot be opened logs a warning, and that reads and writes
+        return None rather than raising
+        """
+        store = toolbox.SoftwareTestCache(str(tmp_path / "missing_dir" / "store.sqlite3"))
+        assert store.is_passed("bclconvert", "key") is None
+        assert store.write("DELETE FROM software_tests") is None
+        assert store.read("SELECT * FROM software_tests", fetch_all=True) is None
+        assert "could not be used, continuing without it" in caplog.text
+
+    def test_subclass_locks(self):
+        """
+        Test that each database has its own lock
+        """
+        assert toolbox.SoftwareTestCache.lock is not toolbox.ChecksumCache.lock
+        assert toolbox.SoftwareTestCache().lock is toolbox.SoftwareTestCache.lock
+
+    def test_added_columns(self, tmp_path):
+        """
+        Test that columns added since a table was created are added to an existing database
+        """
+        db_path = str(tmp_path / "fastq_cache.sqlite3")
+        connection = toolbox.sqlite3.connect(db_path)
+        connection.execute(
+            "CREATE TABLE fastq_validation (fastq_path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, validated TEXT)"
+        )
+        connection.close()
+        fastq_path = tmp_path / "Sample_R1.fastq.gz"
+        fastq_path.write_bytes(b"fastq")
+        cache = toolbox.FastqValidationCache(db_path)
+        cache.record_valid(str(fastq_path), "deep", 100)
+        assert cache.is_valid(str(fastq_path), "deep")
+        assert cache.get_read_count(str(fastq_path)) == 100
+
+
+@pytest.fixture(scope="function")
+def logger_obj(tmp_path):
+    """
+    Return a logger writing to a temporary logfile
+    """
+    return ad_logger.AdLogger(
+        __name__, "demux", str(tmp_path / "temp.log")
+    ).get_logger()
+
+
+@pytest.fixture(scope="function")
+def fastq_dir(tmp_path, monkeypatch):
+    """
+    Return a temporary directory containing valid gzipped fastqs, with the validation
+    cache written to the same temporary directory
+    """
+    monkeypatch.setattr(ToolboxConfig, "AD_LOGDIR", str(tmp_path))
+    fastq_dir = tmp_path / "fastqs"
+    fastq_dir.mkdir()
+    for sample in range(4):
+        for read in ["R1", "R2"]:
+            with gzip.open(fastq_dir / f"Sample{sample}_S{sample}_{read}_001.fastq.gz", "wb") as fastq:
+                fastq.write(b"@read1\nACGT\n+\nIIII\n" * 100)
+    return str(fastq_dir)
+
+
+class TestValidateFastqs:
+    """
+    Tests for the validate_fastqs function
+    """
+
+    def test_valid_fastqs_cached(self, fastq_dir, logger_obj, caplog):
+        """
+        Test that valid fastqs pass, and are not re-validated while unchanged
+        """
+        assert toolbox.validate_fastqs(fastq_dir, logger_obj, processes=2)
+        assert toolbox.validate_fastqs(fastq_dir, logger_obj, processes=2)
+        assert "8 fastqs previously validated and unchanged" in caplog.text
+
+    def test_changed_fastq_revalidated(self, fastq_dir, logger_obj):
+        """
+        Test that a fastq that changes after it has been validated is re-validated
+        """
+        assert toolbox.validate_fastqs(fastq_dir, logger_obj, processes=2)
+        fastq_path = os.path.join(fastq_dir, "Sample0_S0_R1_001.fastq.gz")
+        with open(fastq_path, "wb") as fastq:
+            fastq.write(b"not a gzip file")
+        assert not toolbox.validate_fastqs(fastq_dir, logger_obj, processes=2)
+
+    def test_invalid_fastqs_listed(self, fastq_dir, logger_obj):
+        """
+        Test that all invalid fastqs are listed (not only the first) when requested
+        """
+        for fastq in ["Sample1_S1_R1_001.fastq.gz", "Sample3_S3_R2_001.fastq.gz"]:
+            with open(os.path.join(fastq_dir, fastq), "wb") as fastq_file:
+                fastq_file.write(b"not a gzip file")
+        invalid_fastqs = []
+        assert not toolbox.validate_fastqs(
+            fastq_dir, logger_obj, processes=1, invalid_fastqs=invalid_fastqs
+        )
+        assert sorted(invalid_fastqs) == [
+            "Sample1_S1_R1_001.fastq.gz",
+            "Sample3_S3_R2_001.fastq.gz",
+        ]
+
+    def test_deep_mode_read_counts(self, fastq_dir, logger_obj):
+        """
+        Test that deep mode validates the fastqs and records the read count of each fastq
+        """
+        assert toolbox.validate_fastqs(fastq_dir, logger_obj, processes=2, mode="deep")
+        cache = toolbox.FastqValidationCache()
+        for fastq in os.listdir(fastq_dir):
+            assert cache.get_read_count(os.path.join(fastq_dir, fastq)) == 100
+
+    def test_deep_mode_truncated(self, fastq_dir, logger_obj):
+        """
+        Test that deep mode detects a fastq truncated after the first record, which passes
+        the quick mode checks
+        """
+        fastq_path = os.path.join(fastq_dir, "Sample0_S0_R1_001.fastq.gz")
+        with open(fastq_path, "rb") as fastq:
+            data = fastq.read()
+        with open(fastq_path, "wb") as fastq:
+            fastq.write(data[: len(data) // 2] + data[-4:])  # Truncated, with ISIZE trailer
+        assert not toolbox.validate_fastqs(fastq_dir, logger_obj, processes=2, mode="deep")
+
+    def test_deep_mode_pair_mismatch(self, fastq_dir, logger_obj):
+        """
+        Test that deep mode fails if R1 and R2 contain different numbers of reads
+        """
+        with gzip.open(os.path.join(fastq_dir, "Sample0_S0_R2_001.fastq.gz"), "wb") as fastq:
+            fastq.write(b"@read1\nACGT\n+\nIIII\n" * 99)
+        assert toolbox.validate_fastqs(fastq_dir, logger_obj, processes=2)
+        assert not toolbox.validate_fastqs(fastq_dir, logger_obj, processes=2, mode="deep")
+
+
+class TestValidateFastqSampled:
+    """
+    Tests for the validate_fastq_sampled function
+    """
+
+    @pytest.fixture(scope="function")
+    def sampled_fastq(self, tmp_path, monkeypatch):
+        """
+        Return the path to a multi-member gzipped fastq, with the sampled mode window sizes reduced
+        so that the fastq is sampled rather than fully decompressed
+        """
+        monkeypatch.setattr(ToolboxConfig, "FASTQ_SAMPLED_MIN_BYTES", 1024)
+        monkeypatch.setattr(ToolboxConfig, "FASTQ_SAMPLED_WINDOW_BYTES", 32 * 1024)
+        monkeypatch.setattr(ToolboxConfig, "FASTQ_SAMPLED_SEARCH_BYTES", 16 * 1024)
+        records = b"".join(
+            b"@read%d\n%s\n+\n%s\n" % (read, b"ACGTN"[read % 5 :] * 30, b"IF:,#"[read % 5 :] * 30)
+            for read in range(20000)
+        )
+        fastq_path = tmp_path / "Sample0_S0_R1_001.fastq.gz"
+        fastq_path.write_bytes(
+            b"".join(
+                gzip.compress(records[start : start + 65280])
+                for start in range(0, len(records), 65280)
+            )
+        )
+        return str(fastq_path)
+
+    def test_valid_fastq(self, sampled_fastq):
+        """
+        Test that a valid fastq passes sampled validation
+        """
+        assert toolbox.validate_fastq_sampled(sampled_fastq) == (True, None, None)
+
+    def test_small_fastq_deep(self, sampled_fastq, monkeypatch):
+        """
+        Test that fastqs smaller than FASTQ_SAMPLED_MIN_BYTES are fully decompressed
+        """
+        monkeypatch.setattr(ToolboxConfig, "FASTQ_SAMPLED_MIN_BYTES", 1024**3)
+        assert toolbox.validate_fastq_sampled(sampled_fastq) == (True, None, 20000)
+
+    def test_truncated_fastq(self, sampled_fastq):
+        """
+        Test that a fastq truncated part-way through its final gzip member fails, although it
+        passes the quick mode checks
+        """
+        with open(sampled_fastq, "rb") as fastq:
+            data = fastq.read()
+        with open(sampled_fastq, "wb") as fastq:
+            fastq.write(data[:-1000] + data[-4:])  # Truncated, with ISIZE trailer
+        assert toolbox.validate_fastq_gzip(sampled_fastq)[0]
+        assert not toolbox.validate_fastq_sampled(sampled_fastq)[0]
+
+    def test_corrupt_window(self, sampled_fastq):
+        """
+        Test that corruption within a sampled window fails
+        """
+        with open(sampled_fastq, "rb") as fastq:
+            data = bytearray(fastq.read())
+        offset = len(data) // (ToolboxConfig.FASTQ_SAMPLED_WINDOWS + 1) + 20000
+        data[offset : offset + 100] = bytes(100)
+        with open(sampled_fastq, "wb") as fastq:
+            fastq.write(data)
+        assert not toolbox.validate_fastq_sampled(sampled_fastq)[0]
+
+
+class TestStreamSubprocessCommand:
+    """
+    Tests for the stream_subprocess_command function and CommandProgress class
+    """
+
+    def test_output_streamed(self, logger_obj, tmp_path):
+        """
+        Test that output lines are written to the output logger, and only a bounded tail of
+        each stream is returned
+        """
+        output_logger = ad_logger.AdLogger(
+            "stream_output", "demultiplex_docker_log", str(tmp_path / "output.log")
+        ).get_logger()
+        out, err, returncode = toolbox.stream_subprocess_command(
+            "for i in $(seq 1 500); do echo out$i; echo err$i >&2; done",
+            logger_obj,
+            output_logger,
+        )
+        assert returncode == 0
+        assert out.split("\n") == [f"out{i}" for i in range(301, 501)]
+        assert err.split("\n")[-1] == "err500"
+        with open(tmp_path / "output.log") as output_log:
+            contents = output_log.read()
+        assert "out1\n" in contents and "err500" in contents
+
+    def test_failed_command(self, logger_obj):
+        """
+        Test that the returncode and tail of stderr of a failed command are returned
+        """
+        out, err, returncode = toolbox.stream_subprocess_command(
+            "echo failed >&2; exit 3", logger_obj
+        )
+        assert (out, err, returncode) == ("", "failed", 3)
+
+    def test_progress_parsed(self, logger_obj, caplog):
+        """
+        Test that progress lines (including carriage return separated progress bars) are parsed
+        into a percent complete and logged
+        """
+        progress = toolbox.CommandProgress("bases2fastq", logger_obj, interval=0)
+        toolbox.stream_subprocess_command(
+            "printf 'Demultiplexing 10%%\\rDemultiplexing 55.5%%\\r'", logger_obj, progress=progress
+        )
+        assert progress.percent == 55.5
+        assert "bases2fastq progress: 55.5% complete" in caplog.text
+
+    def test_progress_throughput(self, logger_obj):
+        """
+        Test that lines that are not progress lines are ignored, and the throughput is reported
+        as percent per minute
+        """
+        progress = toolbox.CommandProgress("bases2fastq", logger_obj)
+        assert progress.update("Demultiplexing 25%")
+        assert not progress.update("Writing fastqs")
+        assert progress.percent == 25.0
+        assert progress.get_throughput(60) == "25.00%/min"
+
+
+class TestSamplesheetValidationCache:
+    """
+    Tests for the SamplesheetValidationCache class
+    """
+
+    @pytest.fixture(scope="function")
+    def ss_cache(self, tmp_path):
+        """
+        Return a SamplesheetValidationCache using a temporary database
+        """
+        return toolbox.SamplesheetValidationCache(str(tmp_path / "ss_cache.sqlite3"))
+
+    @pytest.fixture(scope="function")
+    def samplesheet_path(self, tmp_path):
+        """
+        Return the path to a temporary SampleSheet
+        """
+        samplesheet_path = tmp_path / "999999_M02631_0000_00000TEST_SampleSheet.csv"
+        samplesheet_path.write_text("[Data]\nSample_ID,Sample_Name\n")
+        return str(samplesheet_path)
+
+    def test_unchanged_samplesheet_cached(self, ss_cache, samplesheet_path):
+        """
+        Test that the result for an unchanged SampleSheet is returned from the cache
+        """
+        key = ss_cache.get_key(samplesheet_path, "1.4.0", [["M02631"], {"Pan1234"}])
+        assert ss_cache.get_result(key) is None
+        ss_cache.record_result(key, False, False, "Invalid sample name")
+        assert ss_cache.get_result(
+            ss_cache.get_key(samplesheet_path, "1.4.0", [["M02631"], {"Pan1234"}])
+        ) == (False, False, "Invalid sample name")
+
+    def test_changed_samplesheet_not_cached(self, ss_cache, samplesheet_path):
+        """
+        Test that a changed SampleSheet, validator version or configuration is not returned
+        from the cache
+        """
+        key = ss_cache.get_key(samplesheet_path, "1.4.0", [["M02631"]])
+        ss_cache.record_result(key, True, False, "")
+        assert ss_cache.get_key(samplesheet_path, "1.5.0", [["M02631"]]) != key
+        assert ss_cache.get_key(samplesheet_path, "1.4.0", [["M02631", "A01229"]]) != key
+        with open(samplesheet_path, "a") as samplesheet:
+            samplesheet.write("Pan1234-Sample,Pan1234-Sample\n")
+        assert ss_cache.get_result(ss_cache.get_key(samplesheet_path, "1.4.0", [["M02631"]])) is None
+
+    def test_missing_samplesheet(self, ss_cache, tmp_path):
+        """
+        Test that a missing SampleSheet has no key, so is always validated
+        """
+        key = ss_cache.get_key(str(tmp_path / "missing.csv"), "1.4.0", [])
+        assert key is None
+        assert ss_cache.get_result(key) is None
+
+
+class TestWriteLinesAtomic:
+    """
+    Tests for the write_lines_atomic function
+    """
+
+    def test_file_replaced(self, tmp_path):
+        """
+        Test that the file is replaced with the new lines, and no temporary file remains
+        """
+        file_path = tmp_path / "flag.txt"
+        file_path.write_text("old contents\n")
+        toolbox.write_lines_atomic(str(file_path), ["line 1", "line 2"])
+        assert file_path.read_text() == "line 1\nline 2\n"
+        assert os.listdir(tmp_path) == ["flag.txt"]
+
+    def test_failed_write_leaves_file(self, tmp_path, monkeypatch):
+        """
+        Test that if the rename fails, the original file is unchanged and the temporary
+        file is removed
+        """
+        file_path = tmp_path / "flag.txt"
+        file_path.write_text("old contents\n")
+
+        def failed_replace(src, dst):
+            raise OSError("No space left on device")
+
+        monkeypatch.setattr(toolbox.os, "replace", failed_replace)
+        with pytest.raises(OSError):
+            toolbox.write_lines_atomic(str(file_path), "new contents")
+        assert file_path.read_text() == "old contents\n"
+        assert os.listdir(tmp_path) == ["flag.txt"]
+
+
+class TestSoftwareTestCache:
+    """
+    Tests for the SoftwareTestCache class and test_software function
+    """
+
+    @pytest.fixture(scope="function")
+    def software_cache(self, tmp_path, monkeypatch):
+        """
+        Use a temporary software test cache, and count the software tests carried out
+        """
+        db_path = str(tmp_path / "software_test_cache.sqlite3")
+        software_test_cache = toolbox.SoftwareTestCache
+        monkeypatch.setattr(toolbox, "SoftwareTestCache", lambda: software_test_cache(db_path))
+        tested = []
+
+        def test_programs(software_name, logger):
+            tested.append(software_name)
+            return True
+
+        monkeypatch.setattr(toolbox, "test_programs", test_programs)
+        monkeypatch.setattr(toolbox, "get_software_key", lambda software_name: "sha256:0001")
+        return tested
+
+    def test_passed_cached(self, software_cache, logger_obj):
+        """
+        Test that passing software tests are not repeated while the image is unchanged
+        """
+        assert toolbox.test_processing_software(logger_obj)
+        assert sorted(software_cache) == ["bases2fastq", "bclconvert", "gatk_collect_lane_metrics"]
+        assert toolbox.test_processing_software(logger_obj)
+        assert len(software_cache) == 3
+
+    def test_changed_key_or_expired(self, tmp_path, monkeypatch):
+        """
+        Test that a cached pass is not used for a different key, or once the TTL has elapsed
+        """
+        cache = toolbox.SoftwareTestCache(str(tmp_path / "software_test_cache.sqlite3"))
+        cache.record_passed("bclconvert", "sha256:0001")
+        assert cache.is_passed("bclconvert", "sha256:0001")
+        assert not cache.is_passed("bclconvert", "sha256:0002")
+        assert not cache.is_passed("bclconvert", None)
+        monkeypatch.setattr(ToolboxConfig, "SOFTWARE_TEST_TTL", -1)
+        assert not cache.is_passed("bclconvert", "sha256:0001")
+
+    def test_failed_test_exits(self, software_cache, logger_obj, monkeypatch):
+        """
+        Test that a failing software test, run in a worker thread, exits the script
+        """
+
+        def test_programs(software_name, logger):
+            sys.exit(1)
+
+        monkeypatch.setattr(toolbox, "test_programs", test_programs)
+        with pytest.raises(SystemExit):
+            toolbox.test_processing_software(logger_obj)
+
+
+class TestRunfolderObject:
+    """
+    Tests for the RunfolderObject class
+    """
+
+    @pytest.fixture(scope="function")
+    def aviti_runfolder(self, tmp_path, monkeypatch):
+        """
+        Return the name of an AVITI runfolder containing RunParameters.json, in a temporary
+        AVITI runfolders directory
+        """
+        monkeypatch.setattr(ToolboxConfig, "AVITI_RUNFOLDER", str(tmp_path))
+        runfolder_name = f"20240101_{ToolboxConfig.AVITI_ID}_0001_TEST"
+        (tmp_path / runfolder_name).mkdir()
+        (tmp_path / runfolder_name / "RunParameters.json").write_text(
+            json.dumps(
+                {
+                    "Date": "2024-01-01T00:00:00",
+                    "InstrumentName": ToolboxConfig.AVITI_ID,
+                    "Side": "SideA",
+                    "FlowcellID": "FC0001",
+                }
+            )
+        )
+        return runfolder_name
+
+    def test_construction_side_effect_free(self, aviti_runfolder, monkeypatch):
+        """
+        Test that construction reads no files and creates no directories, and that the output
+        directory is only created by prepare()
+        """
+        opened = []
+
+        def get_credential(file):
+            opened.append(file)
+            return "token"
+
+        monkeypatch.setattr(toolbox, "get_credential", get_credential)
+        rf_obj = toolbox.RunfolderObject(aviti_runfolder, "20240101_000000")
+        assert not opened
+        assert rf_obj.samplesheet_name == f"240101_{ToolboxConfig.AVITI_ID}_AFC0001_SampleSheet.csv"
+        assert not os.path.exists(rf_obj.bases2fastq_outputpath)
+        rf_obj.prepare()
+        assert os.path.isdir(rf_obj.bases2fastq_outputpath)
+        assert rf_obj.dnanexus_auth == "token"
+        assert rf_obj.dnanexus_auth == "token"
+        assert len(opened) == 1
+
+    def test_construction_reads_no_files(self, monkeypatch):
+        """
+        Test that constructing RunfolderObjects for 500 runfolders, as each script does on every
+        run, neither reads the DNAnexus credential file nor opens any file, and derives no
+        attributes until they are accessed
+        """
+        opened = []
+
+        def record_open(file, *args, **kwargs):
+            opened.append(file)
+            raise AssertionError(f"File opened during construction: {file}")
+
+        monkeypatch.setattr(toolbox, "get_credential", record_open)
+        attributes = [
+            name
+            for name, value in vars(toolbox.RunfolderObject).items()
+            if isinstance(value, toolbox.cached_property)
+        ]
+        with monkeypatch.context() as patch:
+            patch.setattr(builtins, "open", record_open)
+            rf_objs = [
+                toolbox.RunfolderObject(
+                    f"999999_M02631_{number:04d}_00000TEST", "20240101_000000"
+                )
+                for number in range(500)
+            ]
+        assert not opened
+        assert all(
+            attribute not in vars(rf_obj) for rf_obj in rf_objs for attribute in attributes
+        )
+
+
+class TestFastqDirectoryIndex:
+    """
+    Tests for the FastqDirectoryIndex class
+    """
+
+    @pytest.fixture(scope="function")
+    def fastq_index(self, tmp_path):
+        """
+        Return a FastqDirectoryIndex of a directory containing bclconvert, bases2fastq,
+        undetermined and non-fastq files
+        """
+        for file_name in [
+            "NGS1_01_Pan1234_S1_R1_001.fastq.gz",
+            "NGS1_01_Pan1234_S1_R2_001.fastq.gz",
+            "NGS1_010_Pan1234_S10_R1_001.fastq.gz",
+            "NGS1_02_Pan1234_R1.fastq.gz",
+            "Undetermined_S0_R1_001.fastq.gz",
+            "Reports.txt",
+        ]:
+            (tmp_path / file_name).write_bytes(b"\x1f\x8b")
+        (tmp_path / "Reports").mkdir()
+        return toolbox.FastqDirectoryIndex(str(tmp_path))
+
+    def test_files_indexed(self, fastq_index):
+        """
+        Test that the files are indexed with their size and modification time, and directories
+        are not indexed
+        """
+        assert len(fastq_index.files) == 6
+        assert "Reports" not in fastq_index.files
+        size, mtime_ns = fastq_index.files["Reports.txt"]
+        assert size == 2
+        assert mtime_ns == os.stat(fastq_index.get_path("Reports.txt")).st_mtime_ns
+
+    def test_find(self, fastq_index):
+        """
+        Test that fastqs are found by exact sample name (a sample name contained in another
+        sample's name does not match the other sample's fastqs), for bclconvert and bases2fastq
+        names
+        """
+        assert fastq_index.find("NGS1_01_Pan1234", "R1") == "NGS1_01_Pan1234_S1_R1_001.fastq.gz"
+        assert fastq_index.find("NGS1_01_Pan1234", "R2") == "NGS1_01_Pan1234_S1_R2_001.fastq.gz"
+        assert fastq_index.find("NGS1_010_Pan1234", "R1") == (
+            "NGS1_010_Pan1234_S10_R1_001.fastq.gz"
+        )
+        assert fastq_index.find("NGS1_02_Pan1234", "R1") == "NGS1_02_Pan1234_R1.fastq.gz"
+        assert fastq_index.find("NGS1_02_Pan1234", "R2") is None
+
+    def test_find_unexpected_name(self, tmp_path):
+        """
+        Test that fastqs that are not named as expected are found by substring match
+        """
+        (tmp_path / "NGS1_01_Pan1234_R1_extra.fastq.gz").write_bytes(b"")
+        fastq_index = toolbox.FastqDirectoryIndex(str(tmp_path))
+        assert fastq_index.find("NGS1_01_Pan1234", "R1") == "NGS1_01_Pan1234_R1_extra.fastq.gz"
+
+    @pytest.mark.parametrize(
+        "fastq_name, expected",
+        [
+            ("NGS1_01_Pan1234_S1_R1_001.fastq.gz", ("NGS1_01_Pan1234", None, "R1")),
+            ("NGS1_01_Pan1234_S1_L002_I1_001.fastq.gz", ("NGS1_01_Pan1234", "_L002", "I1")),
+            ("NGS1_01_Pan1234_R2.fastq.gz", ("NGS1_01_Pan1234", None, "R2")),
+            ("NGS1_S2_Pan1234_S12_L001_R1_001.fastq.gz", ("NGS1_S2_Pan1234", "_L001", "R1")),
+            ("NGS1_01_Pan1234_S2_R1.fastq.gz", ("NGS1_01_Pan1234_S2", None, "R1")),
+            ("Reports.txt", None),
+        ],
+    )
+    def test_fastq_name_pattern(self, fastq_name, expected):
+        """
+        Test that the sample name, lane and read are parsed from bclconvert and bases2fastq fastq
+        names, and that _S followed by digits is only removed as the bclconvert sample number
+        """
+        match = toolbox.FASTQ_NAME_PATTERN.match(fastq_name)
+        if expected is None:
+            assert match is None
+        else:
+            assert match.group("sample_name", "lane", "read") == expected
+
+    def test_missing_directory(self, tmp_path):
+        """
+        Test that a missing fastq directory gives an empty index
+        """
+        fastq_index = toolbox.FastqDirectoryIndex(str(tmp_path / "missing"))
+        assert fastq_index.files == {}
+        assert fastq_index.find("NGS1_01_Pan1234", "R1") is None
+
+
+class TestPannumMatcher:
+    """
+    Tests for the precompiled panel number matcher (match_pannum() and get_samplename_dict())
+    """
+
+    @pytest.fixture(scope="function")
+    def samplesheet_path(self, tmp_path):
+        """
+        Return the path of a synthetic 384-sample SampleSheet, cycling through the
+        config-defined panel numbers
+        """
+        lines = ["[Header]", "FileFormatVersion,2", "[BCLConvert_Data]", "Sample_ID,index,index2"]
+        for number in range(384):
+            pannum = ToolboxConfig.PANELS[number % len(ToolboxConfig.PANELS)]
+            lines.append(
+                f"NGS999_{number:03d}_{100000 + number}_JD_U_VCP1{pannum}_{pannum},"
+                f"ACGTACGT,TGCATGCA"
+            )
+        samplesheet_path = tmp_path / "SampleSheet.csv"
+        samplesheet_path.write_text("\n".join(lines) + "\n")
+        return str(samplesheet_path)
+
+    def test_match_pannum(self):
+        """
+        Test that the panel number and its settings are returned, that a panel number is not
+        matched within a longer number, and that None is returned if there is no panel number
+        """
+        pannum = ToolboxConfig.PANELS[0]
+        assert toolbox.match_pannum(f"NGS999_01_{pannum}_S1") == (
+            pannum,
+            ToolboxConfig.PANEL_DICT[pannum],
+        )
+        assert toolbox.match_pannum(f"NGS999_01_{pannum}9999") == (None, None)
+        assert toolbox.match_pannum("NGS999_01_Pan0") == (None, None)
+
+    def test_samplename_dict_matches_scan(self, samplesheet_path, logger_obj):
+        """
+        Test that get_samplename_dict() for a 384-sample SampleSheet returns the same panel
+        numbers as testing every line for every panel number (the previous implementation)
+        """
+        lines = list(reversed(toolbox.read_lines(samplesheet_path)))[:384]
+        scanned = {}
+        for line in lines:
+            for pannum in ToolboxConfig.PANELS:
+                if pannum in line:
+                    scanned[line.split(",")[0]] = pannum
+        toolbox.SAMPLESHEET_CACHE.clear()
+        samplename_dict = toolbox.get_samplename_dict(logger_obj, samplesheet_path)
+        assert samplename_dict == scanned
+
+
+class TestSampleSheet:
+    """
+    Tests for the SampleSheet class and read_samplesheet()
+    """
+
+    @pytest.fixture(scope="function")
+    def samplesheet_path(self, tmp_path):
+        """
+        Return the path of a lane-split v2 SampleSheet
+        """
+        pannum = ToolboxConfig.PANELS[0]
+        samplesheet_path = tmp_path / "SampleSheet.csv"
+        samplesheet_path.write_text(
+            "\n".join(
+                [
+                    "[Header],,",
+                    "FileFormatVersion,2,",
+                    "RunName,TEST,",
+                    "[Reads],,",
+                    "Read1Cycles,151,",
+                    "Read2Cycles,151,",
+                    "[BCLConvert_Data],,",
+                    "Lane,Sample_ID,index,index2",
+                    f"1,NGS999_01_{pannum},ACGTACGT,TGCATGCA",
+                    f"2,NGS999_01_{pannum},ACGTACGT,TGCATGCA",
+                    "1,NGS999_02_NoPanel,CCCCAAAA,GGGGTTTT",
+                    ",,,",
+                    "[Cloud_Data],,",
+                    "Sample_ID,ProjectName",
+                ]
+            )
+            + "\n"
+        )
+        return str(samplesheet_path)
+
+    def test_parsed(self, samplesheet_path):
+        """
+        Test that the header, reads and data rows are parsed, and the accessors return the
+        sample IDs, panel numbers, indexes and lanes
+        """
+        samplesheet = toolbox.SampleSheet(samplesheet_path)
+        pannum = ToolboxConfig.PANELS[0]
+        assert samplesheet.header == {"FileFormatVersion": "2", "RunName": "TEST"}
+        assert samplesheet.reads == {"Read1Cycles": 151, "Read2Cycles": 151}
+        assert samplesheet.header_lines[-1] == "Lane,Sample_ID,index,index2"
+        assert samplesheet.get_sample_ids() == [f"NGS999_01_{pannum}", "NGS999_02_NoPanel"]
+        assert samplesheet.get_pannums() == {
+            f"NGS999_01_{pannum}": pannum,
+            "NGS999_02_NoPanel": None,
+        }
+        assert samplesheet.get_indexes()["NGS999_02_NoPanel"] == ("CCCCAAAA", "GGGGTTTT")
+        assert samplesheet.get_lanes() == [1, 2]
+
+    def test_get_lines(self, samplesheet_path):
+        """
+        Test that only the data rows of other samples are removed
+        """
+        samplesheet = toolbox.SampleSheet(samplesheet_path)
+        lines = samplesheet.get_lines({"NGS999_02_NoPanel"})
+        assert len(lines) == len(samplesheet.lines) - 2
+        assert lines[-1] == "Sample_ID,ProjectName"
+
+    def test_cached(self, samplesheet_path):
+        """
+        Test that the parsed SampleSheet is reused until the SampleSheet changes
+        """
+        toolbox.SAMPLESHEET_CACHE.clear()
+        samplesheet = toolbox.read_samplesheet(samplesheet_path)
+        assert toolbox.read_samplesheet(samplesheet_path) is samplesheet
+        with open(samplesheet_path, "a") as samplesheet_file:
+            samplesheet_file.write("NGS999_03_Extra,\n")
+        assert toolbox.read_samplesheet(samplesheet_path) is not samplesheet
+
+
+class TestExecuteCommands:
+    """
+    Tests for execute_commands()
+    """
+
+    def test_results(self, logger_obj):
+        """
+        Test that a CommandResult is returned for each command in command order, and that
+        arguments are passed without a shell
+        """
+        results = toolbox.execute_commands(
+            [
+                [sys.executable, "-c", "import sys; print(sys.argv[1])", "$HOME; echo injected"],
+                [sys.executable, "-c", "import sys; sys.stderr.write('error'); sys.exit(3)"],
+            ],
+            logger_obj,
+        )
+        assert results[0].returncode == 0
+        assert results[0].stdout == "$HOME; echo injected"
+        assert results[1].returncode == 3
+        assert results[1].stderr == "error"
+        assert not any(result.timed_out for result in results)
+
+    def test_output_truncated(self, logger_obj, monkeypatch):
+        """
+        Test that only the last SUBPROCESS_TAIL_LINES lines of output are returned
+        """
+        monkeypatch.setattr(ToolboxConfig, "SUBPROCESS_TAIL_LINES", 2)
+        (result,) = toolbox.execute_commands(
+            [[sys.executable, "-c", "print('1\\n2\\n3')"]], logger_obj
+        )
+        assert result.stdout == "2\n3"
+
+    def test_concurrent(self, logger_obj, monkeypatch, tmp_path):
+        """
+        Test that commands run concurrently, at most COMMAND_CONCURRENCY at a time. Each command
+        records its start and end time, and the number of commands running at once is counted
+        """
+        monkeypatch.setattr(ToolboxConfig, "COMMAND_CONCURRENCY", 2)
+        script = (
+            "import sys, time; start = time.time(); time.sleep(0.2); "
+            "open(sys.argv[1], 'w').write(f'{start} {time.time()}')"
+        )
+        results = toolbox.execute_commands(
+            [
+                [sys.executable, "-c", script, str(tmp_path / f"command_{number}.txt")]
+                for number in range(4)
+            ],
+            logger_obj,
+        )
+        assert all(result.returncode == 0 for result in results)
+        events = []
+        for times_file in tmp_path.glob("command_*.txt"):
+            start, end = (float(value) for value in times_file.read_text().split())
+            events.extend([(start, 1), (end, -1)])
+        running, max_running = 0, 0
+        for _, change in sorted(events):
+            running += change
+            max_running = max(max_running, running)
+        assert len(events) == 8
+        assert max_running == 2
+
+    def test_timeout(self, logger_obj):
+        """
+        Test that a command is killed at its timeout
+        """
+        (result,) = toolbox.execute_commands(
+            [[sys.executable, "-c", "import time; time.sleep(10)"]], logger_obj, timeout=0.5
+        )
+        assert result.timed_out
+        assert result.returncode != 0
+        assert result.duration < 5
+
+    def test_not_started(self, logger_obj, tmp_path):
+        """
+        Test that a command that cannot be started has no returncode
+        """
+        (result,) = toolbox.execute_commands([[str(tmp_path / "missing")]], logger_obj)
+        assert result.returncode is None
@@ -1,9 +1,46 @@
 """
 This script contains functions and classes shared across scripts / modules. Contains the following classes:
 
+- CommandResult
+    Result of a command run by execute_commands(): exit code, duration and output tails
+
+- RunfolderStateIndex
+    SQLite-backed index of runfolder lifecycle state, keyed by runfolder name
+
+- FastqValidationCache
+    SQLite-backed cache of fastq validation results, keyed by fastq path, size and modification time
+
+- SamplesheetValidationCache
+    SQLite-backed cache of SampleSheet validation results, keyed by SampleSheet content hash and
+    validator version / configuration hash
+
+- SoftwareTestCache
+    SQLite-backed cache of passing software tests, keyed by docker image ID or executable path
+    and modification time
+
+- ChecksumCache
+    SQLite-backed cache of file md5 checksums calculated by the built-in integrity check, keyed
+    by file path, size and modification time
+
+- ThreadLayoutStore
+    SQLite-backed store of the fastest demultiplexing thread layout per host, tool and
+    sequencer type
+
+- CommandProgress
+    Parse progress lines from a streamed command's output, periodically logging the percent
+    complete and throughput
+
+- SampleSheet
+    Parsed SampleSheet (sections, reads, data rows), with accessors for sample IDs, panel
+    numbers, indexes and lanes
+
 - RunfolderObject:
     An object with runfolder-specific properties
 
+- FastqDirectoryIndex
+    Snapshot of a fastq directory from a single scan, mapping sample name and read to fastq
+    name, size and modification time
+
 - RunfolderSamples
     An object with properties derived from the samples names in the samplesheet
 
@@ -14,19 +51,51 @@ This script contains functions and classes shared across scripts / modules. Cont
 import sys
 import os
 import re
+import shlex
+import asyncio
 import subprocess
 import logging
 import time
 import json
+import hashlib
+import sqlite3
+import datetime
+import socket
+import threading
+import multiprocessing
 import seglh_naming
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from collections import deque
+from contextlib import closing
+from functools import cached_property
 from pathlib import Path
 from typing import Tuple
 from distutils.spawn import find_executable
 from typing import Union, Optional
-from config.ad_config import ToolboxConfig
+from config.ad_config import ToolboxConfig, AdLoggerConfig
 from ad_logger.ad_logger import RunfolderLoggers
 import gzip
 import zlib
+from itertools import repeat
+
+# Sample name, lane and read of a bclconvert (Sample_S1_R1_001.fastq.gz,
+# Sample_S1_L001_R1_001.fastq.gz) or bases2fastq (Sample_R1.fastq.gz) fastq name. The sample
+# number (_S1) is only removed from bclconvert names, and only if it precedes the lane / read, so
+# sample names containing _S followed by digits (e.g. NGS1_S2_Pan1234) are kept whole
+FASTQ_NAME_PATTERN = re.compile(
+    r"^(?P<sample_name>.+?)"
+    r"(?:_S\d+(?P<lane>_L\d{3})?(?=_[RI]\d_001\.fastq\.gz$)|(?=_[RI]\d\.fastq\.gz$))"
+    r"_(?P<read>[RI]\d)(?:_001)?\.fastq\.gz$"
+)
+# Alternation of the config-defined panel numbers, compiled once. The negative lookahead stops a
+# panel number matching the start of a longer panel number (e.g. Pan123 within Pan1234)
+PANNUM_PATTERN = re.compile(
+    r"(?:%s)(?!\d)" % "|".join(re.escape(pannum) for pannum in ToolboxConfig.PANELS)
+)
+# Parsed SampleSheets keyed by path, with the (size, modification time in ns) they were parsed at
+SAMPLESHEET_CACHE = {}
+# Logs warnings from the SQLite databases (SqliteStore), which are not runfolder-specific
+sqlite_logger = logging.getLogger(f"{AdLoggerConfig.REPO_NAME}.sqlite_store")
 
 
 def get_credential(file: str) -> None:
@@ -42,7 +111,8 @@ def get_credential(file: str) -> None:
 
 def write_lines(file: str, mode: str, lines: str) -> None:
     """
-    Write line to newline of file
+    Write line to newline of file. If the file is a runfolder flag file, the runfolder state
+    index is updated
         :param file (str):          Filepath
         :param mode (str):          Mode to open the file in
         :param lines (str | list):  Line (/s)
@@ -53,6 +123,42 @@ def write_lines(file: str, mode: str, lines: str) -> None:
     with open(file, mode) as open_file:
         for line in lines:
             open_file.write(f"{line}\n")
+    if os.path.basename(file) in ToolboxConfig.FLAG_FILES.values():
+        RunfolderStateIndex().record_flag_file(file)
+
+
+def write_lines_atomic(file: str, lines: str) -> None:
+    """
+    Write lines to a temporary file in the same directory, and rename it to the filepath, so
+    that a partially written file is never seen by other processes (e.g. flag files read by
+    concurrent script runs). If the file is a runfolder flag file, the runfolder state index
+    is updated
+        :param file (str):          Filepath
+        :param lines (str | list):  Line (/s)
+        :return None:
+    """
+    if isinstance(lines, str):
+        lines = [lines]
+    tmp_path = os.path.join(
+        os.path.dirname(file),
+        f".{os.path.basename(file)}.{os.getpid()}.{threading.get_ident()}.tmp",
+    )
+    try:
+        # Opened with the default file mode so that the process umask is applied, as for open()
+        with os.fdopen(
+            os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666), "w"
+        ) as open_file:
+            for line in lines:
+                open_file.write(f"{line}\n")
+            open_file.flush()
+            os.fsync(open_file.fileno())
+        os.replace(tmp_path, file)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    if os.path.basename(file) in ToolboxConfig.FLAG_FILES.values():
+        RunfolderStateIndex().record_flag_file(file)
 
 
 def read_lines(file: str) -> None:
@@ -162,6 +268,278 @@ def execute_subprocess_command(
     return out, err, returncode
 
 
+def stream_subprocess_command(
+    command: str,
+    logger: logging.Logger,
+    output_logger: Optional[logging.Logger] = None,
+    progress: Optional["CommandProgress"] = None,
+) -> Tuple[str, str, int]:
+    """
+    Execute a subprocess, streaming its output line by line as it is produced rather than
+    buffering it until the command exits. Each stdout / stderr line is written to output_logger
+    and passed to progress (if provided). Only the last SUBPROCESS_TAIL_LINES lines of each stream
+    are retained (for error reporting), so memory use is bounded for long-running commands
+        :param command(str):                    Input command
+        :param logger(logging.Logger):          Logger
+        :param output_logger(logging.Logger):   Logger to which command output lines are written
+        :param progress (CommandProgress):      Parses progress lines from the command output
+        :return (stdout(str),
+        stderr(str),
+        returncode(int))(tuple):                Tail of stdout, tail of stderr, returncode
+    """
+    logger.info(logger.log_msgs["executing_command"], command)
+    proc = subprocess.Popen(
+        [command],
+        stderr=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        shell=True,
+        executable="/bin/bash",
+    )
+    tails = {
+        pipe: deque(maxlen=ToolboxConfig.SUBPROCESS_TAIL_LINES)
+        for pipe in (proc.stdout, proc.stderr)
+    }
+    readers = [
+        threading.Thread(
+            target=read_output_stream,
+            args=(pipe, tail, output_logger, progress),
+            daemon=True,
+        )
+        for pipe, tail in tails.items()
+    ]
+    for reader in readers:
+        reader.start()
+    returncode = proc.wait()
+    for reader in readers:
+        reader.join()
+    out, err = ("\n".join(tail) for tail in tails.values())
+    if progress:
+        progress.log()
+    if returncode == 0:
+        logger.info(logger.log_msgs["cmd_success"], returncode)
+    else:
+        logger.error(logger.log_msgs["cmd_fail"], returncode, out, err)
+    return out, err, returncode
+
+
+def read_output_stream(
+    pipe,
+    tail: deque,
+    output_logger: Optional[logging.Logger] = None,
+    progress: Optional["CommandProgress"] = None,
+) -> None:
+    """
+    Read a subprocess output stream line by line until it is closed. Lines are split on newlines
+    and carriage returns (progress bars), and lines longer than SUBPROCESS_MAX_LINE_BYTES are split
+        :param pipe (io.BufferedReader):        Subprocess stdout / stderr
+        :param tail (deque):                    Bounded deque to which lines are appended
+        :param output_logger(logging.Logger):   Logger to which lines are written
+        :param progress (CommandProgress):      Parses progress lines
+        :return None:
+    """
+    buffer = b""
+    with pipe:
+        for chunk in iter(lambda: pipe.read1(65536), b""):
+            lines, buffer = split_output_chunk(buffer, chunk)
+            for line in lines:
+                handle_output_line(line, tail, output_logger, progress)
+    handle_output_line(buffer, tail, output_logger, progress)  # Final line without a newline
+
+
+def split_output_chunk(buffer: bytes, chunk: bytes) -> Tuple[list, bytes]:
+    """
+    Split a chunk of subprocess output into complete lines. Lines are split on newlines and
+    carriage returns (progress bars), and lines longer than SUBPROCESS_MAX_LINE_BYTES are split
+        :param buffer (bytes):  Incomplete line remaining from the previous chunk
+        :param chunk (bytes):   Output chunk
+        :return lines (list):   Complete lines
+        :return buffer (bytes): Incomplete line remaining at the end of the chunk
+    """
+    *lines, buffer = re.split(rb"[\r\n]", buffer + chunk)
+    while len(buffer) > ToolboxConfig.SUBPROCESS_MAX_LINE_BYTES:
+        lines.append(buffer[: ToolboxConfig.SUBPROCESS_MAX_LINE_BYTES])
+        buffer = buffer[ToolboxConfig.SUBPROCESS_MAX_LINE_BYTES :]
+    return lines, buffer
+
+
+def handle_output_line(
+    line: bytes,
+    tail: deque,
+    output_logger: Optional[logging.Logger] = None,
+    progress: Optional["CommandProgress"] = None,
+) -> None:
+    """
+    Append a line of subprocess output to the tail, writing it to output_logger and passing it
+    to progress (if provided). Empty lines are skipped
+        :param line (bytes):                    Output line
+        :param tail (deque):                    Bounded deque to which the line is appended
+        :param output_logger(logging.Logger):   Logger to which the line is written
+        :param progress (CommandProgress):      Parses progress lines
+        :return None:
+    """
+    line = line.decode("utf-8", errors="replace").strip()
+    if line:
+        tail.append(line)
+        if output_logger:
+            output_logger.info(line)
+        if progress:
+            progress.update(line)
+
+
+class CommandResult:
+    """
+    Result of a command run by execute_commands()
+
+    Attributes
+        argv (list):            Command arguments
+        returncode (int):       Exit code, or None if the command could not be started
+        duration (float):       Seconds from starting the command until it exited
+        stdout (str):           Last SUBPROCESS_TAIL_LINES lines of stdout
+        stderr (str):           Last SUBPROCESS_TAIL_LINES lines of stderr
+        timed_out (bool):       True if the command was killed at its timeout
+    """
+
+    def __init__(
+        self,
+        argv: list,
+        returncode: Optional[int],
+        duration: float,
+        stdout: str,
+        stderr: str,
+        timed_out: bool = False,
+    ):
+        """
+        Constructor for the CommandResult class
+            :param argv (list):             Command arguments
+            :param returncode (int):        Exit code, or None if the command could not be started
+            :param duration (float):        Seconds from starting the command until it exited
+            :param stdout (str):            Last SUBPROCESS_TAIL_LINES lines of stdout
+            :param stderr (str):            Last SUBPROCESS_TAIL_LINES lines of stderr
+            :param timed_out (bool):        True if the command was killed at its timeout
+        """
+        self.argv = argv
+        self.returncode = returncode
+        self.duration = duration
+        self.stdout = stdout
+        self.stderr = stderr
+        self.timed_out = timed_out
+
+
+async def read_output_stream_async(
+    stream: asyncio.StreamReader,
+    tail: deque,
+    output_logger: Optional[logging.Logger] = None,
+) -> None:
+    """
+    Read an asyncio subprocess output stream until it is closed (see read_output_stream)
+        :param stream (asyncio.StreamReader):   Subprocess stdout / stderr
+        :param tail (deque):                    Bounded deque to which lines are appended
+        :param output_logger(logging.Logger):   Logger to which lines are written
+        :return None:
+    """
+    buffer = b""
+    while chunk := await stream.read(65536):
+        lines, buffer = split_output_chunk(buffer, chunk)
+        for line in lines:
+            handle_output_line(line, tail, output_logger)
+    handle_output_line(buffer, tail, output_logger)  # Final line without a newline
+
+
+async def run_command(
+    argv: list,
+    logger: logging.Logger,
+    semaphore: asyncio.Semaphore,
+    timeout: Optional[float] = None,
+    output_logger: Optional[logging.Logger] = None,
+) -> CommandResult:
+    """
+    Run a command without a shell once the semaphore is acquired, streaming its output. The
+    command is killed if it has not exited after timeout seconds
+        :param argv (list):                     Command arguments
+        :param logger (logging.Logger):         Logger
+        :param semaphore (asyncio.Semaphore):   Limits the number of commands run at once
+        :param timeout (float):                 Seconds after which the command is killed, or
+                                                None for no limit
+        :param output_logger(logging.Logger):   Logger to which command output lines are written
+        :return (CommandResult):                Exit code, duration and output tails
+    """
+    async with semaphore:
+        command = shlex.join(argv)
+        logger.info(logger.log_msgs["executing_command"], command)
+        start = time.monotonic()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except OSError as exception:
+            logger.error(logger.log_msgs["cmd_not_started"], command, exception)
+            return CommandResult(argv, None, time.monotonic() - start, "", str(exception))
+        tails = (
+            deque(maxlen=ToolboxConfig.SUBPROCESS_TAIL_LINES),
+            deque(maxlen=ToolboxConfig.SUBPROCESS_TAIL_LINES),
+        )
+        timed_out = False
+        try:
+            await asyncio.wait_for(
+                asyncio.gather(
+                    read_output_stream_async(proc.stdout, tails[0], output_logger),
+                    read_output_stream_async(proc.stderr, tails[1], output_logger),
+                    proc.wait(),
+                ),
+                timeout,
+            )
+        except asyncio.TimeoutError:
+            timed_out = True
+            proc.kill()
+            await proc.wait()
+        result = CommandResult(
+            argv,
+            proc.returncode,
+            time.monotonic() - start,
+            *("\n".join(tail) for tail in tails),
+            timed_out,
+        )
+    if timed_out:
+        logger.error(logger.log_msgs["cmd_timeout"], timeout, command)
+    elif result.returncode == 0:
+        logger.info(logger.log_msgs["cmd_success"], result.returncode)
+    else:
+        logger.error(
+            logger.log_msgs["cmd_fail"], result.returncode, result.stdout, result.stderr
+        )
+    return result
+
+
+def execute_commands(
+    commands: list,
+    logger: logging.Logger,
+    timeout: Optional[float] = ToolboxConfig.COMMAND_TIMEOUT,
+    output_logger: Optional[logging.Logger] = None,
+) -> list:
+    """
+    Execute independent commands concurrently using asyncio. Commands are argument lists run
+    without a shell (so are not subject to shell quoting or injection), at most
+    COMMAND_CONCURRENCY at a time. Unlike execute_subprocess_command(), the caller is not
+    blocked on each command in turn
+        :param commands (list):                 Argument lists of the commands
+        :param logger (logging.Logger):         Logger
+        :param timeout (float):                 Seconds after which each command is killed, or
+                                                None for no limit
+        :param output_logger(logging.Logger):   Logger to which command output lines are written
+        :return (list):                         CommandResult of each command, in command order
+    """
+    async def run_commands() -> list:
+        semaphore = asyncio.Semaphore(ToolboxConfig.COMMAND_CONCURRENCY)
+        return await asyncio.gather(
+            *(run_command(argv, logger, semaphore, timeout, output_logger) for argv in commands)
+        )
+
+    logger.info(
+        logger.log_msgs["executing_commands"], len(commands), ToolboxConfig.COMMAND_CONCURRENCY
+    )
+    return asyncio.run(run_commands())
+
+
 def exit_on_returncode(returncode: int) -> None:
     """
     Exit the script if the returncode is not 0 (success)
@@ -286,20 +664,16 @@ def get_demultiplexlog_file(sequencer_type: str, runfolderpath: str) -> str:
             runfolderpath, ToolboxConfig.FLAG_FILES["bclconvertlog"]
         )
 
-def create_aviti_outputpath(runfolderpath: str, sequencer_type : str) -> str:
+def get_aviti_outputpath(runfolderpath: str, sequencer_type : str) -> Optional[str]:
     """
-    Checks to see if bases2fastq output directory has been made, if
-    not then creates output directory
+    Return the bases2fastq output directory path for AVITI runs. The directory is created by
+    RunfolderObject.prepare()
         :param runfolderpath (str):     Runfolder path string
-        :return (str):                  Fastq output folder string
+        :param sequencer_type (str):    Sequencer type string
+        :return (Optional[str]):        Fastq output folder string, None if not an AVITI run
     """ 
     if sequencer_type == ToolboxConfig.AVITI_ID: 
-        fastq_outputpath = os.path.join(runfolderpath, "Fastq")
-        if os.path.exists(fastq_outputpath):
-            return fastq_outputpath
-        else:
-            os.mkdir(fastq_outputpath)
-            return fastq_outputpath
+        return os.path.join(runfolderpath, "Fastq")
     else:
         return None
 
@@ -324,7 +698,7 @@ def test_upload_software(logger: logging.Logger) -> True:
     Test the required software is installed and performing. If not, exit the script
         :return True | None:    Return True if all software tests pass, else None
     """
-    if test_programs("dx_toolkit", logger) and test_programs("upload_agent", logger):
+    if test_software(["dx_toolkit", "upload_agent"], logger):
         return True
     else:
         logger.error(logger.log_msgs["software_fail"])
@@ -333,15 +707,76 @@ def test_upload_software(logger: logging.Logger) -> True:
 
 def test_processing_software(logger: logging.Logger) -> Optional[bool]:
     """
-    Test the software is installed and performing, by calling the test_upload_agent
-    and test_dx_toolkit functions
+    Test the processing software (GATK, bclconvert, bases2fastq) is installed and performing
         :return True|None:  Return true if the tests all pass
     """
-    
-    if test_programs("gatk_collect_lane_metrics", logger) and test_programs(
-        "bclconvert", logger) and test_programs (
-        "bases2fastq", logger):
+    return test_software(["gatk_collect_lane_metrics", "bclconvert", "bases2fastq"], logger)
+
+
+def test_software(software_names: list, logger: logging.Logger) -> Optional[bool]:
+    """
+    Test the software concurrently, reusing passing results cached within SOFTWARE_TEST_TTL for
+    the same docker image / executable. If any test fails, the script exits (test_programs)
+        :param software_names (list):   Names of the software to test (keys of TEST_PROGRAMS_DICT)
+        :param logger (logging.Logger): Logger
+        :return True|None:              Return True if the tests all pass
+    """
+    cache = SoftwareTestCache()
+    with ThreadPoolExecutor(max_workers=len(software_names)) as executor:
+        futures = [
+            executor.submit(test_program_cached, software_name, logger, cache)
+            for software_name in software_names
+        ]
+        if all(future.result() for future in futures):
+            return True
+
+
+def test_program_cached(
+    software_name: str, logger: logging.Logger, cache: "SoftwareTestCache"
+) -> True:
+    """
+    Test the software unless a passing test is cached for the same docker image / executable,
+    recording a passing test in the cache
+        :param software_name (str):         Name of the software being tested
+        :param logger (logging.Logger):     Logger
+        :param cache (SoftwareTestCache):   Software test cache
+        :return True:                       Return True if test passes, else exit script
+    """
+    key = get_software_key(software_name)
+    if cache.is_passed(software_name, key):
+        logger.info(logger.log_msgs["software_test_cached"], software_name, key)
         return True
+    if test_programs(software_name, logger):
+        # Image may have been pulled by the test
+        cache.record_passed(software_name, key or get_software_key(software_name))
+        return True
+
+
+def get_software_key(software_name: str) -> Optional[str]:
+    """
+    Return the key a software test is cached by - the ID (digest) of the docker image, or the
+    path and modification time of the executable
+        :param software_name (str):     Name of the software (key of TEST_PROGRAMS_DICT)
+        :return (Optional[str]):        Key, or None if the image / executable is not present
+    """
+    software_dict = ToolboxConfig.TEST_PROGRAMS_DICT[software_name]
+    if "docker_image" in software_dict:
+        try:
+            proc = subprocess.run(
+                ["docker", "image", "inspect", "--format", "{{.Id}}", software_dict["docker_image"]],
+                capture_output=True,
+                text=True,
+                timeout=60,
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return None
+        if proc.returncode == 0:
+            return proc.stdout.strip()
+    else:
+        executable = find_executable(software_dict["executable"])
+        if executable:
+            executable = os.path.realpath(executable)
+            return f"{executable}:{os.stat(executable).st_mtime_ns}"
 
 
 def test_programs(software_name: str, logger: logging.Logger) -> True:
@@ -390,46 +825,65 @@ def get_num_processed_runfolders(
     return num_processed_runfolders
 
 
+def match_pannum(string: str) -> Tuple[Optional[str], Optional[dict]]:
+    """
+    Return the first config-defined panel number in a string (e.g. a SampleSheet line or
+    sample name), and its panel settings
+        :param string (str):        String to search
+        :return pannum (str):       Panel number, or None if there is no panel number
+        :return settings (dict):    Panel settings from PANEL_DICT, or None if there is no
+                                    panel number
+    """
+    match = PANNUM_PATTERN.search(string)
+    if match:
+        return match.group(), ToolboxConfig.PANEL_DICT[match.group()]
+    return None, None
+
+
+def read_samplesheet(samplesheet_path: str) -> "SampleSheet":
+    """
+    Return the parsed SampleSheet. SampleSheets are parsed once per process, and re-parsed if
+    their size or modification time changes
+        :param samplesheet_path (str):  Path to SampleSheet
+        :return (SampleSheet):          Parsed SampleSheet
+    """
+    samplesheet_stat = os.stat(samplesheet_path)
+    key = (samplesheet_stat.st_size, samplesheet_stat.st_mtime_ns)
+    cached = SAMPLESHEET_CACHE.get(samplesheet_path)
+    if cached and cached[0] == key:
+        return cached[1]
+    samplesheet = SampleSheet(samplesheet_path)
+    SAMPLESHEET_CACHE[samplesheet_path] = (key, samplesheet)
+    return samplesheet
+
+
 def get_samplename_dict(
     logger: logging.Logger, samplesheet_path: str
 ) -> Optional[dict]:
     """
     Read SampleSheet to create a dict of samples and their pan numbers for the
-    run. Reads file into list and loops through in reverse allowing us to access
-    sample names and stop at column headers, skipping the file header
+    run, from the data rows of the parsed SampleSheet
         :param logger (logging.Logger): Logger
         :param samplesheet_path (str):  Path to samplesheet
         :return samplename_dict (dict): Dict of sample names identified from the
                                         SampleSheet, and their pan numbers
     """
-    samplename_dict = {}
     if os.path.exists(samplesheet_path):
-        reversed_samplesheet = reversed(read_lines(samplesheet_path))
-        for line in reversed_samplesheet:
-            if line.startswith(("Sample_ID", "SampleName", "[Data],", "#",)):
-                break
-            # Skip empty lines (check first element of the line, after splitting on comma)
-            elif len(line.split(",")[0]) < 2:
-                pass
-            else:  # If it's a line detailing a sample, get sample name and pan num
-                panel_number = ""
-                sample_name = line.split(",")[0]
-                for pannum in ToolboxConfig.PANELS:
-                    if pannum in line:
-                        panel_number = pannum
-                    samplename_dict[sample_name] = panel_number
+        samplename_dict = {
+            sample_id: pannum or ""
+            for sample_id, pannum in read_samplesheet(samplesheet_path).get_pannums().items()
+        }
         if samplename_dict:  # If samples identified
             return samplename_dict
     else:
         logger.error(logger.log_msgs["ss_missing"])
 
 
-def validate_fastq_gzip(file_path: str, logger: logging.Logger) -> Optional[bool]:
+def validate_fastq_gzip(file_path: str) -> Tuple[bool, Optional[str]]:
     """
     Fast gzip validation with basic FASTQ structure checks
         :param file_path (str): Path to the FASTQ file
-        :param logger (logging.Logger): Logger
-        :return (bool, str): True if valid, False and error message if not
+        :return (tuple):        True and None if valid, else False and the error message
     """
     try:
         # Check compressed file header (magic number check)
@@ -472,43 +926,1305 @@ def validate_fastq_gzip(file_path: str, logger: logging.Logger) -> Optional[bool
         return False, f"Unexpected error: {str(e)}"
 
 
-def validate_fastqs(fastq_dir_path: str, logger: logging.Logger) -> Optional[bool]:
+def check_fastq_records(lines: list) -> Optional[str]:
+    """
+    Check the FASTQ record invariants (header starts with @, separator starts with +, sequence
+    and quality are the same length) for a list of lines containing complete records. The lines
+    are checked column-wise using C-level map / slice operations rather than per-line Python
+        :param lines (list):        List of lines (bytes), length a multiple of 4
+        :return (Optional[str]):    Error message if any record is invalid, else None
+    """
+    if not all(map(bytes.startswith, lines[0::4], repeat(b"@"))):
+        return "Invalid FASTQ: Missing @ header"
+    if not all(map(bytes.startswith, lines[2::4], repeat(b"+"))):
+        return "Invalid FASTQ: Missing + separator"
+    if list(map(len, lines[1::4])) != list(map(len, lines[3::4])):
+        return "Invalid FASTQ: Sequence/quality length mismatch"
+
+
+def validate_fastq_deep(file_path: str) -> Tuple[bool, Optional[str], Optional[int]]:
+    """
+    Deep fastq validation. Streams the whole fastq through zlib in large buffers (handling
+    multi-member gzip files), which verifies the CRC and size trailer of every gzip member and
+    detects truncation at any point in the file, and checks the FASTQ record invariants of every
+    record
+        :param file_path (str):     Path to the FASTQ file
+        :return (tuple):            True if valid, False if not, error message if not valid, and
+                                    the number of reads in the fastq if valid
+    """
+    read_count = 0
+    remainder = []  # Lines of an incomplete record carried over to the next buffer
+    partial = b""  # Incomplete line carried over to the next buffer
+    try:
+        with open(file_path, "rb") as f:
+            if f.read(2) != b"\x1f\x8b":
+                return False, "Invalid gzip magic bytes", None
+            f.seek(0)
+            decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+            data = f.read(ToolboxConfig.FASTQ_DEEP_BUFFER)
+            while data:
+                chunk = decompressor.decompress(data)
+                if decompressor.eof:  # End of gzip member - next member (if any) follows
+                    data = decompressor.unused_data or f.read(ToolboxConfig.FASTQ_DEEP_BUFFER)
+                    if data:
+                        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                else:
+                    data = f.read(ToolboxConfig.FASTQ_DEEP_BUFFER)
+                lines = (partial + chunk).split(b"\n")
+                partial = lines.pop()
+                lines = remainder + lines
+                complete = len(lines) - len(lines) % 4
+                error_msg = check_fastq_records(lines[:complete])
+                if error_msg:
+                    return False, f"{error_msg} (record {read_count + 1} onwards)", None
+                read_count += complete // 4
+                remainder = lines[complete:]
+            if not decompressor.eof:
+                return False, "Truncated gzip file: end of compressed data not found", None
+            if partial or remainder:
+                return False, "Invalid FASTQ: Incomplete FASTQ record at end of file", None
+            if not read_count:
+                return False, "Invalid FASTQ: No FASTQ records", None
+    except (OSError, EOFError, zlib.error) as e:
+        return False, f"Validation error: {str(e)}", None
+    except Exception as e:
+        return False, f"Unexpected error: {str(e)}", None
+    return True, None, read_count
+
+
+# Preset dictionary used when decompressing from a deflate block boundary part-way through a
+# gzip member, in place of the unknown preceding 32 KiB of output. Back-references into this window
+# (and copies of them) produce NUL bytes in the output
+DEFLATE_UNKNOWN_WINDOW = bytes(32768)
+# Translation table marking bytes that could begin a non-final dynamic Huffman deflate block
+# (BFINAL = 0, BTYPE = 10), used to find candidate block boundaries at C speed
+DEFLATE_BLOCK_START = bytes(1 if byte & 0b111 == 0b100 else 0 for byte in range(256))
+# Bytes that may occur in fastq data decompressed from a deflate block boundary
+FASTQ_WINDOW_BYTES = bytes(range(32, 127)) + b"\n\0"
+
+
+def check_fastq_window(data: bytes, unknown_window: bool = False) -> Optional[str]:
+    """
+    Check decompressed data starting part-way through a fastq. If the data was decompressed from a
+    gzip member boundary the partial first and last lines are discarded, the first complete record
+    is located and the FASTQ record invariants are checked. If the data was decompressed from a
+    deflate block boundary (without the preceding output), line framing cannot be recovered, so
+    the data is checked to contain only characters that can occur in a fastq
+        :param data (bytes):            Decompressed data
+        :param unknown_window (bool):   Data was decompressed from a deflate block boundary
+        :return (Optional[str]):        Error message if the data is invalid, else None
+    """
+    if unknown_window:
+        if data.translate(None, FASTQ_WINDOW_BYTES):
+            return "Invalid FASTQ: Non-FASTQ characters in decompressed data"
+        return None
+    lines = data.split(b"\n")[1:-1]
+    for index in range(min(4, len(lines) - 3)):
+        if (
+            lines[index].startswith(b"@")
+            and lines[index + 2].startswith(b"+")
+            and len(lines[index + 1]) == len(lines[index + 3])
+        ):
+            records = lines[index:]
+            return check_fastq_records(records[: len(records) - len(records) % 4])
+    return "Invalid FASTQ: Could not find FASTQ record framing"
+
+
+def find_gzip_member(data: bytes, window_bytes: int) -> Optional[Tuple[int, bytes, bool]]:
+    """
+    Find the first complete gzip member (e.g. of a multi-member gzip) starting in the data, and decompress the
+    consecutive members from that point onwards (up to window_bytes of compressed data). Each
+    member's CRC and size trailer are verified by zlib. A zlib.error raised after the first member
+    denotes corruption
+        :param data (bytes):        Compressed data
+        :param window_bytes (int):  Bytes of compressed data to decompress from the member start
+        :return (Optional[tuple]):  Tuple of offset of the member within data, decompressed data,
+                                    and whether decompression reached the end of the data, or None
+                                    if no member could be found
+    """
+    start = data.find(b"\x1f\x8b\x08")
+    while start != -1:
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        try:
+            output = [decompressor.decompress(data[start:start + window_bytes])]
+        except zlib.error:
+            output = None
+        if output is not None and decompressor.eof:
+            # Decompress consecutive members within the window
+            while decompressor.eof and decompressor.unused_data:
+                remaining = decompressor.unused_data
+                decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+                output.append(decompressor.decompress(remaining))
+            reached_end = decompressor.eof and start + window_bytes >= len(data)
+            return start, b"".join(output), reached_end
+        start = data.find(b"\x1f\x8b\x08", start + 1)
+    return None
+
+
+def find_deflate_block(data: bytes, search_bytes: int) -> Optional[Tuple[int, int, object]]:
+    """
+    Find the first position (bit offset) within the first search_bytes of the data at which a
+    dynamic Huffman deflate block begins. Candidate positions are identified from the 3-bit block
+    header and the HLIT / HDIST fields, and confirmed by decompressing 64 KiB from the candidate
+    (using DEFLATE_UNKNOWN_WINDOW for back-references into the unknown preceding output) and
+    checking the output contains only fastq characters
+        :param data (bytes):            Compressed data
+        :param search_bytes (int):      Number of bytes to search for a block boundary
+        :return (Optional[tuple]):      Tuple of byte offset and bit offset of the block, and the
+                                        shifted data starting at the block, or None if no block
+                                        boundary is found
+    """
+    value = int.from_bytes(data, "little")
+    for bit in range(8):
+        shifted = (value >> bit).to_bytes(len(data), "little")
+        candidates = shifted[:search_bytes].translate(DEFLATE_BLOCK_START)
+        start = candidates.find(1)
+        while start != -1:
+            header = int.from_bytes(shifted[start:start + 2], "little")
+            # HLIT (bits 3-7) and HDIST (bits 8-12) must each be <= 29
+            if (header >> 3) & 0x1F <= 29 and (header >> 8) & 0x1F <= 29:
+                decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=DEFLATE_UNKNOWN_WINDOW)
+                try:
+                    output = decompressor.decompress(shifted[start:start + 65536], 262144)
+                    if len(output) > 65536 and not check_fastq_window(output, True):
+                        return start, bit, shifted[start:]
+                except zlib.error:
+                    pass
+            start = candidates.find(1, start + 1)
+    return None
+
+
+def check_fastq_sample(file_path: str, offset: int, tail: bool = False) -> Optional[str]:
+    """
+    Check a window of a gzipped fastq starting at the given offset. The first gzip member or
+    deflate block boundary after the offset is located, and FASTQ_SAMPLED_WINDOW_BYTES of
+    compressed data are decompressed from that point and checked. Windows starting at a gzip member
+    have their FASTQ framing and member CRCs checked; windows starting at a deflate block boundary
+    within a member are checked for deflate stream integrity and fastq characters only. A
+    decompression error after a boundary has been found denotes corruption. For the tail window,
+    decompression must reach the end of the final gzip member, followed by its 8-byte trailer
+        :param file_path (str):     Path to the FASTQ file
+        :param offset (int):        Offset (bytes) within the compressed file
+        :param tail (bool):         The window is at the end of the file
+        :return (Optional[str]):    Error message if the window is invalid, else None
+    """
+    window_bytes = ToolboxConfig.FASTQ_SAMPLED_WINDOW_BYTES
+    search_bytes = ToolboxConfig.FASTQ_SAMPLED_SEARCH_BYTES
+    with open(file_path, "rb") as f:
+        f.seek(offset)
+        data = f.read(search_bytes + window_bytes) if not tail else f.read()
+    try:
+        member = find_gzip_member(data, len(data))
+    except zlib.error as e:
+        return f"Validation error at offset {offset}: {str(e)}"
+    if member:
+        start, output, reached_end = member
+        if tail and not reached_end:
+            return "Truncated gzip file: end of compressed data not found"
+        return check_fastq_window(output)
+    block = find_deflate_block(data, search_bytes)
+    if block is None:
+        if tail:
+            return f"No gzip member or deflate block boundary found in the final {len(data)} bytes"
+        return None  # No boundary found near the offset - the window cannot be checked
+    start, bit, shifted = block
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=DEFLATE_UNKNOWN_WINDOW)
+    try:
+        output = decompressor.decompress(shifted if tail else shifted[:window_bytes])
+    except zlib.error as e:
+        return f"Validation error at offset {offset + start}: {str(e)}"
+    if tail and not (decompressor.eof and len(decompressor.unused_data) == 8):
+        return "Truncated gzip file: end of compressed data or gzip trailer not found"
+    return check_fastq_window(output, True)
+
+
+def validate_fastq_sampled(file_path: str) -> Tuple[bool, Optional[str], Optional[int]]:
+    """
+    Sampled fastq validation. Performs the quick validation checks, then checks windows at
+    FASTQ_SAMPLED_WINDOWS offsets spread across the fastq and its tail in parallel, giving broad
+    corruption coverage in a fraction of the time taken to decompress the whole fastq. Fastqs
+    smaller than FASTQ_SAMPLED_MIN_BYTES are fully decompressed (deep validation) instead
+        :param file_path (str):     Path to the FASTQ file
+        :return (tuple):            True if valid, False if not, error message if not valid, and
+                                    the number of reads in the fastq if counted
+    """
+    size = os.path.getsize(file_path)
+    if size < ToolboxConfig.FASTQ_SAMPLED_MIN_BYTES:
+        return validate_fastq_deep(file_path)
+    is_valid, error_msg = validate_fastq_gzip(file_path)
+    if not is_valid:
+        return is_valid, error_msg, None
+    windows = ToolboxConfig.FASTQ_SAMPLED_WINDOWS
+    offsets = [size * window // (windows + 1) for window in range(1, windows + 1)]
+    tail_offset = max(0, size - ToolboxConfig.FASTQ_SAMPLED_WINDOW_BYTES)
+    try:
+        with ThreadPoolExecutor(max_workers=windows + 1) as executor:
+            futures = [executor.submit(check_fastq_sample, file_path, offset) for offset in offsets]
+            futures.append(executor.submit(check_fastq_sample, file_path, tail_offset, True))
+            for future in futures:
+                error_msg = future.result()
+                if error_msg:
+                    return False, error_msg, None
+    except (OSError, EOFError) as e:
+        return False, f"Validation error: {str(e)}", None
+    except Exception as e:
+        return False, f"Unexpected error: {str(e)}", None
+    return True, None, None
+
+
+def check_fastq(file_path: str, mode: str) -> Tuple[bool, Optional[str], Optional[int]]:
+    """
+    Validate a fastq using the validation function for the given mode. Called in a
+    separate process by validate_fastqs
+        :param file_path (str):     Path to the FASTQ file
+        :param mode (str):          Validation mode (one of FASTQ_VALIDATION_MODES)
+        :return (tuple):            True if valid, False if not, error message if not valid, and
+                                    the number of reads in the fastq if counted by the mode
+    """
+    if mode == "deep":
+        return validate_fastq_deep(file_path)
+    if mode == "sampled":
+        return validate_fastq_sampled(file_path)
+    is_valid, error_msg = validate_fastq_gzip(file_path)
+    return is_valid, error_msg, None
+
+
+def fastq_pairs_match(read_counts: dict, logger: logging.Logger) -> Optional[bool]:
+    """
+    Check that each R1 fastq contains the same number of reads as its R2 fastq
+        :param read_counts (dict):      Read counts, keyed by fastq name
+        :param logger (logging.Logger): Logger
+        :return Optional[bool]:         True if all R1 / R2 read counts match
+    """
+    pairs_match = True
+    for fastq, read_count in read_counts.items():
+        r2_fastq = re.sub(r"_R1(_\d{3})?\.fastq\.gz$", r"_R2\1.fastq.gz", fastq)
+        if r2_fastq != fastq and r2_fastq in read_counts:
+            if read_count != read_counts[r2_fastq]:
+                logger.error(
+                    logger.log_msgs["fastq_pair_mismatch"],
+                    read_count,
+                    read_counts[r2_fastq],
+                    fastq,
+                    r2_fastq,
+                )
+                pairs_match = False
+    return pairs_match
+
+
+def validate_fastqs(
+    fastq_dir_path: str,
+    logger: logging.Logger,
+    processes: int = ToolboxConfig.FASTQ_VALIDATION_PROCESSES,
+    mode: str = ToolboxConfig.FASTQ_VALIDATION_MODE,
+    invalid_fastqs: Optional[list] = None,
+) -> Optional[bool]:
     """
     Validate the created fastqs in the BaseCalls directory and log success
-    or failure error message accordingly. If any failure, remove demultiplex log
-    file to trigger re-demultiplex on next script run
+    or failure error message accordingly. Fastqs that have previously been validated (in the
+    same or a more thorough mode) and have not changed since (same size and modification time)
+    are not re-validated. The remaining fastqs are validated in parallel using a bounded process
+    pool, and validation is aborted on the first invalid fastq, unless the invalid fastqs are
+    requested. In deep mode, the read counts of each fastq are logged and recorded in the
+    validation cache, and R1 and R2 fastqs are checked to contain the same number of reads. If
+    any failure, remove demultiplex log file to trigger re-demultiplex on next script run
         :param fastq_dir_path (str):    Runfolder fastq directory path (within runfolder)
         :param logger (logging.Logger): Logger
+        :param processes (int):         Maximum number of fastqs validated in parallel
+        :param mode (str):              Validation mode (one of FASTQ_VALIDATION_MODES)
+        :param invalid_fastqs (list):   If provided, all fastqs are validated and the names of
+                                        the invalid fastqs are appended to this list
         :return Optional[bool]:         Return True if fastqs are all determined to be valid
     """
     fastqs = sorted([x for x in os.listdir(fastq_dir_path) if x.endswith("fastq.gz")])
-    returncodes = []
-
+    cache = FastqValidationCache()
+    cached, to_validate = [], []
+    read_counts = {}
     for fastq in fastqs:
-        full_path = os.path.join(fastq_dir_path, fastq)
-        is_valid, error_msg = validate_fastq_gzip(full_path, logger)
-        
-        if is_valid:
-            logger.info(
-                logger.log_msgs["fastq_valid"],
-                fastq,
+        if cache.is_valid(os.path.join(fastq_dir_path, fastq), mode):
+            cached.append(fastq)
+            read_counts[fastq] = cache.get_read_count(os.path.join(fastq_dir_path, fastq))
+        else:
+            to_validate.append(fastq)
+    if cached:
+        logger.info(logger.log_msgs["fastq_cached"], len(cached), ", ".join(cached))
+
+    all_valid = True
+    if to_validate:
+        # forkserver avoids forking a process that may be running other threads
+        # (e.g. the demultiplex scheduler)
+        with ProcessPoolExecutor(
+            max_workers=max(1, min(processes, len(to_validate))),
+            mp_context=multiprocessing.get_context("forkserver"),
+        ) as executor:
+            futures = {
+                executor.submit(check_fastq, os.path.join(fastq_dir_path, fastq), mode): fastq
+                for fastq in to_validate
+            }
+            pending = set(futures)
+            while pending and (all_valid or invalid_fastqs is not None):
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in sorted(done, key=lambda future: futures[future]):
+                    fastq = futures[future]
+                    try:
+                        is_valid, error_msg, read_count = future.result()
+                    except Exception as exception:
+                        is_valid, error_msg = False, f"Unexpected error: {str(exception)}"
+                    if is_valid:
+                        logger.info(
+                            logger.log_msgs["fastq_valid"],
+                            mode,
+                            fastq,
+                        )
+                        if read_count is not None:
+                            logger.info(logger.log_msgs["fastq_read_count"], read_count, fastq)
+                        read_counts[fastq] = read_count
+                        cache.record_valid(os.path.join(fastq_dir_path, fastq), mode, read_count)
+                    else:
+                        logger.error(
+                            logger.log_msgs["fastq_invalid"],
+                            fastq,
+                            error_msg,
+                        )
+                        all_valid = False
+                        if invalid_fastqs is not None:
+                            invalid_fastqs.append(fastq)
+            if pending:  # Abort on first failure
+                for future in pending:
+                    future.cancel()
+                logger.error(logger.log_msgs["fastq_validation_aborted"], len(pending))
+
+    if all_valid and mode == "deep":
+        all_valid = fastq_pairs_match(read_counts, logger)
+    if all_valid:
+        logger.info(logger.log_msgs["demux_success"])
+        return True
+
+
+def get_file_key(file_path: str) -> Optional[tuple]:
+    """
+    Return the size and modification time of a file, used by the SQLite caches to detect files
+    that have changed since they were cached
+        :param file_path (str):     Path to the file
+        :return (Optional[tuple]):  Tuple of size and modification time (ns), None if the file
+                                    does not exist
+    """
+    try:
+        file_stat = os.stat(file_path)
+        return file_stat.st_size, file_stat.st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class SqliteStore(ToolboxConfig):
+    """
+    Base class for the SQLite databases stored in AD_LOGDIR (caches, stores and the runfolder
+    state index). Owns the database connection (with a timeout and write-ahead logging, as the
+    databases are shared by concurrent script runs), a lock per subclass serialising access from
+    concurrent threads, creation of the schema, and handling of database errors. If the database
+    cannot be read or written, a warning is logged and the caller continues as if nothing was
+    stored. Subclasses declare the database name, schema and their queries
+
+    Attributes
+        db_path (str):          Path to the SQLite database
+
+    Methods
+        connect()
+            Return a connection to the database, creating the schema if required
+        read(query, params, fetch_all)
+            Run a query, returning the first row (or all rows), or None if the database cannot
+            be read
+        write(query, params, many)
+            Run a statement (or the statement for each set of parameters) in a transaction
+        warn(exception)
+            Log that the database could not be used
+    """
+
+    DB_NAME = None  # Database file name within AD_LOGDIR
+    SCHEMA = []  # Statements creating the tables
+    ADDED_COLUMNS = {}  # Columns added after a table was first created, keyed by table
+
+    def __init_subclass__(cls, **kwargs):
+        """
+        Give each subclass its own lock, so that access to different databases is not serialised
+        """
+        super().__init_subclass__(**kwargs)
+        cls.lock = threading.Lock()
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Constructor for the SqliteStore class
+            :param db_path (str):   Path to the SQLite database (default is DB_NAME within
+                                    AD_LOGDIR)
+        """
+        self.db_path = db_path or os.path.join(ToolboxConfig.AD_LOGDIR, self.DB_NAME)
+
+    def connect(self) -> sqlite3.Connection:
+        """
+        Return a connection to the database, creating the tables (and any columns added since
+        the tables were created) if required
+            :return (sqlite3.Connection):   Database connection
+        """
+        connection = sqlite3.connect(self.db_path, timeout=ToolboxConfig.SQLITE_TIMEOUT)
+        connection.execute("PRAGMA journal_mode=WAL")
+        for statement in self.SCHEMA:
+            connection.execute(statement)
+        for table, added_columns in self.ADDED_COLUMNS.items():
+            columns = [row[1] for row in connection.execute(f"PRAGMA table_info({table})")]
+            for column, column_type in added_columns:
+                if column not in columns:
+                    connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+        return connection
+
+    def read(self, query: str, params: Union[tuple, list] = (), fetch_all: bool = False):
+        """
+        Run a query, returning the first row (or all rows)
+            :param query (str):                 SQL query
+            :param params (tuple | list):       Query parameters
+            :param fetch_all (bool):            Return all rows rather than the first row
+            :return (Optional[tuple | list]):   First row (None if no rows), or list of rows.
+                                                None if the database cannot be read
+        """
+        try:
+            with self.lock, closing(self.connect()) as connection:
+                cursor = connection.execute(query, params)
+                return cursor.fetchall() if fetch_all else cursor.fetchone()
+        except sqlite3.Error as exception:
+            self.warn(exception)
+            return None
+
+    def write(self, query: str, params: Union[tuple, list] = (), many: bool = False) -> Optional[bool]:
+        """
+        Run a statement in a transaction
+            :param query (str):             SQL statement
+            :param params (tuple | list):   Statement parameters, or list of parameters if many
+            :param many (bool):             Run the statement for each set of parameters
+            :return (Optional[bool]):       True if written, None if the database cannot be written
+        """
+        try:
+            with self.lock, closing(self.connect()) as connection, connection:
+                if many:
+                    connection.executemany(query, params)
+                else:
+                    connection.execute(query, params)
+            return True
+        except sqlite3.Error as exception:
+            self.warn(exception)
+            return None
+
+    def warn(self, exception: Exception) -> None:
+        """
+        Log that the database could not be used
+            :param exception (Exception):   Database error
+            :return None:
+        """
+        sqlite_logger.warning(
+            AdLoggerConfig.LOG_MSGS["general"]["sqlite_store_unavailable"],
+            self.db_path,
+            exception,
+        )
+
+
+class FastqValidationCache(SqliteStore):
+    """
+    SQLite-backed cache of fastq validation results, keyed by fastq path, size and modification
+    time, so that fastqs are only re-validated if they have changed (e.g. re-demultiplexing loops,
+    and later stages that validate the same fastqs). Only valid results are cached, so that
+    invalid fastqs are always re-validated. The validation mode and (deep mode) read count are
+    recorded, so that a cached result is only used if the mode is at least as thorough as that
+    requested, and so that read counts can be reused by later stages
+
+    Methods
+        is_valid(fastq_path, mode)
+            Return True if the fastq has previously been validated and has not changed since
+        record_valid(fastq_path, mode, read_count)
+            Record that the fastq is valid
+        get_read_count(fastq_path)
+            Return the read count recorded for the fastq
+    """
+
+    DB_NAME = ToolboxConfig.FASTQ_CACHE_NAME
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS fastq_validation ("
+        "fastq_path TEXT PRIMARY KEY, "
+        "size INTEGER NOT NULL, "
+        "mtime_ns INTEGER NOT NULL, "
+        "validated TEXT, "
+        "mode TEXT, "
+        "read_count INTEGER)"
+    ]
+    ADDED_COLUMNS = {"fastq_validation": [("mode", "TEXT"), ("read_count", "INTEGER")]}
+
+    def is_valid(self, fastq_path: str, mode: str = "quick") -> Optional[bool]:
+        """
+        Return True if the fastq has previously been validated, in the given mode or a more
+        thorough mode, and has not changed since
+            :param fastq_path (str):    Path to the fastq
+            :param mode (str):          Validation mode (one of FASTQ_VALIDATION_MODES)
+            :return (Optional[bool]):   True if a valid result is cached for the fastq
+        """
+        key = get_file_key(fastq_path)
+        if key is None:
+            return None
+        row = self.read(
+            "SELECT size, mtime_ns, mode FROM fastq_validation WHERE fastq_path = ?",
+            (os.path.abspath(fastq_path),),
+        )
+        modes = ToolboxConfig.FASTQ_VALIDATION_MODES
+        if (
+            row
+            and tuple(row[:2]) == key
+            and modes.index(row[2] or "quick") >= modes.index(mode)
+        ):
+            return True
+
+    def record_valid(
+        self, fastq_path: str, mode: str = "quick", read_count: Optional[int] = None
+    ) -> None:
+        """
+        Record that the fastq is valid, with its current size and modification time
+            :param fastq_path (str):    Path to the fastq
+            :param mode (str):          Validation mode (one of FASTQ_VALIDATION_MODES)
+            :param read_count (int):    Number of reads in the fastq (if counted)
+            :return None:
+        """
+        key = get_file_key(fastq_path)
+        if key is None:
+            return
+        self.write(
+            "INSERT OR REPLACE INTO fastq_validation "
+            "(fastq_path, size, mtime_ns, validated, mode, read_count) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                os.path.abspath(fastq_path),
+                *key,
+                str(datetime.datetime.now()),
+                mode,
+                read_count,
+            ),
+        )
+
+    def get_read_count(self, fastq_path: str) -> Optional[int]:
+        """
+        Return the read count recorded for the fastq, if it has not changed since
+            :param fastq_path (str):    Path to the fastq
+            :return (Optional[int]):    Number of reads, None if not recorded
+        """
+        row = self.read(
+            "SELECT size, mtime_ns, read_count FROM fastq_validation WHERE fastq_path = ?",
+            (os.path.abspath(fastq_path),),
+        )
+        if row and tuple(row[:2]) == get_file_key(fastq_path):
+            return row[2]
+
+
+class RunfolderStateIndex(SqliteStore):
+    """
+    SQLite-backed index of runfolder state, keyed by runfolder name. Records the lifecycle state
+    (derived from the flag files present), the flag file modification times, and the last
+    processing decision made for the runfolder. The index is updated whenever a flag file is
+    written by the scripts. Creating or removing a flag file updates the modification time of the
+    runfolder directory, so the flag files of a runfolder are only stat-ed (reconciled with the
+    filesystem) when the directory modification time differs from that recorded in the index.
+    The index is shared by the demultiplex, setoff_workflows and wscleaner scripts. If the index
+    cannot be read, state is derived from the filesystem
+
+    Methods
+        get_states(runfolder_paths)
+            Return the state of each runfolder, reconciling only changed runfolders
+        reconcile(runfolder_path)
+            Derive the runfolder state from the flag files and record it in the index
+        record_flag_file(flag_file_path)
+            Record that a flag file has been written or removed
+        record_decision(runfolder_path, decision)
+            Record the last processing decision made for the runfolder
+        get_runfolders(states)
+            Return the names and paths of the runfolders in the index with the given states
+    """
+
+    DB_NAME = ToolboxConfig.STATE_INDEX_NAME
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS runfolder_state ("
+        "runfolder_name TEXT PRIMARY KEY, "
+        "runfolder_path TEXT NOT NULL, "
+        "state TEXT NOT NULL, "
+        "dir_mtime_ns INTEGER, "
+        "flag_mtimes TEXT, "
+        "decision TEXT, "
+        "updated TEXT)"
+    ]
+
+    def get_states(self, runfolder_paths: list) -> dict:
+        """
+        Return the state of each runfolder. States are read from the index in a single query,
+        and only runfolders whose directory modification time has changed since they were last
+        recorded are reconciled with the filesystem
+            :param runfolder_paths (list):  List of runfolder paths
+            :return states (dict):          Runfolder states, keyed by runfolder name
+        """
+        rows = {
+            name: (dir_mtime_ns, state)
+            for name, dir_mtime_ns, state in self.read(
+                "SELECT runfolder_name, dir_mtime_ns, state FROM runfolder_state",
+                fetch_all=True,
             )
-            returncodes.append(True)
+            or []
+        }
+        states = {}
+        for runfolder_path in runfolder_paths:
+            runfolder_name = os.path.basename(runfolder_path.rstrip(os.sep))
+            try:
+                dir_mtime_ns = os.stat(runfolder_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            if rows.get(runfolder_name, (None,))[0] == dir_mtime_ns:
+                states[runfolder_name] = rows[runfolder_name][1]
+            else:
+                states[runfolder_name] = self.reconcile(runfolder_path)
+        return states
+
+    def reconcile(self, runfolder_path: str) -> str:
+        """
+        Derive the runfolder state from the flag files present in the runfolder, and record
+        the state and flag file modification times in the index
+            :param runfolder_path (str):    Runfolder path
+            :return state (str):            Runfolder lifecycle state
+        """
+        dir_mtime_ns = os.stat(runfolder_path).st_mtime_ns
+        flag_files = {}
+        for flag_name, flag_file in ToolboxConfig.FLAG_FILES.items():
+            try:
+                flag_stat = os.stat(os.path.join(runfolder_path, flag_file))
+                flag_files[flag_name] = (flag_stat.st_mtime, flag_stat.st_size)
+            except FileNotFoundError:
+                continue
+        demultiplexlogs = [
+            flag_files[flag_name]
+            for flag_name in ["bclconvertlog", "bases2fastqlog"]
+            if flag_name in flag_files
+        ]
+        if "upload_started" in flag_files:
+            state = "uploaded"
+        elif demultiplexlogs:
+            if "cd_failed" in flag_files:
+                state = "cluster_density_failed"
+            elif any(size for mtime, size in demultiplexlogs):
+                state = "demultiplexed"
+            else:
+                state = "demultiplexing"
+        elif "illumina_seq_complete" in flag_files or "aviti_seq_complete" in flag_files:
+            state = "sequencing_complete"
         else:
-            logger.error(
-                logger.log_msgs["fastq_invalid"],
-                fastq,
-                error_msg,
+            state = "sequencing"
+        flag_mtimes = json.dumps(
+            {flag_name: mtime for flag_name, (mtime, size) in flag_files.items()}
+        )
+        self.write(
+            "INSERT INTO runfolder_state "
+            "(runfolder_name, runfolder_path, state, dir_mtime_ns, flag_mtimes, updated) "
+            "VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(runfolder_name) DO UPDATE SET "
+            "runfolder_path = excluded.runfolder_path, state = excluded.state, "
+            "dir_mtime_ns = excluded.dir_mtime_ns, flag_mtimes = excluded.flag_mtimes, "
+            "updated = excluded.updated",
+            (
+                os.path.basename(runfolder_path.rstrip(os.sep)),
+                runfolder_path,
+                state,
+                dir_mtime_ns,
+                flag_mtimes,
+                str(datetime.datetime.now()),
+            ),
+        )
+        return state
+
+    def record_flag_file(self, flag_file_path: str) -> Optional[str]:
+        """
+        Record that a flag file has been written or removed, by reconciling its runfolder
+            :param flag_file_path (str):    Path to the flag file
+            :return (Optional[str]):        Runfolder lifecycle state, None if the runfolder
+                                            does not exist
+        """
+        runfolder_path = os.path.dirname(os.path.abspath(flag_file_path))
+        if os.path.isdir(runfolder_path):
+            return self.reconcile(runfolder_path)
+
+    def record_decision(self, runfolder_path: str, decision: str) -> None:
+        """
+        Record the last processing decision made for the runfolder
+            :param runfolder_path (str):    Runfolder path
+            :param decision (str):          Decision made, e.g. "demultiplex: processed"
+            :return None:
+        """
+        if not os.path.isdir(runfolder_path):
+            return
+        self.reconcile(runfolder_path)
+        self.write(
+            "UPDATE runfolder_state SET decision = ?, updated = ? "
+            "WHERE runfolder_name = ?",
+            (
+                decision,
+                str(datetime.datetime.now()),
+                os.path.basename(runfolder_path.rstrip(os.sep)),
+            ),
+        )
+
+    def get_runfolders(self, states: list) -> dict:
+        """
+        Return the names and paths of the runfolders in the index with the given states
+            :param states (list):       List of runfolder lifecycle states
+            :return (dict):             Runfolder paths, keyed by runfolder name (empty if the
+                                        index cannot be read)
+        """
+        return dict(
+            self.read(
+                "SELECT runfolder_name, runfolder_path FROM runfolder_state "
+                f"WHERE state IN ({', '.join('?' * len(states))})",
+                states,
+                fetch_all=True,
             )
-            returncodes.append(False)
+            or []
+        )
 
-    if all(returncodes):
-        logger.info(logger.log_msgs["demux_success"])
+
+class SamplesheetValidationCache(SqliteStore):
+    """
+    SQLite-backed cache of SampleSheet validation results, keyed by the SHA-256 of the SampleSheet
+    bytes and a hash of the validator version and configuration (panels, sequencer IDs, runfolder
+    name) passed to the validator. An unchanged SampleSheet is therefore not re-validated, while a
+    changed SampleSheet (or validator / panel configuration) produces a new key and is validated
+    immediately
+
+    Methods
+        get_key(samplesheet_path, validator_version, validator_config)
+            Return the SampleSheet content hash and validator configuration hash
+        get_result(key)
+            Return the cached validation result for the key
+        record_result(key, valid, tso, errors)
+            Record the validation result for the key
+    """
+
+    DB_NAME = ToolboxConfig.SAMPLESHEET_CACHE_NAME
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS samplesheet_validation ("
+        "content_sha256 TEXT NOT NULL, "
+        "config_sha256 TEXT NOT NULL, "
+        "valid INTEGER NOT NULL, "
+        "tso INTEGER, "
+        "errors TEXT, "
+        "validated TEXT, "
+        "PRIMARY KEY (content_sha256, config_sha256))"
+    ]
+
+    def get_key(
+        self, samplesheet_path: str, validator_version: str, validator_config: list
+    ) -> Optional[tuple]:
+        """
+        Return the SHA-256 of the SampleSheet bytes, and the SHA-256 of the validator version and
+        configuration
+            :param samplesheet_path (str):      Path to the SampleSheet
+            :param validator_version (str):     samplesheet_validator version
+            :param validator_config (list):     Arguments passed to the validator (other than the
+                                                SampleSheet path and logfile directory)
+            :return (Optional[tuple]):          Tuple of content hash and configuration hash, None
+                                                if the SampleSheet cannot be read
+        """
+        try:
+            with open(samplesheet_path, "rb") as samplesheet:
+                content_sha256 = hashlib.sha256(samplesheet.read()).hexdigest()
+        except OSError:
+            return None
+        config_json = json.dumps(
+            [validator_version, validator_config], sort_keys=True, default=sorted
+        )
+        config_sha256 = hashlib.sha256(config_json.encode()).hexdigest()
+        return content_sha256, config_sha256
+
+    def get_result(self, key: Optional[tuple]) -> Optional[tuple]:
+        """
+        Return the cached validation result for the key
+            :param key (Optional[tuple]):   Key returned by get_key()
+            :return (Optional[tuple]):      Tuple of whether the SampleSheet is valid, whether it
+                                            is a TSO SampleSheet, and the error string, or None if
+                                            no result is cached
+        """
+        if key is None:
+            return None
+        row = self.read(
+            "SELECT valid, tso, errors FROM samplesheet_validation "
+            "WHERE content_sha256 = ? AND config_sha256 = ?",
+            key,
+        )
+        if row:
+            return bool(row[0]), bool(row[1]), row[2] or ""
+
+    def record_result(self, key: Optional[tuple], valid: bool, tso: bool, errors: str) -> None:
+        """
+        Record the validation result for the key
+            :param key (Optional[tuple]):   Key returned by get_key()
+            :param valid (bool):            SampleSheet is valid
+            :param tso (bool):              SampleSheet is a TSO SampleSheet
+            :param errors (str):            Error string
+            :return None:
+        """
+        if key is None:
+            return
+        self.write(
+            "INSERT OR REPLACE INTO samplesheet_validation "
+            "(content_sha256, config_sha256, valid, tso, errors, validated) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (*key, int(valid), int(bool(tso)), errors, str(datetime.datetime.now())),
+        )
+
+
+class SoftwareTestCache(SqliteStore):
+    """
+    SQLite-backed cache of passing software tests, keyed by software name and the docker image ID
+    or executable path and modification time (get_software_key). A passing test is reused for
+    SOFTWARE_TEST_TTL seconds, unless the image / executable changes. Failing tests are not
+    cached
+
+    Methods
+        is_passed(software_name, key)
+            Return True if the software test passed within SOFTWARE_TEST_TTL for the key
+        record_passed(software_name, key)
+            Record that the software test passed for the key
+    """
+
+    DB_NAME = ToolboxConfig.SOFTWARE_TEST_CACHE_NAME
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS software_tests ("
+        "software_name TEXT PRIMARY KEY, "
+        "key TEXT NOT NULL, "
+        "passed REAL NOT NULL)"
+    ]
+
+    def is_passed(self, software_name: str, key: Optional[str]) -> Optional[bool]:
+        """
+        Return True if the software test passed within SOFTWARE_TEST_TTL for the key
+            :param software_name (str):     Name of the software
+            :param key (Optional[str]):     Key returned by get_software_key()
+            :return (Optional[bool]):       True if a passing test is cached
+        """
+        if key is None:
+            return None
+        row = self.read(
+            "SELECT key, passed FROM software_tests WHERE software_name = ?",
+            (software_name,),
+        )
+        if row and row[0] == key and time.time() - row[1] < ToolboxConfig.SOFTWARE_TEST_TTL:
+            return True
+
+    def record_passed(self, software_name: str, key: Optional[str]) -> None:
+        """
+        Record that the software test passed for the key
+            :param software_name (str):     Name of the software
+            :param key (Optional[str]):     Key returned by get_software_key()
+            :return None:
+        """
+        if key is None:
+            return
+        self.write(
+            "INSERT OR REPLACE INTO software_tests (software_name, key, passed) "
+            "VALUES (?, ?, ?)",
+            (software_name, key, time.time()),
+        )
+
+
+class ChecksumCache(SqliteStore):
+    """
+    SQLite-backed cache of file md5 checksums calculated by the built-in integrity check, keyed by
+    file path, size and modification time (get_file_key). Files are therefore only hashed once as
+    they arrive in the runfolder during sequencing, and are re-hashed if they change (e.g. a file
+    that was still being written when it was hashed)
+
+    Methods
+        get_md5s(file_paths)
+            Return the md5 checksums recorded for the files that have not changed since
+        record_md5s(records)
+            Record the md5 checksums of files
+    """
+
+    DB_NAME = ToolboxConfig.CHECKSUM_CACHE_NAME
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS file_checksums ("
+        "file_path TEXT PRIMARY KEY, "
+        "size INTEGER NOT NULL, "
+        "mtime_ns INTEGER NOT NULL, "
+        "md5 TEXT NOT NULL)"
+    ]
+
+    def get_md5s(self, file_paths: list) -> dict:
+        """
+        Return the md5 checksums recorded for the files that have not changed since
+            :param file_paths (list):   Paths to the files
+            :return (dict):             md5 checksum of each unchanged file, keyed by file path
+        """
+        abspaths = [os.path.abspath(file_path) for file_path in file_paths]
+        rows = {}
+        for start in range(0, len(abspaths), 500):  # SQLite host parameter limit
+            chunk = abspaths[start : start + 500]
+            chunk_rows = self.read(
+                "SELECT file_path, size, mtime_ns, md5 FROM file_checksums "
+                f"WHERE file_path IN ({', '.join('?' * len(chunk))})",
+                chunk,
+                fetch_all=True,
+            )
+            if chunk_rows is None:
+                return {}
+            rows.update((row[0], row[1:]) for row in chunk_rows)
+        md5s = {}
+        for file_path in file_paths:
+            row = rows.get(os.path.abspath(file_path))
+            if row and tuple(row[:2]) == get_file_key(file_path):
+                md5s[file_path] = row[2]
+        return md5s
+
+    def record_md5s(self, records: list) -> None:
+        """
+        Record the md5 checksums of files
+            :param records (list):  Tuples of file path, (size, modification time) of the file
+                                    when it was hashed, and md5 checksum
+            :return None:
+        """
+        self.write(
+            "INSERT OR REPLACE INTO file_checksums (file_path, size, mtime_ns, md5) "
+            "VALUES (?, ?, ?, ?)",
+            [(os.path.abspath(file_path), *key, md5) for file_path, key, md5 in records],
+            many=True,
+        )
+
+
+class ThreadLayoutStore(SqliteStore):
+    """
+    SQLite-backed store of the fastest demultiplexing thread layout found by benchmarking
+    (demultiplex/thread_tuning.py), per host, demultiplexing tool and sequencer type. Layouts are
+    stored as threads per CPU for each thread option, with the CPUs and time of the benchmark.
+    If no layout can be read, none is used
+
+    Attributes
+        host (str):             Host name the layouts are stored for
+
+    Methods
+        get_layout(tool, sequencer_type)
+            Return the stored thread layout for the tool and sequencer type on this host
+        record_layout(tool, sequencer_type, layout, cpus, seconds)
+            Record the thread layout for the tool and sequencer type on this host
+    """
+
+    DB_NAME = ToolboxConfig.THREAD_LAYOUT_STORE_NAME
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS thread_layouts ("
+        "host TEXT NOT NULL, "
+        "tool TEXT NOT NULL, "
+        "sequencer_type TEXT NOT NULL, "
+        "layout TEXT NOT NULL, "
+        "cpus INTEGER NOT NULL, "
+        "seconds REAL NOT NULL, "
+        "recorded TEXT NOT NULL, "
+        "PRIMARY KEY (host, tool, sequencer_type))"
+    ]
+
+    def __init__(self, db_path: Optional[str] = None):
+        """
+        Constructor for the ThreadLayoutStore class
+            :param db_path (str):   Path to the SQLite database (default is
+                                    THREAD_LAYOUT_STORE_NAME within AD_LOGDIR)
+        """
+        super().__init__(db_path)
+        self.host = socket.gethostname()
+
+    def get_layout(self, tool: str, sequencer_type: str) -> Optional[dict]:
+        """
+        Return the stored thread layout for the tool and sequencer type on this host
+            :param tool (str):              Demultiplexing tool (bclconvert or bases2fastq)
+            :param sequencer_type (str):    Sequencer type
+            :return (Optional[dict]):       Threads per CPU keyed by thread option, or None if
+                                            no layout is stored
+        """
+        row = self.read(
+            "SELECT layout FROM thread_layouts "
+            "WHERE host = ? AND tool = ? AND sequencer_type = ?",
+            (self.host, tool, sequencer_type),
+        )
+        if row:
+            return json.loads(row[0])
+
+    def record_layout(
+        self, tool: str, sequencer_type: str, layout: dict, cpus: int, seconds: float
+    ) -> None:
+        """
+        Record the thread layout for the tool and sequencer type on this host, replacing any
+        previously stored layout
+            :param tool (str):              Demultiplexing tool (bclconvert or bases2fastq)
+            :param sequencer_type (str):    Sequencer type
+            :param layout (dict):           Threads per CPU keyed by thread option
+            :param cpus (int):              CPUs the layout was benchmarked with
+            :param seconds (float):         Benchmark time
+            :return None:
+        """
+        self.write(
+            "INSERT OR REPLACE INTO thread_layouts "
+            "(host, tool, sequencer_type, layout, cpus, seconds, recorded) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                self.host,
+                tool,
+                sequencer_type,
+                json.dumps(layout, sort_keys=True),
+                cpus,
+                seconds,
+                datetime.datetime.now().isoformat(timespec="seconds"),
+            ),
+        )
+
+
+class CommandProgress(ToolboxConfig):
+    """
+    Parse progress lines from the streamed output of a demultiplexing command (see
+    stream_subprocess_command), periodically logging the percent complete and throughput. Only
+    used for tools that print their progress (PROGRESS_PATTERNS)
+
+    Attributes
+        tool (str):                 Tool name (key of PROGRESS_PATTERNS)
+        logger (logging.Logger):    Logger to which progress is written
+        interval (int):             Seconds between progress log messages
+        pattern (re.Pattern):       Compiled progress line pattern
+        start (float):              Time (time.monotonic) at which progress tracking started
+        last_logged (float):        Time (time.monotonic) at which progress was last logged
+        percent (float):            Last parsed percent complete, or None if not yet parsed
+        lock (threading.Lock):      Serialises updates from the stdout and stderr reader threads
+
+    Methods
+        update(line)
+            Parse a line of command output, logging progress if PROGRESS_LOG_INTERVAL has passed
+        get_throughput(elapsed)
+            Return the throughput (percent per minute) as a string
+        log()
+            Log the percent complete and throughput
+    """
+
+    def __init__(
+        self, tool: str, logger: logging.Logger, interval: int = ToolboxConfig.PROGRESS_LOG_INTERVAL
+    ):
+        """
+        Constructor for the CommandProgress class
+            :param tool (str):                  Tool name (key of PROGRESS_PATTERNS)
+            :param logger (logging.Logger):     Logger to which progress is written
+            :param interval (int):              Seconds between progress log messages
+        """
+        self.tool = tool
+        self.logger = logger
+        self.interval = interval
+        self.pattern = re.compile(ToolboxConfig.PROGRESS_PATTERNS[tool])
+        self.start = time.monotonic()
+        self.last_logged = self.start
+        self.percent = None
+        self.lock = threading.Lock()
+
+    def update(self, line: str) -> Optional[bool]:
+        """
+        Parse a line of command output. If it is a progress line, record the percent complete,
+        and log progress if PROGRESS_LOG_INTERVAL seconds have passed since it was last logged
+            :param line (str):          Line of command output
+            :return (Optional[bool]):   True if the line is a progress line
+        """
+        match = self.pattern.search(line)
+        if not match:
+            return None
+        with self.lock:
+            self.percent = min(100.0, float(match.group("percent")))
+            if time.monotonic() - self.last_logged >= self.interval:
+                self.log()
         return True
 
+    def get_throughput(self, elapsed: float) -> str:
+        """
+        Return the throughput since progress tracking started, as percent per minute
+            :param elapsed (float): Seconds since progress tracking started
+            :return (str):          Throughput
+        """
+        minutes = max(elapsed, 1) / 60
+        return f"{self.percent / minutes:.2f}%/min"
+
+    def log(self) -> None:
+        """
+        Log the percent complete and throughput, if any progress lines have been parsed
+            :return None:
+        """
+        if self.percent is None:
+            return
+        self.last_logged = time.monotonic()
+        elapsed = self.last_logged - self.start
+        self.logger.info(
+            self.logger.log_msgs["cmd_progress"],
+            self.tool,
+            self.percent,
+            elapsed,
+            self.get_throughput(elapsed),
+        )
+
+
+class SampleSheet(ToolboxConfig):
+    """
+    Parsed SampleSheet (Illumina v1 [Data] / v2 [BCLConvert_Data] SampleSheets, or AVITI
+    SampleSheets). The data rows are the lines following the data column header (the line
+    with a Sample_ID or SampleName column), up to the next section. Empty lines, and lines with a
+    sample ID shorter than 2 characters, are skipped. Use read_samplesheet() to share parsed
+    SampleSheets between consumers
+
+    Attributes
+        path (str):             Path to SampleSheet
+        lines (list):           All lines, without line endings
+        sections (dict):        Lines of each section preceding the data rows, keyed by section
+                                name (e.g. Header), excluding the section name line
+        header (dict):          Values of the [Header] section, keyed by field name
+        reads (dict):           Cycles of each read ([Reads] section), keyed by read name (e.g.
+                                Read1Cycles). Reads listed as cycles only (v1) are named ReadN
+        columns (list):         Data column names
+        sample_id_column (str): Name of the sample ID column (Sample_ID or SampleName)
+        header_lines (list):    Lines up to and including the data column header
+        data_rows (list):       (Line number, row dictionary keyed by column name) of each
+                                data row
+
+    Methods
+        parse()
+            Parse the SampleSheet lines into sections, the data column header and data rows
+        get_sample_ids()
+            Return the sample IDs of the data rows
+        get_pannums()
+            Return the panel number of each sample
+        get_indexes()
+            Return the indexes of each sample
+        get_lanes()
+            Return the lanes of the data rows
+        get_lines(sample_ids)
+            Return the SampleSheet lines, retaining only the data rows of the samples
+    """
+
+    DATA_HEADERS = ("Sample_ID", "SampleName")
+    INDEX_COLUMNS = (("index", "index2"), ("Index1", "Index2"))
+
+    def __init__(self, samplesheet_path: str):
+        """
+        Constructor for the SampleSheet class. Reads and parses the SampleSheet
+            :param samplesheet_path (str):  Path to SampleSheet
+        """
+        self.path = samplesheet_path
+        self.lines = [line.rstrip("\r\n") for line in read_lines(self.path)]
+        self.sections, self.header, self.reads = {}, {}, {}
+        self.columns, self.header_lines, self.data_rows = [], [], []
+        self.sample_id_column = None
+        self.parse()
+
+    def parse(self) -> None:
+        """
+        Parse the SampleSheet lines into sections, the data column header and data rows
+            :return None:
+        """
+        section, data_header_index = None, None
+        for line_number, line in enumerate(self.lines):
+            fields = line.split(",")
+            if line.startswith("["):
+                section = line.split("]")[0].strip("[")
+                if data_header_index is None:
+                    self.sections[section] = []
+                elif line_number > data_header_index:
+                    break  # Data rows end at the next section
+            elif data_header_index is None and any(
+                column.strip() in self.DATA_HEADERS for column in fields
+            ):
+                data_header_index = line_number
+                self.columns = [column.strip() for column in fields]
+                self.sample_id_column = next(
+                    column for column in self.DATA_HEADERS if column in self.columns
+                )
+                self.header_lines = self.lines[: line_number + 1]
+            elif data_header_index is None:
+                if section is not None:
+                    self.sections[section].append(line)
+            elif not line.startswith("#"):
+                row = dict(zip(self.columns, (field.strip() for field in fields)))
+                if len(row.get(self.sample_id_column, "")) >= 2:  # Skip empty lines
+                    self.data_rows.append((line_number, row))
+        for line in self.sections.get("Header", []):
+            fields = line.split(",")
+            if fields[0]:
+                self.header[fields[0]] = fields[1] if len(fields) > 1 else ""
+        for line in self.sections.get("Reads", []):
+            fields = [field for field in line.split(",") if field]
+            if len(fields) > 1 and fields[1].isdigit():
+                self.reads[fields[0]] = int(fields[1])
+            elif fields and fields[0].isdigit():
+                self.reads[f"Read{len(self.reads) + 1}"] = int(fields[0])
+
+    def get_sample_ids(self) -> list:
+        """
+        Return the sample IDs of the data rows, in SampleSheet order (a sample on several lanes
+        is returned once)
+            :return (list):     Sample IDs
+        """
+        return list(dict.fromkeys(row[self.sample_id_column] for _, row in self.data_rows))
+
+    def get_pannums(self) -> dict:
+        """
+        Return the panel number of each sample, from the first config-defined panel number in
+        the sample's data row (match_pannum())
+            :return (dict):     Panel number (or None if the row has no panel number), keyed by
+                                sample ID
+        """
+        pannums = {}
+        for line_number, row in self.data_rows:
+            pannums.setdefault(row[self.sample_id_column], match_pannum(self.lines[line_number])[0])
+        return pannums
+
+    def get_indexes(self) -> dict:
+        """
+        Return the indexes of each sample (Illumina index / index2, or AVITI Index1 / Index2)
+            :return (dict):     Tuple of the sample's indexes (empty strings for absent
+                                indexes), keyed by sample ID
+        """
+        index_columns = next(
+            (columns for columns in self.INDEX_COLUMNS if columns[0] in self.columns),
+            self.INDEX_COLUMNS[0],
+        )
+        return {
+            row[self.sample_id_column]: tuple(row.get(column, "") for column in index_columns)
+            for _, row in self.data_rows
+        }
+
+    def get_lanes(self) -> list:
+        """
+        Return the lanes of the data rows
+            :return (list):     Sorted lane numbers, or an empty list if the SampleSheet has no
+                                Lane column (all samples are on all lanes)
+        """
+        return sorted(
+            {int(row["Lane"]) for _, row in self.data_rows if row.get("Lane", "").isdigit()}
+        )
+
+    def get_lines(self, sample_ids: Optional[set] = None) -> list:
+        """
+        Return the SampleSheet lines, retaining only the data rows of the samples. Lines
+        following the data rows (e.g. later sections) are retained
+            :param sample_ids (Optional[set]):  Sample IDs to retain, or None to retain all
+                                                samples
+            :return (list):                     SampleSheet lines, without line endings
+        """
+        excluded = {
+            line_number
+            for line_number, row in self.data_rows
+            if sample_ids is not None and row[self.sample_id_column] not in sample_ids
+        }
+        return [line for line_number, line in enumerate(self.lines) if line_number not in excluded]
+
+
 class RunfolderObject(ToolboxConfig):
     """
-    An object with runfolder-specific properties
+    An object with runfolder-specific properties. Objects are constructed for every runfolder
+    on each script run, so all attributes other than the runfolder name and timestamp are cached
+    properties, derived when first accessed (reading the DNAnexus credential file, or
+    RunParameters.json for AVITI runs, only where needed)
 
     Attributes
         dnanexus_auth (str):                    DNAnexus auth token
@@ -519,7 +2235,7 @@ class RunfolderObject(ToolboxConfig):
         runfolderpath (str):                    Path of runfolder on workstation
         aviti_runparameters_file (str):         RunParameters.json path string for AVITI runs (within runfolder)
         samplesheet_name (str):                 Name of runfolder SampleSheet
-        rtacompletefile_path (str):             Sequencing finished filepath (within runfolder)
+        runcompletefile_path (str):             Sequencing finished filepath (within runfolder)
         samplesheet_path (str):                 Path to SampleSheet in SampleSheets dir
         runfolder_samplesheet_path (str):       Runfolder SampleSheets path (within runfolder)
         checksumfile_path (str):                md5 checksum (integrity check) file path (within runfolder)
@@ -527,7 +2243,15 @@ class RunfolderObject(ToolboxConfig):
         sscheck_flagfile_path (str):            2nd attempt Samplesheet check flag file path (within runfolder)
         demultiplexlog_file (str):              Demultiplex logfile path - bases2fastq/bclconvert (within runfolder)
         fastq_dir_path (str):                   Runfolder fastq directory path (within runfolder)
+        bases2fastq_outputpath (str):           bases2fastq output directory (within runfolder), None
+                                                if not an AVITI run
         upload_flagfile (str):                  Flag file denoting upload has begun (within runfolder)
+        quality_hold_flagfile (str):            Flag file denoting the run is held by the run quality
+                                                gate (within runfolder)
+        quality_release_flagfile (str):         Flag file releasing a run held by the run quality gate
+                                                (within runfolder)
+        cd_failed_flagfile (str):               Flag file denoting the cluster density calculation
+                                                failed after demultiplexing (within runfolder)
         bclconvertstats_file (str):             Bclconvert stats file (within runfolder)
         cluster_density_files (list):           List containing runfolder lane metrics
                                                 and phasing metrics file paths
@@ -543,78 +2267,170 @@ class RunfolderObject(ToolboxConfig):
         logfiles_to_upload (list):              All logfiles that require upload to DNAnexus
 
     Methods
+        prepare()
+            Create the runfolder output directories
+        age()
+            Return runfolder age in days
         get_runfolder_loggers(script)
             Return dictionary of logger.Logging objects for the runfolder
     """
 
     def __init__(self, runfolder_name: str, timestamp: str):
         """
-        Constructor for the RunfolderObject class
+        Constructor for the RunfolderObject class. Construction has no side effects: all other
+        attributes are derived (and cached) when first accessed, and the runfolder output
+        directories are created by prepare()
             :param runfolder_name (str):    Runfolder name
             :param timestamp (str):         Timestamp in the format str(f"{datetime.datetime.now():%Y%m%d_%H%M%S}")
         """
-        self.dnanexus_auth = get_credential(
-            ToolboxConfig.CREDENTIALS["dnanexus_authtoken"]
-        )
         self.timestamp = timestamp
         self.runfolder_name = runfolder_name
-        self.sequencer_type = get_sequencer_type(self.runfolder_name)
-        self.runfolderpath = get_runfolder_path(self.sequencer_type, self.runfolder_name)
-        self.aviti_runparameters_file = os.path.join(
-            self.runfolderpath, "RunParameters.json"
-        )
-        self.samplesheet_name = get_samplesheet_name(self.sequencer_type, self.runfolder_name, self.aviti_runparameters_file)
-        self.runcompletefile_path = get_runcompletefile_path(self.sequencer_type, self.runfolderpath)
-        self.samplesheet_path = get_samplesheet_path(self.sequencer_type, self.samplesheet_name)
-        self.runfolder_samplesheet_path = os.path.join(
-            self.runfolderpath, self.samplesheet_name
-        )
-        self.runfolder_samplesheet_path = os.path.join(
-            self.runfolderpath, self.samplesheet_name
-        )
-        self.masterfile_name = f"{self.runfolder_name}_MasterDataFile.xlsx"
-        self.masterfile_path = os.path.join(
-            ToolboxConfig.RUNFOLDERS, "samplesheets", self.masterfile_name
-        )
-        self.runfolder_masterfile_path = os.path.join(
-            self.runfolderpath, self.masterfile_name
-        )
-        self.checksumfile_path = os.path.join(
-            self.runfolderpath, ToolboxConfig.FLAG_FILES["md5checksum"]
+
+    def prepare(self) -> None:
+        """
+        Create the runfolder output directories (the bases2fastq output directory for AVITI runs)
+            :return None:
+        """
+        if self.bases2fastq_outputpath:
+            os.makedirs(self.bases2fastq_outputpath, exist_ok=True)
+
+    @cached_property
+    def dnanexus_auth(self) -> str:
+        """DNAnexus auth token"""
+        return get_credential(ToolboxConfig.CREDENTIALS["dnanexus_authtoken"])
+
+    @cached_property
+    def sequencer_type(self) -> str:
+        """Sequencer ID string"""
+        return get_sequencer_type(self.runfolder_name)
+
+    @cached_property
+    def runfolderpath(self) -> str:
+        """Path of runfolder on workstation"""
+        return get_runfolder_path(self.sequencer_type, self.runfolder_name)
+
+    @cached_property
+    def aviti_runparameters_file(self) -> str:
+        """RunParameters.json path string for AVITI runs (within runfolder)"""
+        return os.path.join(self.runfolderpath, "RunParameters.json")
+
+    @cached_property
+    def samplesheet_name(self) -> str:
+        """Name of runfolder SampleSheet (read from RunParameters.json for AVITI runs)"""
+        return get_samplesheet_name(
+            self.sequencer_type, self.runfolder_name, self.aviti_runparameters_file
         )
-        self.initial_sscheck_flagfile_path = os.path.join(
+
+    @cached_property
+    def runcompletefile_path(self) -> str:
+        """Sequencing finished filepath (within runfolder)"""
+        return get_runcompletefile_path(self.sequencer_type, self.runfolderpath)
+
+    @cached_property
+    def samplesheet_path(self) -> str:
+        """Path to SampleSheet in SampleSheets dir"""
+        return get_samplesheet_path(self.sequencer_type, self.samplesheet_name)
+
+    @cached_property
+    def runfolder_samplesheet_path(self) -> str:
+        """Runfolder SampleSheets path (within runfolder)"""
+        return os.path.join(self.runfolderpath, self.samplesheet_name)
+
+    @cached_property
+    def masterfile_name(self) -> str:
+        """OncoDEEP MasterFile name"""
+        return f"{self.runfolder_name}_MasterDataFile.xlsx"
+
+    @cached_property
+    def masterfile_path(self) -> str:
+        """Path to OncoDEEP MasterFile in SampleSheets dir"""
+        return os.path.join(ToolboxConfig.RUNFOLDERS, "samplesheets", self.masterfile_name)
+
+    @cached_property
+    def runfolder_masterfile_path(self) -> str:
+        """OncoDEEP MasterFile path (within runfolder)"""
+        return os.path.join(self.runfolderpath, self.masterfile_name)
+
+    @cached_property
+    def checksumfile_path(self) -> str:
+        """md5 checksum (integrity check) file path (within runfolder)"""
+        return os.path.join(self.runfolderpath, ToolboxConfig.FLAG_FILES["md5checksum"])
+
+    @cached_property
+    def initial_sscheck_flagfile_path(self) -> str:
+        """initial Samplesheet check flag file path (within runfolder)"""
+        return os.path.join(
             self.runfolderpath, ToolboxConfig.FLAG_FILES["initial_sscheck_flag"]
         )
-        self.sscheck_flagfile_path = os.path.join(
-            self.runfolderpath, ToolboxConfig.FLAG_FILES["sscheck_flag"]
-        )
-        self.demultiplexlog_file = get_demultiplexlog_file(self.sequencer_type, self.runfolderpath)
-        self.bclconvert_log_output_dir = os.path.join(
-            self.runfolderpath, "Bcl_convert_logs"
-        )
-        self.bases2fastq_log_output = os.path.join(
-            self.runfolderpath, "Fastq", "info", "Bases2Fastq.log"
-        )
-        self.fastq_dir_path = get_fastq_dir_path(self.sequencer_type, self.runfolderpath)
-        self.bases2fastq_outputpath = create_aviti_outputpath(self.runfolderpath, self.sequencer_type)
-        self.upload_flagfile = os.path.join(
-            self.runfolderpath, ToolboxConfig.FLAG_FILES["upload_started"]
-        )
+
+    @cached_property
+    def sscheck_flagfile_path(self) -> str:
+        """2nd attempt Samplesheet check flag file path (within runfolder)"""
+        return os.path.join(self.runfolderpath, ToolboxConfig.FLAG_FILES["sscheck_flag"])
+
+    @cached_property
+    def demultiplexlog_file(self) -> str:
+        """Demultiplex logfile path - bases2fastq/bclconvert (within runfolder)"""
+        return get_demultiplexlog_file(self.sequencer_type, self.runfolderpath)
+
+    @cached_property
+    def bclconvert_log_output_dir(self) -> str:
+        """bclconvert log directory (within runfolder)"""
+        return os.path.join(self.runfolderpath, "Bcl_convert_logs")
+
+    @cached_property
+    def bases2fastq_log_output(self) -> str:
+        """bases2fastq logfile (within runfolder)"""
+        return os.path.join(self.runfolderpath, "Fastq", "info", "Bases2Fastq.log")
+
+    @cached_property
+    def fastq_dir_path(self) -> str:
+        """Runfolder fastq directory path (within runfolder)"""
+        return get_fastq_dir_path(self.sequencer_type, self.runfolderpath)
+
+    @cached_property
+    def bases2fastq_outputpath(self) -> Optional[str]:
+        """bases2fastq output directory (within runfolder), None if not an AVITI run"""
+        return get_aviti_outputpath(self.runfolderpath, self.sequencer_type)
+
+    @cached_property
+    def upload_flagfile(self) -> str:
+        """Flag file denoting upload has begun (within runfolder)"""
+        return os.path.join(self.runfolderpath, ToolboxConfig.FLAG_FILES["upload_started"])
+
+    @cached_property
+    def quality_hold_flagfile(self) -> str:
+        """Flag file denoting the run is held by the run quality gate (within runfolder)"""
+        return os.path.join(self.runfolderpath, ToolboxConfig.FLAG_FILES["quality_hold"])
+
+    @cached_property
+    def quality_release_flagfile(self) -> str:
+        """Flag file releasing a run held by the run quality gate (within runfolder)"""
+        return os.path.join(self.runfolderpath, ToolboxConfig.FLAG_FILES["quality_release"])
+
+    @cached_property
+    def cd_failed_flagfile(self) -> str:
+        """Flag file denoting the cluster density calculation failed after demultiplexing (within runfolder)"""
+        return os.path.join(self.runfolderpath, ToolboxConfig.FLAG_FILES["cd_failed"])
+
+    @cached_property
+    def bclconvertstats_file(self) -> list:
+        """Bclconvert stats files (within runfolder)"""
         bclconvert_stats = [
             "Adapter_Cycle_Metrics.csv", "Adapter_Metrics.csv",
-            "Demultiplex_Stats.csv", "fastq_list.csv", "Index_Hopping_Counts.csv", 
-            "IndexMetricsOut.bin", "Quality_Metrics.csv", "Quality_Tile_Metrics.csv", 
+            "Demultiplex_Stats.csv", "fastq_list.csv", "Index_Hopping_Counts.csv",
+            "IndexMetricsOut.bin", "Quality_Metrics.csv", "Quality_Tile_Metrics.csv",
             "RunInfo.xml", "SampleSheet.csv", "Top_Unknown_Barcodes.csv"
         ]
-        self.bclconvertstats_file = []
-        for stats in bclconvert_stats:
-            self.bclconvertstats_file.append(
-                os.path.join(
-                    self.runfolderpath,
-                    f"Data/Intensities/BaseCalls/Reports/{stats}", 
-            )
-        )
-        self.cluster_density_files = [
+        return [
+            os.path.join(self.runfolderpath, f"Data/Intensities/BaseCalls/Reports/{stats}")
+            for stats in bclconvert_stats
+        ]
+
+    @cached_property
+    def cluster_density_files(self) -> list:
+        """List containing runfolder lane metrics and phasing metrics file paths"""
+        return [
             os.path.join(
                 self.runfolderpath,
                 f"{self.runfolder_name}{ToolboxConfig.STRINGS['lane_metrics_suffix']}",
@@ -627,57 +2443,94 @@ class RunfolderObject(ToolboxConfig):
                 ),
             ),
         ]
-        self.demultiplex_runfolder_logfile = (
-            os.path.join(  # Record demultiplex script logs
-                ToolboxConfig.AD_LOGDIR,
-                "demultiplexing_script_logfiles",
-                f"{self.runfolder_name}_demultiplex_runfolder.log",
-            )
+
+    @cached_property
+    def demultiplex_runfolder_logfile(self) -> str:
+        """Runfolder demultiplex logfile (within logfiles dir)"""
+        return os.path.join(  # Record demultiplex script logs
+            ToolboxConfig.AD_LOGDIR,
+            "demultiplexing_script_logfiles",
+            f"{self.runfolder_name}_demultiplex_runfolder.log",
         )
-        self.sw_runfolder_logfile = os.path.join(
+
+    @cached_property
+    def sw_runfolder_logfile(self) -> str:
+        """Records output of setoff workflow script"""
+        return os.path.join(
             ToolboxConfig.AD_LOGDIR,
             "sw_script_logfiles",
             f"{self.runfolder_name}_setoff_workflow.log",
         )
-        self.upload_runfolder_logfile = os.path.join(
+
+    @cached_property
+    def upload_runfolder_logfile(self) -> str:
+        """Records the logs from the upload_runfolder script"""
+        return os.path.join(
             ToolboxConfig.AD_LOGDIR,
             "upload_runfolder_script_logfiles",
             f"{self.runfolder_name}_upload_runfolder.log",
         )
-        self.runfolder_dx_run_script = os.path.join(
+
+    @cached_property
+    def runfolder_dx_run_script(self) -> str:
+        """Workflow dx run commands for runfolder (within logfiles dir)"""
+        return os.path.join(
             ToolboxConfig.AD_LOGDIR,
             "dx_run_commands",
             f"{self.runfolder_name}_dx_run_commands.sh",
         )
-        self.post_run_dx_run_script = os.path.join(
+
+    @cached_property
+    def post_run_dx_run_script(self) -> str:
+        """Separate DX run script for downstream processing apps (TSO only)"""
+        return os.path.join(
             ToolboxConfig.AD_LOGDIR,
             "dx_run_commands",
             f"{self.runfolder_name}_post_run_commands.sh",
         )
-        self.decision_support_upload_script = os.path.join(
+
+    @cached_property
+    def decision_support_upload_script(self) -> str:
+        """Decision support upload commands for runfolder (within logfiles dir)"""
+        return os.path.join(
             ToolboxConfig.AD_LOGDIR,
             "dx_run_commands",
             f"{self.runfolder_name}_decision_support.sh",
         )
-        self.proj_creation_script = os.path.join(
+
+    @cached_property
+    def proj_creation_script(self) -> str:
+        """DNAnexus project creation bash script (within logfiles dir)"""
+        return os.path.join(
             ToolboxConfig.AD_LOGDIR,
             "dx_run_commands",
             f"{self.runfolder_name}_create_nexus_project.sh",
         )
-        self.samplesheet_validator_logfile = os.path.join(
+
+    @cached_property
+    def samplesheet_validator_logfile(self) -> str:
+        """SampleSheet validator script logfile (within logfiles dir)"""
+        return os.path.join(
             ToolboxConfig.AD_LOGDIR,
             "samplesheet_validator_script_logfiles",
             f"{self.runfolder_name}_samplesheet_validator.log",
         )
-        self.logfiles_config = {
+
+    @cached_property
+    def logfiles_config(self) -> dict:
+        """Contains all runfolder log files"""
+        return {
             "sw": self.sw_runfolder_logfile,
             "demux": self.demultiplex_runfolder_logfile,
             "backup": self.upload_runfolder_logfile,
             "demultiplex_docker_log": self.demultiplexlog_file,
             "ss_validator": self.samplesheet_validator_logfile,
         }
-        # Log files that sit outside the runfolder that require uploading
-        self.logfiles_to_upload = [
+
+    @cached_property
+    def logfiles_to_upload(self) -> list:
+        """Log files that sit outside the runfolder that require uploading"""
+        return [
             self.sw_runfolder_logfile,
             self.demultiplex_runfolder_logfile,
             self.proj_creation_script,
@@ -705,6 +2558,83 @@ class RunfolderObject(ToolboxConfig):
         return loggers_obj.loggers
 
 
+class FastqDirectoryIndex(ToolboxConfig):
+    """
+    Snapshot of a fastq directory from a single os.scandir() call, shared by the RunfolderSamples
+    and SampleObjects of a runfolder, so that the fastqs for every sample, missing fastq
+    detection and the fastq upload list all use the same listing. Fastqs with bclconvert
+    (Sample_S1_R1_001.fastq.gz) or bases2fastq (Sample_R1.fastq.gz) names are indexed by sample
+    name and read
+
+    Attributes
+        fastq_dir_path (str):       Fastq directory path
+        files (dict):               (Size, modification time in ns) of each file in the
+                                    directory, keyed by file name, in directory order
+        fastqs (dict):              Fastq name keyed by (sample name, read)
+
+    Methods
+        scan()
+            Scan the fastq directory
+        find(sample_name, read)
+            Return the name of the fastq for the sample and read
+        get_path(file_name)
+            Return the path of a file in the fastq directory
+    """
+
+    def __init__(self, fastq_dir_path: str):
+        """
+        Constructor for the FastqDirectoryIndex class
+            :param fastq_dir_path (str):    Fastq directory path
+        """
+        self.fastq_dir_path = fastq_dir_path
+        self.files = self.scan()
+        self.fastqs = {}
+        for file_name in self.files:
+            match = FASTQ_NAME_PATTERN.match(file_name)
+            if match:
+                self.fastqs.setdefault(match.group("sample_name", "read"), file_name)
+
+    def scan(self) -> dict:
+        """
+        Scan the fastq directory. Directories are not included. An empty index is returned if
+        the fastq directory does not exist
+            :return (dict):     (Size, modification time in ns) of each file, keyed by file name
+        """
+        files = {}
+        try:
+            with os.scandir(self.fastq_dir_path) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        entry_stat = entry.stat()
+                        files[entry.name] = (entry_stat.st_size, entry_stat.st_mtime_ns)
+        except FileNotFoundError:
+            pass
+        return files
+
+    def find(self, sample_name: str, read: str) -> Optional[str]:
+        """
+        Return the name of the fastq for the sample and read. Fastqs that are not named as
+        expected are matched as fastqs whose name contains the sample name and _{read}
+            :param sample_name (str):   Sample name
+            :param read (str):          Either 'R1' or 'R2'
+            :return (Optional[str]):    Fastq name, or None if there is no fastq
+        """
+        fastq_name = self.fastqs.get((sample_name, read))
+        if fastq_name:
+            return fastq_name
+        for file_name in self.files:
+            if sample_name in file_name and f"_{read}" in file_name:
+                return file_name
+
+    def get_path(self, file_name: str) -> str:
+        """
+        Return the path of a file in the fastq directory
+            :param file_name (str):     File name
+            :return (str):              File path
+        """
+        return os.path.join(self.fastq_dir_path, file_name)
+
+
 class RunfolderSamples(ToolboxConfig):
     """
     An object with properties derived from the sample names in the samplesheet
@@ -716,6 +2646,7 @@ class RunfolderSamples(ToolboxConfig):
         runfolder_name (str):               Runfolder name string
         fastq_dir_path (str):               Runfolder fastq directory path (within runfolder)
         logger (logging.Logger):            Logger
+        fastq_index (FastqDirectoryIndex):  Snapshot of the fastq directory, shared by all samples
         samplename_dict (dict):             Dict of sample names identified from the
                                             SampleSheet, and their pan numbers
         pipeline (str):                     Pipeline name
@@ -779,6 +2710,7 @@ class RunfolderSamples(ToolboxConfig):
         self.runfolder_name = rf_obj.runfolder_name
         self.fastq_dir_path = rf_obj.fastq_dir_path
         self.logger = logger
+        self.fastq_index = FastqDirectoryIndex(self.fastq_dir_path)
         self.samplename_dict = get_samplename_dict(self.logger, self.samplesheet_path)
         self.pipeline = self.get_pipeline()
         self.runtype_str = self.get_runtype()
@@ -972,6 +2904,7 @@ class RunfolderSamples(ToolboxConfig):
                     self.fastq_dir_path,
                     self.nexus_paths,
                     self.nexus_runfolder_suffix,
+                    self.fastq_index,
                 )
                 if self.sample_obj.fastqs_dict:
                     samples_dict[sample_name] = self.sample_obj.return_sample_dict()
@@ -984,57 +2917,56 @@ class RunfolderSamples(ToolboxConfig):
 
     def check_for_missing_fastqs(self) -> None:
         """
-        Validate the fastqs in the BaseCalls directory by checking that all sample fastqs
-        match a sample name from the self.samplename_dict. If they do not, log an error
-        and add to a missing_samples list. Add all samples in the missing samples list to
-        the samples_dict so that they are processed
+        Validate the fastqs in the BaseCalls directory (from the fastq directory index) by
+        checking that all sample fastqs match a sample name from the self.samplename_dict. If
+        they do not, log an error and add to a missing_samples list. Add all samples in the
+        missing samples list to the samples_dict so that they are processed
             :return None:
         """
         if self.samplename_dict:
             missing_samples = []
-            for fastq_dir_file in os.listdir(self.fastq_dir_path):
-                if os.path.isfile(fastq_dir_file):
-                    if fastq_dir_file.endswith("fastq.gz"):
-                        self.logger.info(
-                            self.logger.log_msgs["checking_fastq"],
-                            fastq_dir_file,
-                        )
-                        if self.fastq_not_undetermined(
-                            fastq_dir_file
-                        ):  # Exclude undetermined
-                            try:
-                                seglh_naming.Sample.from_string(fastq_dir_file)
-                                sample_name = [
-                                    sample_name
-                                    for sample_name in self.samplename_dict.keys()
-                                    if sample_name in fastq_dir_file
-                                ]
-                                if sample_name:
-                                    self.logger.info(
-                                        self.logger.log_msgs["sample_match"],
-                                        fastq_dir_file,
-                                        sample_name,
-                                    )
-                                else:
-                                    self.logger.error(
-                                        self.logger.log_msgs["sample_mismatch"],
-                                        fastq_dir_file,
-                                    )
-                                    sample_name = re.sub(
-                                        "R[0-9]_001.fastq.gz", "", fastq_dir_file
-                                    )
-                                    missing_samples.append(fastq_dir_file)
-                            except ValueError as exception:
+            for fastq_dir_file in self.fastq_index.files:
+                if fastq_dir_file.endswith("fastq.gz"):
+                    self.logger.info(
+                        self.logger.log_msgs["checking_fastq"],
+                        fastq_dir_file,
+                    )
+                    if self.fastq_not_undetermined(
+                        fastq_dir_file
+                    ):  # Exclude undetermined
+                        try:
+                            seglh_naming.Sample.from_string(fastq_dir_file)
+                            sample_name = [
+                                sample_name
+                                for sample_name in self.samplename_dict.keys()
+                                if sample_name in fastq_dir_file
+                            ]
+                            if sample_name:
+                                self.logger.info(
+                                    self.logger.log_msgs["sample_match"],
+                                    fastq_dir_file,
+                                    sample_name,
+                                )
+                            else:
                                 self.logger.error(
-                                    self.logger.log_msgs["fastq_wrong_naming"],
+                                    self.logger.log_msgs["sample_mismatch"],
                                     fastq_dir_file,
-                                    exception,
                                 )
-                    else:
-                        self.logger.info(
-                            self.logger.log_msgs["not_fastq"],
-                            fastq_dir_file,
-                        )
+                                sample_name = re.sub(
+                                    "R[0-9]_001.fastq.gz", "", fastq_dir_file
+                                )
+                                missing_samples.append(fastq_dir_file)
+                        except ValueError as exception:
+                            self.logger.error(
+                                self.logger.log_msgs["fastq_wrong_naming"],
+                                fastq_dir_file,
+                                exception,
+                            )
+                else:
+                    self.logger.info(
+                        self.logger.log_msgs["not_fastq"],
+                        fastq_dir_file,
+                    )
             for sample_name in missing_samples:  # Add the sample to the sample_obj
                 # Strip end off sample name
                 sample_name = re.sub(r"_S[0-9]+_R[1-2]{1}_001.fastq.gz", "", sample_name)
@@ -1046,6 +2978,7 @@ class RunfolderSamples(ToolboxConfig):
                     self.fastq_dir_path,
                     self.nexus_paths,
                     self.nexus_runfolder_suffix,
+                    self.fastq_index,
                 )
                 self.samples_dict[sample_name] = self.sample_obj.return_sample_dict()
 
@@ -1103,13 +3036,14 @@ class RunfolderSamples(ToolboxConfig):
             :return undetermined_fastqs_list (list): List of all undetermined fastqs in the run
         """
         undetermined_fastqs_list = []
-        illumina_r1 = os.path.join(self.fastq_dir_path, "Undetermined_S0_R1_001.fastq.gz")
-        illumina_r2 = os.path.join(self.fastq_dir_path, "Undetermined_S0_R2_001.fastq.gz")
-        aviti_r1 = os.path.join(self.fastq_dir_path, "Unassigned_R1.fastq.gz")
-        aviti_r2 = os.path.join(self.fastq_dir_path, "Unassigned_R2.fastq.gz")
-        for fastq in [illumina_r1, illumina_r2, aviti_r1, aviti_r2]:
-            if os.path.exists(fastq):
-                undetermined_fastqs_list.append(fastq)
+        for fastq in [
+            "Undetermined_S0_R1_001.fastq.gz",
+            "Undetermined_S0_R2_001.fastq.gz",
+            "Unassigned_R1.fastq.gz",
+            "Unassigned_R2.fastq.gz",
+        ]:
+            if fastq in self.fastq_index.files:
+                undetermined_fastqs_list.append(self.fastq_index.get_path(fastq))
         return undetermined_fastqs_list
 
 
@@ -1128,6 +3062,7 @@ class SampleObject(ToolboxConfig):
                                             are required for building dx commands
         nexus_runfolder_suffix (str):       String of '_' delimited unique library numbers,
                                             and WES batch numbers if run is a WES run
+        fastq_index (FastqDirectoryIndex):  Snapshot of the fastq directory
         neg_control (bool):                 True if sample is a negative control, else False
         pos_control (bool):                 True if sample is a reference sample, else False
         pannum (str):                       Panel number that matches a config-defined panel
@@ -1142,11 +3077,9 @@ class SampleObject(ToolboxConfig):
         check_control(identifiers, control_type)
             Determine whether sample contains the control identifier strings
         find_pannum()
-            Extract panel number from sample name using regular expression
+            Extract the config-defined panel number from the sample name
         return_panel_settings()
             Return panel settings for the specified pan number, if exists
-        validate_pannum(pannum)
-            Check whether pan number is valid
         get_identifiers()
             For WES and PIPE samples, extract DNA number from sample name. For oncology
             samples, collect 3rd and 4th identifiers, setting secondary_identifier to
@@ -1169,6 +3102,7 @@ class SampleObject(ToolboxConfig):
         fastq_dir_path: str,
         nexus_paths: dict,
         nexus_runfolder_suffix: str,
+        fastq_index: Optional[FastqDirectoryIndex] = None,
     ):
         """
         Constructor for the SampleObject class. Calls the class methods
@@ -1180,6 +3114,9 @@ class SampleObject(ToolboxConfig):
                                                     required for building dx commands
             :param nexus_runfolder_suffix (str):    String of '_' delimited unique library numbers,
                                                     and WES batch numbers if run is a WES run
+            :param fastq_index (FastqDirectoryIndex):   Snapshot of the fastq directory, shared by
+                                                        the samples of the runfolder. The fastq
+                                                        directory is scanned if not provided
         """
         self.sample_name = sample_name
         self.pipeline = pipeline
@@ -1187,6 +3124,7 @@ class SampleObject(ToolboxConfig):
         self.fastq_dir_path = fastq_dir_path
         self.nexus_paths = nexus_paths
         self.nexus_runfolder_suffix = nexus_runfolder_suffix
+        self.fastq_index = fastq_index or FastqDirectoryIndex(self.fastq_dir_path)
         self.neg_control = self.check_control(ToolboxConfig.NTCON_IDS, "Negative")
         self.pos_control = self.check_control(ToolboxConfig.PSCON_IDS, "Positive")
         self.pannum = self.find_pannum()
@@ -1211,26 +3149,33 @@ class SampleObject(ToolboxConfig):
 
     def find_pannum(self) -> Optional[str]:
         """
-        Extract panel number from sample name using regular expression
+        Extract the config-defined panel number from the sample name (match_pannum())
             :return pannum (Optional[str]): Panel number that matches a config-defined
                                             panel number, or None if pannum not valid
         """
-        # print(ToolboxConfig.PANEL_DICT[pannum]["panel_name"])
-        try:
-            pannum = str(re.search(r"Pan\d+", self.sample_name).group()).strip()
-            if self.validate_pannum(pannum):
-                self.logger.debug(
-                    self.logger.log_msgs["sample_identified"],
-                    ToolboxConfig.PANEL_DICT[pannum]["panel_name"],
-                    self.sample_name,
-                )
-                return pannum
-        except:
+        pannum, panel_settings = match_pannum(self.sample_name)
+        if pannum:
+            self.logger.debug(
+                self.logger.log_msgs["recognised_panno"],
+                self.sample_name,
+                pannum,
+            )
+            self.logger.debug(
+                self.logger.log_msgs["sample_identified"],
+                panel_settings["panel_name"],
+                self.sample_name,
+            )
+            return pannum
+        if re.search(r"Pan\d+", self.sample_name):
             self.logger.error(
-                self.logger.log_msgs["missing_panno"],
+                self.logger.log_msgs["unrecognised_panno"],
                 self.sample_name,
             )
-    
+        self.logger.error(
+            self.logger.log_msgs["missing_panno"],
+            self.sample_name,
+        )
+
     def return_panel_settings(self) -> Optional[dict]:
         """
         Return panel settings for the specified pan number, if exists
@@ -1239,25 +3184,6 @@ class SampleObject(ToolboxConfig):
         if self.pannum:
             return ToolboxConfig.PANEL_DICT[self.pannum]
 
-    def validate_pannum(self, pannum: int) -> bool:
-        """
-        Check whether pan number is valid
-            :return bool:   True if pan number is valid, else None
-        """
-        if str(pannum) in ToolboxConfig.PANELS:
-            self.logger.debug(
-                self.logger.log_msgs["recognised_panno"],
-                self.sample_name,
-                pannum,
-            )
-            return True
-        else:
-            self.logger.error(
-                self.logger.log_msgs["unrecognised_panno"],
-                self.sample_name,
-            )
-            sys.exit(1)
-
     def get_identifiers(self) -> Tuple[str, str]:
         """
         For WES and GATK/SENTIEON PIPE samples, extract DNA number from sample name. For oncology
@@ -1315,8 +3241,8 @@ class SampleObject(ToolboxConfig):
 
     def get_fastq_paths(self, read: str) -> Union[str, str, str]:
         """
-        Get fastqs in fastq directory that correspond to each sample name in the
-        sample dictionary. Build the fastq name, local path, and DNAnexus path
+        Get fastqs in fastq directory (from the fastq directory index) that correspond to each
+        sample name in the sample dictionary. Build the fastq name, local path, and DNAnexus path
         for each fastq file
             :param read (str):                  Either 'R1' or 'R2'
             :return fastq_name (str):           Fastq name
@@ -1324,30 +3250,25 @@ class SampleObject(ToolboxConfig):
             :return nexus_fastq_path (str):     DNAnexus fastq path
         """
         matches = [self.sample_name, f"_{read}"]
-        try:
-            fastq_name = list(
-                fastq_path
-                for fastq_path in os.listdir(self.fastq_dir_path)
-                if all([substring in fastq_path for substring in matches])
-            )[0]
-            self.logger.debug(
-                self.logger.log_msgs["fastq_identified"],
-                fastq_name,
-                ", ".join(matches),
-            )
-            fastq_path = os.path.join(self.fastq_dir_path, fastq_name)
-            nexus_fastq_path = os.path.join(
-                f"{ToolboxConfig.DNANEXUS_PROJ_ID}:{self.nexus_paths['fastqs_dir']}",
-                fastq_name,
-            )
-            return fastq_name, fastq_path, nexus_fastq_path
-        except Exception as exception:
+        fastq_name = self.fastq_index.find(self.sample_name, read)
+        if not fastq_name:
             self.logger.error(
                 self.logger.log_msgs["fastq_nonexistent"],
                 ", ".join(matches),
-                exception,
+                f"No fastq in {self.fastq_dir_path}",
             )
             return False, False, False
+        self.logger.debug(
+            self.logger.log_msgs["fastq_identified"],
+            fastq_name,
+            ", ".join(matches),
+        )
+        fastq_path = self.fastq_index.get_path(fastq_name)
+        nexus_fastq_path = os.path.join(
+            f"{ToolboxConfig.DNANEXUS_PROJ_ID}:{self.nexus_paths['fastqs_dir']}",
+            fastq_name,
+        )
+        return fastq_name, fastq_path, nexus_fastq_path
 
     def return_sample_dict(self) -> dict:
         """
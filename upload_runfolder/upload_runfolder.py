@@ -9,11 +9,13 @@ import sys
 import os
 import re
 import math
+import shlex
 import logging
 import datetime
 from config.ad_config import URConfig
 from toolbox.toolbox import (
     execute_subprocess_command,
+    execute_commands,
     git_tag,
     test_upload_software,
     get_credential,
@@ -68,6 +70,8 @@ class UploadRunfolder(URConfig):
             has caused it to hang.
         upload_files(upload_cmd, files_list)
             Uploads files when provided with an upload command and files list
+        upload_files_concurrently(uploads)
+            Run several upload agent commands concurrently, retrying failed uploads
         count_uploaded_files(ignore)
             Count the number of files to be uploaded and check if any that should
             have been ignored are in DNAnexus
@@ -165,15 +169,17 @@ class UploadRunfolder(URConfig):
         self.file_dict = self.get_file_dict(ignore)
         self.build_upload_cmds()
         # It is quicker to upload files in parallel so files in each
-        # folder are uploaded as separate commands
+        # folder are uploaded as separate, concurrently run, commands
+        uploads = {}
         for folderpath in self.file_dict:
             self.logger.info(self.logger.log_msgs["uploading_files"], folderpath)
             if "upload_cmds" in self.file_dict[folderpath].keys():
                 for upload_cmd in self.file_dict[folderpath]["upload_cmds"]:
-                    filepath_list = self.file_dict[folderpath]["upload_cmds"][
-                        upload_cmd
-                    ]
-                    self.upload_files(upload_cmd, filepath_list)
+                    uploads[upload_cmd] = (
+                        upload_cmd,
+                        self.file_dict[folderpath]["upload_cmds"][upload_cmd],
+                    )
+        self.upload_files_concurrently(uploads)
         self.count_uploaded_files(ignore)  # Run tests to count files
 
     def check_runfolder_exists(self) -> None:
@@ -391,8 +397,7 @@ class UploadRunfolder(URConfig):
         """
         Uploads files when provided with an upload command and files list. Details
         are written to log files (upload agent logfile and runfolder logfile) and
-        then command passed to execute_subprocess_command(). All standard
-        error/standard out is written to a log file
+        then command passed to upload_files_concurrently()
             :param upload_cmd (str):    Command to use to upload the files
             :param files_list (list):   List of all files requiring upload
             :return "fail" (str) |
@@ -401,40 +406,49 @@ class UploadRunfolder(URConfig):
                                         unsuccessful, nonexistent_files if not all
                                         files for upload are present on the machine
         """
-        upload_attempts = 1
-        # Check all files exist before trying to upload. If they don't, the script
-        # will fail when trying to upload them
-        if all([os.path.isfile(file) for file in files_list]):
-            self.logger.info(self.logger.log_msgs["call_ua"], ", ".join(files_list))
-            while upload_attempts < 6:  # Attempt the upload 5 times
-                # Execute upload agent command, writing log to upload agent log file
-                self.logger.info(
-                    self.logger.log_msgs["upload_attempt"], upload_attempts
-                )
-                _, _, returncode = execute_subprocess_command(
-                    upload_cmd,
-                    self.logger,
-                )
-                if returncode == 0:
-                    return "success"
-                else:
-                    upload_attempts += 1
-            else:
-                return "fail"
-        else:
-            nonexistent_files = []
-            for file in files_list:
-                if not os.path.isfile(file):
-                    nonexistent_files.append(file)
+        return self.upload_files_concurrently({upload_cmd: (upload_cmd, files_list)})[
+            upload_cmd
+        ]
+
+    def upload_files_concurrently(self, uploads: dict) -> dict:
+        """
+        Run several upload agent commands concurrently (execute_commands()). The upload agent
+        commands contain no shell syntax, so are split into argument lists and run without a
+        shell. Uploads whose files do not all exist are not attempted. Failed uploads are
+        retried (all failed uploads at once), up to UPLOAD_ATTEMPTS attempts
+            :param uploads (dict):  (Upload command, list of files requiring upload) keyed by
+                                    upload name
+            :return (dict):         Result of each upload keyed by upload name: "success" if
+                                    upload successful, "fail" if unsuccessful,
+                                    nonexistent_files (list) if not all files for upload are
+                                    present on the machine
+        """
+        results, pending = {}, {}
+        # Check all files exist before trying to upload. If they don't, the upload
+        # agent will fail when trying to upload them
+        for name, (upload_cmd, files_list) in uploads.items():
+            nonexistent_files = [file for file in files_list if not os.path.isfile(file)]
             if nonexistent_files:
                 self.logger.error(
                     self.logger.log_msgs["nonexistent_files"], nonexistent_files
                 )
+                results[name] = nonexistent_files
             else:
-                self.logger.error(
-                    self.logger.log_msgs["files_exist"],
-                )
-            return nonexistent_files
+                self.logger.info(self.logger.log_msgs["call_ua"], ", ".join(files_list))
+                pending[name] = shlex.split(upload_cmd)
+        for upload_attempt in range(1, URConfig.UPLOAD_ATTEMPTS + 1):
+            if not pending:
+                break
+            self.logger.info(self.logger.log_msgs["upload_attempt"], upload_attempt)
+            for name, result in zip(
+                list(pending), execute_commands(list(pending.values()), self.logger)
+            ):
+                if result.returncode == 0:
+                    results[name] = "success"
+                    del pending[name]
+        for name in pending:
+            results[name] = "fail"
+        return results
 
     def count_uploaded_files(self, ignore: str) -> None:
         """
@@ -28,6 +28,7 @@ from toolbox.toolbox import (
     get_credential,
     get_runfolder_path,
     RunfolderObject,
+    RunfolderStateIndex,
     RunfolderSamples,
     script_start_logmsg,
     script_end_logmsg
@@ -137,8 +138,19 @@ class RunFolderManager:
         """
         runfolder_objects = []
         folders = self.get_dirs_created_after(self.runfolders_dir, '2024-06-12')  # V45.0.0 of the automated scripts (logfile number changed to 6)
+        # Runfolders that have not been uploaded can never be deleted
+        states = RunfolderStateIndex().get_states(folders)
+        not_uploaded = [
+            folder_name for folder_name, state in states.items()
+            if state in RunfolderCleanupConfig.STATE_INDEX_SKIP
+        ]
+        script_logger.info(
+            script_logger.log_msgs["state_index_skipped"], ", ".join(not_uploaded)
+        )
         for runfolder_path in folders:
             folder_name = runfolder_path.split("/")[-1]
+            if folder_name in not_uploaded:
+                continue
             if get_runfolder_path(folder_name) and re.compile(
                 RunfolderCleanupConfig.RUNFOLDER_PATTERN
             ).match(folder_name):